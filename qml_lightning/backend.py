@@ -0,0 +1,245 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Compute-backend registry. Every compiled kernel used by the representations, features and models is registered here under a
+device-independent name, e.g get_kernel('num_neighbours', X) returns pairlist_gpu.get_num_neighbours_gpu for CUDA tensors and
+pairlist_cpu.get_num_neighbours_cpu for CPU tensors. Additional devices can be plugged in with register_kernel.
+
+The compiled extensions are only imported the first time one of their kernels is requested, so importing the models neither loads
+the CUDA extensions nor initialises a CUDA context.
+
+'''
+import time
+import importlib
+import importlib.util
+import torch
+
+# kernel name -> {device type: callable, or 'module:function' string naming a function in qml_lightning.cuda}
+_kernels = {}
+
+_extensions = {}
+
+
+def load_extension(name):
+
+    '''imports (once) the compiled extension qml_lightning.cuda.name'''
+
+    if (name not in _extensions):
+        _extensions[name] = importlib.import_module('qml_lightning.cuda.' + name)
+
+    return _extensions[name]
+
+
+def extension_built(name):
+
+    '''checks whether qml_lightning.cuda.name exists without importing it'''
+
+    if (name in _extensions):
+        return True
+
+    try:
+        return importlib.util.find_spec('qml_lightning.cuda.' + name) is not None
+    except ImportError:
+        return False
+
+
+def register_kernel(name, device_type, kernel):
+
+    '''
+    registers (or replaces) the implementation of kernel name for device_type, e.g 'cpu' or 'cuda'. kernel is either a callable or a
+    'module:function' string, which is imported on first use.
+    '''
+
+    _kernels.setdefault(name, {})[device_type] = kernel
+
+
+def device_type_of(device):
+
+    '''device may be a torch.Tensor, torch.device or device string'''
+
+    if (isinstance(device, torch.Tensor)):
+        return device.device.type
+
+    return torch.device(device).type
+
+
+def get_kernel(name, device):
+
+    '''returns the implementation of kernel name for the device of the tensor (or torch.device) device'''
+
+    if (name not in _kernels):
+        print("ERROR: unknown kernel:", name)
+        exit()
+
+    device_type = device_type_of(device)
+
+    kernel = _kernels[name].get(device_type)
+
+    if (kernel is None):
+        print("ERROR: kernel", name, "is not available on device type", device_type + ".")
+        exit()
+
+    if (isinstance(kernel, str)):
+
+        module, function = kernel.split(':')
+
+        if (not extension_built(module)):
+            print("ERROR: kernel", name, "requires the", module, "extension, which has not been built.",
+                  "If this is a CUDA device, CUDA was not available (or CUDA_HOME was not set) when running setup.py.")
+            exit()
+
+        kernel = getattr(load_extension(module), function)
+
+        _kernels[name][device_type] = kernel
+
+    return kernel
+
+
+def cuda_available():
+    return extension_built('utils_gpu') and torch.cuda.is_available()
+
+
+def resolve_device(device=None):
+
+    '''
+    device=None selects CUDA if it is available and the CUDA extensions have been built, otherwise the CPU.
+    '''
+
+    if (device is None):
+        return torch.device('cuda' if cuda_available() else 'cpu')
+
+    device = torch.device(device)
+
+    if (device.type == 'cuda' and not cuda_available()):
+        print("ERROR: device", device, "was requested but CUDA is unavailable or the CUDA extensions have not been built.")
+        exit()
+
+    return device
+
+
+def synchronize(device):
+
+    if (device_type_of(device) == 'cuda'):
+        torch.cuda.synchronize()
+
+
+def empty_cache(device):
+
+    if (device_type_of(device) == 'cuda'):
+        torch.cuda.empty_cache()
+
+
+class Timer(object):
+
+    '''
+    wall-clock replacement for pairs of torch.cuda.Event timers: the device is synchronized before the clock is read, so
+    elapsed_time() returns the same milliseconds on both CPU and CUDA devices.
+    '''
+
+    def __init__(self, device):
+        self.device = device
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+
+        synchronize(self.device)
+
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+
+        synchronize(self.device)
+
+        self.end_time = time.perf_counter()
+
+    def elapsed_time(self):
+        return (self.end_time - self.start_time) * 1000.0
+
+
+def _outer_product_cpu(input):
+    return torch.matmul(input.T, input).float()
+
+
+def _matmul_and_reduce_cpu(A, B, C):
+    C += torch.matmul(A.double(), B.double())
+
+
+def _mul_in_place_by_const_cpu(input, f):
+    input.mul_(f)
+
+
+def _sorf_matrix_gpu(input, diagonals, normalization):
+    return normalization * load_extension('sorf_gpu').sorf_matrix_gpu(input, diagonals)
+
+
+def _register_cpu_kernels():
+
+    register_kernel('num_neighbours', 'cpu', 'pairlist_cpu:get_num_neighbours_cpu')
+    register_kernel('neighbour_list', 'cpu', 'pairlist_cpu:get_neighbour_list_cpu')
+    register_kernel('neighbour_list_csr', 'cpu', 'pairlist_cpu:get_neighbour_list_csr_cpu')
+    register_kernel('safe_fill', 'cpu', 'pairlist_cpu:safe_fill_cpu')
+
+    register_kernel('element_types', 'cpu', 'egto_cpu:get_element_types_cpu')
+    register_kernel('egto', 'cpu', 'egto_cpu:get_egto')
+
+    register_kernel('fchl_representation', 'cpu', 'fchl_cpu:get_fchl_representation')
+    register_kernel('fchl_derivative', 'cpu', 'fchl_cpu:get_fchl_derivative')
+    register_kernel('fchl_and_derivative', 'cpu', 'fchl_cpu:get_fchl_and_derivative')
+    register_kernel('fchl_backwards', 'cpu', 'fchl_cpu:fchl_backwards')
+
+    register_kernel('sorf_matrix', 'cpu', 'sorf_cpu:sorf_matrix_cpu')
+    register_kernel('hadamard_transform', 'cpu', 'sorf_cpu:hadamard_transform_cpu')
+    register_kernel('hadamard_transform_backwards', 'cpu', 'sorf_cpu:hadamard_transform_backwards_cpu')
+    register_kernel('cos_features', 'cpu', 'sorf_cpu:CosFeaturesCPU')
+    register_kernel('cos_features_derivative', 'cpu', 'sorf_cpu:CosDerivativeFeaturesCPU')
+    register_kernel('hadamard_features', 'cpu', 'sorf_cpu:compute_hadamard_features')
+    register_kernel('partial_feature_derivatives', 'cpu', 'sorf_cpu:compute_partial_feature_derivatives')
+    register_kernel('molecular_featurization_derivative', 'cpu', 'sorf_cpu:compute_molecular_featurization_derivative')
+    register_kernel('hadamard_derivative_features', 'cpu', 'sorf_cpu:compute_hadamard_derivative_features')
+
+    register_kernel('rff', 'cpu', 'rff_cpu:get_rff')
+    register_kernel('rff_derivatives', 'cpu', 'rff_cpu:get_rff_derivatives')
+
+    register_kernel('outer_product', 'cpu', _outer_product_cpu)
+    register_kernel('matmul_and_reduce', 'cpu', _matmul_and_reduce_cpu)
+    register_kernel('mul_in_place_by_const', 'cpu', _mul_in_place_by_const_cpu)
+
+
+def _register_cuda_kernels():
+
+    register_kernel('num_neighbours', 'cuda', 'pairlist_gpu:get_num_neighbours_gpu')
+    register_kernel('neighbour_list', 'cuda', 'pairlist_gpu:get_neighbour_list_gpu')
+    register_kernel('neighbour_list_csr', 'cuda', 'pairlist_gpu:get_neighbour_list_csr_gpu')
+    register_kernel('safe_fill', 'cuda', 'pairlist_gpu:safe_fill_gpu')
+
+    register_kernel('element_types', 'cuda', 'egto_gpu:get_element_types_gpu')
+    register_kernel('egto', 'cuda', 'egto_gpu:get_egto')
+
+    register_kernel('fchl_representation', 'cuda', 'fchl_gpu:get_fchl_representation')
+    register_kernel('fchl_derivative', 'cuda', 'fchl_gpu:get_fchl_derivative')
+    register_kernel('fchl_and_derivative', 'cuda', 'fchl_gpu:get_fchl_and_derivative')
+    register_kernel('fchl_backwards', 'cuda', 'fchl_gpu:fchl_backwards')
+
+    register_kernel('sorf_matrix', 'cuda', _sorf_matrix_gpu)
+    register_kernel('hadamard_transform', 'cuda', 'sorf_gpu:hadamard_transform_gpu')
+    register_kernel('hadamard_transform_backwards', 'cuda', 'sorf_gpu:hadamard_transform_backwards_gpu')
+    register_kernel('cos_features', 'cuda', 'sorf_gpu:CosFeaturesCUDA')
+    register_kernel('cos_features_derivative', 'cuda', 'sorf_gpu:CosDerivativeFeaturesCUDA')
+    register_kernel('hadamard_features', 'cuda', 'sorf_gpu:compute_hadamard_features')
+    register_kernel('partial_feature_derivatives', 'cuda', 'sorf_gpu:compute_partial_feature_derivatives')
+    register_kernel('molecular_featurization_derivative', 'cuda', 'sorf_gpu:compute_molecular_featurization_derivative')
+    register_kernel('hadamard_derivative_features', 'cuda', 'sorf_gpu:compute_hadamard_derivative_features')
+
+    register_kernel('rff', 'cuda', 'rff_gpu:get_rff')
+    register_kernel('rff_derivatives', 'cuda', 'rff_gpu:get_rff_derivatives')
+
+    register_kernel('outer_product', 'cuda', 'utils_gpu:outer_product')
+    register_kernel('matmul_and_reduce', 'cuda', 'utils_gpu:matmul_and_reduce')
+    register_kernel('mul_in_place_by_const', 'cuda', 'utils_gpu:MulInPlaceByConstCUDA')
+
+
+_register_cpu_kernels()
+_register_cuda_kernels()
@@ -0,0 +1,255 @@
+#ifndef QML_LIGHTNING_CPU_UTILS_H
+#define QML_LIGHTNING_CPU_UTILS_H
+
+#include <math.h>
+#include <algorithm>
+
+/* Host-side equivalents of the __device__ helpers used by the CUDA kernels, shared by the OpenMP CPU backends. */
+
+#define GAUSSIAN_DISTRIBUTION 0
+#define LOGNORMAL_DISTRIBUTION 1
+#define EXPEXP_DISTRIBUTION 2
+
+#define COSINE_CUTOFF 0
+#define SWITCH_FUNCTION 1
+
+#define SQRT2PI 2.506628275f
+
+static inline void get_pbc_drij_cpu(float *drij, const float *cell_vectors, const float *inv_cell_vectors) {
+
+	/*
+	 *   h := [a, b, c], a=(a1,a2,a3), ... (the matrix of box vectors)
+	 r_ij := r_i - r_j                 (difference vector)
+
+	 s_i = h^{-1} r_i
+	 s_ij = s_i - s_j
+	 s_ij <-- s_ij - NINT(s_ij)        (general minimum image convention)
+	 r_ij = h s_ij
+	 */
+	float sij[3] = { 0.0, 0.0, 0.0 };
+
+	for (int m = 0; m < 3; m++) {
+
+		for (int k = 0; k < 3; k++) {
+			sij[m] += inv_cell_vectors[m * 3 + k] * drij[k];
+		}
+
+		sij[m] = sij[m] - round(sij[m]);
+	}
+
+	for (int m = 0; m < 3; m++) {
+
+		float rij_m = 0.0;
+
+		for (int k = 0; k < 3; k++) {
+			rij_m += cell_vectors[m * 3 + k] * sij[k];
+		}
+
+		drij[m] = rij_m;
+	}
+}
+
+static inline bool is_orthorhombic_cpu(const float *cell_vectors) {
+
+	/* true if h is diagonal, i.e the cell vectors lie along x, y and z and the minimum image reduces to an independent shift per axis */
+	return cell_vectors[1] == 0.0f && cell_vectors[2] == 0.0f && cell_vectors[3] == 0.0f && cell_vectors[5] == 0.0f && cell_vectors[6] == 0.0f
+			&& cell_vectors[7] == 0.0f;
+}
+
+static inline void get_pbc_shift_cpu(const float *drij, const float *inv_cell_vectors, int *shift, bool orthorhombic = false) {
+
+	/* lattice translation n = NINT(h^{-1} r_ij) applied by get_pbc_drij_cpu, i.e the minimum image of j sits at r_j + h n */
+	if (orthorhombic) {
+		for (int m = 0; m < 3; m++) {
+			shift[m] = (int) roundf(drij[m] * inv_cell_vectors[m * 4]);
+		}
+		return;
+	}
+
+	for (int m = 0; m < 3; m++) {
+
+		float sm = 0.0;
+
+		for (int k = 0; k < 3; k++) {
+			sm += inv_cell_vectors[m * 3 + k] * drij[k];
+		}
+
+		shift[m] = (int) round(sm);
+	}
+}
+
+static inline void get_pbc_image_range_cpu(const float *inv_cell_vectors, float rcut, int *nimages) {
+
+	/* number of lattice translations around the minimum image to search along each cell vector. The planes of fractional axis m are
+	 * 1 / |inv_cell[m]| apart and the minimum image satisfies |s_m| <= 1/2, so image n + k can only be within rcut if
+	 * (|k| - 1/2) / |inv_cell[m]| < rcut. This is 0 whenever every cell width exceeds 2 rcut, i.e the minimum image alone suffices */
+	for (int m = 0; m < 3; m++) {
+
+		float norm = sqrtf(inv_cell_vectors[m * 3] * inv_cell_vectors[m * 3] + inv_cell_vectors[m * 3 + 1] * inv_cell_vectors[m * 3 + 1]
+				+ inv_cell_vectors[m * 3 + 2] * inv_cell_vectors[m * 3 + 2]);
+
+		nimages[m] = (int) floor(rcut * norm + 0.5);
+	}
+}
+
+static inline void apply_image_shift_cpu(float *drij, const float *cell_vectors, const int *shift, bool orthorhombic = false) {
+
+	/* r_ij <-- r_ij - h n, i.e the difference vector to the image of j at r_j + h n */
+	if (orthorhombic) {
+		for (int m = 0; m < 3; m++) {
+			drij[m] -= cell_vectors[m * 4] * shift[m];
+		}
+		return;
+	}
+
+	for (int m = 0; m < 3; m++) {
+		for (int k = 0; k < 3; k++) {
+			drij[m] -= cell_vectors[m * 3 + k] * shift[k];
+		}
+	}
+}
+
+static inline float get_cutoff_cpu(float rij, float rcut, float rswitch, int cutoff_type) {
+	float cut = 1.0;
+
+	switch (cutoff_type) {
+
+	case SWITCH_FUNCTION:
+		if (rij > rswitch) {
+			float sx = (rij - rswitch) / (rcut - rswitch);
+			cut = cut - 6.0 * powf(sx, 5.0) + 15.0 * powf(sx, 4.0) - 10.0 * powf(sx, 3.0);
+		}
+		break;
+
+	case COSINE_CUTOFF:
+	default:
+		cut = 0.5 * (cosf(rij * M_PI / rcut) + 1.0);
+		break;
+	}
+
+	return cut;
+}
+
+static inline float get_cutoff_derivative_cpu(float rij, float rcut, float rswitch, int cutoff_type) {
+	float dcut = 0.0;
+
+	switch (cutoff_type) {
+
+	case SWITCH_FUNCTION:
+		if (rij > rswitch) {
+			float sx = (rij - rswitch) / (rcut - rswitch);
+			dcut = (1.0 / (rcut - rswitch)) * (-30.0 * powf(sx, 4.0) + 60.0 * powf(sx, 3.0) - 30.0 * powf(sx, 2.0));
+		}
+		break;
+
+	case COSINE_CUTOFF:
+	default:
+		dcut = -0.5 * (sinf(rij * M_PI / rcut)) * M_PI / rcut;
+		break;
+	}
+
+	return dcut;
+}
+
+static inline float get_radial_distribution_cpu(float rij, float eta, const float *gridpoints, int index, int distribution_type) {
+
+	float d = 0.0;
+	float mu = 0.0;
+	float sigma2 = 0.0;
+	float sigma = 0.0;
+
+	switch (distribution_type) {
+
+	case LOGNORMAL_DISTRIBUTION:
+		mu = log(rij / sqrt(1.0 + eta / powf(rij, 2.0)));
+		sigma2 = log(1.0 + eta / powf(rij, 2.0));
+		sigma = sqrt(sigma2);
+
+		d = 1.0 / (gridpoints[index] * sigma * SQRT2PI) * expf(-powf(log(gridpoints[index]) - mu, 2.0) / (2.0 * sigma2));
+		break;
+
+	case EXPEXP_DISTRIBUTION:
+		d = expf(-eta * powf(expf(-rij) - gridpoints[index], 2.0));
+		break;
+
+	case GAUSSIAN_DISTRIBUTION:
+	default:
+		d = sqrt(eta / M_PI) * expf(-eta * powf(rij - gridpoints[index], 2.0));
+		break;
+	}
+
+	return d;
+}
+
+static inline float get_radial_derivative_distribution_cpu(float drijx, float rij, float eta, const float *gridpoints, int index, int distribution_type) {
+
+	float dradial_dx = 0.0;
+
+	float sqrt_eta = sqrt(eta / M_PI);
+	float mu = 0.0;
+	float sigma = 0.0;
+	float sigma2 = 0.0;
+	float sigma4 = 0.0;
+	float lnRs = 0.0;
+	float exp_ln = 0.0;
+	float rij2 = 0.0;
+	float dmu_dx = 0.0;
+	float dsigma_dx = 0.0;
+
+	switch (distribution_type) {
+
+	case LOGNORMAL_DISTRIBUTION:
+
+		mu = log(rij / sqrt(1.0 + (eta / powf(rij, 2.0))));
+		sigma = sqrt(log(1.0 + (eta / powf(rij, 2.0))));
+		sigma2 = powf(sigma, 2.0);
+		sigma4 = powf(sigma, 4.0);
+		lnRs = log(gridpoints[index]);
+		exp_ln = expf(-powf(lnRs - mu, 2.0) / powf(sigma, 2.0) * 0.5);
+		rij2 = powf(rij, 2.0);
+
+		dsigma_dx = drijx * eta * (1.0 / ((eta + rij2) * rij * sqrt(log((eta + rij2) / rij2))));
+		dmu_dx = -drijx * ((2 * eta + rij2) / ((eta + rij2) * rij));
+
+		dradial_dx = (sqrt(2.0) / (2 * sqrt(M_PI) * gridpoints[index] * sigma4))
+				* (((mu - lnRs) * dsigma_dx - sigma * dmu_dx) * (mu - lnRs) - sigma2 * dsigma_dx) * exp_ln;
+		break;
+
+	case EXPEXP_DISTRIBUTION:
+		dradial_dx = 2.0 * eta * (-gridpoints[index] + expf(-rij)) * expf(-eta * powf(expf(-rij) - gridpoints[index], 2.0)) * expf(-rij) * -drijx;
+		break;
+
+	case GAUSSIAN_DISTRIBUTION:
+	default:
+		dradial_dx = sqrt_eta * expf(-eta * powf(rij - gridpoints[index], 2.0)) * -eta * 2.0 * (rij - gridpoints[index]) * -drijx;
+		break;
+	}
+
+	return dradial_dx;
+}
+
+static inline float dot_abcd_cpu(const float *ab, const float *cd) {
+	return ab[0] * cd[0] + ab[1] * cd[1] + ab[2] * cd[2];
+}
+
+static inline float calc_cos_angle_abcb_cpu(const float *ab, const float *cb) {
+
+	float v1norm = sqrt(ab[0] * ab[0] + ab[1] * ab[1] + ab[2] * ab[2]);
+	float v2norm = sqrt(cb[0] * cb[0] + cb[1] * cb[1] + cb[2] * cb[2]);
+
+	return (ab[0] * cb[0] + ab[1] * cb[1] + ab[2] * cb[2]) / (v1norm * v2norm);
+}
+
+static inline float calc_angle_abcb_cpu(const float *ab, const float *cb) {
+
+	float cos_angle = calc_cos_angle_abcb_cpu(ab, cb);
+
+	if (cos_angle > 1.0)
+		cos_angle = 1.0;
+	if (cos_angle < -1.0)
+		cos_angle = -1.0;
+
+	return acosf(cos_angle);
+}
+
+#endif
@@ -0,0 +1,896 @@
+#include <torch/extension.h>
+#include <omp.h>
+#include <vector>
+#include <iostream>
+
+#include "cpu_utils.h"
+
+using namespace at;
+using namespace std;
+
+/* OpenMP implementation of the FCHL19 kernels in fchl_cuda_kernel.cu. One (molID, iatom) pair from blockMolIDs/blockAtomIDs
+ * maps to one task, the same decomposition the CUDA kernels use for thread blocks. */
+
+struct FCHLNeighbourData {
+	/* per-atom cache of the neighbour geometry, so the three-body loop doesn't recompute PBC images for every pair. */
+	vector<float> drij;
+	vector<float> rij;
+	vector<int> elements;
+	vector<int> indexes;
+};
+
+static int load_neighbours(const TensorAccessor<float, 2> &coords, const TensorAccessor<int, 1> &element_types, const int *neighbours, const int *shifts,
+		int iatom, int nneighbours_i, float rcut, bool pbc, const float *cell, const float *inv_cell, FCHLNeighbourData &data) {
+
+	/* neighbour lists may be built with a skin (rcut + skin) and reused over several steps, so only the neighbours within rcut are
+	 * kept. Returns the number of neighbours loaded. */
+
+	data.drij.resize(3 * nneighbours_i);
+	data.rij.resize(nneighbours_i);
+	data.elements.resize(nneighbours_i);
+	data.indexes.resize(nneighbours_i);
+
+	int nloaded = 0;
+
+	for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+		int j = neighbours[jatom];
+
+		float *drij = &data.drij[3 * nloaded];
+
+		drij[0] = coords[iatom][0] - coords[j][0];
+		drij[1] = coords[iatom][1] - coords[j][1];
+		drij[2] = coords[iatom][2] - coords[j][2];
+
+		// image shifts from the neighbour search take precedence, the minimum image is only valid for cells wider than 2 rcut
+		if (shifts != NULL) {
+			apply_image_shift_cpu(drij, cell, &shifts[jatom * 3]);
+		} else if (pbc) {
+			get_pbc_drij_cpu(drij, cell, inv_cell);
+		}
+
+		float rij = sqrtf(drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2]);
+
+		if (rij > rcut) {
+			continue;
+		}
+
+		data.rij[nloaded] = rij;
+		data.elements[nloaded] = element_types[j];
+		data.indexes[nloaded] = j;
+
+		nloaded++;
+	}
+
+	return nloaded;
+}
+
+static void load_cell(torch::Tensor cell, torch::Tensor inv_cell, int molID, float *scell, float *sinv_cell) {
+
+	auto cell_a = cell.accessor<float, 3>();
+	auto inv_cell_a = inv_cell.accessor<float, 3>();
+
+	for (int i = 0; i < 3; i++) {
+		for (int j = 0; j < 3; j++) {
+			scell[i * 3 + j] = cell_a[molID][i][j];
+			sinv_cell[i * 3 + j] = inv_cell_a[molID][i][j];
+		}
+	}
+}
+
+void FCHLCpu(torch::Tensor coordinates, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell,
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor output) {
+
+	int nRs2 = Rs2.size(0);
+	int nRs3 = Rs3.size(0);
+	int nelements = species.size(0);
+	int nblocks = blockAtomIDs.size(0);
+
+	bool pbc = cell.size(0) > 0;
+
+	auto coords_a = coordinates.accessor<float, 3>();
+	auto element_types_a = element_types.accessor<int, 2>();
+	auto neighbour_offsets_a = neighbour_offsets.accessor<int, 2>();
+	const int *neighbour_indices_p = neighbour_indices.data_ptr<int>();
+	const int *neighbour_shifts_p = neighbour_shifts.size(0) > 0 ? neighbour_shifts.data_ptr<int>() : NULL;
+	auto nneighbours_a = nneighbours.accessor<int, 2>();
+	auto atomIDs_a = blockAtomIDs.accessor<int, 1>();
+	auto molIDs_a = blockMolIDs.accessor<int, 1>();
+	auto output_a = output.accessor<float, 3>();
+
+	const float *sRs2 = Rs2.data_ptr<float>();
+	const float *sRs3 = Rs3.data_ptr<float>();
+
+	float expf_v = expf(-powf(M_PI, 2) * 0.5);
+	float sqrt2pi = sqrtf(2.0 * M_PI);
+
+#pragma omp parallel
+	{
+		FCHLNeighbourData data;
+
+		float scell[9];
+		float sinv_cell[9];
+
+#pragma omp for schedule(dynamic, 4)
+		for (int b = 0; b < nblocks; b++) {
+
+			int molID = molIDs_a[b];
+			int iatom = atomIDs_a[b];
+			int nneighbours_i = nneighbours_a[molID][iatom];
+
+			if (pbc) {
+				load_cell(cell, inv_cell, molID, scell, sinv_cell);
+			}
+
+			int offset = neighbour_offsets_a[molID][iatom];
+
+			const int *neighbours = &neighbour_indices_p[offset];
+			const int *shifts = neighbour_shifts_p != NULL ? &neighbour_shifts_p[3 * offset] : NULL;
+
+			nneighbours_i = load_neighbours(coords_a[molID], element_types_a[molID], neighbours, shifts, iatom, nneighbours_i, rcut, pbc, scell, sinv_cell, data);
+
+			float *out = &output_a[molID][iatom][0];
+
+			for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+				int jelement = data.elements[jatom];
+
+				float *drij = &data.drij[3 * jatom];
+				float drji[3] = { -drij[0], -drij[1], -drij[2] };
+
+				float rij = data.rij[jatom];
+
+				float scaling = 1.0 / powf(rij, two_body_decay);
+
+				float rcutij = get_cutoff_cpu(rij, rcut, 0.0, COSINE_CUTOFF);
+
+				float mu = log(rij / sqrt(1.0 + eta2 / powf(rij, 2.0)));
+				float sigma = sqrtf(log(1.0 + eta2 / powf(rij, 2.0)));
+
+				float invsigma22 = 1.0 / (2.0 * powf(sigma, 2));
+
+				for (int z = 0; z < nRs2; z++) {
+					out[jelement * nRs2 + z] += 1.0 / (sigma * sqrt2pi * sRs2[z]) * expf(-powf(log(sRs2[z]) - mu, 2) * invsigma22) * scaling * rcutij;
+				}
+
+				for (int katom = jatom + 1; katom < nneighbours_i; katom++) {
+
+					float rik = data.rij[katom];
+
+					if (rik > rcut) {
+						continue;
+					}
+
+					int kelement = data.elements[katom];
+
+					float *drik = &data.drij[3 * katom];
+
+					float drjk[3] = { drik[0] - drij[0], drik[1] - drij[1], drik[2] - drij[2] };
+					float drki[3] = { -drik[0], -drik[1], -drik[2] };
+					float drkj[3] = { -drjk[0], -drjk[1], -drjk[2] };
+
+					float rjk = sqrtf(drjk[0] * drjk[0] + drjk[1] * drjk[1] + drjk[2] * drjk[2]);
+
+					float rcutik = get_cutoff_cpu(rik, rcut, 0.0, COSINE_CUTOFF);
+
+					float angle = calc_angle_abcb_cpu(drji, drki);
+
+					float cos_1 = calc_cos_angle_abcb_cpu(drji, drki); // ji, ki
+					float cos_2 = calc_cos_angle_abcb_cpu(drjk, drik); // jk, ik
+					float cos_3 = calc_cos_angle_abcb_cpu(drij, drkj); // ij, kj
+
+					float ksi3 = three_body_weight * (1.0 + 3 * cos_1 * cos_2 * cos_3) / powf(rij * rik * rjk, three_body_decay);
+
+					float cos_angle = expf_v * 2.0 * cosf(angle) * ksi3;
+					float sin_angle = expf_v * 2.0 * sinf(angle) * ksi3;
+
+					int p = min(jelement, kelement);
+					int q = max(jelement, kelement);
+
+					int s = nelements * nRs2 + nRs3 * 2 * (-(p * (p + 1)) / 2 + q + nelements * p);
+
+					float rcuts = rcutik * rcutij;
+					float rmean = 0.5 * (rij + rik);
+
+					for (int l = 0; l < nRs3; l++) {
+
+						float radial = expf(-eta3 * powf(rmean - sRs3[l], 2.0)) * rcuts;
+
+						out[s + l * 2] += radial * cos_angle;
+						out[s + l * 2 + 1] += radial * sin_angle;
+					}
+				}
+			}
+		}
+	}
+}
+
+void FCHLRepresentationAndDerivativeCpu(torch::Tensor coordinates, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor output, torch::Tensor atom_offsets, torch::Tensor grad) {
+
+	int nRs2 = Rs2.size(0);
+	int nRs3 = Rs3.size(0);
+	int nelements = species.size(0);
+	int nblocks = blockAtomIDs.size(0);
+
+	bool pbc = cell.size(0) > 0;
+
+	auto coords_a = coordinates.accessor<float, 3>();
+	auto element_types_a = element_types.accessor<int, 2>();
+	auto neighbour_offsets_a = neighbour_offsets.accessor<int, 2>();
+	const int *neighbour_indices_p = neighbour_indices.data_ptr<int>();
+	const int *neighbour_shifts_p = neighbour_shifts.size(0) > 0 ? neighbour_shifts.data_ptr<int>() : NULL;
+	auto nneighbours_a = nneighbours.accessor<int, 2>();
+	auto atomIDs_a = blockAtomIDs.accessor<int, 1>();
+	auto molIDs_a = blockMolIDs.accessor<int, 1>();
+	auto output_a = output.accessor<float, 3>();
+	auto grad_a = grad.accessor<float, 4>();
+
+	// grad rows are packed without padding when atom_offsets is given, row b for the b-th entry of (molIDs, atomIDs), row = molID * max_natoms + iatom otherwise
+	const bool packed = atom_offsets.size(0) > 0;
+	const int max_natoms = coordinates.size(1);
+
+	const float *sRs2 = Rs2.data_ptr<float>();
+	const float *sRs3 = Rs3.data_ptr<float>();
+
+	float invcut = 1.0 / rcut;
+	float zeta_factor = expf(-powf(M_PI, 2) * 0.5);
+
+#pragma omp parallel
+	{
+		FCHLNeighbourData data;
+
+		float scell[9];
+		float sinv_cell[9];
+
+#pragma omp for schedule(dynamic, 4)
+		for (int b = 0; b < nblocks; b++) {
+
+			int molID = molIDs_a[b];
+			int iatom = atomIDs_a[b];
+			int nneighbours_i = nneighbours_a[molID][iatom];
+
+			if (pbc) {
+				load_cell(cell, inv_cell, molID, scell, sinv_cell);
+			}
+
+			int offset = neighbour_offsets_a[molID][iatom];
+
+			const int *neighbours = &neighbour_indices_p[offset];
+			const int *shifts = neighbour_shifts_p != NULL ? &neighbour_shifts_p[3 * offset] : NULL;
+
+			nneighbours_i = load_neighbours(coords_a[molID], element_types_a[molID], neighbours, shifts, iatom, nneighbours_i, rcut, pbc, scell, sinv_cell, data);
+
+			// each task owns output[molID][iatom] and its grad row, so no atomics are required here.
+			auto out = output_a[molID][iatom];
+			auto grad_i = grad_a[packed ? b : molID * max_natoms + iatom];
+
+			for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+				int j = data.indexes[jatom];
+				int jelement = data.elements[jatom];
+
+				float *drij = &data.drij[3 * jatom];
+				float drji[3] = { -drij[0], -drij[1], -drij[2] };
+
+				float rij = data.rij[jatom];
+				float rij2 = rij * rij;
+				float invrij = 1.0 / rij;
+				float invrij2 = invrij * invrij;
+
+				float scaling = 1.0 / powf(rij, two_body_decay);
+
+				float rcutij = get_cutoff_cpu(rij, rcut, 0.0, COSINE_CUTOFF);
+
+				float mu = log(rij / sqrt(1.0 + eta2 / powf(rij, 2.0)));
+				float sigma = sqrt(log(1.0 + eta2 / powf(rij, 2.0)));
+
+				float dcut = get_cutoff_derivative_cpu(rij, rcut, 0.0, COSINE_CUTOFF);
+
+				float dscal = -two_body_decay / powf(rij, two_body_decay + 1.0);
+
+				for (int z = 0; z < nRs2; z++) {
+
+					float radial = 1.0 / (sigma * sqrt(2.0 * M_PI) * sRs2[z]) * expf(-powf(log(sRs2[z]) - mu, 2) / (2.0 * powf(sigma, 2)));
+
+					out[jelement * nRs2 + z] += radial * scaling * rcutij;
+
+					for (int x = 0; x < 3; x++) {
+
+						float dx = drij[x] / rij;
+
+						float dradialx = get_radial_derivative_distribution_cpu(dx, rij, eta2, sRs2, z, LOGNORMAL_DISTRIBUTION);
+
+						float dcutx = dcut * -dx;
+
+						float dscalingx = dscal * -dx;
+
+						float deriv = dradialx * scaling * rcutij + radial * dscalingx * rcutij + radial * scaling * dcutx;
+
+						grad_i[iatom][x][jelement * nRs2 + z] -= deriv;
+						grad_i[j][x][jelement * nRs2 + z] += deriv;
+					}
+				}
+
+				for (int katom = jatom + 1; katom < nneighbours_i; katom++) {
+
+					float rik = data.rij[katom];
+
+					if (rik > rcut) {
+						continue;
+					}
+
+					int k = data.indexes[katom];
+					int kelement = data.elements[katom];
+
+					float *drik = &data.drij[3 * katom];
+
+					float drjk[3] = { drik[0] - drij[0], drik[1] - drij[1], drik[2] - drij[2] };
+					float drki[3] = { -drik[0], -drik[1], -drik[2] };
+					float drkj[3] = { -drjk[0], -drjk[1], -drjk[2] };
+
+					float rik2 = rik * rik;
+					float invrik = 1.0 / rik;
+					float invrik2 = invrik * invrik;
+
+					float rjk2 = drjk[0] * drjk[0] + drjk[1] * drjk[1] + drjk[2] * drjk[2];
+					float rjk = sqrtf(rjk2);
+
+					float invrjk = 1.0 / rjk;
+					float invrjk2 = invrjk * invrjk;
+
+					float rcutik = get_cutoff_cpu(rik, rcut, 0.0, COSINE_CUTOFF);
+
+					float angle = calc_angle_abcb_cpu(drji, drki);
+
+					float cos_i = calc_cos_angle_abcb_cpu(drji, drki); // ji, ki
+					float cos_k = calc_cos_angle_abcb_cpu(drjk, drik); // jk, ik
+					float cos_j = calc_cos_angle_abcb_cpu(drij, drkj); // ij, kj
+
+					float cos_angle = zeta_factor * 2.0 * cosf(angle);
+					float sin_angle = zeta_factor * 2.0 * sinf(angle);
+
+					float invr_atm = powf(invrij * invrjk * invrik, three_body_decay);
+
+					float atm = (1.0 + 3.0 * cos_i * cos_j * cos_k) * invr_atm * three_body_weight;
+
+					int p = min(jelement, kelement);
+					int q = max(jelement, kelement);
+
+					int s = nelements * nRs2 + nRs3 * 2 * (-(p * (p + 1)) / 2 + q + nelements * p);
+
+					float rcuts = rcutij * rcutik;
+
+					for (int l = 0; l < nRs3; l++) {
+
+						float radial = expf(-eta3 * powf(0.5 * (rij + rik) - sRs3[l], 2.0)) * rcuts;
+
+						out[s + l * 2] += radial * cos_angle * atm;
+						out[s + l * 2 + 1] += radial * sin_angle * atm;
+					}
+
+					float vi = dot_abcd_cpu(drji, drki);
+					float vj = dot_abcd_cpu(drkj, drij);
+					float vk = dot_abcd_cpu(drik, drjk);
+
+					float dcos_angle = zeta_factor * 2.0 * sinf(angle) / sqrt(max(1e-10f, rij2 * rik2 - vi * vi));
+					float dsin_angle = -zeta_factor * 2.0 * cosf(angle) / sqrt(max(1e-10f, rij2 * rik2 - vi * vi));
+
+					float atm_i = (3.0 * cos_j * cos_k) * invr_atm * invrij * invrik;
+					float atm_j = (3.0 * cos_k * cos_i) * invr_atm * invrij * invrjk;
+					float atm_k = (3.0 * cos_i * cos_j) * invr_atm * invrjk * invrik;
+
+					float atm_cut = atm * rcuts;
+
+					for (int x = 0; x < 3; x++) {
+
+						float a = drji[x];
+						float b = 0.0;
+						float c = drki[x];
+
+						float d_radial_d_j = (b - a) * invrij;
+						float d_radial_d_k = (b - c) * invrik;
+						float d_radial_d_i = -(d_radial_d_j + d_radial_d_k);
+
+						float d_angular_d_j = (c - b) + vi * ((b - a) * invrij2);
+						float d_angular_d_k = (a - b) + vi * ((b - c) * invrik2);
+						float d_angular_d_i = -(d_angular_d_j + d_angular_d_k);
+
+						float d_ijdecay = -M_PI * (b - a) * sinf(M_PI * rij * invcut) * 0.5 * invrij * invcut;
+						float d_ikdecay = -M_PI * (b - c) * sinf(M_PI * rik * invcut) * 0.5 * invrik * invcut;
+
+						float d_atm_ii = 2 * b - a - c - vi * ((b - a) * invrij2 + (b - c) * invrik2);
+						float d_atm_ij = c - a - vj * (b - a) * invrij2;
+						float d_atm_ik = a - c - vk * (b - c) * invrik2;
+
+						float d_atm_ji = c - b - vi * (a - b) * invrij2;
+						float d_atm_jj = 2 * a - b - c - vj * ((a - b) * invrij2 + (a - c) * invrjk2);
+						float d_atm_jk = b - c - vk * (a - c) * invrjk2;
+
+						float d_atm_ki = a - b - vi * (c - b) * invrik2;
+						float d_atm_kj = b - a - vj * (c - a) * invrjk2;
+						float d_atm_kk = 2 * c - a - b - vk * ((c - a) * invrjk2 + (c - b) * invrik2);
+
+						float d_atm_extra_i = ((a - b) * invrij2 + (c - b) * invrik2) * atm * three_body_decay / three_body_weight;
+						float d_atm_extra_j = ((b - a) * invrij2 + (c - a) * invrjk2) * atm * three_body_decay / three_body_weight;
+						float d_atm_extra_k = ((a - c) * invrjk2 + (b - c) * invrik2) * atm * three_body_decay / three_body_weight;
+
+						float datm_i = (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcuts;
+						float datm_j = (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcuts;
+						float datm_k = (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcuts;
+
+						float ddecay_i = (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm;
+						float ddecay_j = -d_ijdecay * rcutik * atm;
+						float ddecay_k = -rcutij * d_ikdecay * atm;
+
+						for (int l = 0; l < nRs3; l++) {
+
+							float radial = expf(-eta3 * powf(0.5 * (rij + rik) - sRs3[l], 2.0));
+							float d_radial = radial * eta3 * (0.5 * (rij + rik) - sRs3[l]);
+
+							int z = s + l * 2;
+
+							grad_i[iatom][x][z] += dcos_angle * d_angular_d_i * radial * atm_cut + cos_angle * d_radial * d_radial_d_i * atm_cut
+									+ cos_angle * radial * datm_i + cos_angle * radial * ddecay_i;
+
+							grad_i[iatom][x][z + 1] += dsin_angle * d_angular_d_i * radial * atm_cut + sin_angle * d_radial * d_radial_d_i * atm_cut
+									+ sin_angle * radial * datm_i + sin_angle * radial * ddecay_i;
+
+							grad_i[j][x][z] += dcos_angle * d_angular_d_j * radial * atm_cut + cos_angle * d_radial * d_radial_d_j * atm_cut
+									+ cos_angle * radial * datm_j + cos_angle * radial * ddecay_j;
+
+							grad_i[j][x][z + 1] += dsin_angle * d_angular_d_j * radial * atm_cut + sin_angle * d_radial * d_radial_d_j * atm_cut
+									+ sin_angle * radial * datm_j + sin_angle * radial * ddecay_j;
+
+							grad_i[k][x][z] += dcos_angle * d_angular_d_k * radial * atm_cut + cos_angle * d_radial * d_radial_d_k * atm_cut
+									+ cos_angle * radial * datm_k + cos_angle * radial * ddecay_k;
+
+							grad_i[k][x][z + 1] += dsin_angle * d_angular_d_k * radial * atm_cut + sin_angle * d_radial * d_radial_d_k * atm_cut
+									+ sin_angle * radial * datm_k + sin_angle * radial * ddecay_k;
+						}
+					}
+				}
+			}
+		}
+	}
+}
+
+void FCHLBackwardsCpu(torch::Tensor coordinates, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell,
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor grad_in, torch::Tensor grad_out) {
+
+	int nRs2 = Rs2.size(0);
+	int nRs3 = Rs3.size(0);
+	int nelements = species.size(0);
+	int nblocks = blockAtomIDs.size(0);
+
+	bool pbc = cell.size(0) > 0;
+
+	auto coords_a = coordinates.accessor<float, 3>();
+	auto element_types_a = element_types.accessor<int, 2>();
+	auto neighbour_offsets_a = neighbour_offsets.accessor<int, 2>();
+	const int *neighbour_indices_p = neighbour_indices.data_ptr<int>();
+	const int *neighbour_shifts_p = neighbour_shifts.size(0) > 0 ? neighbour_shifts.data_ptr<int>() : NULL;
+	auto nneighbours_a = nneighbours.accessor<int, 2>();
+	auto atomIDs_a = blockAtomIDs.accessor<int, 1>();
+	auto molIDs_a = blockMolIDs.accessor<int, 1>();
+	auto grad_in_a = grad_in.accessor<float, 3>();
+	auto grad_out_a = grad_out.accessor<float, 3>();
+
+	const float *sRs2 = Rs2.data_ptr<float>();
+	const float *sRs3 = Rs3.data_ptr<float>();
+
+	float invcut = 1.0 / rcut;
+	float zeta_factor = expf(-powf(M_PI, 2) * 0.5);
+
+#pragma omp parallel
+	{
+		FCHLNeighbourData data;
+
+		vector<float> sgrad;
+
+		float scell[9];
+		float sinv_cell[9];
+
+#pragma omp for schedule(dynamic, 4)
+		for (int b = 0; b < nblocks; b++) {
+
+			int molID = molIDs_a[b];
+			int iatom = atomIDs_a[b];
+			int nneighbours_i = nneighbours_a[molID][iatom];
+
+			if (pbc) {
+				load_cell(cell, inv_cell, molID, scell, sinv_cell);
+			}
+
+			int offset = neighbour_offsets_a[molID][iatom];
+
+			const int *neighbours = &neighbour_indices_p[offset];
+			const int *shifts = neighbour_shifts_p != NULL ? &neighbour_shifts_p[3 * offset] : NULL;
+
+			nneighbours_i = load_neighbours(coords_a[molID], element_types_a[molID], neighbours, shifts, iatom, nneighbours_i, rcut, pbc, scell, sinv_cell, data);
+
+			sgrad.assign(3 * nneighbours_i, 0.0);
+
+			auto gin = grad_in_a[molID][iatom];
+
+			float igrad[3] = { 0.0, 0.0, 0.0 };
+
+			for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+				int jelement = data.elements[jatom];
+
+				float *drij = &data.drij[3 * jatom];
+				float drji[3] = { -drij[0], -drij[1], -drij[2] };
+
+				float rij = data.rij[jatom];
+				float rij2 = rij * rij;
+				float invrij = 1.0 / rij;
+				float invrij2 = invrij * invrij;
+
+				float scaling = 1.0 / powf(rij, two_body_decay);
+
+				float rcutij = get_cutoff_cpu(rij, rcut, 0.0, COSINE_CUTOFF);
+
+				float mu = log(rij / sqrt(1.0 + eta2 / powf(rij, 2.0)));
+				float sigma = sqrt(log(1.0 + eta2 / powf(rij, 2.0)));
+
+				float dcut = get_cutoff_derivative_cpu(rij, rcut, 0.0, COSINE_CUTOFF);
+
+				float dscal = -two_body_decay / powf(rij, two_body_decay + 1.0);
+
+				for (int z = 0; z < nRs2; z++) {
+
+					float radial = 1.0 / (sigma * sqrt(2.0 * M_PI) * sRs2[z]) * expf(-powf(log(sRs2[z]) - mu, 2) / (2.0 * powf(sigma, 2)));
+
+					float grad_in_iatom = gin[jelement * nRs2 + z];
+
+					for (int x = 0; x < 3; x++) {
+
+						float dx = drij[x] / rij;
+
+						float dradialx = get_radial_derivative_distribution_cpu(dx, rij, eta2, sRs2, z, LOGNORMAL_DISTRIBUTION);
+
+						float dcutx = dcut * -dx;
+
+						float dscalingx = dscal * -dx;
+
+						float deriv = dradialx * scaling * rcutij + radial * dscalingx * rcutij + radial * scaling * dcutx;
+
+						igrad[x] -= grad_in_iatom * deriv;
+						sgrad[3 * jatom + x] += grad_in_iatom * deriv;
+					}
+				}
+
+				for (int katom = jatom + 1; katom < nneighbours_i; katom++) {
+
+					float rik = data.rij[katom];
+
+					if (rik > rcut) {
+						continue;
+					}
+
+					int kelement = data.elements[katom];
+
+					float *drik = &data.drij[3 * katom];
+
+					float drjk[3] = { drik[0] - drij[0], drik[1] - drij[1], drik[2] - drij[2] };
+					float drki[3] = { -drik[0], -drik[1], -drik[2] };
+					float drkj[3] = { -drjk[0], -drjk[1], -drjk[2] };
+
+					float rik2 = rik * rik;
+					float invrik = 1.0 / rik;
+					float invrik2 = invrik * invrik;
+
+					float rjk2 = drjk[0] * drjk[0] + drjk[1] * drjk[1] + drjk[2] * drjk[2];
+					float rjk = sqrtf(rjk2);
+
+					float invrjk = 1.0 / rjk;
+					float invrjk2 = invrjk * invrjk;
+
+					float rcutik = get_cutoff_cpu(rik, rcut, 0.0, COSINE_CUTOFF);
+
+					float angle = calc_angle_abcb_cpu(drji, drki);
+
+					float cos_i = calc_cos_angle_abcb_cpu(drji, drki); // ji, ki
+					float cos_k = calc_cos_angle_abcb_cpu(drjk, drik); // jk, ik
+					float cos_j = calc_cos_angle_abcb_cpu(drij, drkj); // ij, kj
+
+					float cos_angle = zeta_factor * 2.0 * cosf(angle);
+					float sin_angle = zeta_factor * 2.0 * sinf(angle);
+
+					float invr_atm = powf(invrij * invrjk * invrik, three_body_decay);
+
+					float atm = (1.0 + 3.0 * cos_i * cos_j * cos_k) * invr_atm * three_body_weight;
+
+					int p = min(jelement, kelement);
+					int q = max(jelement, kelement);
+
+					int s = nelements * nRs2 + nRs3 * 2 * (-(p * (p + 1)) / 2 + q + nelements * p);
+
+					float vi = dot_abcd_cpu(drji, drki);
+					float vj = dot_abcd_cpu(drkj, drij);
+					float vk = dot_abcd_cpu(drik, drjk);
+
+					float dcos_angle = zeta_factor * 2.0 * sinf(angle) / sqrt(max(1e-10f, rij2 * rik2 - vi * vi));
+					float dsin_angle = -zeta_factor * 2.0 * cosf(angle) / sqrt(max(1e-10f, rij2 * rik2 - vi * vi));
+
+					float atm_i = (3.0 * cos_j * cos_k) * invr_atm * invrij * invrik;
+					float atm_j = (3.0 * cos_k * cos_i) * invr_atm * invrij * invrjk;
+					float atm_k = (3.0 * cos_i * cos_j) * invr_atm * invrjk * invrik;
+
+					float rcuts = rcutij * rcutik;
+					float atm_cut = atm * rcuts;
+
+					/* contract grad_in over the radial grid first: the derivative terms are separable into
+					 * (angular | d_angular) x (radial | d_radial), so the l loop only needs doing once per triplet. */
+					float g_radial_cos = 0.0, g_radial_sin = 0.0, g_dradial_cos = 0.0, g_dradial_sin = 0.0;
+
+					for (int l = 0; l < nRs3; l++) {
+
+						float radial = expf(-eta3 * powf(0.5 * (rij + rik) - sRs3[l], 2.0));
+						float d_radial = radial * eta3 * (0.5 * (rij + rik) - sRs3[l]);
+
+						float gcos = gin[s + l * 2];
+						float gsin = gin[s + l * 2 + 1];
+
+						g_radial_cos += gcos * radial;
+						g_radial_sin += gsin * radial;
+						g_dradial_cos += gcos * d_radial;
+						g_dradial_sin += gsin * d_radial;
+					}
+
+					float g_angular = g_radial_cos * dcos_angle + g_radial_sin * dsin_angle;
+					float g_dradial = g_dradial_cos * cos_angle + g_dradial_sin * sin_angle;
+					float g_radial = g_radial_cos * cos_angle + g_radial_sin * sin_angle;
+
+					for (int x = 0; x < 3; x++) {
+
+						float a = drji[x];
+						float b = 0.0;
+						float c = drki[x];
+
+						float d_radial_d_j = (b - a) * invrij;
+						float d_radial_d_k = (b - c) * invrik;
+						float d_radial_d_i = -(d_radial_d_j + d_radial_d_k);
+
+						float d_angular_d_j = (c - b) + vi * ((b - a) * invrij2);
+						float d_angular_d_k = (a - b) + vi * ((b - c) * invrik2);
+						float d_angular_d_i = -(d_angular_d_j + d_angular_d_k);
+
+						float d_ijdecay = -M_PI * (b - a) * sinf(M_PI * rij * invcut) * 0.5 * invrij * invcut;
+						float d_ikdecay = -M_PI * (b - c) * sinf(M_PI * rik * invcut) * 0.5 * invrik * invcut;
+
+						float d_atm_ii = 2 * b - a - c - vi * ((b - a) * invrij2 + (b - c) * invrik2);
+						float d_atm_ij = c - a - vj * (b - a) * invrij2;
+						float d_atm_ik = a - c - vk * (b - c) * invrik2;
+
+						float d_atm_ji = c - b - vi * (a - b) * invrij2;
+						float d_atm_jj = 2 * a - b - c - vj * ((a - b) * invrij2 + (a - c) * invrjk2);
+						float d_atm_jk = b - c - vk * (a - c) * invrjk2;
+
+						float d_atm_ki = a - b - vi * (c - b) * invrik2;
+						float d_atm_kj = b - a - vj * (c - a) * invrjk2;
+						float d_atm_kk = 2 * c - a - b - vk * ((c - a) * invrjk2 + (c - b) * invrik2);
+
+						float d_atm_extra_i = ((a - b) * invrij2 + (c - b) * invrik2) * atm * three_body_decay / three_body_weight;
+						float d_atm_extra_j = ((b - a) * invrij2 + (c - a) * invrjk2) * atm * three_body_decay / three_body_weight;
+						float d_atm_extra_k = ((a - c) * invrjk2 + (b - c) * invrik2) * atm * three_body_decay / three_body_weight;
+
+						float datm_i = (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcuts
+								+ (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm;
+						float datm_j = (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcuts
+								- d_ijdecay * rcutik * atm;
+						float datm_k = (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcuts
+								- rcutij * d_ikdecay * atm;
+
+						igrad[x] += g_angular * d_angular_d_i * atm_cut + g_dradial * d_radial_d_i * atm_cut + g_radial * datm_i;
+						sgrad[3 * jatom + x] += g_angular * d_angular_d_j * atm_cut + g_dradial * d_radial_d_j * atm_cut + g_radial * datm_j;
+						sgrad[3 * katom + x] += g_angular * d_angular_d_k * atm_cut + g_dradial * d_radial_d_k * atm_cut + g_radial * datm_k;
+					}
+				}
+			}
+
+			for (int x = 0; x < 3; x++) {
+#pragma omp atomic
+				grad_out_a[molID][iatom][x] += igrad[x];
+			}
+
+			for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+				int j = data.indexes[jatom];
+
+				for (int x = 0; x < 3; x++) {
+#pragma omp atomic
+					grad_out_a[molID][j][x] += sgrad[3 * jatom + x];
+				}
+			}
+		}
+	}
+}
+
+static void check_cpu_inputs(torch::Tensor coordinates, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts) {
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+	TORCH_CHECK(coordinates.scalar_type() == torch::kFloat32, "coordinates must be float32");
+	TORCH_CHECK(neighbour_offsets.device().type() == torch::kCPU, "neighbour_offsets must be a CPU tensor");
+	TORCH_CHECK(neighbour_indices.device().type() == torch::kCPU, "neighbour_indices must be a CPU tensor");
+	TORCH_CHECK(neighbour_indices.scalar_type() == torch::kInt32 && neighbour_indices.is_contiguous(), "neighbour_indices must be a contiguous int32 tensor");
+	TORCH_CHECK(neighbour_shifts.size(0) == 0 || neighbour_shifts.size(0) == neighbour_indices.size(0), "neighbour_shifts must be empty or [npairs, 3]");
+	TORCH_CHECK(neighbour_shifts.scalar_type() == torch::kInt32 && neighbour_shifts.is_contiguous(), "neighbour_shifts must be a contiguous int32 tensor");
+}
+
+torch::Tensor get_fchl_representation(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints,
+		torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut) {
+
+	check_cpu_inputs(coordinates, neighbour_offsets, neighbour_indices, neighbour_shifts);
+
+	int nspecies = species.size(0);
+
+	int nRs2 = two_body_gridpoints.size(0);
+	int nRs3 = three_body_gridpoints.size(0);
+
+	int repsize = nspecies * nRs2 + (nspecies * (nspecies + 1)) * nRs3;
+
+	if (coordinates.dim() == 2) { // pad a dimension
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
+
+	FCHLCpu(coordinates, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices, neighbour_shifts, nneighbours,
+			two_body_gridpoints.contiguous(), three_body_gridpoints.contiguous(), eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+			output);
+
+	return output;
+}
+
+torch::Tensor get_fchl_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints,
+		torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut) {
+
+	check_cpu_inputs(coordinates, neighbour_offsets, neighbour_indices, neighbour_shifts);
+
+	int nspecies = species.size(0);
+
+	int nRs2 = two_body_gridpoints.size(0);
+	int nRs3 = three_body_gridpoints.size(0);
+
+	int repsize = nspecies * nRs2 + (nspecies * (nspecies + 1)) * nRs3;
+
+	if (coordinates.dim() == 2) { // pad a dimension
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
+	torch::Tensor output_deriv = torch::zeros( { nbatch * natoms, natoms, 3, repsize }, options);
+
+	torch::Tensor atom_offsets = torch::empty( { 0 }, options.dtype(torch::kInt32));
+
+	FCHLRepresentationAndDerivativeCpu(coordinates, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets,
+			neighbour_indices, neighbour_shifts, nneighbours, two_body_gridpoints.contiguous(), three_body_gridpoints.contiguous(), eta2, eta3, two_body_decay,
+			three_body_weight, three_body_decay, rcut, output, atom_offsets, output_deriv);
+
+	return output_deriv.view( { nbatch, natoms, natoms, 3, repsize });
+}
+
+torch::Tensor fchl_backwards(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2,
+		float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor grad_in) {
+
+	check_cpu_inputs(coordinates, neighbour_offsets, neighbour_indices, neighbour_shifts);
+
+	if (coordinates.dim() == 2) { // pad a dimension
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output_deriv = torch::zeros( { nbatch, natoms, 3 }, options);
+
+	FCHLBackwardsCpu(coordinates, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices,
+			neighbour_shifts, nneighbours, two_body_gridpoints.contiguous(), three_body_gridpoints.contiguous(), eta2, eta3, two_body_decay, three_body_weight,
+			three_body_decay, rcut, grad_in.contiguous(), output_deriv);
+
+	return output_deriv;
+}
+
+std::vector<torch::Tensor> get_fchl_and_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species,
+		torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs,
+		torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours,
+		torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
+		float three_body_decay, float rcut, torch::Tensor atom_offsets, bool gradients) {
+
+	/*
+	 * atom_offsets: [nbatch + 1] exclusive prefix sum of the atom counts. When non-empty the derivative is returned packed without
+	 * padding as [natoms_total, max_natoms, 3, repsize], one row per entry of (blockMolIDs, blockAtomIDs) in that order (atom_offsets[molID] + iatom
+	 * for the ragged order), otherwise as [nbatch, max_natoms, max_natoms, 3, repsize].
+	 */
+
+	check_cpu_inputs(coordinates, neighbour_offsets, neighbour_indices, neighbour_shifts);
+
+	int nspecies = species.size(0);
+
+	int nRs2 = two_body_gridpoints.size(0);
+	int nRs3 = three_body_gridpoints.size(0);
+
+	int repsize = nspecies * nRs2 + (nspecies * (nspecies + 1)) * nRs3;
+
+	if (coordinates.dim() == 2) { // pad a dimension
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
+
+	if (gradients) {
+
+		atom_offsets = atom_offsets.to(torch::kInt32).contiguous();
+
+		const bool packed = atom_offsets.size(0) > 0;
+
+		const int nrows = packed ? atom_offsets[nbatch].item<int>() : nbatch * natoms;
+
+		torch::Tensor output_deriv = torch::zeros( { nrows, natoms, 3, repsize }, options);
+
+		FCHLRepresentationAndDerivativeCpu(coordinates, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets,
+				neighbour_indices, neighbour_shifts, nneighbours, two_body_gridpoints.contiguous(), three_body_gridpoints.contiguous(), eta2, eta3, two_body_decay,
+				three_body_weight, three_body_decay, rcut, output, atom_offsets, output_deriv);
+
+		if (!packed) {
+			output_deriv = output_deriv.view( { nbatch, natoms, natoms, 3, repsize });
+		}
+
+		return {output, output_deriv};
+	} else {
+
+		FCHLCpu(coordinates, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices, neighbour_shifts, nneighbours,
+				two_body_gridpoints.contiguous(), three_body_gridpoints.contiguous(), eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+				output);
+
+		return {output};
+	}
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+	m.def("get_fchl_representation", &get_fchl_representation, "FCHL19 Representation (CPU)");
+	m.def("get_fchl_derivative", &get_fchl_derivative, "Grad FCHL19 Representation (CPU)");
+	m.def("get_fchl_and_derivative", &get_fchl_and_derivative, "FCHL19 Representation and Grad (CPU)");
+	m.def("fchl_backwards", &fchl_backwards, "FCHL19 backwards pass for autograd (CPU)");
+}
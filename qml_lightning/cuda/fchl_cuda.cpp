@@ -4,29 +4,31 @@
 using namespace at;
 using namespace std;
 
-void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell,
-		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3,
-		float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor output);
+void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor output);
 
 void FCHLRepresentationAndDerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
-		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist,
-		torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut, torch::Tensor output, torch::Tensor grad);
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2,
+		float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor output, torch::Tensor atom_offsets,
+		torch::Tensor grad);
 
 void FCHLDerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut,
-		torch::Tensor grad);
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor atom_offsets, torch::Tensor grad);
 
 void FCHLBackwardsCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut,
-		torch::Tensor grad_in, torch::Tensor grad_out);
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor grad_in, torch::Tensor grad_out);
 
-torch::Tensor get_fchl_representation(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut) {
+torch::Tensor get_fchl_representation(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints,
+		torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut) {
 
 	torch::Tensor clone_coordinates;
 	torch::Tensor clone_charges;
@@ -52,17 +54,18 @@ torch::Tensor get_fchl_representation(torch::Tensor coordinates, torch::Tensor c
 
 	torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
 
-	FCHLCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, two_body_gridpoints,
-			three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, output);
+	FCHLCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices,
+			neighbour_shifts, nneighbours, two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+			output);
 
 	return output;
 
 }
 
-torch::Tensor get_fchl_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut) {
+torch::Tensor get_fchl_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints,
+		torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut) {
 
 	torch::Tensor clone_coordinates;
 	torch::Tensor clone_charges;
@@ -86,19 +89,22 @@ torch::Tensor get_fchl_derivative(torch::Tensor coordinates, torch::Tensor charg
 
 	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCUDA);
 
-	torch::Tensor output_deriv = torch::zeros( { nbatch, natoms, natoms, 3, repsize }, options);
+	torch::Tensor output_deriv = torch::zeros( { nbatch * natoms, natoms, 3, repsize }, options);
 
-	FCHLDerivativeCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, two_body_gridpoints,
-			three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, output_deriv);
+	torch::Tensor atom_offsets = torch::empty( { 0 }, options.dtype(torch::kInt32));
 
-	return output_deriv;
+	FCHLDerivativeCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices,
+			neighbour_shifts, nneighbours, two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+			atom_offsets, output_deriv);
+
+	return output_deriv.view( { nbatch, natoms, natoms, 3, repsize });
 
 }
 
 torch::Tensor fchl_backwards(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut, torch::Tensor grad_in) {
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2,
+		float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor grad_in) {
 
 	torch::Tensor clone_coordinates;
 	torch::Tensor clone_charges;
@@ -117,17 +123,25 @@ torch::Tensor fchl_backwards(torch::Tensor coordinates, torch::Tensor charges, t
 
 	torch::Tensor output_deriv = torch::zeros( { nbatch, natoms, 3 }, options);
 
-	FCHLBackwardsCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, two_body_gridpoints,
-			three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, grad_in, output_deriv);
+	FCHLBackwardsCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices,
+			neighbour_shifts, nneighbours, two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+			grad_in, output_deriv);
 
 	return output_deriv;
 
 }
 
-std::vector<torch::Tensor> get_fchl_and_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
-		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist,
-		torch::Tensor nneighbours, torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay,
-		float three_body_weight, float three_body_decay, float rcut, bool gradients) {
+std::vector<torch::Tensor> get_fchl_and_derivative(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species,
+		torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs,
+		torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours,
+		torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
+		float three_body_decay, float rcut, torch::Tensor atom_offsets, bool gradients) {
+
+	/*
+	 * atom_offsets: [nbatch + 1] exclusive prefix sum of the atom counts. When non-empty the derivative is returned packed without
+	 * padding as [natoms_total, max_natoms, 3, repsize], one row per entry of (blockMolIDs, blockAtomIDs) in that order (atom_offsets[molID] + iatom
+	 * for the ragged order), otherwise as [nbatch, max_natoms, max_natoms, 3, repsize].
+	 */
 
 	torch::Tensor clone_coordinates;
 	torch::Tensor clone_charges;
@@ -154,18 +168,29 @@ std::vector<torch::Tensor> get_fchl_and_derivative(torch::Tensor coordinates, to
 	if (gradients) {
 
 		torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
-		torch::Tensor output_deriv = torch::zeros( { nbatch, natoms, natoms, 3, repsize }, options);
 
-		FCHLRepresentationAndDerivativeCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours,
-				two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, output, output_deriv);
+		const bool packed = atom_offsets.size(0) > 0;
+
+		const int nrows = packed ? atom_offsets[nbatch].item<int>() : nbatch * natoms;
+
+		torch::Tensor output_deriv = torch::zeros( { nrows, natoms, 3, repsize }, options);
+
+		FCHLRepresentationAndDerivativeCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets,
+				neighbour_indices, neighbour_shifts, nneighbours, two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight,
+				three_body_decay, rcut, output, atom_offsets, output_deriv);
+
+		if (!packed) {
+			output_deriv = output_deriv.view( { nbatch, natoms, natoms, 3, repsize });
+		}
 
 		return {output, output_deriv};
 	} else {
 
 		torch::Tensor output = torch::zeros( { nbatch, natoms, repsize }, options);
 
-		FCHLCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, two_body_gridpoints,
-				three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, output);
+		FCHLCuda(coordinates, charges, species, element_types, cell, inv_cell, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices,
+				neighbour_shifts, nneighbours, two_body_gridpoints, three_body_gridpoints, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut,
+				output);
 
 		return {output};
 	}
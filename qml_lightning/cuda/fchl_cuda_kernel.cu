@@ -48,6 +48,17 @@ __device__ void get_pbc_drij(float *drij, float *cell_vectors, float *inv_cell_v
 	}
 }
 
+__device__ void add_image_shift(float *rj, const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> &cell,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> &neighbour_shifts, int molID, int pair) {
+
+	/* moves neighbour j to the periodic image the pair was found at, r_j + h n with n = neighbour_shifts[pair] */
+	for (int m = 0; m < 3; m++) {
+		for (int k = 0; k < 3; k++) {
+			rj[m] += cell[molID][m][k] * neighbour_shifts[pair][k];
+		}
+	}
+}
+
 __device__ float get_cutoff(float rij, float rcut, float rswitch, int cutoff_type) {
 	float cut = 1.0;
 
@@ -269,7 +280,9 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_cell,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs2,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
@@ -315,11 +328,18 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 
 	for (int jatom = threadIdx.y * blockDim.x + threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x * blockDim.y) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
+
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 
 	}
@@ -338,6 +358,9 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	if (cell.size(0) > 0) {
 
 		pbc = true;
@@ -372,7 +395,7 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 		drij[1] = ri[1] - rj[1];
 		drij[2] = ri[2] - rj[2];
 
-		if (pbc) {
+		if (minimum_image) {
 			get_pbc_drij(drij, scell, sinv_cell);
 		}
 
@@ -382,6 +405,11 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 
 		float rij = sqrtf(drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2]);
 
+		// neighbour lists may be built with a skin (rcut + skin), so drop pairs outside the cutoff here
+		if (rij > rcut) {
+			continue;
+		}
+
 		float scaling = 1.0 / powf(rij, two_body_decay);
 
 		float rcutij = get_cutoff(rij, rcut, 0.0, 0);
@@ -411,7 +439,7 @@ __global__ void fchl19_representation_cuda_old(const torch::PackedTensorAccessor
 			drik[1] = ri[1] - rk[1];
 			drik[2] = ri[2] - rk[2];
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_drij(drik, scell, sinv_cell);
 			}
 			drjk[0] = drik[0] - drij[0];
@@ -481,7 +509,9 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_cell,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs2,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
@@ -523,11 +553,18 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 
 	for (int jatom = threadIdx.y * blockDim.x + threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x * blockDim.y) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
+
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 
 	}
@@ -545,6 +582,9 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	if (cell.size(0) > 0) {
 
 		pbc = true;
@@ -575,7 +615,7 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 		drij[1] = ri[1] - scoords_y[jatom];
 		drij[2] = ri[2] - scoords_z[jatom];
 
-		if (pbc) {
+		if (minimum_image) {
 			get_pbc_drij(drij, scell, sinv_cell);
 		}
 
@@ -585,6 +625,11 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 
 		float rij = sqrtf(drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2]);
 
+		// neighbour lists may be built with a skin (rcut + skin), so drop pairs outside the cutoff here
+		if (rij > rcut) {
+			continue;
+		}
+
 		float scaling = 1.0 / powf(rij, two_body_decay);
 
 		float rcutij = get_cutoff(rij, rcut, 0.0, 0);
@@ -610,7 +655,7 @@ __global__ void fchl19_representation_cuda(const torch::PackedTensorAccessor32<f
 			drik[1] = ri[1] - scoords_y[katom];
 			drik[2] = ri[2] - scoords_z[katom];
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_drij(drik, scell, sinv_cell);
 			}
 
@@ -681,12 +726,15 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_cell,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs,
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs2,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
 		float three_body_decay, float rcut, torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> output,
-		torch::PackedTensorAccessor32<float, 5, torch::RestrictPtrTraits> grad) {
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> atom_offsets,
+		torch::PackedTensorAccessor32<float, 4, torch::RestrictPtrTraits> grad) {
 
 	extern __shared__ int s[];
 
@@ -709,15 +757,27 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 
 	int molID = blockMolIDs[blockIdx.x];
 	int iatom = blockAtomIDs[blockIdx.x];
+
+	// grad row of this atom: packed without padding when atom_offsets is given, one row per block in the order of (blockMolIDs, blockAtomIDs),
+	// i.e atom_offsets[molID] + iatom for the ragged order or contiguous rows per element for an element-sorted order. molID * max_natoms + iatom otherwise
+	int row = atom_offsets.size(0) > 0 ? blockIdx.x : molID * coordinates.size(1) + iatom;
+
 	int nneighbours_i = nneighbours[molID][iatom];
 
 	for (int jatom = threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
+
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 		sneighbours[jatom] = j;
 
@@ -733,6 +793,9 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	if (cell.size(0) > 0) {
 
 		pbc = true;
@@ -778,7 +841,7 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 		drij[1] = ri[1] - rj[1];
 		drij[2] = ri[2] - rj[2];
 
-		if (pbc) {
+		if (minimum_image) {
 			get_pbc_drij(drij, scell, sinv_cell);
 		}
 
@@ -786,6 +849,11 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 
 		float rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
 		float rij = sqrtf(rij2);
+
+		// neighbour lists may be built with a skin (rcut + skin), so drop pairs outside the cutoff here
+		if (rij > rcut) {
+			continue;
+		}
 		float invrij = 1.0 / rij;
 		float invrij2 = invrij * invrij;
 
@@ -820,8 +888,8 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 
 				float deriv = dradialx * scaling * rcutij + radial * dscalingx * rcutij + radial * scaling * dcutx;
 
-				atomicAdd(&grad[molID][iatom][iatom][x][jelement * nRs2 + z], -deriv);
-				atomicAdd(&grad[molID][iatom][j][x][jelement * nRs2 + z], deriv);
+				atomicAdd(&grad[row][iatom][x][jelement * nRs2 + z], -deriv);
+				atomicAdd(&grad[row][j][x][jelement * nRs2 + z], deriv);
 
 			}
 
@@ -840,7 +908,7 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 			drik[1] = ri[1] - rk[1];
 			drik[2] = ri[2] - rk[2];
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_drij(drik, scell, sinv_cell);
 			}
 			drjk[0] = drik[0] - drij[0];
@@ -968,32 +1036,32 @@ __global__ void fchl19_representation_and_derivative_cuda(const torch::PackedTen
 
 					int z = s + l * 2;
 
-					atomicAdd(&grad[molID][iatom][iatom][x][z],
+					atomicAdd(&grad[row][iatom][x][z],
 							dcos_angle * d_angular_d_i * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_i * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcutij
 											* rcutik + cos_angle * radial * (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm);
 
-					atomicAdd(&grad[molID][iatom][iatom][x][z + 1],
+					atomicAdd(&grad[row][iatom][x][z + 1],
 							dsin_angle * d_angular_d_i * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_i * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcutij
 											* rcutik + sin_angle * radial * (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm);
 
-					atomicAdd(&grad[molID][iatom][j][x][z],
+					atomicAdd(&grad[row][j][x][z],
 							dcos_angle * d_angular_d_j * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_j * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcutij
 											* rcutik - cos_angle * radial * d_ijdecay * rcutik * atm);
 
-					atomicAdd(&grad[molID][iatom][j][x][z + 1],
+					atomicAdd(&grad[row][j][x][z + 1],
 							dsin_angle * d_angular_d_j * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_j * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcutij
 											* rcutik - sin_angle * radial * d_ijdecay * rcutik * atm);
 
-					atomicAdd(&grad[molID][iatom][k][x][z],
+					atomicAdd(&grad[row][k][x][z],
 							dcos_angle * d_angular_d_k * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_k * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcutij
 											* rcutik - cos_angle * radial * rcutij * d_ikdecay * atm);
 
-					atomicAdd(&grad[molID][iatom][k][x][z + 1],
+					atomicAdd(&grad[row][k][x][z + 1],
 							dsin_angle * d_angular_d_k * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_k * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcutij
 											* rcutik - sin_angle * radial * rcutij * d_ikdecay * atm);
@@ -1012,11 +1080,14 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_cell,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs2,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut, torch::PackedTensorAccessor32<float, 5, torch::RestrictPtrTraits> grad) {
+		float three_body_decay, float rcut, const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> atom_offsets,
+		torch::PackedTensorAccessor32<float, 4, torch::RestrictPtrTraits> grad) {
 
 	extern __shared__ int s[];
 
@@ -1039,17 +1110,32 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 
 	int molID = blockMolIDs[blockIdx.x];
 	int iatom = blockAtomIDs[blockIdx.x];
+
+	// grad row of this atom: packed without padding when atom_offsets is given, one row per block in the order of (blockMolIDs, blockAtomIDs),
+	// i.e atom_offsets[molID] + iatom for the ragged order or contiguous rows per element for an element-sorted order. molID * max_natoms + iatom otherwise
+	int row = atom_offsets.size(0) > 0 ? blockIdx.x : molID * coordinates.size(1) + iatom;
+
 	int nneighbours_i = nneighbours[molID][iatom];
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	for (int jatom = threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
+
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 		sneighbours[jatom] = j;
 
@@ -1110,7 +1196,7 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 		drij[1] = ri[1] - rj[1];
 		drij[2] = ri[2] - rj[2];
 
-		if (pbc) {
+		if (minimum_image) {
 			get_pbc_drij(drij, scell, sinv_cell);
 		}
 
@@ -1118,6 +1204,11 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 
 		float rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
 		float rij = sqrtf(rij2);
+
+		// neighbour lists may be built with a skin (rcut + skin), so drop pairs outside the cutoff here
+		if (rij > rcut) {
+			continue;
+		}
 		float invrij = 1.0 / rij;
 		float invrij2 = invrij * invrij;
 
@@ -1148,8 +1239,8 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 
 				float deriv = dradialx * scaling * rcutij + radial * dscalingx * rcutij + radial * scaling * dcutx;
 
-				atomicAdd(&grad[molID][iatom][iatom][x][jelement * nRs2 + z], -deriv);
-				atomicAdd(&grad[molID][iatom][j][x][jelement * nRs2 + z], deriv);
+				atomicAdd(&grad[row][iatom][x][jelement * nRs2 + z], -deriv);
+				atomicAdd(&grad[row][j][x][jelement * nRs2 + z], deriv);
 
 			}
 
@@ -1168,7 +1259,7 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 			drik[1] = ri[1] - rk[1];
 			drik[2] = ri[2] - rk[2];
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_drij(drik, scell, sinv_cell);
 			}
 
@@ -1286,32 +1377,32 @@ __global__ void fchl19_derivative_cuda(const torch::PackedTensorAccessor32<float
 
 					int z = s + l * 2;
 
-					atomicAdd(&grad[molID][iatom][iatom][x][z],
+					atomicAdd(&grad[row][iatom][x][z],
 							dcos_angle * d_angular_d_i * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_i * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcutij
 											* rcutik + cos_angle * radial * (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm);
 
-					atomicAdd(&grad[molID][iatom][iatom][x][z + 1],
+					atomicAdd(&grad[row][iatom][x][z + 1],
 							dsin_angle * d_angular_d_i * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_i * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ii + atm_j * d_atm_ij + atm_k * d_atm_ik + d_atm_extra_i) * three_body_weight * rcutij
 											* rcutik + sin_angle * radial * (d_ijdecay * rcutik + rcutij * d_ikdecay) * atm);
 
-					atomicAdd(&grad[molID][iatom][j][x][z],
+					atomicAdd(&grad[row][j][x][z],
 							dcos_angle * d_angular_d_j * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_j * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcutij
 											* rcutik - cos_angle * radial * d_ijdecay * rcutik * atm);
 
-					atomicAdd(&grad[molID][iatom][j][x][z + 1],
+					atomicAdd(&grad[row][j][x][z + 1],
 							dsin_angle * d_angular_d_j * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_j * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ji + atm_j * d_atm_jj + atm_k * d_atm_jk + d_atm_extra_j) * three_body_weight * rcutij
 											* rcutik - sin_angle * radial * d_ijdecay * rcutik * atm);
 
-					atomicAdd(&grad[molID][iatom][k][x][z],
+					atomicAdd(&grad[row][k][x][z],
 							dcos_angle * d_angular_d_k * radial * atm * rcutij * rcutik + cos_angle * d_radial * d_radial_d_k * atm * rcutij * rcutik
 									+ cos_angle * radial * (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcutij
 											* rcutik - cos_angle * radial * rcutij * d_ikdecay * atm);
 
-					atomicAdd(&grad[molID][iatom][k][x][z + 1],
+					atomicAdd(&grad[row][k][x][z + 1],
 							dsin_angle * d_angular_d_k * radial * atm * rcutij * rcutik + sin_angle * d_radial * d_radial_d_k * atm * rcutij * rcutik
 									+ sin_angle * radial * (atm_i * d_atm_ki + atm_j * d_atm_kj + atm_k * d_atm_kk + d_atm_extra_k) * three_body_weight * rcutij
 											* rcutik - sin_angle * radial * rcutij * d_ikdecay * atm);
@@ -1330,7 +1421,9 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_cell,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs2,
 		const torch::PackedTensorAccessor32<float, 1, torch::RestrictPtrTraits> Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
@@ -1366,11 +1459,18 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 
 	for (int jatom = threadIdx.y * blockDim.x + threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x * blockDim.y) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
+
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 		sneighbours[jatom] = j;
 
@@ -1401,6 +1501,9 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	if (cell.size(0) > 0) {
 
 		pbc = true;
@@ -1449,7 +1552,7 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 		drij[1] = ri[1] - rj[1];
 		drij[2] = ri[2] - rj[2];
 
-		if (pbc) {
+		if (minimum_image) {
 			get_pbc_drij(drij, scell, sinv_cell);
 		}
 
@@ -1457,6 +1560,11 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 
 		float rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
 		float rij = sqrtf(rij2);
+
+		// neighbour lists may be built with a skin (rcut + skin), so drop pairs outside the cutoff here
+		if (rij > rcut) {
+			continue;
+		}
 		float invrij = 1.0 / rij;
 		float invrij2 = invrij * invrij;
 
@@ -1517,7 +1625,7 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 			drik[1] = ri[1] - rk[1];
 			drik[2] = ri[2] - rk[2];
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_drij(drik, scell, sinv_cell);
 			}
 
@@ -1714,9 +1822,9 @@ __global__ void fchl19_backwards_cuda(const torch::PackedTensorAccessor32<float,
 }
 
 void FCHLCuda_old(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut,
-		torch::Tensor output) {
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor output) {
 
 	const int nthreadsx = 32;
 	const int nthreadsy = 1;
@@ -1745,7 +1853,9 @@ void FCHLCuda_old(torch::Tensor coordinates, torch::Tensor charges, torch::Tenso
 			inv_cell.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			Rs2.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
@@ -1758,9 +1868,10 @@ void FCHLCuda_old(torch::Tensor coordinates, torch::Tensor charges, torch::Tenso
 
 }
 
-void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell, torch::Tensor inv_cell,
-		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3,
-		float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor output) {
+void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor output) {
 
 	const int nthreadsx = 16;
 	const int nthreadsy = 8;
@@ -1789,7 +1900,9 @@ void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor sp
 			inv_cell.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			Rs2.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
@@ -1803,9 +1916,9 @@ void FCHLCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor sp
 }
 
 void FCHLDerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut,
-		torch::Tensor grad) {
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor atom_offsets, torch::Tensor grad) {
 
 	const int nthreads = 32;
 
@@ -1827,22 +1940,25 @@ void FCHLDerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch:
 			inv_cell.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			Rs2.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
 			Rs3.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
 			eta2, eta3, two_body_decay, three_body_weight, three_body_decay,rcut,
-			grad.packed_accessor32<float, 5, torch::RestrictPtrTraits>());
+			atom_offsets.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			grad.packed_accessor32<float, 4, torch::RestrictPtrTraits>());
 
 	cudaDeviceSynchronize();
 
 }
 
 void FCHLBackwardsCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-		torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut,
-		torch::Tensor grad_in, torch::Tensor grad_out) {
+		torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay,
+		float three_body_weight, float three_body_decay, float rcut, torch::Tensor grad_in, torch::Tensor grad_out) {
 
 	const int nthreadsx = 16;
 	const int nthreadsy = 8;
@@ -1869,7 +1985,9 @@ void FCHLBackwardsCuda(torch::Tensor coordinates, torch::Tensor charges, torch::
 			inv_cell.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			Rs2.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
@@ -1883,9 +2001,10 @@ void FCHLBackwardsCuda(torch::Tensor coordinates, torch::Tensor charges, torch::
 }
 
 void FCHLRepresentationAndDerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
-		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist,
-		torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2, float eta3, float two_body_decay, float three_body_weight,
-		float three_body_decay, float rcut, torch::Tensor output, torch::Tensor grad) {
+		torch::Tensor cell, torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets,
+		torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor Rs2, torch::Tensor Rs3, float eta2,
+		float eta3, float two_body_decay, float three_body_weight, float three_body_decay, float rcut, torch::Tensor output, torch::Tensor atom_offsets,
+		torch::Tensor grad) {
 
 	const int nthreads = 32;
 
@@ -1907,14 +2026,17 @@ void FCHLRepresentationAndDerivativeCuda(torch::Tensor coordinates, torch::Tenso
 			inv_cell.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			Rs2.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
 			Rs3.packed_accessor32<float, 1, torch::RestrictPtrTraits>(),
 			eta2, eta3, two_body_decay, three_body_weight, three_body_decay,rcut,
 
-			output.packed_accessor32<float, 3, torch::RestrictPtrTraits>(), grad.packed_accessor32<float, 5, torch::RestrictPtrTraits>());
+			output.packed_accessor32<float, 3, torch::RestrictPtrTraits>(), atom_offsets.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			grad.packed_accessor32<float, 4, torch::RestrictPtrTraits>());
 
 	cudaDeviceSynchronize();
 
@@ -0,0 +1,456 @@
+#include <torch/extension.h>
+#include <omp.h>
+#include <iostream>
+#include <vector>
+
+#include "cpu_utils.h"
+
+using namespace at;
+using namespace std;
+
+void getElementTypesCPU(torch::Tensor charges, torch::Tensor natom_counts, torch::Tensor species, torch::Tensor element_types) {
+
+	int nbatch = charges.size(0);
+	int nspecies = species.size(0);
+
+	auto charges_a = charges.accessor<float, 2>();
+	auto natom_counts_a = natom_counts.accessor<int, 1>();
+	auto species_a = species.accessor<float, 1>();
+	auto element_types_a = element_types.accessor<int, 2>();
+
+#pragma omp parallel for
+	for (int batchID = 0; batchID < nbatch; batchID++) {
+
+		int natoms = natom_counts_a[batchID];
+
+		for (int iatom = 0; iatom < natoms; iatom++) {
+
+			int qi = charges_a[batchID][iatom];
+
+			int index = -1;
+			for (int j = 0; j < nspecies; j++) {
+				if (qi == species_a[j]) {
+					index = j;
+				}
+			}
+
+			element_types_a[batchID][iatom] = index;
+		}
+	}
+}
+
+torch::Tensor get_element_types_cpu(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor natom_counts, torch::Tensor species) {
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+
+	TORCH_CHECK(charges.device().type() == torch::kCPU, "charges must be a CPU tensor");
+
+	TORCH_CHECK(species.device().type() == torch::kCPU, "species must be a CPU tensor");
+
+	if (coordinates.dim() == 2) {
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kInt32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor element_types = torch::zeros( { nbatch, natoms }, options);
+
+	getElementTypesCPU(charges.to(torch::kFloat32), natom_counts, species.to(torch::kFloat32), element_types);
+
+	return element_types;
+}
+
+struct EGTONeighbourData {
+
+	/* per-atom neighbour geometry, computed once and reused for every (orbital, gaussian) pair */
+
+	vector<float> drij; // [nneighbours * 3]
+	vector<float> rij;
+	vector<float> cut;
+	vector<float> dcut;
+	vector<int> elements;
+	vector<int> indexes;
+	vector<float> radial; // [nneighbours * ngauss]
+
+	void resize(int n, int ngauss) {
+		drij.resize(n * 3);
+		rij.resize(n);
+		cut.resize(n);
+		dcut.resize(n);
+		elements.resize(n);
+		indexes.resize(n);
+		radial.resize(n * ngauss);
+	}
+};
+
+static void load_egto_neighbours(const TensorAccessor<float, 2> &coords, const TensorAccessor<int, 1> &element_types,
+		const int *neighbours, const int *shifts, int iatom, int nneighbours_i, bool pbc, const float *cell, const float *inv_cell, const float *gridpoints,
+		int ngauss, float eta, float rcut, float rswitch, int cutoff_type, int distribution_type, bool gradients, EGTONeighbourData &data) {
+
+	data.resize(nneighbours_i, ngauss);
+
+	for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+		int j = neighbours[jatom];
+
+		float *drij = &data.drij[jatom * 3];
+
+		for (int x = 0; x < 3; x++) {
+			drij[x] = coords[iatom][x] - coords[j][x];
+		}
+
+		// image shifts from the neighbour search take precedence, the minimum image is only valid for cells wider than 2 rcut
+		if (shifts != NULL) {
+			apply_image_shift_cpu(drij, cell, &shifts[jatom * 3]);
+		} else if (pbc) {
+			get_pbc_drij_cpu(drij, cell, inv_cell);
+		}
+
+		float rij = sqrt(drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2]);
+
+		data.rij[jatom] = rij;
+		data.cut[jatom] = get_cutoff_cpu(rij, rcut, rswitch, cutoff_type);
+		data.dcut[jatom] = gradients ? get_cutoff_derivative_cpu(rij, rcut, rswitch, cutoff_type) : 0.0f;
+		data.elements[jatom] = element_types[j];
+		data.indexes[jatom] = j;
+
+		for (int z = 0; z < ngauss; z++) {
+			data.radial[jatom * ngauss + z] = get_radial_distribution_cpu(rij, eta, gridpoints, z, distribution_type);
+		}
+	}
+}
+
+void EGTOCpu(torch::Tensor coordinates, torch::Tensor species, torch::Tensor element_types, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs,
+		torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor mbodylist,
+		torch::Tensor gto_components, torch::Tensor gto_powers, torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights,
+		torch::Tensor inv_factors, float eta, int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type,
+		int distribution_type, torch::Tensor gto_output, torch::Tensor gto_output_derivative, bool gradients) {
+
+	/*
+	 * OpenMP port of egto_atomic_representation_cuda / egto_atomic_representation_derivative_cuda. Each task owns
+	 * gto_output[molID][iatom] and gto_output_derivative[molID][iatom], so no atomics are needed.
+	 */
+
+	const int ngauss = gridpoints.size(0);
+	const int nspecies = species.size(0);
+	const int norbs = gto_components.size(0);
+	const int nmbody = int((float(nspecies + 1.0) / 2.0) * nspecies);
+	const int lrepsize = nmbody * (lmax + 1) * ngauss;
+	const int natoms_total = blockAtomIDs.size(0);
+
+	const bool pbc = cell.size(0) > 0;
+
+	auto coordinates_a = coordinates.accessor<float, 3>();
+	auto element_types_a = element_types.accessor<int, 2>();
+	auto blockAtomIDs_a = blockAtomIDs.accessor<int, 1>();
+	auto blockMolIDs_a = blockMolIDs.accessor<int, 1>();
+	auto neighbour_offsets_a = neighbour_offsets.accessor<int, 2>();
+	const int *neighbour_indices_p = neighbour_indices.data_ptr<int>();
+	const int *neighbour_shifts_p = neighbour_shifts.size(0) > 0 ? neighbour_shifts.data_ptr<int>() : NULL;
+	auto nneighbours_a = nneighbours.accessor<int, 2>();
+	auto mbodylist_a = mbodylist.accessor<int, 2>();
+	auto gto_components_a = gto_components.accessor<float, 2>();
+	auto gto_powers_a = gto_powers.accessor<int, 1>();
+	auto orbital_weights_a = orbital_weights.accessor<float, 1>();
+	auto gridpoints_a = gridpoints.accessor<float, 1>();
+	auto lchannel_weights_a = lchannel_weights.accessor<float, 1>();
+	auto inv_factors_a = inv_factors.accessor<float, 1>();
+	auto output_a = gto_output.accessor<float, 3>();
+
+	vector<float> sgridpoints(ngauss);
+	for (int z = 0; z < ngauss; z++) {
+		sgridpoints[z] = gridpoints_a[z];
+	}
+
+	vector<int> smbodylist(nspecies * nspecies);
+	for (int m = 0; m < nspecies; m++) {
+		for (int n = 0; n < nspecies; n++) {
+			smbodylist[m * nspecies + n] = mbodylist_a[m][n];
+		}
+	}
+
+#pragma omp parallel
+	{
+		EGTONeighbourData data;
+
+		vector<float> lmax_temporary(lrepsize);
+		vector<float> local_rep(nmbody * ngauss);
+		vector<float> vals;
+		vector<float> dvals;
+
+		float lcell[9];
+		float linv_cell[9];
+
+#pragma omp for schedule(dynamic, 4)
+		for (int idx = 0; idx < natoms_total; idx++) {
+
+			int molID = blockMolIDs_a[idx];
+			int iatom = blockAtomIDs_a[idx];
+			int nneighbours_i = nneighbours_a[molID][iatom];
+
+			if (pbc) {
+				auto cell_a = cell.accessor<float, 3>();
+				auto inv_cell_a = inv_cell.accessor<float, 3>();
+
+				for (int i = 0; i < 3; i++) {
+					for (int j = 0; j < 3; j++) {
+						lcell[i * 3 + j] = cell_a[molID][i][j];
+						linv_cell[i * 3 + j] = inv_cell_a[molID][i][j];
+					}
+				}
+			}
+
+			int offset = neighbour_offsets_a[molID][iatom];
+
+			load_egto_neighbours(coordinates_a[molID], element_types_a[molID], &neighbour_indices_p[offset],
+					neighbour_shifts_p != NULL ? &neighbour_shifts_p[3 * offset] : NULL, iatom, nneighbours_i, pbc, lcell, linv_cell, sgridpoints.data(), ngauss, eta,
+					rcut, rswitch, cutoff_type, distribution_type, gradients, data);
+
+			vals.resize(nneighbours_i);
+			dvals.resize(nneighbours_i * 3);
+
+			std::fill(lmax_temporary.begin(), lmax_temporary.end(), 0.0f);
+
+			for (int korb = 0; korb < norbs; korb++) {
+
+				int lchannel = gto_powers_a[korb];
+				float inv_factor = inv_factors_a[lchannel];
+
+				float cx = gto_components_a[korb][0];
+				float cy = gto_components_a[korb][1];
+				float cz = gto_components_a[korb][2];
+
+				float lweight = lchannel_weights_a[lchannel] * orbital_weights_a[korb];
+
+				// angular * radial scaling * cutoff, independent of the gaussian index
+				for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+					const float *drij = &data.drij[jatom * 3];
+					float rij = data.rij[jatom];
+
+					float ang = powf(drij[0], cx) * powf(drij[1], cy) * powf(drij[2], cz);
+
+					vals[jatom] = (1.0 / powf(rij, inv_factor + lchannel)) * ang * data.cut[jatom];
+				}
+
+				std::fill(local_rep.begin(), local_rep.end(), 0.0f);
+
+				for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+					int element_type = data.elements[jatom];
+					const float *g = &data.radial[jatom * ngauss];
+					float val = vals[jatom];
+
+					for (int m = 0; m < nspecies; m++) {
+
+						float *lrep = &local_rep[smbodylist[element_type * nspecies + m] * ngauss];
+
+						for (int z = 0; z < ngauss; z++) {
+							lrep[z] += g[z] * val;
+						}
+					}
+				}
+
+				//contract into lmax channels here
+				for (int m = 0; m < nspecies; m++) {
+					for (int n = m; n < nspecies; n++) {
+
+						int mnidx = smbodylist[m * nspecies + n];
+
+						for (int z = 0; z < ngauss; z++) {
+							float val = local_rep[mnidx * ngauss + z];
+							lmax_temporary[lchannel * nmbody * ngauss + mnidx * ngauss + z] += lweight * val * val;
+						}
+					}
+				}
+
+				if (!gradients)
+					continue;
+
+				auto grad_a = gto_output_derivative.accessor<float, 5>()[molID][iatom];
+
+				float dcx = (cx == 1.0) ? -1.0 : -cx;
+				float dcy = (cy == 1.0) ? -1.0 : -cy;
+				float dcz = (cz == 1.0) ? -1.0 : -cz;
+
+				for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+
+					const float *drij = &data.drij[jatom * 3];
+					float rij = data.rij[jatom];
+					float cut = data.cut[jatom];
+					float dcut = data.dcut[jatom];
+					int element_type = data.elements[jatom];
+					int j = data.indexes[jatom];
+
+					float rscaling = (1.0 / powf(rij, inv_factor + lchannel));
+					float drscaling = -(inv_factor + float(lchannel)) * (1.0 / powf(rij, 1.0 + inv_factor + float(lchannel)));
+					float ang = powf(drij[0], cx) * powf(drij[1], cy) * powf(drij[2], cz);
+
+					float dang[3] = { 0.0, 0.0, 0.0 };
+
+					if (cx >= 1)
+						dang[0] = dcx * powf(drij[0], (int) cx - 1) * powf(drij[1], (int) cy) * powf(drij[2], (int) cz);
+					if (cy >= 1)
+						dang[1] = dcy * powf(drij[1], (int) cy - 1) * powf(drij[0], (int) cx) * powf(drij[2], (int) cz);
+					if (cz >= 1)
+						dang[2] = dcz * powf(drij[2], (int) cz - 1) * powf(drij[0], (int) cx) * powf(drij[1], (int) cy);
+
+					const float *radial = &data.radial[jatom * ngauss];
+
+					for (int x = 0; x < 3; x++) {
+
+						float drijx = drij[x] / rij;
+
+						for (int z = 0; z < ngauss; z++) {
+
+							float dradial = get_radial_derivative_distribution_cpu(drijx, rij, eta, sgridpoints.data(), z, distribution_type);
+
+							float drscalingx = drscaling * -drijx * ang * radial[z] * cut;
+							float dangx = rscaling * dang[x] * radial[z] * cut;
+							float dcutx = rscaling * ang * radial[z] * dcut * -drijx;
+							float dradialx = rscaling * ang * dradial * cut;
+
+							float deriv = lweight * 2.0 * (drscalingx + dangx + dradialx + dcutx);
+
+							for (int n = 0; n < nspecies; n++) {
+
+								int mnidx = smbodylist[element_type * nspecies + n];
+
+								int lmn = lchannel * nmbody * ngauss + mnidx * ngauss + z;
+
+								float final = deriv * local_rep[mnidx * ngauss + z];
+
+								grad_a[j][x][lmn] += final;
+								grad_a[iatom][x][lmn] -= final;
+							}
+						}
+					}
+				}
+			}
+
+			//subtract single-element contributions
+			for (int l = 0; l <= lmax; l++) {
+				for (int m = 0; m < nspecies; m++) {
+					for (int n = m + 1; n < nspecies; n++) {
+
+						int mnidx = smbodylist[m * nspecies + n];
+						int mmidx = smbodylist[m * nspecies + m];
+						int nnidx = smbodylist[n * nspecies + n];
+
+						for (int z = 0; z < ngauss; z++) {
+
+							int lmn = l * nmbody * ngauss + mnidx * ngauss + z;
+							int lmm = l * nmbody * ngauss + mmidx * ngauss + z;
+							int lnn = l * nmbody * ngauss + nnidx * ngauss + z;
+
+							lmax_temporary[lmn] -= (lmax_temporary[lmm] + lmax_temporary[lnn]);
+
+							if (!gradients)
+								continue;
+
+							auto grad_a = gto_output_derivative.accessor<float, 5>()[molID][iatom];
+
+							for (int x = 0; x < 3; x++) {
+
+								grad_a[iatom][x][lmn] -= (grad_a[iatom][x][lmm] + grad_a[iatom][x][lnn]);
+
+								for (int jatom = 0; jatom < nneighbours_i; jatom++) {
+									int j = data.indexes[jatom];
+									grad_a[j][x][lmn] -= (grad_a[j][x][lmm] + grad_a[j][x][lnn]);
+								}
+							}
+						}
+					}
+				}
+			}
+
+			for (int k = 0; k < lrepsize; k++) {
+				output_a[molID][iatom][k] = lmax_temporary[k];
+			}
+		}
+	}
+}
+
+std::vector<torch::Tensor> get_egto(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor orbital_weights,
+		torch::Tensor gto_powers, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta, int lmax, float rcut,
+		float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, bool gradients) {
+
+	/** ElementalGTO representation CPU wrapper, same signature as the GPU get_egto.
+	 *
+	 * coordinates: [nbatch, natoms, 3]
+	 * charges: [nbatch, natoms]
+	 * element_types: [nbatch, natoms]
+	 * mbodylist: [nspecies, nspecies]
+	 * gto_components: [norbs, 3]
+	 * orbital_weights: [norbs]
+	 * gto_powers: [norbs]
+	 * gridpoints: [ngaussians]
+	 *
+	 * **/
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+
+	TORCH_CHECK(charges.device().type() == torch::kCPU, "charges must be a CPU tensor");
+
+	TORCH_CHECK(element_types.device().type() == torch::kCPU, "element_types must be a CPU tensor");
+
+	TORCH_CHECK(mbodylist.device().type() == torch::kCPU, "mbodylist must be a CPU tensor");
+
+	TORCH_CHECK(gto_components.device().type() == torch::kCPU, "gto_components must be a CPU tensor");
+
+	TORCH_CHECK(gridpoints.device().type() == torch::kCPU, "gridpoints must be a CPU tensor");
+
+	int nspecies = mbodylist.size(0);
+
+	int ngaussians = gridpoints.size(0);
+
+	int nmbody = int((float(nspecies + 1.0) / 2.0) * nspecies);
+	int repsize = nmbody * (lmax + 1) * ngaussians;
+
+	if (coordinates.dim() == 2) {
+
+		coordinates = coordinates.unsqueeze(0);
+		charges = charges.unsqueeze(0);
+	}
+
+	int nbatch = coordinates.size(0);
+	int natoms = coordinates.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor gto_output = torch::zeros( { nbatch, natoms, repsize }, options);
+	torch::Tensor gto_output_derivative;
+
+	if (gradients) {
+		gto_output_derivative = torch::zeros( { nbatch, natoms, natoms, 3, repsize }, options);
+	} else {
+		gto_output_derivative = torch::zeros( { 0, 0, 0, 0, 0 }, options);
+	}
+
+	EGTOCpu(coordinates.to(torch::kFloat32), species, element_types.to(torch::kInt32), blockAtomIDs.to(torch::kInt32), blockMolIDs.to(torch::kInt32),
+			neighbour_offsets.to(torch::kInt32), neighbour_indices.to(torch::kInt32).contiguous(),
+			neighbour_shifts.to(torch::kInt32).contiguous(), nneighbours.to(torch::kInt32), mbodylist.to(torch::kInt32),
+			gto_components.to(torch::kFloat32), gto_powers.to(torch::kInt32), orbital_weights.to(torch::kFloat32), gridpoints.to(torch::kFloat32),
+			lchannel_weights.to(torch::kFloat32), inv_factor.to(torch::kFloat32), eta, lmax, rcut, rswitch, cell.to(torch::kFloat32),
+			inv_cell.to(torch::kFloat32), cutoff_type, distribution_type, gto_output, gto_output_derivative, gradients);
+
+	if (gradients) {
+		return {gto_output, gto_output_derivative};
+	}
+
+	return {gto_output};
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+	m.def("get_egto", &get_egto, "Elemental GTO Representation");
+
+	m.def("get_element_types_cpu", &get_element_types_cpu, "returns atomic species according to torch::Tensor species");
+}
@@ -7,14 +7,16 @@ using namespace std;
 void getElementTypesCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor natoms, torch::Tensor species, torch::Tensor element_types);
 
 void EGTOCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor blockAtomIDs,
-		torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components,
-		torch::Tensor gto_powers, torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta,
-		int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output);
-
-void EGTODerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor blockAtomIDs,
-		torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components,
-		torch::Tensor gto_powers, torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta,
-		int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output,
+		torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts,
+		torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor gto_powers, torch::Tensor orbital_weights,
+		torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta, int lmax, float rcut, float rswitch,
+		torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output);
+
+void EGTODerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor gto_powers,
+		torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta, int lmax, float rcut,
+		float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output,
 		torch::Tensor gto_output_derivative);
 
 torch::Tensor get_element_types_gpu(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor natom_counts, torch::Tensor species) {
@@ -45,10 +47,10 @@ torch::Tensor get_element_types_gpu(torch::Tensor coordinates, torch::Tensor cha
 }
 
 std::vector<torch::Tensor> get_egto(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
-		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor mbodylist,
-		torch::Tensor gto_components, torch::Tensor orbital_weights, torch::Tensor gto_powers, torch::Tensor gridpoints, torch::Tensor lchannel_weights,
-		torch::Tensor inv_factor, float eta, int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type,
-		int distribution_type, bool gradients) {
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor orbital_weights,
+		torch::Tensor gto_powers, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factor, float eta, int lmax, float rcut,
+		float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, bool gradients) {
 
 	/** ElementalGTO representation GPU wrapper
 	 *
@@ -110,18 +112,18 @@ std::vector<torch::Tensor> get_egto(torch::Tensor coordinates, torch::Tensor cha
 		torch::Tensor gto_output = torch::zeros( { nbatch, natoms, repsize }, options);
 		torch::Tensor gto_output_derivative = torch::zeros( { nbatch, natoms, natoms, 3, repsize }, options);
 
-		EGTODerivativeCuda(coordinates, charges, species, element_types, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, mbodylist, gto_components,
-				gto_powers, orbital_weights, gridpoints, lchannel_weights, inv_factor, eta, lmax, rcut, rswitch, cell, inv_cell, cutoff_type, distribution_type,
-				gto_output, gto_output_derivative);
+		EGTODerivativeCuda(coordinates, charges, species, element_types, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices, neighbour_shifts,
+				nneighbours, mbodylist, gto_components, gto_powers, orbital_weights, gridpoints, lchannel_weights, inv_factor, eta, lmax, rcut, rswitch, cell,
+				inv_cell, cutoff_type, distribution_type, gto_output, gto_output_derivative);
 
 		return {gto_output, gto_output_derivative};
 	} else {
 
 		torch::Tensor gto_output = torch::zeros( { nbatch, natoms, repsize }, options);
 
-		EGTOCuda(coordinates, charges, species, element_types, blockAtomIDs, blockMolIDs, neighbourlist, nneighbours, mbodylist, gto_components, gto_powers,
-				orbital_weights, gridpoints, lchannel_weights, inv_factor, eta, lmax, rcut, rswitch, cell, inv_cell, cutoff_type, distribution_type,
-				gto_output);
+		EGTOCuda(coordinates, charges, species, element_types, blockAtomIDs, blockMolIDs, neighbour_offsets, neighbour_indices, neighbour_shifts,
+				nneighbours, mbodylist, gto_components, gto_powers, orbital_weights, gridpoints, lchannel_weights, inv_factor, eta, lmax, rcut, rswitch, cell,
+				inv_cell, cutoff_type, distribution_type, gto_output);
 
 		return {gto_output};
 	}
@@ -44,6 +44,17 @@ __device__ void get_pbc_dij(float *drij, float *cell_vectors, float *inv_cell_ve
 	}
 }
 
+__device__ void add_image_shift(float *rj, const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> &cell,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> &neighbour_shifts, int molID, int pair) {
+
+	/* moves neighbour j to the periodic image the pair was found at, r_j + h n with n = neighbour_shifts[pair] */
+	for (int m = 0; m < 3; m++) {
+		for (int k = 0; k < 3; k++) {
+			rj[m] += cell[molID][m][k] * neighbour_shifts[pair][k];
+		}
+	}
+}
+
 __device__ float get_cutoff(float rij, float rcut, float rswitch, int cutoff_type) {
 	float cut = 1.0;
 
@@ -187,7 +198,9 @@ __global__ void egto_atomic_representation_cuda(const torch::PackedTensorAccesso
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> element_types,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> mbodylist,
 		const torch::PackedTensorAccessor32<float, 2, torch::RestrictPtrTraits> gto_components,
@@ -246,6 +259,9 @@ __global__ void egto_atomic_representation_cuda(const torch::PackedTensorAccesso
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	/*Each thread only stores the m-body components from the uncontracted GTO representation locally. The full
 	 * uncontacted GTO representation is not built (unlike in egto_atomic_representation_cuda).
 	 * Results in significantly reduced shared memory footprint, as only the final contracted representation is stored.*/
@@ -295,11 +311,18 @@ __global__ void egto_atomic_representation_cuda(const torch::PackedTensorAccesso
 //load coordinates into shared memory
 	for (int jatom = threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
+
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 
 	}
@@ -340,7 +363,7 @@ __global__ void egto_atomic_representation_cuda(const torch::PackedTensorAccesso
 			drij[1] = riy - rjy;
 			drij[2] = riz - rjz;
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
 			}
 
@@ -423,7 +446,9 @@ void egto_atomic_representation_derivative_cuda(const torch::PackedTensorAccesso
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> element_types,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockAtomIDs, // blockIdx -> atom idx
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> blockMolIDs, // blockIdx -> molecule jdx
-		const torch::PackedTensorAccessor32<int, 3, torch::RestrictPtrTraits> neighbourlist,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_offsets,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> nneighbours, const int max_neighbours,
 		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> mbodylist,
 		const torch::PackedTensorAccessor32<float, 2, torch::RestrictPtrTraits> gto_components,
@@ -481,6 +506,9 @@ void egto_atomic_representation_derivative_cuda(const torch::PackedTensorAccesso
 
 	bool pbc = false;
 
+	// with image shifts the neighbour coordinates are already those of the periodic image, the minimum image is only needed without them
+	bool minimum_image = cell.size(0) > 0 && neighbour_shifts.size(0) == 0;
+
 	if (cell.size(0) > 0) {
 
 		pbc = true;
@@ -533,11 +561,18 @@ void egto_atomic_representation_derivative_cuda(const torch::PackedTensorAccesso
 //load coordinates into shared memory
 	for (int jatom = threadIdx.x; jatom < nneighbours_i; jatom += blockDim.x) {
 
-		int j = neighbourlist[molID][iatom][jatom];
+		int pair = neighbour_offsets[molID][iatom] + jatom;
+		int j = neighbour_indices[pair];
+
+		float rj_image[3] = { coordinates[molID][j][0], coordinates[molID][j][1], coordinates[molID][j][2] };
+
+		if (neighbour_shifts.size(0) > 0) {
+			add_image_shift(rj_image, cell, neighbour_shifts, molID, pair);
+		}
 
-		scoords_x[jatom] = coordinates[molID][j][0];
-		scoords_y[jatom] = coordinates[molID][j][1];
-		scoords_z[jatom] = coordinates[molID][j][2];
+		scoords_x[jatom] = rj_image[0];
+		scoords_y[jatom] = rj_image[1];
+		scoords_z[jatom] = rj_image[2];
 		selement_types[jatom] = element_types[molID][j];
 		sneighbours[jatom] = j;
 
@@ -593,7 +628,7 @@ void egto_atomic_representation_derivative_cuda(const torch::PackedTensorAccesso
 			drij[1] = riy - rjy;
 			drij[2] = riz - rjz;
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
 			}
 
@@ -645,7 +680,7 @@ void egto_atomic_representation_derivative_cuda(const torch::PackedTensorAccesso
 			drij[1] = riy - rjy;
 			drij[2] = riz - rjz;
 
-			if (pbc) {
+			if (minimum_image) {
 				get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
 			}
 
@@ -861,9 +896,10 @@ void getElementTypesCuda(torch::Tensor coordinates, torch::Tensor charges, torch
 }
 
 void EGTOCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor blockAtomIDs,
-		torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components,
-		torch::Tensor gto_powers, torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factors, float eta,
-		int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output) {
+		torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts,
+		torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor gto_powers, torch::Tensor orbital_weights,
+		torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factors, float eta, int lmax, float rcut, float rswitch,
+		torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output) {
 
 	const int nthreads = 32;
 
@@ -888,7 +924,9 @@ void EGTOCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor sp
 			element_types.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			mbodylist.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
@@ -907,10 +945,11 @@ void EGTOCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor sp
 
 }
 
-void EGTODerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor blockAtomIDs,
-		torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components,
-		torch::Tensor gto_powers, torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factors, float eta,
-		int lmax, float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output,
+void EGTODerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types,
+		torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+		torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor mbodylist, torch::Tensor gto_components, torch::Tensor gto_powers,
+		torch::Tensor orbital_weights, torch::Tensor gridpoints, torch::Tensor lchannel_weights, torch::Tensor inv_factors, float eta, int lmax,
+		float rcut, float rswitch, torch::Tensor cell, torch::Tensor inv_cell, int cutoff_type, int distribution_type, torch::Tensor gto_output,
 		torch::Tensor gto_output_derivative) {
 
 	const int nthreads = 32;
@@ -937,7 +976,9 @@ void EGTODerivativeCuda(torch::Tensor coordinates, torch::Tensor charges, torch:
 			element_types.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			blockAtomIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
 			blockMolIDs.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			neighbourlist.packed_accessor32<int, 3, torch::RestrictPtrTraits>(),
+			neighbour_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
 			nneighbours.packed_accessor32<int,2, torch::RestrictPtrTraits>(),
 			max_neighbours,
 			mbodylist.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
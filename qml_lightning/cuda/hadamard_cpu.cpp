@@ -0,0 +1,558 @@
+#include <torch/extension.h>
+#include <omp.h>
+#include <iostream>
+#include <vector>
+#include <math.h>
+
+using namespace at;
+using namespace std;
+
+/* OpenMP implementations of the structured orthogonal random feature (SORF) transforms in hadamard_kernel.cu. */
+
+static inline void fwht_cpu(float *s, const int N) {
+
+	/*
+	 * in-place, unnormalised fast Walsh-Hadamard transform of length N = 2^log2N.
+	 * the inner loop runs over contiguous memory so the compiler can vectorise each butterfly stage.
+	 */
+
+	for (int h = 1; h < N; h <<= 1) {
+		for (int i = 0; i < N; i += (h << 1)) {
+
+			float *lo = s + i;
+			float *hi = s + i + h;
+
+#pragma omp simd
+			for (int j = 0; j < h; j++) {
+				float a = lo[j];
+				float b = hi[j];
+				lo[j] = a + b;
+				hi[j] = a - b;
+			}
+		}
+	}
+}
+
+static inline void hd_blocks_cpu(float *s, const float *dmatrix, const int ntransforms, const int nstacks, const int stack, const int N, const float normh) {
+
+	/* applies [(H D_m) normh] for m = 0..ntransforms-1 to s in place. dmatrix is the contiguous [ntransforms, nstacks, N] rademacher tensor. */
+
+	for (int m = 0; m < ntransforms; m++) {
+
+		const float *d = dmatrix + (m * nstacks + stack) * N;
+
+#pragma omp simd
+		for (int k = 0; k < N; k++) {
+			s[k] *= d[k];
+		}
+
+		fwht_cpu(s, N);
+
+#pragma omp simd
+		for (int k = 0; k < N; k++) {
+			s[k] *= normh;
+		}
+	}
+}
+
+void hadamard_cpu(torch::Tensor input, torch::Tensor dmatrix, torch::Tensor output, const float normalisation, const int ntransforms) {
+
+	/*
+	 * input: [natoms, N], dmatrix: [ntransforms, nstacks, N], output: [natoms, nstacks, N]
+	 */
+
+	const int natoms = input.size(0);
+	const int N = input.size(1);
+	const int nstacks = dmatrix.size(1);
+	const int log2N = int(log2(N));
+
+	const float normh = (1.0 / powf(2.0, float(log2N) / 2.0));
+
+	const float *input_p = input.data_ptr<float>();
+	const float *dmatrix_p = dmatrix.data_ptr<float>();
+	float *output_p = output.data_ptr<float>();
+
+#pragma omp parallel for schedule(static)
+	for (long idx = 0; idx < (long) natoms * nstacks; idx++) {
+
+		const int iatom = idx / nstacks;
+		const int stack = idx % nstacks;
+
+		// each (atom, stack) pair owns its output row, so transform directly in place
+		float *s = output_p + idx * N;
+
+		const float *u = input_p + (long) iatom * N;
+
+		for (int k = 0; k < N; k++) {
+			s[k] = u[k];
+		}
+
+		hd_blocks_cpu(s, dmatrix_p, ntransforms, nstacks, stack, N, normh);
+
+		for (int k = 0; k < N; k++) {
+			s[k] *= normalisation;
+		}
+	}
+}
+
+void hadamard_backwards_cpu(torch::Tensor input, torch::Tensor dmatrix, torch::Tensor output, const float normalisation, const int ntransforms) {
+
+	/*
+	 * input: [natoms, nstacks, N] (upstream gradient), dmatrix: [ntransforms, nstacks, N], output: [natoms, N]
+	 *
+	 * the transpose of [(HD)_n] is applied in reverse order, i.e D_m H for m = ntransforms-1..0, and the stacks are summed.
+	 */
+
+	const int natoms = input.size(0);
+	const int nstacks = input.size(1);
+	const int N = input.size(2);
+	const int log2N = int(log2(N));
+
+	const float normh = (1.0 / powf(2.0, float(log2N) / 2.0));
+
+	const float *input_p = input.data_ptr<float>();
+	const float *dmatrix_p = dmatrix.data_ptr<float>();
+	float *output_p = output.data_ptr<float>();
+
+#pragma omp parallel
+	{
+		vector<float> s(N);
+
+#pragma omp for schedule(static)
+		for (int iatom = 0; iatom < natoms; iatom++) {
+
+			float *sout = output_p + (long) iatom * N;
+
+			for (int stack = 0; stack < nstacks; stack++) {
+
+				const float *g = input_p + ((long) iatom * nstacks + stack) * N;
+
+				for (int k = 0; k < N; k++) {
+					s[k] = g[k];
+				}
+
+				for (int m = ntransforms - 1; m >= 0; m--) {
+
+					fwht_cpu(s.data(), N);
+
+					const float *d = dmatrix_p + (m * nstacks + stack) * N;
+
+#pragma omp simd
+					for (int k = 0; k < N; k++) {
+						s[k] = d[k] * normh * s[k];
+					}
+				}
+
+#pragma omp simd
+				for (int k = 0; k < N; k++) {
+					sout[k] += s[k];
+				}
+			}
+
+			for (int k = 0; k < N; k++) {
+				sout[k] *= normalisation;
+			}
+		}
+	}
+}
+
+torch::Tensor hadamard_transform_cpu(torch::Tensor input, torch::Tensor dmatrix, float normalisation, const int ntransforms) {
+
+	TORCH_CHECK(input.device().type() == torch::kCPU, "input must be a CPU tensor");
+	TORCH_CHECK(dmatrix.device().type() == torch::kCPU, "dmatrix must be a CPU tensor");
+
+	int n = input.size(1);
+	int log2N = int(log2(n));
+
+	TORCH_CHECK(n == 1 << log2N, "input size must be power of 2.");
+	TORCH_CHECK(dmatrix.size(2) == n, "dmatrix and input must have the same trailing dimension.");
+
+	input = input.to(torch::kFloat32).contiguous();
+	dmatrix = dmatrix.to(torch::kFloat32).contiguous();
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { input.size(0), dmatrix.size(1), input.size(1) }, options);
+
+	hadamard_cpu(input, dmatrix, output, normalisation, ntransforms);
+
+	return output;
+}
+
+torch::Tensor hadamard_transform_backwards_cpu(torch::Tensor input, torch::Tensor dmatrix, float normalisation, const int ntransforms) {
+
+	TORCH_CHECK(input.device().type() == torch::kCPU, "input must be a CPU tensor");
+	TORCH_CHECK(dmatrix.device().type() == torch::kCPU, "dmatrix must be a CPU tensor");
+
+	int n = input.size(2);
+	int log2N = int(log2(n));
+
+	TORCH_CHECK(n == 1 << log2N, "input size must be power of 2.");
+
+	input = input.to(torch::kFloat32).contiguous();
+	dmatrix = dmatrix.to(torch::kFloat32).contiguous();
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { input.size(0), input.size(2) }, options);
+
+	hadamard_backwards_cpu(input, dmatrix, output, normalisation, ntransforms);
+
+	return output;
+}
+
+static void build_segments(const int *ordering, const int natoms, const int nmol, vector<int> &seg_start, vector<int> &seg_atoms) {
+
+	/*
+	 * counting sort of the atoms by the molecule they belong to (ordering[iatom]), stored in CSR form such that the atoms of molecule
+	 * imol are seg_atoms[seg_start[imol]..seg_start[imol+1]). this lets each thread own an output row instead of using atomics.
+	 */
+
+	seg_start.assign(nmol + 1, 0);
+	seg_atoms.resize(natoms);
+
+	for (int iatom = 0; iatom < natoms; iatom++) {
+		seg_start[ordering[iatom] + 1]++;
+	}
+
+	for (int imol = 0; imol < nmol; imol++) {
+		seg_start[imol + 1] += seg_start[imol];
+	}
+
+	vector<int> fill(seg_start.begin(), seg_start.end() - 1);
+
+	for (int iatom = 0; iatom < natoms; iatom++) {
+		seg_atoms[fill[ordering[iatom]]++] = iatom;
+	}
+}
+
+void sorf_matrix_cpu_kernel(torch::Tensor input, torch::Tensor scaling, torch::Tensor output, const float normalisation) {
+
+	/*
+	 * output is the [natoms, nstacks * N] matrix normalisation * [(HD)_n x], stacked nstacks times.
+	 */
+
+	const int natoms = input.size(0);
+	const int N = input.size(1);
+	const int ntransforms = scaling.size(0);
+	const int nstacks = scaling.size(1);
+	const int log2N = int(log2(N));
+
+	const float normh = (1.0 / powf(2.0, float(log2N) / 2.0));
+
+	const float *input_p = input.data_ptr<float>();
+	const float *scaling_p = scaling.data_ptr<float>();
+	float *output_p = output.data_ptr<float>();
+
+#pragma omp parallel for schedule(static)
+	for (long idx = 0; idx < (long) natoms * nstacks; idx++) {
+
+		const int iatom = idx / nstacks;
+		const int stack = idx % nstacks;
+
+		float *s = output_p + idx * N;
+		const float *u = input_p + (long) iatom * N;
+
+		for (int k = 0; k < N; k++) {
+			s[k] = u[k];
+		}
+
+		hd_blocks_cpu(s, scaling_p, ntransforms, nstacks, stack, N, normh);
+
+		if (normalisation != 1.0f) {
+			for (int k = 0; k < N; k++) {
+				s[k] *= normalisation;
+			}
+		}
+	}
+}
+
+template<typename scalar_t>
+void cos_features_cpu_kernel(const float *coeffs, const float *bias, const int *ordering, const int natoms, const int nfeatures, const int nmol,
+		scalar_t *features) {
+
+	/*
+	 * features[imol] += sum_{iatom in imol} cos(coeffs[iatom] + b) * sqrt(2/nfeatures), computed and reduced in a single pass per molecule.
+	 */
+
+	vector<int> seg_start, seg_atoms;
+	build_segments(ordering, natoms, nmol, seg_start, seg_atoms);
+
+	const float normf = sqrt(2.0 / float(nfeatures));
+
+#pragma omp parallel for schedule(dynamic, 4)
+	for (int imol = 0; imol < nmol; imol++) {
+
+		scalar_t *out = features + (long) imol * nfeatures;
+
+		for (int k = seg_start[imol]; k < seg_start[imol + 1]; k++) {
+
+			const float *c = coeffs + (long) seg_atoms[k] * nfeatures;
+
+			for (int n = 0; n < nfeatures; n++) {
+				out[n] += cosf(c[n] + bias[n]) * normf;
+			}
+		}
+	}
+}
+
+torch::Tensor sorf_matrix_cpu(torch::Tensor input, torch::Tensor scaling, float normalisation) {
+
+	TORCH_CHECK(input.device().type() == torch::kCPU, "input must be a CPU tensor");
+	TORCH_CHECK(scaling.device().type() == torch::kCPU, "scaling must be a CPU tensor");
+
+	int n = input.size(1);
+	int log2N = int(log2(n));
+
+	TORCH_CHECK(n == 1 << log2N, "representation size must be power of 2.");
+
+	input = input.to(torch::kFloat32).contiguous();
+	scaling = scaling.to(torch::kFloat32).contiguous();
+
+	int natoms = input.size(0);
+	int nfeatures = scaling.size(1) * scaling.size(2);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output_sorf_matrix = torch::empty( { natoms, nfeatures }, options);
+
+	sorf_matrix_cpu_kernel(input, scaling, output_sorf_matrix, normalisation);
+
+	return output_sorf_matrix;
+}
+
+torch::Tensor CosFeaturesCPU(torch::Tensor coeffs, torch::Tensor b, int nmol, torch::Tensor batch_indexes) {
+
+	TORCH_CHECK(coeffs.device().type() == torch::kCPU, "coeffs must be a CPU tensor");
+
+	coeffs = coeffs.to(torch::kFloat32).contiguous();
+	b = b.to(torch::kFloat32).contiguous();
+	batch_indexes = batch_indexes.to(torch::kInt32).contiguous();
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::zeros( { nmol, coeffs.size(1) }, options);
+
+	cos_features_cpu_kernel<float>(coeffs.data_ptr<float>(), b.data_ptr<float>(), batch_indexes.data_ptr<int>(), coeffs.size(0), coeffs.size(1), nmol,
+			output.data_ptr<float>());
+
+	return output;
+}
+
+torch::Tensor CosDerivativeFeaturesCPU(torch::Tensor grads, torch::Tensor coeffs, torch::Tensor b, int nmol, torch::Tensor batch_indexes) {
+
+	TORCH_CHECK(coeffs.device().type() == torch::kCPU, "coeffs must be a CPU tensor");
+
+	grads = grads.to(torch::kFloat32).contiguous();
+	coeffs = coeffs.to(torch::kFloat32).contiguous();
+	b = b.to(torch::kFloat32).contiguous();
+	batch_indexes = batch_indexes.to(torch::kInt32).contiguous();
+
+	const int natoms = coeffs.size(0);
+	const int nfeatures = coeffs.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor output = torch::empty( { natoms, nfeatures }, options);
+
+	const float *grads_p = grads.data_ptr<float>();
+	const float *coeffs_p = coeffs.data_ptr<float>();
+	const float *b_p = b.data_ptr<float>();
+	const int *ordering_p = batch_indexes.data_ptr<int>();
+	float *output_p = output.data_ptr<float>();
+
+	const float normf = sqrt(2.0 / float(nfeatures));
+
+#pragma omp parallel for schedule(static)
+	for (int iatom = 0; iatom < natoms; iatom++) {
+
+		const float *g = grads_p + (long) ordering_p[iatom] * nfeatures;
+		const float *c = coeffs_p + (long) iatom * nfeatures;
+		float *out = output_p + (long) iatom * nfeatures;
+
+		for (int n = 0; n < nfeatures; n++) {
+			out[n] = g[n] * -sinf(c[n] + b_p[n]) * normf;
+		}
+	}
+
+	return output;
+}
+
+void compute_hadamard_features(torch::Tensor sorf_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features) {
+
+	TORCH_CHECK(sorf_matrix.device().type() == torch::kCPU, "sorf_matrix must be a CPU tensor");
+	TORCH_CHECK(features.scalar_type() == torch::kFloat64 && features.is_contiguous(), "features must be a contiguous float64 tensor");
+
+	sorf_matrix = sorf_matrix.to(torch::kFloat32).contiguous();
+	bias = bias.to(torch::kFloat32).contiguous();
+	ordering = ordering.to(torch::kInt32).contiguous();
+
+	cos_features_cpu_kernel<double>(sorf_matrix.data_ptr<float>(), bias.data_ptr<float>(), ordering.data_ptr<int>(), sorf_matrix.size(0),
+			sorf_matrix.size(1), features.size(0), features.data_ptr<double>());
+}
+
+void compute_partial_feature_derivatives(torch::Tensor sorf_matrix, torch::Tensor bias, torch::Tensor sin_coeffs) {
+
+	TORCH_CHECK(sorf_matrix.device().type() == torch::kCPU, "sorf_matrix must be a CPU tensor");
+	TORCH_CHECK(sin_coeffs.scalar_type() == torch::kFloat64 && sin_coeffs.is_contiguous(), "sin_coeffs must be a contiguous float64 tensor");
+
+	sorf_matrix = sorf_matrix.to(torch::kFloat32).contiguous();
+	bias = bias.to(torch::kFloat32).contiguous();
+
+	const int natoms = sorf_matrix.size(0);
+	const int nfeatures = sorf_matrix.size(1);
+
+	const float *coeffs_p = sorf_matrix.data_ptr<float>();
+	const float *b_p = bias.data_ptr<float>();
+	double *output_p = sin_coeffs.data_ptr<double>();
+
+	const float normf = sqrt(2.0 / float(nfeatures));
+
+#pragma omp parallel for schedule(static)
+	for (int iatom = 0; iatom < natoms; iatom++) {
+
+		const float *c = coeffs_p + (long) iatom * nfeatures;
+		double *out = output_p + (long) iatom * nfeatures;
+
+		for (int n = 0; n < nfeatures; n++) {
+			out[n] = sinf(c[n] + b_p[n]) * normf;
+		}
+	}
+}
+
+void compute_molecular_featurization_derivative(torch::Tensor cos_derivs, double normalisation, torch::Tensor scaling, torch::Tensor input_derivatives,
+		torch::Tensor ordering, torch::Tensor atom_offsets, torch::Tensor feature_derivatives) {
+
+	/*
+	 * cos_derivs: [natoms, nfeatures], input_derivatives: [natoms, nderiv_atoms, 3, N], feature_derivatives: [nmol, nderiv_atoms, 3, nfeatures]
+	 *
+	 * atom_offsets: [nmol + 1] exclusive prefix sum of the atom counts. When non-empty feature_derivatives is packed without padding as
+	 * [natoms_total, 3, nfeatures], row atom_offsets[imol] + jatom, and the padded jatom of each molecule are skipped.
+	 *
+	 * feature_derivatives[imol][jatom][x] += normalisation * cos_derivs[iatom] * [(HD)_n d x_iatom / d r_jatom,x] for all iatom in imol.
+	 * work is distributed over (molecule, jatom) pairs so that each thread owns its output rows.
+	 */
+
+	TORCH_CHECK(input_derivatives.device().type() == torch::kCPU, "input_derivatives must be a CPU tensor");
+	TORCH_CHECK(feature_derivatives.scalar_type() == torch::kFloat64 && feature_derivatives.is_contiguous(),
+			"feature_derivatives must be a contiguous float64 tensor");
+
+	const int N = input_derivatives.size(3);
+	const int log2N = int(log2(N));
+
+	TORCH_CHECK(N == 1 << log2N, "input_derivatives size must be power of 2.");
+
+	cos_derivs = cos_derivs.to(torch::kFloat64).contiguous();
+	scaling = scaling.to(torch::kFloat32).contiguous();
+	input_derivatives = input_derivatives.to(torch::kFloat32).contiguous();
+	ordering = ordering.to(torch::kInt32).contiguous();
+	atom_offsets = atom_offsets.to(torch::kInt32).contiguous();
+
+	const bool packed = atom_offsets.size(0) > 0;
+	const int *atom_offsets_p = packed ? atom_offsets.data_ptr<int>() : NULL;
+
+	const int natoms = input_derivatives.size(0);
+	const int nderiv_atoms = input_derivatives.size(1);
+	const int nmol = packed ? atom_offsets.size(0) - 1 : feature_derivatives.size(0);
+	const int nfeatures = cos_derivs.size(1);
+	const int ntransforms = scaling.size(0);
+	const int nstacks = scaling.size(1);
+
+	const float normh = (1.0 / powf(2.0, float(log2N) / 2.0));
+
+	const double *cos_derivs_p = cos_derivs.data_ptr<double>();
+	const float *scaling_p = scaling.data_ptr<float>();
+	const float *input_p = input_derivatives.data_ptr<float>();
+	double *output_p = feature_derivatives.data_ptr<double>();
+
+	vector<int> seg_start, seg_atoms;
+	build_segments(ordering.data_ptr<int>(), natoms, nmol, seg_start, seg_atoms);
+
+#pragma omp parallel
+	{
+		vector<float> u(N);
+
+#pragma omp for schedule(dynamic, 4)
+		for (long idx = 0; idx < (long) nmol * nderiv_atoms; idx++) {
+
+			const int imol = idx / nderiv_atoms;
+			const int jatom = idx % nderiv_atoms;
+
+			if (packed && jatom >= atom_offsets_p[imol + 1] - atom_offsets_p[imol])
+				continue;
+
+			const long row = packed ? (long) atom_offsets_p[imol] + jatom : (long) imol * nderiv_atoms + jatom;
+
+			for (int k = seg_start[imol]; k < seg_start[imol + 1]; k++) {
+
+				const int iatom = seg_atoms[k];
+
+				const double *cd = cos_derivs_p + (long) iatom * nfeatures;
+
+				for (int x = 0; x < 3; x++) {
+
+					const float *du = input_p + (((long) iatom * nderiv_atoms + jatom) * 3 + x) * N;
+
+					// padded or out-of-cutoff atoms have identically zero derivatives - nothing to transform
+					bool nonzero = false;
+
+					for (int pos = 0; pos < N; pos++) {
+						if (du[pos] != 0.0f) {
+							nonzero = true;
+							break;
+						}
+					}
+
+					if (!nonzero)
+						continue;
+
+					double *out = output_p + (row * 3 + x) * nfeatures;
+
+					for (int stack = 0; stack < nstacks; stack++) {
+
+						for (int pos = 0; pos < N; pos++) {
+							u[pos] = du[pos];
+						}
+
+						hd_blocks_cpu(u.data(), scaling_p, ntransforms, nstacks, stack, N, normh);
+
+						for (int pos = 0; pos < N; pos++) {
+							out[stack * N + pos] += normalisation * cd[stack * N + pos] * (double) u[pos];
+						}
+					}
+				}
+			}
+		}
+	}
+}
+
+void compute_hadamard_derivative_features(torch::Tensor sorf_matrix, double normalisation, torch::Tensor bias, torch::Tensor scaling,
+		torch::Tensor input_derivatives, torch::Tensor ordering, torch::Tensor feature_derivatives) {
+
+	auto options = torch::TensorOptions().dtype(torch::kFloat64).layout(torch::kStrided).device(torch::kCPU);
+
+//computes the derivative of the feature only, and not the full chain
+	torch::Tensor partial_feature_derivatives = torch::zeros( { sorf_matrix.size(0), sorf_matrix.size(1) }, options);
+	compute_partial_feature_derivatives(sorf_matrix, bias, partial_feature_derivatives);
+
+//computes the full chain
+	torch::Tensor atom_offsets = torch::empty( { 0 }, options.dtype(torch::kInt32));
+
+	compute_molecular_featurization_derivative(partial_feature_derivatives, normalisation, scaling, input_derivatives, ordering, atom_offsets,
+			feature_derivatives);
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+	m.def("sorf_matrix_cpu", &sorf_matrix_cpu, "Computes the (normalised) SORF matrix components (before featurization).");
+
+	m.def("CosFeaturesCPU", &CosFeaturesCPU, "");
+	m.def("CosDerivativeFeaturesCPU", &CosDerivativeFeaturesCPU, "");
+	m.def("hadamard_transform_cpu", &hadamard_transform_cpu, "hadamard transform");
+	m.def("hadamard_transform_backwards_cpu", &hadamard_transform_backwards_cpu, "hadamard backwards transform");
+
+	m.def("compute_partial_feature_derivatives", &compute_partial_feature_derivatives, "");
+	m.def("compute_molecular_featurization_derivative", &compute_molecular_featurization_derivative, "");
+	m.def("compute_hadamard_features", &compute_hadamard_features, "Computes the featurisation tensor");
+	m.def("compute_hadamard_derivative_features", &compute_hadamard_derivative_features, "Computes the featurisation derivative tensor");
+}
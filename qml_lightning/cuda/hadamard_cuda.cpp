@@ -9,7 +9,7 @@ void compute_sorf_matrix(torch::Tensor input, torch::Tensor scaling, torch::Tens
 void compute_molecular_featurization(torch::Tensor sorf_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features);
 
 void compute_molecular_featurization_derivative(torch::Tensor partial_feature_derivatives, double normalisation, torch::Tensor scaling,
-		torch::Tensor input_derivatives, torch::Tensor ordering, torch::Tensor feature_derivatives);
+		torch::Tensor input_derivatives, torch::Tensor ordering, torch::Tensor atom_offsets, torch::Tensor feature_derivatives);
 
 void compute_partial_feature_derivatives(torch::Tensor sorf_matrix, torch::Tensor bias, torch::Tensor sin_coeffs);
 
@@ -119,7 +119,10 @@ void compute_hadamard_derivative_features(torch::Tensor sorf_matrix, double norm
 	compute_partial_feature_derivatives(sorf_matrix, bias, partial_feature_derivatives);
 
 //computes the full chain
-	compute_molecular_featurization_derivative(partial_feature_derivatives, normalisation, scaling, input_derivatives, ordering, feature_derivatives);
+	torch::Tensor atom_offsets = torch::empty( { 0 }, options.dtype(torch::kInt32));
+
+	compute_molecular_featurization_derivative(partial_feature_derivatives, normalisation, scaling, input_derivatives, ordering, atom_offsets,
+			feature_derivatives);
 
 }
 
@@ -589,7 +589,8 @@ void compute_featurisation_derivative_kernel(const torch::PackedTensorAccessor32
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> ordering,
 		const torch::PackedTensorAccessor32<float, 4, torch::RestrictPtrTraits> input_derivative,
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> D, int nstacks, int log2N,
-		torch::PackedTensorAccessor32<double, 4, torch::RestrictPtrTraits> feature_derivatives) {
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> atom_offsets,
+		torch::PackedTensorAccessor32<double, 3, torch::RestrictPtrTraits> feature_derivatives) {
 
 	const int N = 1 << log2N;
 
@@ -610,6 +611,17 @@ void compute_featurisation_derivative_kernel(const torch::PackedTensorAccessor32
 
 	int batchID = ordering[iatom];
 
+	// output row of (batchID, jatom): packed without padding when atom_offsets is given, the padded atoms have no row
+	int row = batchID * nderiv_atoms + jatom;
+
+	if (atom_offsets.size(0) > 0) {
+
+		if (jatom >= atom_offsets[batchID + 1] - atom_offsets[batchID])
+			return;
+
+		row = atom_offsets[batchID] + jatom;
+	}
+
 	const float normc = (1.0 / powf(2.0, float(log2N) / 2.0));
 
 //printf("thread %d block %d iatom %d jatom %d batchID %d nstacks %d\n", threadIdx.x, blockIdx.x, iatom, jatom, batchID, nstacks);
@@ -709,7 +721,7 @@ void compute_featurisation_derivative_kernel(const torch::PackedTensorAccessor32
 
 				double val = normalisation * cos_derivs[iatom][idx] * (double) u[pos];
 
-				atomicAdd(&feature_derivatives[batchID][jatom][x][idx], val);
+				atomicAdd(&feature_derivatives[row][x][idx], val);
 
 			}
 		}
@@ -903,7 +915,14 @@ void compute_molecular_featurization(torch::Tensor sorf_matrix, torch::Tensor bi
 }
 
 void compute_molecular_featurization_derivative(torch::Tensor cos_derivs, double normalisation, torch::Tensor scaling, torch::Tensor input_derivatives,
-		torch::Tensor ordering, torch::Tensor feature_derivatives) {
+		torch::Tensor ordering, torch::Tensor atom_offsets, torch::Tensor feature_derivatives) {
+
+	/*
+	 * feature_derivatives: [nmol, nderiv_atoms, 3, nfeatures], or [natoms_total, 3, nfeatures] packed without padding when atom_offsets
+	 * ([nmol + 1] exclusive prefix sum of the atom counts) is non-empty. Both are addressed as rows of [3, nfeatures] by the kernel.
+	 */
+
+	torch::Tensor feature_rows = feature_derivatives.view( { -1, 3, feature_derivatives.size(-1) });
 
 	int n = input_derivatives.size(3);
 	int log2N = int(log2(n));
@@ -927,7 +946,8 @@ compute_featurisation_derivative_kernel<<<currBatchSize, nthreads, 2*n * sizeof(
 		input_derivatives.packed_accessor32<float, 4, torch::RestrictPtrTraits>(),
 		scaling.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
 		nstacks, log2N,
-		feature_derivatives.packed_accessor32<double, 4, torch::RestrictPtrTraits>());
+		atom_offsets.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+		feature_rows.packed_accessor32<double, 3, torch::RestrictPtrTraits>());
 
 }
 
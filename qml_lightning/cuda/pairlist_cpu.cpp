@@ -0,0 +1,493 @@
+#include <torch/extension.h>
+#include <omp.h>
+#include <iostream>
+#include <vector>
+#include <algorithm>
+
+#include "cpu_utils.h"
+
+using namespace at;
+using namespace std;
+
+/* OpenMP implementation of the neighbour list builders in pairlist_kernel.cu. Neighbours are stored in ascending atom index order, matching the
+ * CUDA kernels, so both backends produce identical neighbour lists. */
+
+static void load_cell(torch::Tensor lattice_vecs, torch::Tensor inv_lattice_vecs, int batchID, float *cell, float *inv_cell) {
+
+	auto lattice_vecs_a = lattice_vecs.accessor<float, 3>();
+	auto inv_lattice_vecs_a = inv_lattice_vecs.accessor<float, 3>();
+
+	for (int i = 0; i < 3; i++) {
+		for (int j = 0; j < 3; j++) {
+			cell[i * 3 + j] = lattice_vecs_a[batchID][i][j];
+			inv_cell[i * 3 + j] = inv_lattice_vecs_a[batchID][i][j];
+		}
+	}
+}
+
+/* structures with fewer atoms than this use the all-pairs loop, the cell list only pays off for larger systems */
+#define CELL_LIST_MIN_ATOMS 128
+
+/* relative padding on the bin width so pairs sitting exactly at rcut can't be missed due to rounding in the fractional coordinates */
+#define CELL_LIST_BIN_PADDING 1.0001f
+
+struct CellList {
+	/* atoms binned on a regular grid in either cartesian (open boundaries) or fractional (periodic) coordinates. Atom indexes within a bin
+	 * are stored in ascending order (counting sort), bins are stored in CSR format: atoms of bin b are bin_atoms[bin_start[b]:bin_start[b+1]] */
+	int nbins[3];
+	bool pbc;
+	vector<int> atom_bin; // [natoms, 3]
+	vector<int> bin_start; // [nbins + 1]
+	vector<int> bin_atoms; // [natoms]
+};
+
+static void build_cell_list(const TensorAccessor<float, 2> &coords, int natoms, float rcut, bool pbc, const float *inv_cell, CellList &cl) {
+
+	float origin[3] = { 0.0, 0.0, 0.0 };
+	float width[3] = { 1.0, 1.0, 1.0 };
+
+	vector<float> s(3 * natoms);
+
+	cl.pbc = pbc;
+
+	for (int i = 0; i < natoms; i++) {
+		for (int m = 0; m < 3; m++) {
+
+			if (pbc) {
+				float sm = 0.0;
+
+				for (int k = 0; k < 3; k++) {
+					sm += inv_cell[m * 3 + k] * coords[i][k];
+				}
+
+				s[3 * i + m] = sm - floor(sm); // wrap into [0, 1)
+			} else {
+				s[3 * i + m] = coords[i][m];
+			}
+		}
+	}
+
+	if (pbc) {
+		/* the distance between lattice planes of fractional axis m is 1 / |inv_cell[m]|, a pair within rcut can therefore differ
+		 * by at most rcut * |inv_cell[m]| in s_m (after the minimum image shift) */
+		for (int m = 0; m < 3; m++) {
+
+			float norm = sqrtf(inv_cell[m * 3] * inv_cell[m * 3] + inv_cell[m * 3 + 1] * inv_cell[m * 3 + 1] + inv_cell[m * 3 + 2] * inv_cell[m * 3 + 2]);
+
+			cl.nbins[m] = max(1, (int) floor(1.0 / (rcut * CELL_LIST_BIN_PADDING * norm)));
+		}
+	} else {
+		for (int m = 0; m < 3; m++) {
+
+			float lo = HUGE_VALF;
+			float hi = -HUGE_VALF;
+
+			for (int i = 0; i < natoms; i++) {
+				lo = min(lo, s[3 * i + m]);
+				hi = max(hi, s[3 * i + m]);
+			}
+
+			origin[m] = lo;
+
+			cl.nbins[m] = max(1, (int) floor((hi - lo) / (rcut * CELL_LIST_BIN_PADDING)));
+
+			width[m] = max(hi - lo, 1e-6f);
+		}
+	}
+
+	int total_bins = cl.nbins[0] * cl.nbins[1] * cl.nbins[2];
+
+	cl.atom_bin.resize(3 * natoms);
+	cl.bin_start.assign(total_bins + 1, 0);
+	cl.bin_atoms.resize(natoms);
+
+	for (int i = 0; i < natoms; i++) {
+
+		for (int m = 0; m < 3; m++) {
+			int b = (int) ((s[3 * i + m] - origin[m]) / width[m] * cl.nbins[m]);
+			cl.atom_bin[3 * i + m] = min(max(b, 0), cl.nbins[m] - 1);
+		}
+
+		int bin = (cl.atom_bin[3 * i] * cl.nbins[1] + cl.atom_bin[3 * i + 1]) * cl.nbins[2] + cl.atom_bin[3 * i + 2];
+
+		cl.bin_start[bin + 1]++;
+	}
+
+	for (int b = 0; b < total_bins; b++) {
+		cl.bin_start[b + 1] += cl.bin_start[b];
+	}
+
+	vector<int> offset(cl.bin_start.begin(), cl.bin_start.end() - 1);
+
+	for (int i = 0; i < natoms; i++) {
+		int bin = (cl.atom_bin[3 * i] * cl.nbins[1] + cl.atom_bin[3 * i + 1]) * cl.nbins[2] + cl.atom_bin[3 * i + 2];
+		cl.bin_atoms[offset[bin]++] = i;
+	}
+}
+
+static void stencil_range(const CellList &cl, int m, int bin, int *lo, int *hi) {
+
+	/* range of bin offsets to visit along axis m. When there are fewer than 3 bins along an axis the 27-cell stencil would visit
+	 * some bins twice, so every bin along that axis is visited exactly once instead */
+	if (cl.nbins[m] < 3) {
+		*lo = -bin;
+		*hi = cl.nbins[m] - 1 - bin;
+	} else if (cl.pbc) {
+		*lo = -1;
+		*hi = 1;
+	} else {
+		*lo = max(-1, -bin);
+		*hi = min(1, cl.nbins[m] - 1 - bin);
+	}
+}
+
+struct Neighbour {
+	/* neighbour atom index and the lattice translation n of the image it was found at, r_j + h n (zero for open boundaries) */
+	int index;
+	int shift[3];
+
+	bool operator<(const Neighbour &other) const {
+		if (index != other.index) {
+			return index < other.index;
+		}
+		return lexicographical_compare(shift, shift + 3, other.shift, other.shift + 3);
+	}
+};
+
+static void add_neighbour_images(const TensorAccessor<float, 2> &coords, int iatom, int jdx, float rcut2, bool pbc, bool orthorhombic,
+		const float *cell, const float *inv_cell, const int *nimages, vector<Neighbour> &neighbours) {
+
+	/* appends every image of jdx within rcut of iatom. For periodic systems the images are enumerated around the minimum image,
+	 * nimages[m] translations either side along cell vector m, so cells narrower than 2 rcut don't need to be replicated into supercells.
+	 * Images are visited in ascending shift order, so the all-pairs and cell list searches give identical lists. Orthorhombic cells
+	 * take the per-axis path, avoiding the two 3x3 matrix-vector products per pair */
+
+	float drij[3] = { coords[iatom][0] - coords[jdx][0], coords[iatom][1] - coords[jdx][1], coords[iatom][2] - coords[jdx][2] };
+
+	if (!pbc) {
+
+		float rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+
+		if (rij2 < rcut2 && rij2 > 0) {
+			neighbours.push_back( { jdx, { 0, 0, 0 } });
+		}
+
+		return;
+	}
+
+	int n0[3];
+
+	get_pbc_shift_cpu(drij, inv_cell, n0, orthorhombic);
+
+	for (int kx = -nimages[0]; kx <= nimages[0]; kx++) {
+		for (int ky = -nimages[1]; ky <= nimages[1]; ky++) {
+			for (int kz = -nimages[2]; kz <= nimages[2]; kz++) {
+
+				Neighbour nbh = { jdx, { n0[0] + kx, n0[1] + ky, n0[2] + kz } };
+
+				float drij_n[3] = { drij[0], drij[1], drij[2] };
+
+				apply_image_shift_cpu(drij_n, cell, nbh.shift, orthorhombic);
+
+				float rij2 = drij_n[0] * drij_n[0] + drij_n[1] * drij_n[1] + drij_n[2] * drij_n[2];
+
+				// rij2 > 0 excludes i itself, but keeps the periodic images of i in small cells
+				if (rij2 < rcut2 && rij2 > 0) {
+					neighbours.push_back(nbh);
+				}
+			}
+		}
+	}
+}
+
+static int find_neighbours_cell_list(const TensorAccessor<float, 2> &coords, const CellList &cl, int iatom, float rcut2, bool pbc, bool orthorhombic,
+		const float *cell, const float *inv_cell, const int *nimages, vector<Neighbour> &neighbours) {
+
+	neighbours.clear();
+
+	int bi[3] = { cl.atom_bin[3 * iatom], cl.atom_bin[3 * iatom + 1], cl.atom_bin[3 * iatom + 2] };
+	int lo[3], hi[3];
+
+	for (int m = 0; m < 3; m++) {
+		stencil_range(cl, m, bi[m], &lo[m], &hi[m]);
+	}
+
+	for (int dx = lo[0]; dx <= hi[0]; dx++) {
+		for (int dy = lo[1]; dy <= hi[1]; dy++) {
+			for (int dz = lo[2]; dz <= hi[2]; dz++) {
+
+				int bx = (bi[0] + dx + cl.nbins[0]) % cl.nbins[0];
+				int by = (bi[1] + dy + cl.nbins[1]) % cl.nbins[1];
+				int bz = (bi[2] + dz + cl.nbins[2]) % cl.nbins[2];
+
+				int bin = (bx * cl.nbins[1] + by) * cl.nbins[2] + bz;
+
+				for (int idx = cl.bin_start[bin]; idx < cl.bin_start[bin + 1]; idx++) {
+					add_neighbour_images(coords, iatom, cl.bin_atoms[idx], rcut2, pbc, orthorhombic, cell, inv_cell, nimages, neighbours);
+				}
+			}
+		}
+	}
+
+	// bins are visited out of index order, sort so the list is identical to the all-pairs search
+	sort(neighbours.begin(), neighbours.end());
+
+	return neighbours.size();
+}
+
+static int find_neighbours_all_pairs(const TensorAccessor<float, 2> &coords, int natoms, int iatom, float rcut2, bool pbc, bool orthorhombic,
+		const float *cell, const float *inv_cell, const int *nimages, vector<Neighbour> &neighbours) {
+
+	neighbours.clear();
+
+	for (int jdx = 0; jdx < natoms; jdx++) {
+		add_neighbour_images(coords, iatom, jdx, rcut2, pbc, orthorhombic, cell, inv_cell, nimages, neighbours);
+	}
+
+	return neighbours.size();
+}
+
+struct NeighbourStore {
+	/* destination of the neighbour indexes: either the dense [nbatch, max_natoms, max_neighbours] list padded with -1, or the
+	 * CSR list, where the neighbours of (batchID, iatom) are indices[row_offsets[batchID][iatom]:row_offsets[batchID][iatom] + num_neighbours[batchID][iatom]],
+	 * optionally with the lattice translation of each neighbour in shifts [npairs, 3]. In cells narrower than 2 rcut an atom can appear
+	 * once per image, so the dense list is only meaningful for wider cells, the shifts are needed to tell the images apart */
+	int *dense = NULL;
+	int max_natoms = 0;
+	int max_neighbours = 0;
+
+	const int *row_offsets = NULL;
+	int *indices = NULL;
+	int *shifts = NULL;
+};
+
+static void store_neighbours(const vector<Neighbour> &neighbours, int batchID, int iatom, TensorAccessor<int, 2> num_neighbours,
+		const NeighbourStore *store) {
+
+	num_neighbours[batchID][iatom] = neighbours.size();
+
+	if (store == NULL) {
+		return;
+	}
+
+	if (store->dense != NULL) {
+		int64_t offset = ((int64_t) batchID * store->max_natoms + iatom) * store->max_neighbours;
+
+		for (int k = 0; k < min((int) neighbours.size(), store->max_neighbours); k++) {
+			store->dense[offset + k] = neighbours[k].index;
+		}
+	}
+
+	if (store->indices != NULL) {
+		int64_t offset = store->row_offsets[(int64_t) batchID * store->max_natoms + iatom];
+
+		for (int k = 0; k < (int) neighbours.size(); k++) {
+
+			store->indices[offset + k] = neighbours[k].index;
+
+			if (store->shifts != NULL) {
+				copy(neighbours[k].shift, neighbours[k].shift + 3, &store->shifts[3 * (offset + k)]);
+			}
+		}
+	}
+}
+
+void getNeighbourListCPU(torch::Tensor coordinates, torch::Tensor natom_counts, float rcut, torch::Tensor lattice_vecs, torch::Tensor inv_lattice_vecs,
+		torch::Tensor num_neighbours, const NeighbourStore *store) {
+
+	/* store == NULL only counts neighbours into num_neighbours, otherwise their indexes are also written to the dense or CSR list.
+	 *
+	 * Small structures are processed one per thread with the all-pairs loop. Larger structures are binned into a cell list
+	 * (bin width >= rcut) so only the 27 surrounding bins are searched, giving O(N) cost, with threads split over atoms. */
+
+	int nbatch = coordinates.size(0);
+	float rcut2 = rcut * rcut;
+
+	bool pbc = lattice_vecs.size(0) > 0;
+
+	auto coords_a = coordinates.accessor<float, 3>();
+	auto natom_counts_a = natom_counts.accessor<int, 1>();
+	auto num_neighbours_a = num_neighbours.accessor<int, 2>();
+
+#pragma omp parallel
+	{
+		vector<Neighbour> neighbours;
+
+		float cell[9];
+		float inv_cell[9];
+		int nimages[3] = { 0, 0, 0 };
+		bool orthorhombic = false;
+
+#pragma omp for schedule(dynamic, 4)
+		for (int batchID = 0; batchID < nbatch; batchID++) {
+
+			int natoms = natom_counts_a[batchID];
+
+			if (natoms >= CELL_LIST_MIN_ATOMS) {
+				continue;
+			}
+
+			if (pbc) {
+				load_cell(lattice_vecs, inv_lattice_vecs, batchID, cell, inv_cell);
+				get_pbc_image_range_cpu(inv_cell, rcut, nimages);
+				orthorhombic = is_orthorhombic_cpu(cell);
+			}
+
+			for (int iatom = 0; iatom < natoms; iatom++) {
+
+				find_neighbours_all_pairs(coords_a[batchID], natoms, iatom, rcut2, pbc, orthorhombic, cell, inv_cell, nimages, neighbours);
+
+				store_neighbours(neighbours, batchID, iatom, num_neighbours_a, store);
+			}
+		}
+	}
+
+	CellList cl;
+
+	for (int batchID = 0; batchID < nbatch; batchID++) {
+
+		int natoms = natom_counts_a[batchID];
+
+		if (natoms < CELL_LIST_MIN_ATOMS) {
+			continue;
+		}
+
+		float cell[9];
+		float inv_cell[9];
+		int nimages[3] = { 0, 0, 0 };
+		bool orthorhombic = false;
+
+		if (pbc) {
+			load_cell(lattice_vecs, inv_lattice_vecs, batchID, cell, inv_cell);
+			get_pbc_image_range_cpu(inv_cell, rcut, nimages);
+			orthorhombic = is_orthorhombic_cpu(cell);
+		}
+
+		build_cell_list(coords_a[batchID], natoms, rcut, pbc, inv_cell, cl);
+
+#pragma omp parallel
+		{
+			vector<Neighbour> neighbours;
+
+#pragma omp for schedule(dynamic, 64)
+			for (int iatom = 0; iatom < natoms; iatom++) {
+
+				find_neighbours_cell_list(coords_a[batchID], cl, iatom, rcut2, pbc, orthorhombic, cell, inv_cell, nimages, neighbours);
+
+				store_neighbours(neighbours, batchID, iatom, num_neighbours_a, store);
+			}
+		}
+	}
+}
+
+torch::Tensor get_num_neighbours_cpu(torch::Tensor coordinates, torch::Tensor natoms, float rcut,
+		torch::Tensor lattice_vecs = torch::empty( { 0, 3, 3 }, torch::kCPU), torch::Tensor inv_lattice_vecs = torch::empty( { 0, 3, 3 }, torch::kCPU)) {
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+
+	int nbatch = coordinates.size(0);
+
+	int max_natoms = natoms.max().item<int>();
+
+	auto options = torch::TensorOptions().dtype(torch::kInt32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor num_neighbours = torch::zeros( { nbatch, max_natoms }, options);
+
+	getNeighbourListCPU(coordinates, natoms, rcut, lattice_vecs, inv_lattice_vecs, num_neighbours, NULL);
+
+	return num_neighbours;
+}
+
+torch::Tensor get_neighbour_list_cpu(torch::Tensor coordinates, torch::Tensor natoms, int max_neighbours, float rcut,
+		torch::Tensor lattice_vecs = torch::empty( { 0, 3, 3 }, torch::kCPU), torch::Tensor inv_lattice_vecs = torch::empty( { 0, 3, 3 }, torch::kCPU)) {
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+
+	int nbatch = coordinates.size(0);
+
+	int max_natoms = natoms.max().item<int>();
+
+	auto options = torch::TensorOptions().dtype(torch::kInt32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor num_neighbours = torch::zeros( { nbatch, max_natoms }, options);
+	torch::Tensor nbh_list = torch::zeros( { nbatch, max_natoms, max_neighbours }, options);
+
+	nbh_list.fill_(-1);
+
+	NeighbourStore store;
+
+	store.dense = nbh_list.data_ptr<int>();
+	store.max_natoms = max_natoms;
+	store.max_neighbours = max_neighbours;
+
+	getNeighbourListCPU(coordinates, natoms, rcut, lattice_vecs, inv_lattice_vecs, num_neighbours, &store);
+
+	return nbh_list;
+}
+
+std::vector<torch::Tensor> get_neighbour_list_csr_cpu(torch::Tensor coordinates, torch::Tensor natoms, float rcut, torch::Tensor lattice_vecs,
+		torch::Tensor inv_lattice_vecs, torch::Tensor row_offsets, int npairs, bool shifts) {
+
+	/* CSR neighbour list: row_offsets [nbatch, max_natoms] is the exclusive prefix sum of get_num_neighbours_cpu, npairs its total.
+	 * Returns the neighbour indexes [npairs] and, if shifts is true, the lattice translation of each neighbour [npairs, 3] */
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCPU, "coordinates must be a CPU tensor");
+	TORCH_CHECK(row_offsets.device().type() == torch::kCPU, "row_offsets must be a CPU tensor");
+	TORCH_CHECK(row_offsets.scalar_type() == torch::kInt32, "row_offsets must be int32");
+
+	int nbatch = coordinates.size(0);
+
+	int max_natoms = row_offsets.size(1);
+
+	auto options = torch::TensorOptions().dtype(torch::kInt32).layout(torch::kStrided).device(torch::kCPU);
+
+	torch::Tensor num_neighbours = torch::zeros( { nbatch, max_natoms }, options);
+	torch::Tensor indices = torch::zeros( { npairs }, options);
+	torch::Tensor image_shifts = torch::zeros( { shifts ? npairs : 0, 3 }, options);
+
+	row_offsets = row_offsets.contiguous();
+
+	NeighbourStore store;
+
+	store.max_natoms = max_natoms;
+	store.row_offsets = row_offsets.data_ptr<int>();
+	store.indices = indices.data_ptr<int>();
+	store.shifts = shifts ? image_shifts.data_ptr<int>() : NULL;
+
+	getNeighbourListCPU(coordinates, natoms, rcut, lattice_vecs, inv_lattice_vecs, num_neighbours, &store);
+
+	return {indices, image_shifts};
+}
+
+void safe_fill_cpu(torch::Tensor pairlist) {
+	/* replaces -1 entries in pairlist with an arbitrary safe atom index so 1/rij doesn't throw nans */
+
+	TORCH_CHECK(pairlist.device().type() == torch::kCPU, "pairlist must be a CPU tensor");
+
+	auto pairlist_a = pairlist.accessor<int, 3>();
+
+	int nbatch = pairlist.size(0);
+	int natoms = pairlist.size(1);
+
+#pragma omp parallel for collapse(2)
+	for (int batchID = 0; batchID < nbatch; batchID++) {
+		for (int iatom = 0; iatom < natoms; iatom++) {
+
+			int newatm = (iatom == 0) ? 1 : iatom - 1;
+
+			for (int k = 0; k < pairlist.size(2); k++) {
+				if (pairlist_a[batchID][iatom][k] == -1) {
+					pairlist_a[batchID][iatom][k] = newatm;
+				}
+			}
+		}
+	}
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+	m.def("safe_fill_cpu", &safe_fill_cpu, "");
+	m.def("get_neighbour_list_cpu", &get_neighbour_list_cpu, "");
+	m.def("get_num_neighbours_cpu", &get_num_neighbours_cpu, "");
+	m.def("get_neighbour_list_csr_cpu", &get_neighbour_list_csr_cpu, "");
+}
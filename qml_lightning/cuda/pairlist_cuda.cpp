@@ -16,6 +16,9 @@ void getNeighbourListCUDA(torch::Tensor coordinates, torch::Tensor natoms, float
 void getNeighbourListCUDA_shared(torch::Tensor coordinates, torch::Tensor natoms, float rcut, torch::Tensor lattice_vecs, torch::Tensor inv_lattice_vecs,
 		torch::Tensor neighbour_list);
 
+void getNeighbourListCSRCUDA(torch::Tensor coordinates, torch::Tensor natoms, float rcut, torch::Tensor lattice_vecs, torch::Tensor inv_lattice_vecs,
+		torch::Tensor row_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts);
+
 void safeFillCUDA(torch::Tensor pairlist);
 
 torch::Tensor get_num_neighbours_gpu(torch::Tensor coordinates, torch::Tensor natoms, float rcut,
@@ -64,9 +67,30 @@ torch::Tensor get_neighbour_list_gpu(torch::Tensor coordinates, torch::Tensor na
 	return nbh_list;
 }
 
+std::vector<torch::Tensor> get_neighbour_list_csr_gpu(torch::Tensor coordinates, torch::Tensor natoms, float rcut, torch::Tensor lattice_vecs,
+		torch::Tensor inv_lattice_vecs, torch::Tensor row_offsets, int npairs, bool shifts) {
+
+	/* CSR neighbour list: row_offsets [nbatch, max_natoms] is the exclusive prefix sum of get_num_neighbours_gpu, npairs its total.
+	 * Returns the neighbour indexes [npairs] and, if shifts is true, the lattice translation of each neighbour [npairs, 3] */
+
+	TORCH_CHECK(coordinates.device().type() == torch::kCUDA, "coordinates must be a CUDA tensor");
+	TORCH_CHECK(row_offsets.device().type() == torch::kCUDA, "row_offsets must be a CUDA tensor");
+	TORCH_CHECK(row_offsets.scalar_type() == torch::kInt32, "row_offsets must be int32");
+
+	auto options = torch::TensorOptions().dtype(torch::kInt32).layout(torch::kStrided).device(torch::kCUDA);
+
+	torch::Tensor indices = torch::zeros( { npairs }, options);
+	torch::Tensor image_shifts = torch::zeros( { shifts ? npairs : 0, 3 }, options);
+
+	getNeighbourListCSRCUDA(coordinates, natoms, rcut, lattice_vecs, inv_lattice_vecs, row_offsets, indices, image_shifts);
+
+	return {indices, image_shifts};
+}
+
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
 {
 	m.def("safe_fill_gpu", &safe_fill_gpu, "");
 	m.def("get_neighbour_list_gpu", &get_neighbour_list_gpu, "");
 	m.def("get_num_neighbours_gpu", &get_num_neighbours_gpu, "");
+	m.def("get_neighbour_list_csr_gpu", &get_neighbour_list_csr_gpu, "");
 }
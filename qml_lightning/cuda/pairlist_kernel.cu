@@ -38,6 +38,89 @@ __device__ void get_pbc_dij(float *drij, float *cell_vectors, float *inv_cell_ve
 	}
 }
 
+__device__ bool is_orthorhombic(float *cell_vectors) {
+
+	/* true if h is diagonal, i.e the cell vectors lie along x, y and z and the minimum image reduces to an independent shift per axis */
+	return cell_vectors[1] == 0.0f && cell_vectors[2] == 0.0f && cell_vectors[3] == 0.0f && cell_vectors[5] == 0.0f && cell_vectors[6] == 0.0f
+			&& cell_vectors[7] == 0.0f;
+}
+
+__device__ void get_pbc_shift(float *drij, float *inv_cell_vectors, int *shift, bool orthorhombic) {
+
+	/* lattice translation n = NINT(h^{-1} r_ij) applied by get_pbc_dij, i.e the minimum image of j sits at r_j + h n */
+	if (orthorhombic) {
+		for (int m = 0; m < 3; m++) {
+			shift[m] = (int) roundf(drij[m] * inv_cell_vectors[m * 4]);
+		}
+		return;
+	}
+
+	for (int m = 0; m < 3; m++) {
+
+		float sm = 0.0;
+
+		for (int k = 0; k < 3; k++) {
+			sm += inv_cell_vectors[m * 3 + k] * drij[k];
+		}
+
+		shift[m] = (int) round(sm);
+	}
+}
+
+__device__ void get_pbc_image_range(float *inv_cell_vectors, float rcut, int *nimages) {
+
+	/* number of lattice translations around the minimum image to search along each cell vector. The planes of fractional axis m are
+	 * 1 / |inv_cell[m]| apart and the minimum image satisfies |s_m| <= 1/2, so image n + k can only be within rcut if
+	 * (|k| - 1/2) / |inv_cell[m]| < rcut. This is 0 whenever every cell width exceeds 2 rcut, i.e the minimum image alone suffices */
+	for (int m = 0; m < 3; m++) {
+
+		float norm = sqrtf(inv_cell_vectors[m * 3] * inv_cell_vectors[m * 3] + inv_cell_vectors[m * 3 + 1] * inv_cell_vectors[m * 3 + 1]
+				+ inv_cell_vectors[m * 3 + 2] * inv_cell_vectors[m * 3 + 2]);
+
+		nimages[m] = (int) floor(rcut * norm + 0.5);
+	}
+}
+
+__device__ float get_image_distance2(float *drij, int *n0, int *nimages, int image, bool pbc, bool orthorhombic, float *cell_vectors, int *shift) {
+
+	/* squared distance from i to the image-th periodic image of j, r_j + h n with n = n0 + k and k enumerated in ascending order
+	 * over [-nimages, nimages]^3, matching the CPU search. For open boundaries there is a single image, drij itself. Orthorhombic cells
+	 * only need the diagonal of h */
+	if (!pbc) {
+		return drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+	}
+
+	int nz = 2 * nimages[2] + 1;
+	int ny = 2 * nimages[1] + 1;
+
+	shift[0] = n0[0] + image / (ny * nz) - nimages[0];
+	shift[1] = n0[1] + (image / nz) % ny - nimages[1];
+	shift[2] = n0[2] + image % nz - nimages[2];
+
+	float rij2 = 0.0;
+
+	if (orthorhombic) {
+		for (int m = 0; m < 3; m++) {
+			float drij_m = drij[m] - cell_vectors[m * 4] * shift[m];
+			rij2 += drij_m * drij_m;
+		}
+		return rij2;
+	}
+
+	for (int m = 0; m < 3; m++) {
+
+		float drij_m = drij[m];
+
+		for (int k = 0; k < 3; k++) {
+			drij_m -= cell_vectors[m * 3 + k] * shift[k];
+		}
+
+		rij2 += drij_m * drij_m;
+	}
+
+	return rij2;
+}
+
 __global__ void get_num_neighbours_kernel_shared(const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> coordinates,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> natom_counts, float rcut2,
 		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> lattice_vectors,
@@ -87,6 +170,19 @@ __global__ void get_num_neighbours_kernel_shared(const torch::PackedTensorAccess
 
 	__syncthreads();
 
+	bool orthorhombic = pbc && is_orthorhombic(slattice_vecs);
+
+	/* lattice translations searched around the minimum image of each pair, non-zero only for cells narrower than 2 rcut */
+	int nimages[3] = { 0, 0, 0 };
+	int n0[3] = { 0, 0, 0 };
+	int shift[3] = { 0, 0, 0 };
+
+	if (pbc) {
+		get_pbc_image_range(sinv_lattice_vecs, sqrtf(rcut2), nimages);
+	}
+
+	int nimages_total = (2 * nimages[0] + 1) * (2 * nimages[1] + 1) * (2 * nimages[2] + 1);
+
 	if (iatom < natoms) {
 		rix = coordinates[batchID][iatom][0];
 		riy = coordinates[batchID][iatom][1];
@@ -123,16 +219,17 @@ __global__ void get_num_neighbours_kernel_shared(const torch::PackedTensorAccess
 			drij[1] = riy - shared_y[j];
 			drij[2] = riz - shared_z[j];
 
-			float rij2 = 0.0;
-
 			if (pbc) {
-				get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
+				get_pbc_shift(drij, sinv_lattice_vecs, n0, orthorhombic);
 			}
 
-			rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+			for (int image = 0; image < nimages_total; image++) {
 
-			if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
-				num_neighbour_atoms_i++;
+				float rij2 = get_image_distance2(drij, n0, nimages, image, pbc, orthorhombic, slattice_vecs, shift);
+
+				if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
+					num_neighbour_atoms_i++;
+				}
 			}
 		}
 	}
@@ -186,6 +283,19 @@ __global__ void get_num_neighbours_kernel(const torch::PackedTensorAccessor32<fl
 
 	__syncthreads();
 
+	bool orthorhombic = pbc && is_orthorhombic(slattice_vecs);
+
+	/* lattice translations searched around the minimum image of each pair, non-zero only for cells narrower than 2 rcut */
+	int nimages[3] = { 0, 0, 0 };
+	int n0[3] = { 0, 0, 0 };
+	int shift[3] = { 0, 0, 0 };
+
+	if (pbc) {
+		get_pbc_image_range(sinv_lattice_vecs, sqrtf(rcut2), nimages);
+	}
+
+	int nimages_total = (2 * nimages[0] + 1) * (2 * nimages[1] + 1) * (2 * nimages[2] + 1);
+
 	if (iatom < natoms) {
 		rix = coordinates[batchID][iatom][0];
 		riy = coordinates[batchID][iatom][1];
@@ -205,16 +315,17 @@ __global__ void get_num_neighbours_kernel(const torch::PackedTensorAccessor32<fl
 		drij[1] = riy - coordinates[batchID][jdx][1];
 		drij[2] = riz - coordinates[batchID][jdx][2];
 
-		float rij2 = 0.0;
-
 		if (pbc) {
-			get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
+			get_pbc_shift(drij, sinv_lattice_vecs, n0, orthorhombic);
 		}
 
-		rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+		for (int image = 0; image < nimages_total; image++) {
+
+			float rij2 = get_image_distance2(drij, n0, nimages, image, pbc, orthorhombic, slattice_vecs, shift);
 
-		if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
-			num_neighbour_atoms_i++;
+			if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
+				num_neighbour_atoms_i++;
+			}
 		}
 	}
 
@@ -270,6 +381,19 @@ __global__ void get_neighbour_list_kernel_shared(const torch::PackedTensorAccess
 	}
 	__syncthreads();
 
+	bool orthorhombic = pbc && is_orthorhombic(slattice_vecs);
+
+	/* lattice translations searched around the minimum image of each pair, non-zero only for cells narrower than 2 rcut */
+	int nimages[3] = { 0, 0, 0 };
+	int n0[3] = { 0, 0, 0 };
+	int shift[3] = { 0, 0, 0 };
+
+	if (pbc) {
+		get_pbc_image_range(sinv_lattice_vecs, sqrtf(rcut2), nimages);
+	}
+
+	int nimages_total = (2 * nimages[0] + 1) * (2 * nimages[1] + 1) * (2 * nimages[2] + 1);
+
 	if (iatom < natoms) {
 		rix = coordinates[batchID][iatom][0];
 		riy = coordinates[batchID][iatom][1];
@@ -307,17 +431,18 @@ __global__ void get_neighbour_list_kernel_shared(const torch::PackedTensorAccess
 			drij[1] = riy - shared_y[j];
 			drij[2] = riz - shared_z[j];
 
-			float rij2 = 0.0;
-
 			if (pbc) {
-				get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
+				get_pbc_shift(drij, sinv_lattice_vecs, n0, orthorhombic);
 			}
 
-			rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+			for (int image = 0; image < nimages_total; image++) {
 
-			if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
-				neighbour_list[batchID][iatom][count] = jidx;
-				count++;
+				float rij2 = get_image_distance2(drij, n0, nimages, image, pbc, orthorhombic, slattice_vecs, shift);
+
+				if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
+					neighbour_list[batchID][iatom][count] = jidx;
+					count++;
+				}
 			}
 		}
 	}
@@ -363,6 +488,19 @@ __global__ void get_neighbour_list_kernel(const torch::PackedTensorAccessor32<fl
 	}
 	__syncthreads();
 
+	bool orthorhombic = pbc && is_orthorhombic(slattice_vecs);
+
+	/* lattice translations searched around the minimum image of each pair, non-zero only for cells narrower than 2 rcut */
+	int nimages[3] = { 0, 0, 0 };
+	int n0[3] = { 0, 0, 0 };
+	int shift[3] = { 0, 0, 0 };
+
+	if (pbc) {
+		get_pbc_image_range(sinv_lattice_vecs, sqrtf(rcut2), nimages);
+	}
+
+	int nimages_total = (2 * nimages[0] + 1) * (2 * nimages[1] + 1) * (2 * nimages[2] + 1);
+
 	if (iatom < natoms) {
 		rix = coordinates[batchID][iatom][0];
 		riy = coordinates[batchID][iatom][1];
@@ -375,17 +513,114 @@ __global__ void get_neighbour_list_kernel(const torch::PackedTensorAccessor32<fl
 		drij[1] = riy - coordinates[batchID][jdx][1];
 		drij[2] = riz - coordinates[batchID][jdx][2];
 
-		float rij2 = 0.0;
+		if (pbc) {
+			get_pbc_shift(drij, sinv_lattice_vecs, n0, orthorhombic);
+		}
+
+		for (int image = 0; image < nimages_total; image++) {
+
+			float rij2 = get_image_distance2(drij, n0, nimages, image, pbc, orthorhombic, slattice_vecs, shift);
+
+			if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
+				neighbour_list[batchID][iatom][count] = jdx;
+				count++;
+			}
+		}
+	}
+}
+
+__global__ void get_neighbour_list_csr_kernel(const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> coordinates,
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> natom_counts, float rcut2,
+		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> lattice_vectors,
+		const torch::PackedTensorAccessor32<float, 3, torch::RestrictPtrTraits> inv_lattice_vectors,
+		const torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> row_offsets,
+		torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> neighbour_indices,
+		torch::PackedTensorAccessor32<int, 2, torch::RestrictPtrTraits> neighbour_shifts) {
+
+	extern __shared__ float s[];
+
+	float *slattice_vecs = (float*) s;
+	float *sinv_lattice_vecs = (float*) &slattice_vecs[9];
+
+	int batchID = blockIdx.x;
+	int iatom = blockIdx.y * blockDim.x + threadIdx.x;
+
+	int natoms = natom_counts[batchID];
+	int count = 0;
+
+	float rix = -HUGE_VALF;
+	float riy = -HUGE_VALF;
+	float riz = -HUGE_VALF;
+
+	bool pbc = false;
+	bool shifts = neighbour_shifts.size(0) > 0;
+
+	float drij[3];
+
+	if (lattice_vectors.size(0) > 0) {
+
+		pbc = true;
+
+		if (threadIdx.x == 0 && threadIdx.y == 0) {
+			for (int i = 0; i < 3; i++) {
+				for (int j = 0; j < 3; j++) {
+					slattice_vecs[i * 3 + j] = lattice_vectors[batchID][i][j];
+					sinv_lattice_vecs[i * 3 + j] = inv_lattice_vectors[batchID][i][j];
+				}
+			}
+		}
+	}
+	__syncthreads();
+
+	bool orthorhombic = pbc && is_orthorhombic(slattice_vecs);
+
+	/* lattice translations searched around the minimum image of each pair, non-zero only for cells narrower than 2 rcut */
+	int nimages[3] = { 0, 0, 0 };
+	int n0[3] = { 0, 0, 0 };
+	int shift[3] = { 0, 0, 0 };
+
+	if (pbc) {
+		get_pbc_image_range(sinv_lattice_vecs, sqrtf(rcut2), nimages);
+	}
+
+	int nimages_total = (2 * nimages[0] + 1) * (2 * nimages[1] + 1) * (2 * nimages[2] + 1);
+
+	if (iatom >= natoms) {
+		return;
+	}
+
+	int offset = row_offsets[batchID][iatom];
+
+	rix = coordinates[batchID][iatom][0];
+	riy = coordinates[batchID][iatom][1];
+	riz = coordinates[batchID][iatom][2];
+
+	for (int jdx = 0; jdx < natoms; jdx++) {
+
+		drij[0] = rix - coordinates[batchID][jdx][0];
+		drij[1] = riy - coordinates[batchID][jdx][1];
+		drij[2] = riz - coordinates[batchID][jdx][2];
 
 		if (pbc) {
-			get_pbc_dij(drij, slattice_vecs, sinv_lattice_vecs);
+			get_pbc_shift(drij, sinv_lattice_vecs, n0, orthorhombic);
 		}
 
-		rij2 = drij[0] * drij[0] + drij[1] * drij[1] + drij[2] * drij[2];
+		for (int image = 0; image < nimages_total; image++) {
+
+			float rij2 = get_image_distance2(drij, n0, nimages, image, pbc, orthorhombic, slattice_vecs, shift);
+
+			if (rij2 < rcut2 && rij2 > 0) {
 
-		if (rij2 < rcut2 && rij2 > 0 && iatom < natoms) {
-			neighbour_list[batchID][iatom][count] = jdx;
-			count++;
+				neighbour_indices[offset + count] = jdx;
+
+				if (shifts) {
+					neighbour_shifts[offset + count][0] = shift[0];
+					neighbour_shifts[offset + count][1] = shift[1];
+					neighbour_shifts[offset + count][2] = shift[2];
+				}
+
+				count++;
+			}
 		}
 	}
 }
@@ -525,3 +760,25 @@ void getNeighbourListCUDA(torch::Tensor coordinates, torch::Tensor natom_counts,
 	cudaDeviceSynchronize();
 }
 
+
+void getNeighbourListCSRCUDA(torch::Tensor coordinates, torch::Tensor natom_counts, float rcut, torch::Tensor lattice_vecs, torch::Tensor inv_lattice_vecs,
+		torch::Tensor row_offsets, torch::Tensor neighbour_indices, torch::Tensor neighbour_shifts) {
+
+	const int nthreads = 32;
+
+	dim3 numBlocks(coordinates.size(0), int(ceil((float) row_offsets.size(1) / nthreads)));
+
+	float rcut2 = rcut * rcut;
+
+	get_neighbour_list_csr_kernel<<<numBlocks, nthreads, 18 * sizeof(float)>>>(
+			coordinates.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
+			natom_counts.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			rcut2,
+			lattice_vecs.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
+			inv_lattice_vecs.packed_accessor32<float, 3, torch::RestrictPtrTraits>(),
+			row_offsets.packed_accessor32<int, 2, torch::RestrictPtrTraits>(),
+			neighbour_indices.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			neighbour_shifts.packed_accessor32<int, 2, torch::RestrictPtrTraits>());
+
+	cudaDeviceSynchronize();
+}
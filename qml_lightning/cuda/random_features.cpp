@@ -6,7 +6,7 @@ using namespace std;
 
 void compute_rff(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features);
 void compute_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering,
-		torch::Tensor feature_derivative);
+		torch::Tensor atom_offsets, torch::Tensor feature_derivative);
 
 void get_rff(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features) {
 
@@ -20,7 +20,7 @@ void get_rff(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tensor b
 }
 
 void get_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering,
-		torch::Tensor feature_derivatives) {
+		torch::Tensor atom_offsets, torch::Tensor feature_derivatives) {
 
 	TORCH_CHECK(input.device().type() == torch::kCUDA, "input must be a CUDA tensor");
 	TORCH_CHECK(grad.device().type() == torch::kCUDA, "grad must be a CUDA tensor");
@@ -29,7 +29,7 @@ void get_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Tensor
 	TORCH_CHECK(ordering.device().type() == torch::kCUDA, "ordering must be a CUDA tensor");
 	TORCH_CHECK(feature_derivatives.device().type() == torch::kCUDA, "feature derivatives must be a CUDA tensor");
 
-	compute_rff_derivatives(input, grad, sampling_matrix, bias, ordering, feature_derivatives);
+	compute_rff_derivatives(input, grad, sampling_matrix, bias, ordering, atom_offsets, feature_derivatives);
 }
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
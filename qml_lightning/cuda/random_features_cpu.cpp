@@ -0,0 +1,197 @@
+#include <torch/extension.h>
+#include <omp.h>
+#include <iostream>
+#include <algorithm>
+#include <math.h>
+
+using namespace at;
+using namespace std;
+
+/* upper bound on the size of the temporary [rows, feature block] GEMM outputs, so 1M-feature models run in bounded memory */
+#define RFF_BLOCK_BYTES (1 << 26)
+
+#define RFF_MIN_FEATURE_BLOCK 256
+#define RFF_MAX_FEATURE_BLOCK 8192
+
+static int feature_block_size(int nrows, int nfeatures) {
+
+	long block = RFF_BLOCK_BYTES / (sizeof(double) * (long) std::max(nrows, 1));
+
+	block = std::min(std::max(block, (long) RFF_MIN_FEATURE_BLOCK), (long) RFF_MAX_FEATURE_BLOCK);
+
+	return (int) std::min(block, (long) nfeatures);
+}
+
+void compute_rff_cpu(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features) {
+
+	/*
+	 * features[ordering[i]] += sqrt(2/nfeatures) * cos(input[i] W + b)
+	 *
+	 * the features are processed in column blocks: one GEMM per block, then a fused cos + bias + scatter-add. Threads own
+	 * disjoint feature columns, so molecules with several atoms of the same element need no atomics.
+	 */
+
+	const int natoms = input.size(0);
+	const int nfeatures = sampling_matrix.size(1);
+
+	const double normalization = sqrt(2.0 / (double) nfeatures);
+
+	auto input_d = input.to(torch::kFloat64);
+
+	auto ordering_a = ordering.accessor<int, 1>();
+	auto bias_a = bias.accessor<double, 1>();
+	auto features_a = features.accessor<double, 2>();
+
+	const int block = feature_block_size(natoms, nfeatures);
+
+	for (int f0 = 0; f0 < nfeatures; f0 += block) {
+
+		const int nf = std::min(block, nfeatures - f0);
+
+		torch::Tensor coeffs = torch::mm(input_d, sampling_matrix.narrow(1, f0, nf)).contiguous();
+
+		auto coeffs_a = coeffs.accessor<double, 2>();
+
+#pragma omp parallel for schedule(static)
+		for (int f = 0; f < nf; f++) {
+
+			const double b = bias_a[f0 + f];
+
+			for (int iatom = 0; iatom < natoms; iatom++) {
+				features_a[ordering_a[iatom]][f0 + f] += normalization * cos(coeffs_a[iatom][f] + b);
+			}
+		}
+	}
+}
+
+void compute_rff_derivatives_cpu(torch::Tensor input, torch::Tensor grad, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering,
+		torch::Tensor atom_offsets, torch::Tensor feature_derivative) {
+
+	/*
+	 * feature_derivative[ordering[i]][j][x] += sqrt(2/nfeatures) * sin(input[i] W + b) * (grad[i][j][x] W)
+	 *
+	 * feature_derivative is [nmol, nderiv_atoms, 3, nfeatures], or [natoms_total, 3, nfeatures] packed without padding with row
+	 * atom_offsets[ordering[i]] + j when atom_offsets is non-empty.
+	 *
+	 * only the (i, j) pairs with a non-zero representation gradient (i.e within the cutoff) are contracted with W, in row blocks
+	 * sized to keep the temporary GEMM output below RFF_BLOCK_BYTES.
+	 */
+
+	const int natoms = input.size(0);
+	const int nderiv_atoms = grad.size(1);
+	const int npcas = sampling_matrix.size(0);
+	const int nfeatures = sampling_matrix.size(1);
+
+	const double normalization = sqrt(2.0 / (double) nfeatures);
+
+	auto input_d = input.to(torch::kFloat64);
+
+	torch::Tensor grad_rows = grad.reshape( { natoms * nderiv_atoms, 3 * npcas });
+
+	torch::Tensor pairs = grad_rows.abs().sum(1).nonzero().select(1, 0).contiguous();
+
+	const int npairs = pairs.size(0);
+
+	if (npairs == 0)
+		return;
+
+	grad_rows = grad_rows.index_select(0, pairs).to(torch::kFloat64).reshape( { npairs * 3, npcas });
+
+	auto pairs_a = pairs.accessor<int64_t, 1>();
+	auto ordering_a = ordering.accessor<int, 1>();
+	auto bias_a = bias.accessor<double, 1>();
+	torch::Tensor feature_rows = feature_derivative.view( { -1, 3, nfeatures });
+
+	const bool packed = atom_offsets.size(0) > 0;
+	const int *atom_offsets_p = packed ? atom_offsets.data_ptr<int>() : NULL;
+
+	auto output_a = feature_rows.accessor<double, 3>();
+
+	const int block = feature_block_size(natoms, nfeatures);
+
+	const int row_block = std::max(1, RFF_BLOCK_BYTES / (int) (3 * sizeof(double) * block));
+
+	for (int f0 = 0; f0 < nfeatures; f0 += block) {
+
+		const int nf = std::min(block, nfeatures - f0);
+
+		torch::Tensor W = sampling_matrix.narrow(1, f0, nf);
+
+		torch::Tensor sin_coeffs = torch::mm(input_d, W).contiguous();
+
+		auto sin_coeffs_a = sin_coeffs.accessor<double, 2>();
+
+#pragma omp parallel for schedule(static)
+		for (int f = 0; f < nf; f++) {
+
+			const double b = bias_a[f0 + f];
+
+			for (int iatom = 0; iatom < natoms; iatom++) {
+				sin_coeffs_a[iatom][f] = normalization * sin(sin_coeffs_a[iatom][f] + b);
+			}
+		}
+
+		for (int p0 = 0; p0 < npairs; p0 += row_block) {
+
+			const int np = std::min(row_block, npairs - p0);
+
+			torch::Tensor gW = torch::mm(grad_rows.narrow(0, 3 * p0, 3 * np), W).contiguous();
+
+			auto gW_a = gW.accessor<double, 2>();
+
+#pragma omp parallel for schedule(static)
+			for (int f = 0; f < nf; f++) {
+
+				for (int p = 0; p < np; p++) {
+
+					const int64_t pair = pairs_a[p0 + p];
+
+					const int iatom = pair / nderiv_atoms;
+					const int jatom = pair % nderiv_atoms;
+
+					const int mol = ordering_a[iatom];
+					const int row = packed ? atom_offsets_p[mol] + jatom : mol * nderiv_atoms + jatom;
+
+					const double s = sin_coeffs_a[iatom][f];
+
+					for (int x = 0; x < 3; x++) {
+						output_a[row][x][f0 + f] += s * gW_a[p * 3 + x][f];
+					}
+				}
+			}
+		}
+	}
+}
+
+void get_rff(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering, torch::Tensor features) {
+
+	TORCH_CHECK(input.device().type() == torch::kCPU, "input must be a CPU tensor");
+	TORCH_CHECK(sampling_matrix.device().type() == torch::kCPU, "sampling_matrix must be a CPU tensor");
+	TORCH_CHECK(bias.device().type() == torch::kCPU, "bias must be a CPU tensor");
+	TORCH_CHECK(ordering.device().type() == torch::kCPU, "ordering must be a CPU tensor");
+	TORCH_CHECK(features.device().type() == torch::kCPU, "features must be a CPU tensor");
+	TORCH_CHECK(features.scalar_type() == torch::kFloat64, "features must be a float64 tensor");
+
+	compute_rff_cpu(input, sampling_matrix.to(torch::kFloat64), bias.to(torch::kFloat64), ordering.to(torch::kInt32), features);
+}
+
+void get_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering,
+		torch::Tensor atom_offsets, torch::Tensor feature_derivatives) {
+
+	TORCH_CHECK(input.device().type() == torch::kCPU, "input must be a CPU tensor");
+	TORCH_CHECK(grad.device().type() == torch::kCPU, "grad must be a CPU tensor");
+	TORCH_CHECK(sampling_matrix.device().type() == torch::kCPU, "sampling_matrix must be a CPU tensor");
+	TORCH_CHECK(bias.device().type() == torch::kCPU, "bias must be a CPU tensor");
+	TORCH_CHECK(ordering.device().type() == torch::kCPU, "ordering must be a CPU tensor");
+	TORCH_CHECK(feature_derivatives.device().type() == torch::kCPU, "feature derivatives must be a CPU tensor");
+	TORCH_CHECK(feature_derivatives.scalar_type() == torch::kFloat64, "feature derivatives must be a float64 tensor");
+
+	compute_rff_derivatives_cpu(input, grad, sampling_matrix.to(torch::kFloat64), bias.to(torch::kFloat64), ordering.to(torch::kInt32),
+			atom_offsets.to(torch::kInt32).contiguous(), feature_derivatives);
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+	m.def("get_rff", &get_rff, "Computes kitchen sink features");
+	m.def("get_rff_derivatives", &get_rff_derivatives, "Computes kitchen sink features");
+}
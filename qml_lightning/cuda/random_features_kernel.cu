@@ -45,7 +45,8 @@ __global__ void random_fourrier_features_kernel_derivative(const torch::PackedTe
 		const torch::PackedTensorAccessor32<double, 2, torch::RestrictPtrTraits> sampling_matrix,
 		const torch::PackedTensorAccessor32<double, 1, torch::RestrictPtrTraits> bias,
 		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> order,
-		torch::PackedTensorAccessor32<double, 4, torch::RestrictPtrTraits> grad_output) {
+		const torch::PackedTensorAccessor32<int, 1, torch::RestrictPtrTraits> atom_offsets,
+		torch::PackedTensorAccessor32<double, 3, torch::RestrictPtrTraits> grad_output) {
 
 	extern __shared__ float s[];
 
@@ -63,6 +64,17 @@ __global__ void random_fourrier_features_kernel_derivative(const torch::PackedTe
 
 	int mol = order[iatom];
 
+	// output row of (mol, jatom): packed without padding when atom_offsets is given, the padded atoms have no row
+	int row = mol * nderiv_atoms + jatom;
+
+	if (atom_offsets.size(0) > 0) {
+
+		if (jatom >= atom_offsets[mol + 1] - atom_offsets[mol])
+			return;
+
+		row = atom_offsets[mol] + jatom;
+	}
+
 	for (int i = tid; i < npcas; i += blockDim.x) {
 		s[i] = input[iatom][i];
 	}
@@ -88,7 +100,7 @@ __global__ void random_fourrier_features_kernel_derivative(const torch::PackedTe
 
 			}
 
-			atomicAdd(&grad_output[mol][jatom][x][i], feature_deriv_i * sumprod_deriv);
+			atomicAdd(&grad_output[row][x][i], feature_deriv_i * sumprod_deriv);
 		}
 	}
 }
@@ -110,7 +122,9 @@ void compute_rff(torch::Tensor input, torch::Tensor sampling_matrix, torch::Tens
 }
 
 void compute_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Tensor sampling_matrix, torch::Tensor bias, torch::Tensor ordering,
-		torch::Tensor feature_derivative) {
+		torch::Tensor atom_offsets, torch::Tensor feature_derivative) {
+
+	torch::Tensor feature_rows = feature_derivative.view( { -1, 3, feature_derivative.size(-1) });
 
 	int currBatchSize = grad.size(0) * grad.size(1);
 
@@ -124,7 +138,8 @@ void compute_rff_derivatives(torch::Tensor input, torch::Tensor grad, torch::Ten
 			sampling_matrix.packed_accessor32<double, 2, torch::RestrictPtrTraits>(),
 			bias.packed_accessor32<double, 1, torch::RestrictPtrTraits>(),
 			ordering.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
-			feature_derivative.packed_accessor32<double, 4, torch::RestrictPtrTraits>());
+			atom_offsets.packed_accessor32<int, 1, torch::RestrictPtrTraits>(),
+			feature_rows.packed_accessor32<double, 3, torch::RestrictPtrTraits>());
 
 	cudaDeviceSynchronize();
 }
@@ -9,7 +9,14 @@ Created on 1 Apr 2021
 '''
 import torch
 import numpy as np
-from qml_lightning.cuda import sorf_gpu
+from qml_lightning.backend import get_kernel, Timer
+
+
+def sorf_matrix(input_rep, diagonals, normalization=1.0):
+    
+    '''returns normalization * [(HD)_n] input_rep, stacked nstacks times. The CPU backend applies the normalization in-place.'''
+    
+    return get_kernel('sorf_matrix', input_rep)(input_rep, diagonals, normalization)
 
 
 class SORFTransformCuda(torch.autograd.Function):
@@ -25,14 +32,14 @@ class SORFTransformCuda(torch.autograd.Function):
         ctx.coeff_normalisation = coeff_normalisation
         ctx.ntransforms = ntransforms
         
-        return sorf_gpu.hadamard_transform_gpu(u, d, coeff_normalisation, ntransforms)
+        return get_kernel('hadamard_transform', u)(u, d, coeff_normalisation, ntransforms)
 
     @staticmethod
     def backward(ctx, grad):
 
         d = ctx.saved_tensors[0]
 
-        grads = sorf_gpu.hadamard_transform_backwards_gpu(grad, d, ctx.coeff_normalisation, ctx.ntransforms) 
+        grads = get_kernel('hadamard_transform_backwards', grad)(grad.contiguous(), d, ctx.coeff_normalisation, ctx.ntransforms)
 
         return grads, None, None, None
 
@@ -49,7 +56,7 @@ class CosFeatures(torch.autograd.Function):
         ctx.save_for_backward(coeffs, b, batch_indexes)
         ctx.nmol = nmol
         
-        features = sorf_gpu.CosFeaturesCUDA(coeffs, b, nmol, batch_indexes)
+        features = get_kernel('cos_features', coeffs)(coeffs, b, nmol, batch_indexes)
         
         # print ("features:", features.shape)
         return features
@@ -66,7 +73,7 @@ class CosFeatures(torch.autograd.Function):
     
         # print (grad)
         
-        grads = sorf_gpu.CosDerivativeFeaturesCUDA(grad, coeffs, b, ctx.nmol, batch_indexes)
+        grads = get_kernel('cos_features_derivative', grad)(grad, coeffs, b, ctx.nmol, batch_indexes)
         
         # print (grads.shape)
         # print ("outp grad:", grads.shape)
@@ -79,7 +86,7 @@ class CosFeatures(torch.autograd.Function):
         return grads, None, None, None
 
 
-def get_SORF_diagonals(elements, ntransforms, nstacks, npcas):
+def get_SORF_diagonals(elements, ntransforms, nstacks, npcas, device=torch.device('cpu')):
     
     Dmat = {}
     
@@ -88,66 +95,65 @@ def get_SORF_diagonals(elements, ntransforms, nstacks, npcas):
         D[D > 0.0] = 1.0
         D[D < 0.0] = -1.0
         
-        Dmat[e] = torch.from_numpy(D).float().cuda()
+        Dmat[e] = torch.from_numpy(D).float().to(device)
         
     return Dmat
 
 
-def get_bias(elements, nfeatures):
+def get_bias(elements, nfeatures, device=torch.device('cpu')):
     
     b = {}
     
     for e  in elements:
         v = np.random.uniform(0.0, 1.0, [nfeatures]) * 2.0 * np.pi
-        b[e] = torch.from_numpy(v).float().cuda()
+        b[e] = torch.from_numpy(v).float().to(device)
         
     return b
 
 
 def get_SORF_coefficients(input_rep, diagonals, normalization, print_timings=False):
     
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
-    
-    start.record()
-    coeffs = normalization * sorf_gpu.sorf_matrix_gpu(input_rep, diagonals)
+    timer = Timer(input_rep.device)
     
-    end.record()
-    torch.cuda.synchronize()
+    timer.start()
+    coeffs = sorf_matrix(input_rep, diagonals, normalization)
+    timer.stop()
     
     if (print_timings):
-        print("SORF coefficients time: ", start.elapsed_time(end), "ms")
+        print("SORF coefficients time: ", timer.elapsed_time(), "ms")
     
     return coeffs
 
 
 def get_features(coeffs, bias, batch_indexes, batch_num, print_timings=False):
     
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
+    timer = Timer(coeffs.device)
     
-    start.record()
-    features = sorf_gpu.molecular_featurisation_gpu(coeffs, bias, batch_indexes, batch_num)
-    end.record()
-    torch.cuda.synchronize()
+    timer.start()
+    features = torch.zeros(batch_num, coeffs.shape[1], device=coeffs.device, dtype=torch.float64)
+    get_kernel('hadamard_features', coeffs)(coeffs, bias, batch_indexes, features)
+    timer.stop()
     
     if (print_timings):
-        print("features time: ", start.elapsed_time(end), "ms")
+        print("features time: ", timer.elapsed_time(), "ms")
     
     return features
 
 
 def get_feature_derivatives(coeffs, bias, diagonals, input_grad, batch_indexes, batch_num, normalization, print_timings=False):
     
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
+    timer = Timer(coeffs.device)
+    
+    timer.start()
+    cos_derivs = torch.zeros(coeffs.shape, device=coeffs.device, dtype=torch.float64)
+    get_kernel('partial_feature_derivatives', coeffs)(coeffs, bias, cos_derivs)
     
-    start.record()
-    feature_derivs = normalization * sorf_gpu.molecular_featurisation_derivative_gpu(coeffs, bias, diagonals, input_grad, batch_indexes, batch_num)
-    end.record()
-    torch.cuda.synchronize()
+    feature_derivs = torch.zeros(batch_num, input_grad.shape[1], 3, coeffs.shape[1], device=coeffs.device, dtype=torch.float64)
+    atom_offsets = torch.empty(0, dtype=torch.int, device=coeffs.device)
+    get_kernel('molecular_featurization_derivative', coeffs)(cos_derivs, normalization, diagonals, input_grad, batch_indexes, atom_offsets, feature_derivs)
+    timer.stop()
     
     if (print_timings):
-        print("feature derivatives time: ", start.elapsed_time(end), "ms")
+        print("feature derivatives time: ", timer.elapsed_time(), "ms")
         
     return feature_derivs
@@ -0,0 +1,245 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Spatial domain decomposition for single structures too large to be evaluated as one padded block.
+
+The structure is binned on a regular grid of domains of width >= domain_length (fractional coordinates for periodic cells, the
+bounding box otherwise). Every domain owns the atoms in its bin (core) and carries copies of all atoms within rcut of the bin (halo),
+translated to the periodic image adjacent to the domain. Each domain is evaluated as an isolated cluster: the per-atom energies of
+its core atoms only depend on atoms within rcut, so they are exact, and the forces of sum(core energies) are scattered back onto the
+original atoms, halo images included. Energies and forces of all domains are then reduced on the host.
+
+Domains can be evaluated in parallel by worker processes on one host. Each worker holds a copy of the model and one domain at a time,
+so its memory is bounded by the domain size rather than by the size of the structure.
+
+'''
+import os
+import itertools
+
+import torch
+import numpy as np
+
+from qml_lightning.backend import Timer
+
+
+class Domain(object):
+
+    '''
+        indices: [ncore + nhalo] index of every local atom in the full structure, the ncore owned atoms first
+        coordinates: [ncore + nhalo, 3] local coordinates, halo atoms are placed at the periodic image adjacent to the domain
+        charges: [ncore + nhalo] nuclear charges
+    '''
+
+    def __init__(self, indices, coordinates, charges, ncore):
+        self.indices = indices
+        self.coordinates = coordinates
+        self.charges = charges
+        self.ncore = ncore
+
+    @property
+    def natoms(self):
+        return self.indices.shape[0]
+
+
+def decompose(X, Z, rcut, domain_length, cell=None):
+
+    '''
+    generator over the Domains of the structure X [natoms, 3], Z [natoms]. cell [3, 3] holds the lattice vectors as columns, r = h s,
+    matching the representation kernels, None for open boundaries. Domains without core atoms are skipped.
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    Z = np.asarray(Z)
+
+    pbc = cell is not None
+
+    if (pbc):
+        cell = np.asarray(cell, dtype=np.float64).reshape(3, 3)
+        inv_cell = np.linalg.inv(cell)
+
+        s = X @ inv_cell.T
+        s = s - np.floor(s)
+
+        X = s @ cell.T
+
+        # distance between the lattice planes of each fractional axis, and the halo in fractional units
+        widths = 1.0 / np.linalg.norm(inv_cell, axis=1)
+        origin = np.zeros(3)
+        extent = np.ones(3)
+        halo = rcut / widths
+    else:
+        origin = X.min(axis=0)
+        widths = np.maximum(X.max(axis=0) - origin, 1e-6)
+        extent = widths
+        s = X
+        halo = np.full(3, rcut)
+
+    ndomains = np.maximum(1, np.floor(widths / domain_length)).astype(np.int64)
+
+    bins = np.minimum(((s - origin) / extent * ndomains).astype(np.int64), ndomains - 1)
+
+    flat_bins = (bins[:, 0] * ndomains[1] + bins[:, 1]) * ndomains[2] + bins[:, 2]
+
+    # atoms sorted by bin in CSR format, atoms of bin b are order[bin_start[b]:bin_start[b + 1]]
+    order = np.argsort(flat_bins, kind='stable')
+    bin_start = np.zeros(ndomains.prod() + 1, dtype=np.int64)
+    np.cumsum(np.bincount(flat_bins, minlength=ndomains.prod()), out=bin_start[1:])
+
+    # number of neighbouring bins the halo can reach along each axis
+    nreach = np.ceil(halo * ndomains / extent).astype(np.int64)
+
+    for d in itertools.product(*[range(n) for n in ndomains]):
+
+        d = np.array(d)
+
+        b = (d[0] * ndomains[1] + d[1]) * ndomains[2] + d[2]
+
+        core = order[bin_start[b]:bin_start[b + 1]]
+
+        if (core.shape[0] == 0):
+            continue
+
+        lo = origin + d * extent / ndomains - halo
+        hi = origin + (d + 1) * extent / ndomains + halo
+
+        indices = [core]
+        coordinates = [X[core]]
+
+        for offset in itertools.product(*[range(-n, n + 1) for n in nreach]):
+
+            if (not any(offset)):
+                continue
+
+            nbin = d + np.array(offset)
+
+            if (pbc):
+                # bin nbin lies in the periodic image k of the cell
+                k = np.floor_divide(nbin, ndomains)
+                nbin = nbin - k * ndomains
+            elif (np.any(nbin < 0) or np.any(nbin >= ndomains)):
+                continue
+            else:
+                k = np.zeros(3, dtype=np.int64)
+
+            b = (nbin[0] * ndomains[1] + nbin[1]) * ndomains[2] + nbin[2]
+
+            candidates = order[bin_start[b]:bin_start[b + 1]]
+
+            sk = s[candidates] + k
+
+            inside = np.all((sk >= lo) & (sk < hi), axis=1)
+
+            indices.append(candidates[inside])
+            coordinates.append(X[candidates[inside]] + (cell @ k if pbc else 0.0))
+
+        indices = np.concatenate(indices)
+
+        yield Domain(indices, np.concatenate(coordinates), Z[indices], core.shape[0])
+
+
+def evaluate_domain(model, domain, forces=True):
+
+    '''
+    returns the global indices of the domain atoms, the energies of its core atoms and, if forces is True, the forces of the summed
+    core energies on every local atom
+    '''
+
+    data = model.format_data([domain.coordinates], [domain.charges])
+
+    coordinates = data['coordinates']
+
+    if (forces):
+        coordinates.requires_grad = True
+
+    atomic_energies = model.atomic_energies(coordinates, data['charges'], data['atomIDs'], data['molIDs'], data['natom_counts'])[0,:domain.ncore]
+
+    result = [domain.indices, domain.ncore, atomic_energies.detach().double().cpu().numpy()]
+
+    if (forces):
+        local_forces, = torch.autograd.grad(-atomic_energies.sum(), coordinates)
+        result.append(local_forces[0,:domain.natoms].double().cpu().numpy())
+
+    return result
+
+
+_worker_model = None
+_worker_forces = True
+
+
+def _init_worker(model, forces, nthreads):
+
+    global _worker_model, _worker_forces
+
+    _worker_model = model
+    _worker_forces = forces
+
+    torch.set_num_threads(nthreads)
+
+
+def _evaluate_worker_domain(domain):
+    return evaluate_domain(_worker_model, domain, _worker_forces)
+
+
+def predict_domains(model, X, Z, cell=None, domain_length=20.0, nworkers=0, forces=True, print_info=True):
+
+    '''
+    energy and, if forces is True, forces [natoms, 3] of the single structure X [natoms, 3], Z [natoms] using model (HadamardFeaturesModel).
+
+    domain_length: minimum domain width in Angstrom, the halo adds model.rep.high_cutoff either side
+    nworkers: number of worker processes, 0 evaluates the domains one at a time in this process
+    '''
+
+    timer = Timer(model.device)
+
+    timer.start()
+
+    natoms = len(X)
+
+    atomic_energies = np.zeros(natoms, dtype=np.float64)
+    all_forces = np.zeros((natoms, 3), dtype=np.float64)
+
+    domains = decompose(X, Z, model.rep.high_cutoff, domain_length, cell)
+
+    ndomains = 0
+    max_domain_atoms = 0
+
+    def reduce(result):
+
+        indices, ncore, energies = result[0], result[1], result[2]
+
+        atomic_energies[indices[:ncore]] = energies
+
+        if (forces):
+            np.add.at(all_forces, indices, result[3])
+
+        return indices.shape[0]
+
+    if (nworkers > 0):
+
+        nthreads = max(1, (os.cpu_count() or 1) // nworkers)
+
+        context = torch.multiprocessing.get_context('spawn')
+
+        with context.Pool(nworkers, initializer=_init_worker, initargs=(model, forces, nthreads)) as pool:
+            for result in pool.imap_unordered(_evaluate_worker_domain, domains):
+                max_domain_atoms = max(max_domain_atoms, reduce(result))
+                ndomains += 1
+    else:
+        for domain in domains:
+            max_domain_atoms = max(max_domain_atoms, reduce(evaluate_domain(model, domain, forces)))
+            ndomains += 1
+
+    timer.stop()
+
+    if (print_info):
+        print("prediction for", natoms, "atoms over", ndomains, "domains (largest", max_domain_atoms, "atoms incl. halo) time: ",
+              timer.elapsed_time(), "ms")
+
+    energy = torch.tensor(atomic_energies.sum(), dtype=torch.float64)
+
+    if (forces):
+        return energy, torch.from_numpy(all_forces)
+
+    return energy
@@ -6,23 +6,21 @@ Created on 3 May 2021
 import torch
 import numpy as np
 from tqdm import tqdm
-from qml_lightning.features.SORF import get_SORF_diagonals, get_bias, SORFTransformCuda, CosFeatures
+from qml_lightning.features.SORF import get_SORF_diagonals, get_bias, SORFTransformCuda, CosFeatures, sorf_matrix
 import time
-from qml_lightning.cuda.sorf_gpu import compute_hadamard_features, sorf_matrix_gpu, compute_partial_feature_derivatives, compute_molecular_featurization_derivative
 from qml_lightning.models.kernel import BaseKernel
 from qml_lightning.representations.dimensionality_reduction import project_representation, project_derivative
-from qml_lightning.cuda.utils_gpu import matmul_and_reduce
+from qml_lightning.backend import get_kernel, Timer
+from qml_lightning.models.domain_decomposition import predict_domains
+from qml_lightning.utils.dataset import as_dataset
 
 
 class HadamardFeaturesModel(BaseKernel):
     
     def __init__(self, rep=None, elements=np.array([1, 6, 7, 8]), ntransforms=1, sigma=3.0, llambda=1e-11, npcas=128,
-                 nbatch_train=64, nbatch_test=64, nstacks=32):
+                 nbatch_train=64, nbatch_test=64, nstacks=32, device=None):
         
-        super(HadamardFeaturesModel, self).__init__(rep, elements, sigma, llambda)
-        
-        cuda = torch.cuda.is_available()
-        self.device = torch.device('cuda' if cuda else 'cpu')
+        super(HadamardFeaturesModel, self).__init__(rep, elements, sigma, llambda, device)
         
         self.ntransforms = ntransforms
         
@@ -31,12 +29,12 @@ class HadamardFeaturesModel(BaseKernel):
         self.nbatch_train = nbatch_train
         self.nbatch_test = nbatch_test
         
-        self.species = torch.from_numpy(elements).float().cuda()
+        self.species = torch.from_numpy(elements).float().to(self.device)
 
         self.npcas = npcas
 
-        self.Dmat = get_SORF_diagonals(elements, ntransforms, nstacks, npcas)
-        self.bk = get_bias(elements, nstacks * npcas)
+        self.Dmat = get_SORF_diagonals(elements, ntransforms, nstacks, npcas, self.device)
+        self.bk = get_bias(elements, nstacks * npcas, self.device)
         
         self.is_trained = False
         self.alpha = torch.zeros(self.nfeatures(), device=self.device, dtype=torch.float)
@@ -44,18 +42,28 @@ class HadamardFeaturesModel(BaseKernel):
     def nfeatures(self):
         return self.npcas * self.nstacks
 
-    def calculate_features(self, representation, element, indexes, feature_matrix, grad=None, derivative_features=None):
+    def calculate_features(self, representation, element, indexes, feature_matrix, grad=None, derivative_features=None, atom_offsets=None):
+        
+        '''
+        atom_offsets: [nbatch + 1] exclusive prefix sum of the atom counts. When given, derivative_features is packed without padding as
+        [natoms_total, 3, nfeatures] and grad is the packed representation derivative
+        '''
+        
         coeff_normalisation = np.sqrt(representation.shape[1]) / self.sigma
 
-        coeffs = coeff_normalisation * sorf_matrix_gpu(representation, self.Dmat[element])
+        coeffs = sorf_matrix(representation, self.Dmat[element], coeff_normalisation)
 
-        compute_hadamard_features(coeffs, self.bk[element], indexes, feature_matrix)
+        get_kernel('hadamard_features', coeffs)(coeffs, self.bk[element], indexes, feature_matrix)
         
         if (derivative_features is not None and grad is not None):
             cos_derivs = torch.zeros(coeffs.shape, device=coeffs.device, dtype=torch.float64)
-            compute_partial_feature_derivatives(coeffs, self.bk[element], cos_derivs)
+            get_kernel('partial_feature_derivatives', coeffs)(coeffs, self.bk[element], cos_derivs)
 
-            compute_molecular_featurization_derivative(cos_derivs, coeff_normalisation, self.Dmat[element], grad, indexes, derivative_features)
+            if (atom_offsets is None):
+                atom_offsets = torch.empty(0, dtype=torch.int, device=coeffs.device)
+            
+            get_kernel('molecular_featurization_derivative', coeffs)(cos_derivs, coeff_normalisation, self.Dmat[element], grad, indexes, atom_offsets,
+                                                                     derivative_features)
     
     def get_finite_difference_features(self, rep, X, Z, elements, atomIDs, molIDs, natom_counts, dx=0.001):
         device = X.device
@@ -138,7 +146,7 @@ class HadamardFeaturesModel(BaseKernel):
         
                 sub_rep = torch_rep[indices]
 
-                Ztrain = torch.zeros(sub_rep.shape[0], self.nfeatures(), device=torch.device('cuda'), dtype=torch.float32)
+                Ztrain = torch.zeros(sub_rep.shape[0], self.nfeatures(), device=self.device, dtype=torch.float32)
             
                 for e in self.elements:
                     indexes = charges[indices] == e
@@ -164,38 +172,39 @@ class HadamardFeaturesModel(BaseKernel):
             print ("iteration: ", i, torch.mean(torch.abs(batch_predictions - energies[indices].float())))
             print ("alpha:", self.alpha)
     
-    def predict(self, X, Z, max_natoms, cells=None, inv_cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+    def predict(self, X, Z=None, max_natoms=None, cells=None, inv_cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+
+        '''X, Z: lists of per-molecule coordinates and charges, or X: PackedMolecules (Z is then ignored)'''
 
         if (not use_backward):
-            return self.predict_cuda(X, Z, max_natoms, cells, forces, print_info)
+            return self.predict_cuda(X, Z, max_natoms, cells, inv_cells, forces, print_info)
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        timer = Timer(self.device)
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start.record()
+            timer.start()
 
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
                 exit()
             
-            predict_energies = torch.zeros(len(X), device=self.device, dtype=torch.float64)
-            predict_forces = torch.zeros(len(X), max_natoms, 3, device=self.device, dtype=torch.float64)
+            molecules = as_dataset(X, Z, cells=cells, inv_cells=inv_cells).geometries()
             
-            for i in tqdm(range(0, len(X), self.nbatch_test)) if print_info else range(0, len(X), self.nbatch_test):
+            if (max_natoms is None):
+                max_natoms = molecules.max_natoms
                 
-                coordinates = X[i:i + self.nbatch_test]
-                charges = Z[i:i + self.nbatch_test]
-
-                if (cells is not None):
-                    zcells = cells[i:i + self.nbatch_test]
-                    z_invcells = inv_cells[i:i + self.nbatch_test]
-                else: 
-                    zcells = None 
-                    z_invcells = None
-                    
-                data = self.format_data(coordinates, charges, cells=zcells, inv_cells=z_invcells)
+            predict_energies = torch.zeros(len(molecules), device=self.device, dtype=torch.float64)
+            predict_forces = torch.zeros(len(molecules), max_natoms, 3, device=self.device, dtype=torch.float64)
+            
+            schedule = self.schedule_batches(molecules, self.nbatch_test)
+            
+            batches = self.prefetch_batches(molecules, schedule)
+            
+            for b, data in tqdm(batches, total=len(schedule)) if print_info else batches:
+                
+                # positions of the batch molecules in the input
+                batch_order = torch.from_numpy(schedule.indexes(b)).to(self.device)
                 
                 coordinates = data['coordinates']
                 charges = data['charges']
@@ -205,45 +214,52 @@ class HadamardFeaturesModel(BaseKernel):
                 zcells = data['cells']
                 z_invcells = data['inv_cells']
 
-                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, z_invcells, forces=forces, print_info=False, profiler=False)
+                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, z_invcells, forces=forces, print_info=False, profiler=False,
+                                          element_rows=data['element_rows'])
                 
                 if (forces):
-                    predict_energies[i:i + self.nbatch_test] = result[0]
+                    predict_energies[batch_order] = result[0]
                     
                     forces_cuda = result[1]
-    
-                    for j in range(forces_cuda.shape[0]):
-                        predict_forces[i + j,:natom_counts[j]] = forces_cuda[j,:natom_counts[j]]
+                    
+                    rows = (molIDs.long(), atomIDs.long())
+                    
+                    predict_forces[batch_order[rows[0]], rows[1]] = forces_cuda[rows]
                 else:
-                    predict_energies[i:i + self.nbatch_test] = result
+                    predict_energies[batch_order] = result
       
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
         
         if (profiler):
             print(prof.key_averages(group_by_stack_n=30).table(sort_by='self_cuda_time_total', row_limit=30))
             
         if (print_info):
-            print("prediction for", len(X), "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", len(molecules), "molecules time: ", timer.elapsed_time(), "ms")
+            print("batch pipeline:", batches.report())
         
         if (forces):
             return (predict_energies, predict_forces)
         else:
             return predict_energies
         
-    def predict_opt(self, coordinates, charges, atomIDs, molIDs, natom_counts, cells=torch.empty(0, 3, 3, device='cuda'), inv_cells=torch.empty(0, 3, 3, device='cuda'),
-                    forces=True, print_info=True, profiler=False):
+    def predict_opt(self, coordinates, charges, atomIDs, molIDs, natom_counts, cells=None, inv_cells=None,
+                    forces=True, print_info=True, profiler=False, neighbour_list=None, element_rows=None):
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        '''
+        neighbour_list: optional VerletList (qml_lightning.representations.neighbours), reused across MD steps
+        element_rows: optional per-element ragged atom rows of the batch, data['element_rows'] of format_packed, see get_features
+        '''
+        
+        if (cells is None):
+            cells = torch.empty(0, 3, 3, device=coordinates.device)
+            inv_cells = torch.empty(0, 3, 3, device=coordinates.device)
+            
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start = torch.cuda.Event(enable_timing=True)
-            start1 = torch.cuda.Event(enable_timing=True)
-            end = torch.cuda.Event(enable_timing=True)
+            timer = Timer(self.device)
         
-            start.record()
+            timer.start()
             
-            coeff_normalisation = np.sqrt(self.npcas) / self.sigma
-
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
                 exit()
@@ -251,37 +267,19 @@ class HadamardFeaturesModel(BaseKernel):
             if (forces):
                 coordinates.requires_grad = True
       
-            torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells)
+            if (neighbour_list is None):
+                torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells)
+            else:
+                torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells, neighbour_list=neighbour_list)
     
-            Ztest = torch.zeros(coordinates.shape[0], self.nfeatures(), device=torch.device('cuda'), dtype=torch.float32)
-
-            start1.record()
-            
-            for e in self.elements:
-                 
-                indexes = charges.int() == e
-                 
-                batch_indexes = torch.where(indexes)[0].type(torch.int)
-                 
-                sub = torch_rep[indexes]
-                
-                if (sub.shape[0] == 0): continue
-                    
-                sub = project_representation(sub, self.reductors[e])
-            
-                coeffs = SORFTransformCuda.apply(sub, self.Dmat[e], coeff_normalisation, self.ntransforms)
-                  
-                coeffs = coeffs.view(coeffs.shape[0], coeffs.shape[1] * coeffs.shape[2])
-                 
-                Ztest += CosFeatures.apply(coeffs, self.bk[e], coordinates.shape[0], batch_indexes)
+            Ztest = self.get_features(torch_rep, charges, per_atom=False, rows=(molIDs.long(), atomIDs.long()), element_rows=element_rows)
    
             total_energies = torch.matmul(Ztest, self.alpha.float())
             
             if (forces):
                 forces_torch, = torch.autograd.grad(-total_energies.sum(), coordinates)
             
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
             
         # if (profiler):
             # <FunctionEventAvg key=cudaEventCreateWithFlags self_cpu_time=6.000us cpu_time=1.500us  self_cuda_time=0.000us cuda_time=0.000us input_shapes= cpu_memory_usage=0 cuda_memory_usage=0>
@@ -289,7 +287,7 @@ class HadamardFeaturesModel(BaseKernel):
             # print(prof.key_averages(group_by_stack_n=8).table(sort_by='self_cuda_time_total', row_limit=15)['Name'])
             
         if (print_info):
-            print("prediction for", coordinates.shape[0], "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", coordinates.shape[0], "molecules time: ", timer.elapsed_time(), "ms")
         
         if (forces):
             result = total_energies, forces_torch
@@ -302,6 +300,76 @@ class HadamardFeaturesModel(BaseKernel):
             
         return result
 
+    def get_features(self, torch_rep, charges, per_atom=False, rows=None, element_rows=None):
+        
+        '''
+        differentiable random features of the [nbatch, max_natoms, repsize] representation, summed per molecule into [nbatch, nfeatures],
+        or kept per atom as [nbatch * max_natoms, nfeatures] if per_atom is True
+        
+        rows, element_rows: ragged (molIDs, atomIDs) and per-element ragged rows of the batch (format_packed), used instead of searching
+        charges for every element when given
+        '''
+        
+        coeff_normalisation = np.sqrt(self.npcas) / self.sigma
+        
+        nbatch, max_natoms = charges.shape[0], charges.shape[1]
+        
+        nrows = nbatch * max_natoms if per_atom else nbatch
+        
+        Ztest = torch.zeros(nrows, self.nfeatures(), device=self.device, dtype=torch.float32)
+
+        for e in self.elements:
+            
+            if (element_rows is None):
+                molIDs, atomIDs = torch.where(charges.int() == e)
+            elif (e in element_rows):
+                molIDs, atomIDs = rows[0][element_rows[e]], rows[1][element_rows[e]]
+            else:
+                continue
+             
+            batch_indexes = (molIDs * max_natoms + atomIDs if per_atom else molIDs).type(torch.int)
+             
+            sub = torch_rep[molIDs, atomIDs]
+            
+            if (sub.shape[0] == 0): continue
+                
+            sub = project_representation(sub, self.reductors[e])
+        
+            coeffs = SORFTransformCuda.apply(sub, self.Dmat[e], coeff_normalisation, self.ntransforms)
+              
+            coeffs = coeffs.view(coeffs.shape[0], coeffs.shape[1] * coeffs.shape[2])
+             
+            Ztest += CosFeatures.apply(coeffs, self.bk[e], nrows, batch_indexes)
+            
+        return Ztest
+    
+    def atomic_energies(self, coordinates, charges, atomIDs, molIDs, natom_counts, cells=None, inv_cells=None):
+        
+        '''[nbatch, max_natoms] energy contribution of every atom, the molecular energies of predict_opt are their sums'''
+        
+        if (cells is None):
+            cells = torch.empty(0, 3, 3, device=coordinates.device)
+            inv_cells = torch.empty(0, 3, 3, device=coordinates.device)
+        
+        torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells)
+        
+        Ztest = self.get_features(torch_rep, charges, per_atom=True)
+        
+        return torch.matmul(Ztest, self.alpha.float()).view(charges.shape[0], charges.shape[1])
+    
+    def predict_domains(self, X, Z, cell=None, domain_length=20.0, nworkers=0, forces=True, print_info=True):
+        
+        '''
+        energy (and forces) of a single structure too large to be evaluated as one padded block, by spatial domain decomposition.
+        See qml_lightning.models.domain_decomposition.
+        '''
+        
+        if (self.is_trained is False):
+            print ("Error: must train the model first by calling train()!")
+            exit()
+            
+        return predict_domains(self, X, Z, cell=cell, domain_length=domain_length, nworkers=nworkers, forces=forces, print_info=print_info)
+    
     def save_model(self, file_name="model"):
   
         data = {'elements': self.elements,
@@ -309,6 +377,8 @@ class HadamardFeaturesModel(BaseKernel):
                 'nfeatures': self.nfeatures,
                 'nbatch_train': self.nbatch_train,
                 'nbatch_test': self.nbatch_test,
+                'atom_budget': self.atom_budget,
+                'atom_budget_pairs': self.atom_budget_pairs,
                 'npcas': self.npcas,
                 'nstacks': self.nstacks,
                 'is_trained': self.is_trained,
@@ -333,7 +403,7 @@ class HadamardFeaturesModel(BaseKernel):
         data = np.load(file_name  if ".npy" in file_name else file_name + ".npy", allow_pickle=True)[()]
         
         self.elements = data['elements']
-        self.species = torch.from_numpy(self.elements).float().cuda()
+        self.species = torch.from_numpy(self.elements).float().to(self.device)
         self.sigma = data['sigma']
         self.llambda = data['llambda']
         
@@ -341,12 +411,13 @@ class HadamardFeaturesModel(BaseKernel):
         self.nfeatures = data['nfeatures']
         self.nbatch_train = data['nbatch_train']
         self.nbatch_test = data['nbatch_test']
+        self.set_atom_budget(data.get('atom_budget', None), data.get('atom_budget_pairs', False))
         
         self.npcas = data['npcas']
         self.nstacks = data['nstacks']
         
         self.is_trained = data['is_trained']
-        self.alpha = torch.from_numpy(data['alpha']).double().cuda()
+        self.alpha = torch.from_numpy(data['alpha']).double().to(self.device)
         
         self._subtract_self_energies = data['_subtract_self_energies']
 
@@ -358,9 +429,9 @@ class HadamardFeaturesModel(BaseKernel):
         self.reductors = {}
         
         for e in self.elements:
-            self.Dmat[e] = torch.from_numpy(data[f'dmat_{e}']).cuda()
-            self.bk[e] = torch.from_numpy(data[f'bk_{e}']).cuda()
-            self.reductors[e] = torch.from_numpy(data[f'reductors_{e}']).cuda()
+            self.Dmat[e] = torch.from_numpy(data[f'dmat_{e}']).to(self.device)
+            self.bk[e] = torch.from_numpy(data[f'bk_{e}']).to(self.device)
+            self.reductors[e] = torch.from_numpy(data[f'reductors_{e}']).to(self.device)
             
 #
 # class PartitionedSORFModel(BaseKernel):
@@ -3,20 +3,29 @@ Created on 22 Jun 2021
 
 @author: Nicholas J. Browning
 '''
+import hashlib
+
 import torch
 
 import numpy as np
 from qml_lightning.representations.dimensionality_reduction import project_representation, project_derivative
 from tqdm import tqdm
-from qml_lightning.cuda.utils_gpu import outer_product, matmul_and_reduce
+from qml_lightning.backend import get_kernel, resolve_device, synchronize, empty_cache, Timer
+from qml_lightning.utils.packed import PackedMolecules
+from qml_lightning.utils.dataset import Dataset, as_dataset
+from qml_lightning.utils.batching import schedule_batches
+from qml_lightning.utils.prefetch import Prefetcher
+from qml_lightning.representations.cache import RepresentationCache
 
 
 class BaseKernel(torch.nn.Module):
  
-    def __init__(self, rep, elements, sigma, llambda):
+    def __init__(self, rep, elements, sigma, llambda, device=None):
         
         super(BaseKernel, self).__init__()
         
+        self.device = resolve_device(device)
+        
         self.self_energy = None
         
         self.elements = elements
@@ -33,8 +42,20 @@ class BaseKernel(torch.nn.Module):
         
         self.sigma = sigma
         self.llambda = llambda
+        
+        self.atom_budget = None
+        self.atom_budget_pairs = False
+        
+        self.prefetch_depth = 0
+        
+        self.rep_cache = None
+        self.cache_projected = False
+        
+        self._frame_indexes = None
+        
+        self.element_sorted = False
     
-    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None):
+    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None, atom_offsets=None):
         raise NotImplementedError("Abstract method only.")
     
     def train_svd(self, X, Q, E=None, F=None, cells=None, inv_cells=None, print_info=True, cpu_solve=False, ntiles=1, use_specialized_matmul=False):
@@ -47,10 +68,9 @@ class BaseKernel(torch.nn.Module):
             print("ERROR: must have either E, F or both as input to train().")
             exit()
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        timer = Timer(self.device)
    
-        start.record()
+        timer.start()
         
         data = self.format_data(X, Q, E=E, F=F, cells=cells, inv_cells=inv_cells)
         
@@ -119,10 +139,9 @@ class BaseKernel(torch.nn.Module):
         
         print (Ztrain)
         
-        end.record()
-        torch.cuda.synchronize()
+        timer.stop()
 
-        print("Ztrain time: ", start.elapsed_time(end), "ms", Ztrain.shape)
+        print("Ztrain time: ", timer.elapsed_time(), "ms", Ztrain.shape)
     
         U, S, V = torch.svd(Ztrain)
         
@@ -155,10 +174,12 @@ class BaseKernel(torch.nn.Module):
         self.alpha = alpha
         self.is_trained = True
         
-    def build_Z_components(self, X, Q, E=None, F=None, cells=None, inv_cells=None, print_info=True, cpu_solve=False, ntiles=1, use_specialized_matmul=False):
+    def build_Z_components(self, X, Q=None, E=None, F=None, cells=None, inv_cells=None, print_info=True, cpu_solve=False, ntiles=1,
+                           use_specialized_matmul=False):
         
         '''
-        X: list of coordinates : numpy arrays of shape [natom_i, 3]
+        X: list of coordinates : numpy arrays of shape [natom_i, 3], or a PackedMolecules holding the whole dataset (Q, E, F and cells
+           are then taken from it)
         Z: list of charges: numpy arrays of shape [natom_i]
         
         cpu_solve: set to True to store Z^TZ on the CPU, and solve on the CPU
@@ -173,21 +194,26 @@ class BaseKernel(torch.nn.Module):
         if (self.reductors is None):
             print("ERROR: Must call model.get_reductors() first to initialize the projection matrices.")
             exit()
-            
+        
+        molecules = as_dataset(X, Q, E, F, cells, inv_cells)
+        
+        E, F = molecules.energies, molecules.forces
+        
         if (E is None and F is None):
             print("ERROR: must have either E, F or both as input to train().")
             exit()
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        timer = Timer(self.device)
 
         ZTZ = torch.zeros(self.nfeatures(), self.nfeatures(), device=torch.device('cpu') if cpu_solve else self.device, dtype=torch.float64)
             
         ZtrainY = torch.zeros(self.nfeatures(), 1, device=self.device, dtype=torch.float64)
         
-        start.record()
+        timer.start()
         
         nsub_features = int(np.ceil(self.nfeatures() / ntiles))
+        
+        schedule = self.schedule_batches(molecules, self.nbatch_train)
 
         for tile in range(0, ntiles):
             
@@ -202,89 +228,18 @@ class BaseKernel(torch.nn.Module):
                 
                 ZTZ_tile = torch.zeros(tile_size, self.nfeatures(), device=self.device, dtype=torch.float64)
              
-            for i in tqdm(range(0, len(X), self.nbatch_train)) if print_info else (range(0, len(X), self.nbatch_train)):
-                
-                coordinates = X[i:i + self.nbatch_train]
-                charges = Q[i:i + self.nbatch_train]
-                
-                energies = E[i:i + self.nbatch_train] if E is not None else None
-                forces = F[i:i + self.nbatch_train] if F is not None else None
-                zcells = cells[i:i + self.nbatch_train]  if cells is not None else None
-                zinv_cells = inv_cells[i:i + self.nbatch_train]  if cells is not None else None
-                
-                zbatch = len(coordinates)
-                
-                data = self.format_data(coordinates, charges, E=energies, F=forces, cells=zcells, inv_cells=zinv_cells)
-                
-                coordinates = data['coordinates']
-                charges = data['charges']
-                atomIDs = data['atomIDs']
-                molIDs = data['molIDs']
-                natom_counts = data['natom_counts']
-                zcells = data['cells']
-                zinv_cells = data['inv_cells']
-                
-                energies = data['energies']
-                forces = data['forces']
-                
-                if (E is not None and F is None):
-                    targets = energies[:, None] 
-                elif (E is None and F is not None):
-                    # zero out energy targets so it has the correct dimensions for matmul
-                    targets = torch.cat((torch.zeros((zbatch, 1), device=self.device), forces.flatten()[:, None]), dim=0)
-                else:
-                    targets = torch.cat((energies[:, None], forces.flatten()[:, None]), dim=0)
-                
-                max_natoms = natom_counts.max().item()
-          
-                if (F is None):
-                    gto = self.rep.get_representation(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, zinv_cells)
-                else:
-                    gto, gto_derivative = self.rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs,
-                                                                                     natom_counts, zcells, zinv_cells)
-                
-                Ztrain = torch.zeros(zbatch, self.nfeatures(), device=self.device, dtype=torch.float64)
-                
-                Gtrain_derivative = None
-                
-                if (F is not None):
-                    Gtrain_derivative = torch.zeros(zbatch, max_natoms, 3, self.nfeatures(), device=self.device, dtype=torch.float64)
-                    
-                for e in self.elements:
-                
-                    indexes = charges.int() == e
-                    
-                    batch_indexes = torch.where(indexes)[0].type(torch.int)
-                    
-                    sub = gto[indexes]
-                    
-                    if (sub.shape[0] == 0):
-                        continue
-                    
-                    sub = project_representation(sub, self.reductors[e])
-         
-                    sub_grad = None
-                    
-                    if (F is not None):
-                        sub_grad = gto_derivative[indexes]
-                        sub_grad = project_derivative(sub_grad, self.reductors[e])
-         
-                    self.calculate_features(sub, e, batch_indexes, Ztrain, sub_grad, Gtrain_derivative)
-                
-                if (E is None):
-                    Ztrain.fill_(0)  # hack to set all energy features to 0, such that they do not contribute to Z.T Z
+            batches = self.prefetch_batches(molecules, schedule)
+            
+            for b, data in tqdm(batches, total=len(schedule)) if print_info else batches:
                 
-                if (F is not None):
-                    Gtrain_derivative = Gtrain_derivative.reshape(zbatch * max_natoms * 3, self.nfeatures())
-                    
-                    Ztrain = torch.cat((Ztrain, Gtrain_derivative), dim=0)
+                Ztrain, targets = self.batch_Z_components(data)
                 
                 if (ntiles > 1):
                     
                     sub = Ztrain[:, start_tile:end_tile]
                     
                     if (use_specialized_matmul):
-                        matmul_and_reduce(sub.float().T, Ztrain.float(), ZTZ_tile)
+                        get_kernel('matmul_and_reduce', self.device)(sub.float().T, Ztrain.float(), ZTZ_tile)
                     else:
                         ZTZ_tile += torch.matmul(sub.T, Ztrain)
                     
@@ -295,66 +250,368 @@ class BaseKernel(torch.nn.Module):
                         ZTZ += torch.matmul(Ztrain.T, Ztrain).cpu()
                     else:
                         if (use_specialized_matmul):
-                            matmul_and_reduce(Ztrain.float().T, Ztrain.float(), ZTZ)
+                            get_kernel('matmul_and_reduce', self.device)(Ztrain.float().T, Ztrain.float(), ZTZ)
                         else:
                             ZTZ += torch.matmul(Ztrain.T, Ztrain)
                         
                     ZtrainY += torch.matmul(Ztrain.T, targets)
     
                 del Ztrain
-                del gto
-                del sub
+                del targets
                 
-                if (F is not None):
-                    del Gtrain_derivative
-                    del gto_derivative
-                    del sub_grad
-                    
-                torch.cuda.empty_cache()
+                empty_cache(self.device)
             
             if (ntiles > 1):
                 if (cpu_solve):
                     ZTZ[start_tile:end_tile,:] += ZTZ_tile.cpu()
                 else:
                     ZTZ[start_tile:end_tile,:] += ZTZ_tile
+            
+            if (print_info):
+                print("batch pipeline:", batches.report())
                 
-        end.record()
-        torch.cuda.synchronize()
+        timer.stop()
         
         if (print_info):
-            print("ZTZ time: ", start.elapsed_time(end), "ms")
+            print("ZTZ time: ", timer.elapsed_time(), "ms")
+            
+            if (self.rep_cache is not None):
+                print(self.rep_cache.report())
             
         return ZTZ, ZtrainY
      
-    def train(self, X, Q, E=None, F=None, cells=None, inv_cells=None, print_info=True, cpu_solve=False, ntiles=1, use_specialized_matmul=False):
+    def build_Z_components_streaming(self, chunks, print_info=True, cpu_solve=False, use_specialized_matmul=False):
+        
+        '''
+        single pass version of build_Z_components for datasets that are not held in memory.
+        
+        chunks: iterable of PackedMolecules consumed once, e.g qml_lightning.utils.ani1x_dataloader.iter_packed_buckets, which yields one
+                ANI-1x group at a time. Chunks are split into batches as in build_Z_components, so nbatch_train and the atom budget apply.
+                Every chunk must carry the same properties (energies, forces or both).
+        
+        If the model subtracts self energies (set_subtract_self_energies), they are fitted in the same pass: the raw energies are used
+        as targets while the element counts N of every molecule are accumulated into N^T N, N^T E and Z^T N. The self energies
+        beta then follow from N^T N beta = N^T E, and Z^T Y is corrected by -Z^T N beta, which equals Z^T (E - N beta) since only
+        energy rows of Z carry energies. calculate_self_energy need not be called first.
+        
+        get_reductors must be called first, e.g on a subsample of the dataset.
+        
+        returns: Z^TZ, ZY
+        '''
+        
+        if (self.reductors is None):
+            print("ERROR: Must call model.get_reductors() first to initialize the projection matrices.")
+            exit()
+        
+        timer = Timer(self.device)
+        
+        ZTZ = torch.zeros(self.nfeatures(), self.nfeatures(), device=torch.device('cpu') if cpu_solve else self.device, dtype=torch.float64)
+            
+        ZtrainY = torch.zeros(self.nfeatures(), 1, device=self.device, dtype=torch.float64)
+        
+        fit_self_energies = self.subtract_self_energies()
+        
+        nelements = len(self.elements)
+        
+        NTN = torch.zeros(nelements, nelements, device=self.device, dtype=torch.float64)
+        NTE = torch.zeros(nelements, 1, device=self.device, dtype=torch.float64)
+        ZTN = torch.zeros(self.nfeatures(), nelements, device=self.device, dtype=torch.float64)
+        
+        species = torch.from_numpy(np.asarray(self.elements)).long().to(self.device)
+        
+        # column of each nuclear charge in N
+        element_columns = {int(e): i for i, e in enumerate(self.elements)}
+        
+        nmol = 0
+        
+        timer.start()
+        
+        def stream_batches():
+            for chunk in chunks:
+                # indexed once per chunk, then sliced per batch
+                chunk = as_dataset(chunk)
+                schedule = self.schedule_batches(chunk, self.nbatch_train)
+                for b in range(len(schedule)):
+                    yield schedule.batch(chunk, b)
+        
+        # the chunks are read in the background thread too when prefetching
+        batches = self.prefetch(stream_batches(), lambda batch: self.format_packed(batch, subtract_self_energies=False,
+                                                                                    non_blocking=self.prefetch_depth > 0))
+        
+        for data in tqdm(batches) if print_info else batches:
+            
+            zbatch = data['natom_counts'].shape[0]
+            
+            Ztrain, targets = self.batch_Z_components(data)
+            
+            if (cpu_solve):
+                ZTZ += torch.matmul(Ztrain.T, Ztrain).cpu()
+            else:
+                if (use_specialized_matmul):
+                    get_kernel('matmul_and_reduce', self.device)(Ztrain.float().T, Ztrain.float(), ZTZ)
+                else:
+                    ZTZ += torch.matmul(Ztrain.T, Ztrain)
+                
+            ZtrainY += torch.matmul(Ztrain.T, targets)
+            
+            if (fit_self_energies and data['energies'] is not None):
+                
+                # element counts per molecule [zbatch, nelements]
+                N = torch.zeros(zbatch, nelements, device=self.device, dtype=torch.float64)
+                
+                for e, element_rows in data['element_rows'].items():
+                    N[:, element_columns[e]] = torch.bincount(data['molIDs'][element_rows].long(), minlength=zbatch).double()
+                
+                NTN += torch.matmul(N.T, N)
+                NTE += torch.matmul(N.T, data['energies'][:, None])
+                ZTN += torch.matmul(Ztrain[:zbatch].T, N)
+            
+            nmol += zbatch
+            
+            del Ztrain
+            del targets
+            
+            empty_cache(self.device)
+        
+        if (fit_self_energies):
+            
+            self.solve_self_energy(NTN, NTE)
+            
+            ZtrainY -= torch.matmul(ZTN, self.self_energy.to(self.device)[species][:, None])
+            
+        timer.stop()
+        
+        if (print_info):
+            print("ZTZ time for", nmol, "streamed molecules: ", timer.elapsed_time(), "ms")
+            print("batch pipeline:", batches.report())
+            
+        return ZTZ, ZtrainY
+    
+    def batch_Z_components(self, data):
+        
+        '''
+        Z and the targets of one batch formatted by format_packed: the zbatch energy rows first, followed by the natoms_total * 3 force
+        rows of the ragged layout if the batch has forces. Energy rows are zero for batches without energies.
+        '''
+        
+        zbatch = data['natom_counts'].shape[0]
+        
+        atomIDs = data['atomIDs']
+        molIDs = data['molIDs']
+        atom_offsets = data['atom_offsets']
+        
+        energies = data['energies']
+        forces = data['forces']
+        
+        # ragged layout: the atoms of the batch are rows atom_offsets[i]:atom_offsets[i + 1], padded atoms never enter Z
+        natoms_total = molIDs.shape[0]
+        
+        rows = (molIDs.long(), atomIDs.long())
+        
+        if (energies is not None and forces is None):
+            targets = energies[:, None] 
+        elif (energies is None and forces is not None):
+            # zero out energy targets so it has the correct dimensions for matmul
+            targets = torch.cat((torch.zeros((zbatch, 1), device=self.device), forces[rows].flatten()[:, None]), dim=0)
+        else:
+            targets = torch.cat((energies[:, None], forces[rows].flatten()[:, None]), dim=0)
+        
+        Ztrain = torch.zeros(zbatch, self.nfeatures(), device=self.device, dtype=torch.float64)
+        
+        Gtrain_derivative = None
+        
+        if (forces is not None):
+            Gtrain_derivative = torch.zeros(natoms_total, 3, self.nfeatures(), device=self.device, dtype=torch.float64)
+            
+        for e, batch_indexes, sub, sub_grad in self.projected_representations(data, derivatives=forces is not None):
+            self.calculate_features(sub, e, batch_indexes, Ztrain, sub_grad, Gtrain_derivative, atom_offsets)
+        
+        if (energies is None):
+            Ztrain.fill_(0)  # hack to set all energy features to 0, such that they do not contribute to Z.T Z
+        
+        if (forces is not None):
+            Gtrain_derivative = Gtrain_derivative.reshape(natoms_total * 3, self.nfeatures())
+        
+            Ztrain = torch.cat((Ztrain, Gtrain_derivative), dim=0)
+        
+        return Ztrain, targets
+    
+    def representation(self, data, derivatives=False):
+        
+        '''
+        representation [natoms_total, repsize] of the atoms of a batch formatted by format_packed, in the ragged layout or grouped by
+        element with set_element_sorted(True), see element_slices, and if derivatives is True its derivative [natoms_total, max_natoms, 3,
+        repsize] with the same rows. Read from the representation cache if one is set and holds the batch, see set_representation_cache.
+        '''
+        
+        names = ('representation', 'derivative') if derivatives else ('representation',)
+        
+        atomIDs, molIDs = data['atomIDs'], data['molIDs']
+        
+        if (self.element_sorted):
+            
+            # the representation kernels write one row per (molID, atomID) entry in the order given, so the blocks of element_slices are
+            # produced in place rather than gathered per element afterwards
+            order = torch.cat([data['element_rows'][e] for e, _ in self.element_slices(data)])
+            
+            atomIDs, molIDs = atomIDs[order], molIDs[order]
+        
+        if (self.rep_cache is not None):
+            
+            key = self.rep_cache.key(data, 'element_sorted') if self.element_sorted else self.rep_cache.key(data)
+            
+            cached = self.rep_cache.load(key, names, self.device)
+            
+            if (cached is not None):
+                return cached if derivatives else cached[0]
+        
+        rows = (molIDs.long(), atomIDs.long())
+        
+        if (derivatives):
+            result = self.get_ragged_representation_and_derivative(data['coordinates'], data['charges'], atomIDs, molIDs,
+                                                                   data['natom_counts'], data['atom_offsets'], data['cells'], data['inv_cells'])
+        else:
+            result = (self.rep.get_representation(data['coordinates'], data['charges'], atomIDs, molIDs, data['natom_counts'],
+                                                  data['cells'], data['inv_cells'])[rows],)
+        
+        if (self.rep_cache is not None):
+            self.rep_cache.save(key, names, result)
+            
+        return result if derivatives else result[0]
+    
+    def element_slices(self, data):
+        
+        '''
+        list of (element, indexes) for the elements of the model present in a batch formatted by format_packed, indexes selecting the rows
+        of the element in the output of representation: a contiguous slice with set_element_sorted(True), so the representation and
+        its derivative are sliced without copies, otherwise the ascending ragged rows data['element_rows'][element]
+        '''
+        
+        element_rows = data['element_rows']
+        
+        elements = [e for e in self.elements if e in element_rows]
+        
+        if (not self.element_sorted):
+            return [(e, element_rows[e]) for e in elements]
+        
+        bounds = np.cumsum([0] + [element_rows[e].shape[0] for e in elements])
+        
+        return [(e, slice(int(bounds[i]), int(bounds[i + 1]))) for i, e in enumerate(elements)]
+    
+    def projected_representations(self, data, derivatives=False):
+        
+        '''
+        list of (element, batch_indexes, sub, sub_grad) for the elements present in a batch formatted by format_packed:
+        
+            batch_indexes: [natoms_e] molecule of every atom of the element
+            sub: [natoms_e, npcas] projected representations
+            sub_grad: [natoms_e, max_natoms, 3, npcas] projected derivatives if derivatives is True, otherwise None
+        
+        With set_representation_cache(..., projected=True) the projections are cached too, keyed by the projection matrices.
+        '''
+        
+        element_rows = data['element_rows']
+        
+        elements = [e for e in self.elements if e in element_rows]
+        
+        names = [f"{e}.{name}" for e in elements for name in (('sub', 'sub_grad') if derivatives else ('sub',))]
+        
+        if (self.rep_cache is not None and self.cache_projected):
+            
+            reductors = hashlib.sha1(b''.join(self.reductors[e].detach().cpu().numpy().tobytes() for e in self.elements if e in self.reductors))
+            
+            key = self.rep_cache.key(data, 'projected', reductors.hexdigest())
+            
+            cached = self.rep_cache.load(key, names, self.device)
+            
+            if (cached is not None):
+                
+                cached = iter(cached)
+                
+                return [(e, data['molIDs'][element_rows[e]], next(cached), next(cached) if derivatives else None) for e in elements]
+        
+        if (derivatives):
+            gto, gto_derivative = self.representation(data, derivatives=True)
+        else:
+            gto = self.representation(data)
+        
+        result = []
+        
+        for e, indexes in self.element_slices(data):
+            
+            sub = project_representation(gto[indexes], self.reductors[e])
+            
+            sub_grad = None
+            
+            if (derivatives):
+                sub_grad = project_derivative(gto_derivative[indexes], self.reductors[e])
+            
+            result.append((e, data['molIDs'][element_rows[e]], sub, sub_grad))
+        
+        if (self.rep_cache is not None and self.cache_projected):
+            self.rep_cache.save(key, names, [t for r in result for t in ((r[2], r[3]) if derivatives else (r[2],))])
+            
+        return result
+    
+    def get_ragged_representation_and_derivative(self, coordinates, charges, atomIDs, molIDs, natom_counts, atom_offsets, cells=None, inv_cells=None):
+        
+        '''
+        representation [natoms_total, repsize] and its derivative [natoms_total, max_natoms, 3, repsize] in the ragged layout of format_data,
+        rows ordered by (molIDs, atomIDs). Representations that cannot write the packed derivative directly are gathered from the padded one.
+        '''
+        
+        rows = (molIDs.long(), atomIDs.long())
+        
+        if (getattr(self.rep, 'ragged_derivative', False)):
+            gto, gto_derivative = self.rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells,
+                                                                             atom_offsets=atom_offsets)
+        else:
+            gto, gto_derivative = self.rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs, natom_counts, cells, inv_cells)
+            gto_derivative = gto_derivative[rows]
+            
+        return gto[rows], gto_derivative
+    
+    def train(self, X, Q=None, E=None, F=None, cells=None, inv_cells=None, print_info=True, cpu_solve=False, ntiles=1, use_specialized_matmul=False):
+        
+        '''X, Q, E, F, cells: lists of per-molecule arrays, or X a PackedMolecules (qml_lightning.utils.packed), see build_Z_components'''
         
         ZTZ, ZtrainY = self.build_Z_components(X, Q, E, F, cells, inv_cells, print_info, cpu_solve, ntiles, use_specialized_matmul=use_specialized_matmul)
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        self.solve_coefficients(ZTZ, ZtrainY, print_info, cpu_solve)
+        
+    def train_streaming(self, chunks, print_info=True, cpu_solve=False, use_specialized_matmul=False):
+        
+        '''trains from an iterable of PackedMolecules in a single pass, see build_Z_components_streaming'''
+        
+        ZTZ, ZtrainY = self.build_Z_components_streaming(chunks, print_info, cpu_solve, use_specialized_matmul=use_specialized_matmul)
+        
+        self.solve_coefficients(ZTZ, ZtrainY, print_info, cpu_solve)
+        
+    def solve_coefficients(self, ZTZ, ZtrainY, print_info=True, cpu_solve=False):
+        
+        timer = Timer(self.device)
         
         for i in range(self.nfeatures()):
             ZTZ[i, i] += self.llambda
         
-        start.record()
+        timer.start()
         
         if (cpu_solve):
-            self.alpha = torch.linalg.solve(ZTZ, ZtrainY.cpu())[:, 0].cuda()
+            self.alpha = torch.linalg.solve(ZTZ, ZtrainY.cpu())[:, 0].to(self.device)
         else:
             self.alpha = torch.linalg.solve(ZTZ, ZtrainY)[:, 0]
             
-        end.record()
-        torch.cuda.synchronize()
+        timer.stop()
         
         if (print_info):
-            print("coefficients time: ", start.elapsed_time(end), "ms")
+            print("coefficients time: ", timer.elapsed_time(), "ms")
         
         del ZtrainY
         del ZTZ
         
         self.is_trained = True
         
-        torch.cuda.empty_cache()
+        empty_cache(self.device)
         
     def hyperparam_opt_on_valset(self, Xtrain, Qtrain, celltrain, Xval, Qval, cellval, Etrain, Eval, Ftrain=None, Fval=None,
                                  sigmas=np.linspace(2.0, 16.0, 10), llambdas=np.logspace(-11, -4, 9), cpu_solve=False, ntiles=1):
@@ -398,7 +655,7 @@ class BaseKernel(torch.nn.Module):
                 curr_llambda = l
                     
                 if (cpu_solve):
-                    self.alpha = torch.linalg.solve(ZTZ, ZtrainY.cpu())[:, 0].cuda()
+                    self.alpha = torch.linalg.solve(ZTZ, ZtrainY.cpu())[:, 0].to(self.device)
                 else:
                     self.alpha = torch.linalg.solve(ZTZ, ZtrainY)[:, 0]
                 
@@ -541,90 +798,70 @@ class BaseKernel(torch.nn.Module):
     def forward(self, X, Q, max_natoms, cells=None, forces=False, print_info=False, use_backward=True):
         raise NotImplementedError("Abstract method only.")
         
-    def predict_cuda(self, X, Q, max_natoms, cells=None, inv_cells=None, forces=False, print_info=True):
+    def predict_cuda(self, X, Q=None, max_natoms=None, cells=None, inv_cells=None, forces=False, print_info=True):
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        '''X, Q, cells: lists of per-molecule arrays, or X a PackedMolecules. max_natoms defaults to the largest molecule'''
+        
+        timer = Timer(self.device)
         
         if (self.is_trained is False):
             print ("Error: must train the model first by calling train()!")
             exit()
         
-        predict_energies = torch.zeros(len(X), device=self.device, dtype=torch.float64)
-        predict_forces = torch.zeros(len(X), max_natoms, 3, device=self.device, dtype=torch.float64)
-        
-        start.record()
+        molecules = as_dataset(X, Q, cells=cells, inv_cells=inv_cells).geometries()
         
-        for i in tqdm(range(0, len(X), self.nbatch_test)) if print_info else range(0, len(X), self.nbatch_test):
+        if (max_natoms is None):
+            max_natoms = molecules.max_natoms
             
-            coordinates = X[i:i + self.nbatch_test]
-            charges = Q[i:i + self.nbatch_test]
+        predict_energies = torch.zeros(len(molecules), device=self.device, dtype=torch.float64)
+        predict_forces = torch.zeros(len(molecules), max_natoms, 3, device=self.device, dtype=torch.float64)
+        
+        schedule = self.schedule_batches(molecules, self.nbatch_test)
+        
+        timer.start()
+        
+        batches = self.prefetch_batches(molecules, schedule)
+        
+        for b, data in tqdm(batches, total=len(schedule)) if print_info else batches:
             
-            zbatch = len(coordinates)
+            # positions of the batch molecules in the input
+            batch_order = torch.from_numpy(schedule.indexes(b)).to(self.device)
             
-            if (cells is not None):
-                zcells = cells[i:i + self.nbatch_test]
-                zinv_cells = inv_cells[i:i + self.nbatch_test]
-            else: 
-                zcells = None
-                zinv_cells = None
-                
-            data = self.format_data(coordinates, charges, cells=zcells, inv_cells=zinv_cells)
+            zbatch = batch_order.shape[0]
             
-            coordinates = data['coordinates']
-            charges = data['charges']
             atomIDs = data['atomIDs']
             molIDs = data['molIDs']
-            natom_counts = data['natom_counts']
-            zcells = data['cells']
-            zinv_cells = data['inv_cells']
+            atom_offsets = data['atom_offsets']
             
-            batch_max_natoms = natom_counts.max().item()
+            # ragged layout, as in build_Z_components
+            natoms_total = molIDs.shape[0]
+            
+            rows = (molIDs.long(), atomIDs.long())
             
-            if (forces is True):
-                gto, gto_derivative = self.rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, zinv_cells)
-            else:
-                gto = self.rep.get_representation(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, zinv_cells)
-                
             Ztest = torch.zeros(zbatch, self.nfeatures(), device=self.device, dtype=torch.float64)
             
             Gtest_derivative = None
             
             if (forces is True):
-                Gtest_derivative = torch.zeros(zbatch, max_natoms, 3, self.nfeatures(), device=self.device, dtype=torch.float64)
-                
-            for e in self.elements:
-            
-                indexes = charges.int() == e
-                
-                batch_indexes = torch.where(indexes)[0].type(torch.int)
-                
-                sub = gto[indexes]
-                
-                if (sub.shape[0] == 0):
-                    continue
-                
-                sub = project_representation(sub, self.reductors[e])
-                
-                sub_grad = None
+                Gtest_derivative = torch.zeros(natoms_total, 3, self.nfeatures(), device=self.device, dtype=torch.float64)
                 
-                if (forces is True):
-                    sub_grad = gto_derivative[indexes]
-                    sub_grad = project_derivative(sub_grad, self.reductors[e])
-
-                self.calculate_features(sub, e, batch_indexes, Ztest, sub_grad, Gtest_derivative)
+            for e, batch_indexes, sub, sub_grad in self.projected_representations(data, derivatives=forces is True):
+                self.calculate_features(sub, e, batch_indexes, Ztest, sub_grad, Gtest_derivative, atom_offsets)
                 
-            predict_energies[i:i + self.nbatch_test] = torch.matmul(Ztest, self.alpha)
+            predict_energies[batch_order] = torch.matmul(Ztest, self.alpha)
             
             if (forces is True):
-                Gtest_derivative = Gtest_derivative.reshape(zbatch * max_natoms * 3, self.nfeatures())
-                predict_forces[i:i + self.nbatch_test] = torch.matmul(Gtest_derivative, self.alpha).reshape(zbatch, max_natoms, 3)
+                Gtest_derivative = Gtest_derivative.reshape(natoms_total * 3, self.nfeatures())
+                predict_forces[batch_order[rows[0]], rows[1]] = torch.matmul(Gtest_derivative, self.alpha).reshape(natoms_total, 3)
         
-        end.record()
-        torch.cuda.synchronize()
+        timer.stop()
         
         if (print_info):
-            print("prediction for", len(X), "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", len(molecules), "molecules time: ", timer.elapsed_time(), "ms")
+            print("batch pipeline:", batches.report())
+            
+            if (self.rep_cache is not None):
+                print(self.rep_cache.report())
         
         if (forces is True):
             return (predict_energies, predict_forces)
@@ -634,71 +871,53 @@ class BaseKernel(torch.nn.Module):
     def nfeatures(self):
         raise NotImplementedError("Abstract method only.")
     
-    def predict(self, X, Q, max_natoms, cells=None, inv_cells=None, forces=False, print_info=True, use_backward=True):
+    def predict(self, X, Q=None, max_natoms=None, cells=None, inv_cells=None, forces=False, print_info=True, use_backward=True):
         raise NotImplementedError("Abstract method only.")
             
-    def get_reductors(self, X, Q, cells=None, inv_cells=None, npcas=128, npca_choice=256, nsamples=4096, print_info=True):
+    def get_reductors(self, X, Q=None, cells=None, inv_cells=None, npcas=128, npca_choice=256, nsamples=4096, print_info=True):
         
         '''
+        X, Q, cells: lists of per-molecule arrays, or X a PackedMolecules (qml_lightning.utils.packed)
+        
         npcas: length of low-dimension projection
         npca_choice: for each batch, select at most this many atomic representations to be added to the SVD matrix
         nsamples: maximum total number of selected atomic representations
         '''
         
+        molecules = as_dataset(X, Q, cells=cells, inv_cells=inv_cells)
+        
         self.reductors = {}
         
         index_set = {}
  
         for e in self.elements:
             
-            idxs = []
-            
-            for i in range (len(Q)):
-                if (e in Q[i]):
-                    idxs.append(i)
-                    continue
-                
-            idxs = np.array(idxs)
-            
-            index_set[e] = idxs
+            index_set[e] = molecules.molecules_containing(e)
             
             subsample_indexes = np.random.choice(index_set[e], size=np.min([len(index_set[e]), 1024]))
             
-            subsample_coordinates = [X[i] for i in subsample_indexes]
-            subsample_charges = [Q[i] for i in subsample_indexes]
+            subsample = molecules.geometries().subset(subsample_indexes)
             
             inputs = []
             
             nselected = 0
             
-            for i in range(0, len(subsample_coordinates), self.nbatch_train):
+            schedule = self.schedule_batches(subsample, self.nbatch_train)
+            
+            # budgeted batches are sorted by size, visit them in random order so the early exit does not favour small molecules
+            for b, data in self.prefetch_batches(subsample, schedule, np.random.permutation(len(schedule))):
                 
                 # only collect nsample representations to compute the SVD
                 if (nselected > nsamples):
                     break
                 
-                coordinates = subsample_coordinates[i:i + self.nbatch_train]
-                charges = subsample_charges[i:i + self.nbatch_train]
-                
-                data = self.format_data(coordinates, charges, cells, inv_cells)
-                
-                coords = data['coordinates']
-                qs = data['charges']
-                atomIDs = data['atomIDs']
-                molIDs = data['molIDs']
-                natom_counts = data['natom_counts']
-                zcells = data['cells']
-                zinv_cells = data['inv_cells']
-                
-                indexes = qs == e
-                
-                gto = self.rep.get_representation(coords, qs, atomIDs, molIDs, natom_counts, zcells, zinv_cells)
+                indexes = dict(self.element_slices(data)).get(e)
                 
-                sub = gto[indexes]
-            
-                if (sub.shape[0] == 0):
+                if (indexes is None):
                     continue
                 
+                sub = self.representation(data)[indexes]
+                
                 perm = torch.randperm(sub.size(0))
                 idx = perm[:npca_choice]
         
@@ -723,7 +942,7 @@ class BaseKernel(torch.nn.Module):
             
             del vh, mat
             
-            torch.cuda.synchronize()
+            synchronize(self.device)
             
             if (print_info):
                 print (f"element {e}: {size_from} -> {size_to}  Cumulative Explained Feature Variance = {cev:6.2f} %")
@@ -734,6 +953,61 @@ class BaseKernel(torch.nn.Module):
             
             self.reductors[e] = reductor
     
+    def set_atom_budget(self, atom_budget, pairs=False):
+        
+        '''
+        atom_budget: maximum number of padded atoms per batch, or of padded atom pairs if pairs is True, None to batch nbatch_train /
+        nbatch_test molecules at a time. With a budget, molecules are batched in size buckets and outputs are returned in input order.
+        '''
+        
+        self.atom_budget = atom_budget
+        self.atom_budget_pairs = pairs
+        
+    def schedule_batches(self, molecules, nbatch):
+        return schedule_batches(molecules.natom_counts, nbatch, self.atom_budget, self.atom_budget_pairs)
+    
+    def set_representation_cache(self, path, projected=False):
+        
+        '''
+        path: directory of a persistent representation cache (qml_lightning.representations.cache) shared by every call and process using
+        it, None to disable caching
+        projected: also cache the projected representations (and derivatives) of each element, keyed by the projection matrices, so that
+        e.g scans over sigma and llambda skip the projection as well
+        '''
+        
+        self.rep_cache = RepresentationCache(path, self.rep) if path is not None else None
+        self.cache_projected = projected
+        
+    def set_element_sorted(self, element_sorted):
+        
+        '''
+        element_sorted: True to compute the representation and its derivative of every batch with the atoms grouped by element, so that
+        each element is a contiguous block of rows and the per-element projections read views instead of gathering (copying) the rows of
+        the element from the derivative. The force rows of Z stay in the ragged order, as calculate_features writes them per molecule and
+        atom, so no inverse permutation is needed.
+        '''
+        
+        self.element_sorted = element_sorted
+        
+    def set_prefetch(self, depth):
+        
+        '''
+        depth: number of batches formatted ahead by a background thread while the current batch is computed (qml_lightning.utils.prefetch),
+        0 formats every batch when it is needed. The stall time of each stage is printed with the timings when print_info is True.
+        '''
+        
+        self.prefetch_depth = depth
+        
+    def prefetch(self, items, prepare):
+        return Prefetcher(items, prepare, self.prefetch_depth, self.device)
+    
+    def prefetch_batches(self, molecules, schedule, order=None):
+        
+        '''iterates over (b, format_packed(batch b)) for the batches of schedule, in the given order of batch indexes or in schedule order'''
+        
+        return self.prefetch(range(len(schedule)) if order is None else order,
+                             lambda b: (b, self.format_packed(schedule.batch(molecules, b), non_blocking=self.prefetch_depth > 0)))
+    
     def set_subtract_self_energies(self, subtract):
         self._subtract_self_energies = subtract
     
@@ -746,33 +1020,30 @@ class BaseKernel(torch.nn.Module):
     def convert_hartree2kcal(self):
         return self._convert_from_hartree_to_kcal
     
-    def calculate_self_energy(self, Q, E):
+    def calculate_self_energy(self, Q, E=None):
         
         '''
-        computes the per-atom contribution from Q towards the property E
+        computes the per-atom contribution from Q towards the property E. Q can also be PackedMolecules, E then defaults to its energies
         '''
-        nmol = len(Q)
-        
-        natom_counts = torch.zeros(nmol, dtype=torch.int)
         
-        for i in range(nmol):
-            natom_counts[i] = Q[i].shape[0]
-            
-        max_atoms = natom_counts.max().item()
-        
-        paddedZ = torch.zeros(nmol, max_atoms, dtype=torch.int)
+        if (isinstance(Q, PackedMolecules)):
+            if (E is None):
+                E = Q.energies
+            molecules = as_dataset(Q)
+            nmol = len(molecules)
+            molIDs = molecules.molIDs
+            element_atoms = molecules.element_atoms
+        else:
+            natom_counts = np.fromiter((q.shape[0] for q in Q), dtype=np.int64, count=len(Q))
+            charges = np.concatenate(Q).astype(np.int64)
+            nmol = natom_counts.shape[0]
+            molIDs = np.repeat(np.arange(nmol), natom_counts)
+            element_atoms = lambda e: charges == e
         
         X = torch.zeros(nmol, len(self.elements), dtype=torch.float64)
         
-        for i in range(nmol):
-            paddedZ[i,:natom_counts[i]] = torch.from_numpy(Q[i])
-
         for i, e in enumerate(self.elements):
-            indexes = paddedZ == e
-            
-            numbers = torch.sum(indexes, dim=1)
-            
-            X[:, i] = numbers
+            X[:, i] = torch.from_numpy(np.bincount(molIDs[element_atoms(e)], minlength=nmol)).double()
         
         XTX = torch.matmul(X.T, X)
             
@@ -781,9 +1052,16 @@ class BaseKernel(torch.nn.Module):
         if (self.convert_hartree2kcal()):
             energies *= self.hartree2kcalmol
         
-        beta = torch.linalg.lstsq(XTX, torch.matmul(X.T, energies[:, None])).solution[:, 0]
+        self.solve_self_energy(XTX, torch.matmul(X.T, energies[:, None]))
         
-        del XTX
+    def solve_self_energy(self, XTX, XTE):
+        
+        '''
+        per-element self energies from the normal equations of E ~ X beta, XTX: [nelements, nelements], XTE: [nelements, 1], with X the
+        element counts per molecule in the order of self.elements
+        '''
+        
+        beta = torch.linalg.lstsq(XTX.cpu().double(), XTE.cpu().double()).solution[:, 0]
         
         species = torch.from_numpy(self.elements).long()
         
@@ -793,126 +1071,197 @@ class BaseKernel(torch.nn.Module):
         
         print ("Self Energies: ", self.self_energy)
         
+    def frame_indexes(self, topology, nframes):
+        
+        '''
+        charges, natom_counts, atomIDs, molIDs, atom_offsets and element_rows of nframes frames of the molecule with charges topology, as
+        formatted by format_packed, on the device. They are built once for the largest number of frames requested and returned as views
+        of their first rows, which hold the same values for fewer frames.
+        '''
+        
+        key = topology.tobytes()
+        
+        if (self._frame_indexes is None or self._frame_indexes[0] != key or self._frame_indexes[1] < nframes):
+            
+            natoms = topology.shape[0]
+            
+            frames = torch.arange(nframes, dtype=torch.int)
+            
+            indexes = {'charges': torch.from_numpy(topology.astype(np.float32))[None,:].repeat(nframes, 1),
+                       'natom_counts': torch.full((nframes,), natoms, dtype=torch.int),
+                       'atomIDs': torch.arange(natoms, dtype=torch.int).repeat(nframes),
+                       'molIDs': frames.repeat_interleave(natoms),
+                       'atom_offsets': torch.arange(nframes + 1, dtype=torch.int) * natoms}
+            
+            indexes = {name: tensor.to(self.device) for name, tensor in indexes.items()}
+            
+            indexes['element_rows'] = {}
+            
+            for e in self.elements:
+                
+                positions = torch.from_numpy(np.nonzero(topology == e)[0])
+                
+                if (positions.shape[0] > 0):
+                    indexes['element_rows'][int(e)] = (frames.long()[:, None] * natoms + positions[None,:]).flatten().to(self.device)
+            
+            self._frame_indexes = (key, nframes, indexes)
+        
+        key, nmax, indexes = self._frame_indexes
+        
+        natoms = topology.shape[0]
+        
+        return {'charges': indexes['charges'][:nframes],
+                'natom_counts': indexes['natom_counts'][:nframes],
+                'atomIDs': indexes['atomIDs'][:nframes * natoms],
+                'molIDs': indexes['molIDs'][:nframes * natoms],
+                'atom_offsets': indexes['atom_offsets'][:nframes + 1],
+                'element_rows': {e: rows[:rows.shape[0] // nmax * nframes] for e, rows in indexes['element_rows'].items()}}
+    
     def format_data(self, X, Q, E=None, F=None, cells=None, inv_cells=None):
     
         '''
         assumes input lists of type list(ndarrays), e.g for X: [(5, 3), (3,3), (21, 3), ...] 
         and converts them to fixed-size Torch Tensor of shape [zbatch, max_atoms, ...], e.g  [zbatch, 21, ...]
         
-        also outputs natom counts, atomIDs and molIDs necessary for the CUDA implementation
+        also outputs natom counts, atomIDs and molIDs necessary for the CUDA/CPU implementations. All tensors are placed on self.device
+        
+        the molecules are concatenated once into a Dataset batch, see format_packed.
+        '''
+        
+        return self.format_packed(Dataset.from_lists(X, Q, E=E, F=F, cells=cells, inv_cells=inv_cells))
+    
+    def format_packed(self, molecules, subtract_self_energies=True, non_blocking=False):
+        
+        '''
+        converts a PackedMolecules batch (qml_lightning.utils.packed) to the padded tensors of format_data. The flat arrays are wrapped
+        with torch.from_numpy and scattered into preallocated padded buffers using (molIDs, atomIDs), without a per-molecule loop.
+        
+        atom_offsets [zbatch + 1] is the exclusive prefix sum of the atom counts, so the atoms of molecule i are the rows
+        atom_offsets[i]:atom_offsets[i + 1] of the ragged (padding-free) layout, in the order of (molIDs, atomIDs).
         
+        element_rows maps every element of the model present in the batch to the ascending ragged rows of its atoms. The atom counts,
+        (molIDs, atomIDs) and element rows are taken from the indexes of a Dataset (qml_lightning.utils.dataset) batch, other
+        PackedMolecules are indexed here. Batches of a single topology Dataset are reshaped rather than scattered, and their index
+        tensors are shared views of frame_indexes.
+        
+        subtract_self_energies: False to return the raw energies even if the model subtracts self energies, see build_Z_components_streaming
+        non_blocking: copy to a CUDA device from pinned host memory without synchronizing, used by the prefetch pipeline (set_prefetch)
         '''
         
-        if (self.subtract_self_energies() and self.self_energy is None):
+        if (non_blocking and self.device.type == 'cuda'):
+            to_device = lambda t: t.pin_memory().to(self.device, non_blocking=True)
+        else:
+            to_device = lambda t: t.to(self.device)
+        
+        subtract_self_energies = subtract_self_energies and self.subtract_self_energies()
+        
+        if (subtract_self_energies and self.self_energy is None):
             print("ERROR: must call model.calculate_self_energy first - this computes atomic contributes to the potential energy.")
             exit()
         
+        if (not isinstance(molecules, Dataset)):
+            molecules = Dataset.from_packed(molecules, self.elements)
+        
         data_dict = {}
   
-        zbatch = len(X)
+        zbatch = len(molecules)
 
-        natom_counts = torch.zeros(zbatch, dtype=torch.int32)
+        counts = molecules.natom_counts
+        
+        max_atoms = int(counts.max())
+        
+        topology = molecules.topology
+        
+        flat_coordinates = torch.from_numpy(np.asarray(molecules.coordinates).astype(np.float32, copy=False))
+        
+        if (topology is not None):
             
-        for j in range(zbatch):
+            # frames of one molecule: the padded layout is a reshape and the indexes only depend on the number of frames
+            data_dict['coordinates'] = to_device(flat_coordinates.reshape(zbatch, max_atoms, 3))
             
-            coordinates = X[j]
-            charges = Q[j]
-    
-            natom_counts[j] = coordinates.shape[0]
+            data_dict.update(self.frame_indexes(topology, zbatch))
             
-        max_atoms = natom_counts.max().item()
-         
-        all_coordinates = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float32)
-        all_charges = torch.zeros(zbatch, max_atoms, dtype=torch.float32)
-        
-        if (E is not None):
-            all_energies = torch.DoubleTensor(E)
+        else:
             
-        if (F is not None):
-            all_forces = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float64)
+            atom_offsets = molecules.offsets.astype(np.int64)
             
-        if (cells is not None):
-            all_cells = torch.zeros(zbatch, 3, 3, dtype=torch.float32)
-            all_inv_cells = torch.zeros(zbatch, 3, 3, dtype=torch.float32)  
-        
-        molIDs = torch.Tensor([])
-        atomIDs = torch.Tensor([])
+            molIDs = torch.from_numpy(molecules.molIDs)
+            atomIDs = torch.from_numpy(molecules.atomIDs)
             
-        for j in range(zbatch):
+            flat_charges = torch.from_numpy(np.asarray(molecules.charges).astype(np.float32, copy=False))
             
-            charges = torch.from_numpy(Q[j]).float()
-            coordinates = torch.from_numpy(X[j]).float()
+            all_coordinates = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float32)
+            all_coordinates[molIDs, atomIDs] = flat_coordinates
             
-            natoms = natom_counts[j]
+            all_charges = torch.zeros(zbatch, max_atoms, dtype=torch.float32)
+            all_charges[molIDs, atomIDs] = flat_charges
             
-            all_charges[j,:natoms] = charges
-            all_coordinates[j,:natoms,:] = coordinates
+            natom_counts = torch.from_numpy(counts.astype(np.int32))
             
-            molID = torch.empty(natoms, dtype=torch.int32).fill_(j)
-            atomID = torch.arange(0, natoms)
+            data_dict['coordinates'] = to_device(all_coordinates)
+            data_dict['charges'] = to_device(all_charges)
+            data_dict['natom_counts'] = to_device(natom_counts)
+            data_dict['atomIDs'] = to_device(atomIDs.int())
+            data_dict['molIDs'] = to_device(molIDs.int())
+            data_dict['atom_offsets'] = to_device(torch.from_numpy(atom_offsets.astype(np.int32)))
             
-            molIDs = torch.cat((molIDs, molID), dim=0)
-            atomIDs = torch.cat((atomIDs, atomID), dim=0)
+            data_dict['element_rows'] = {}
             
-            if (E is not None):
-             
-                energy = all_energies[j]
-                
-                if (self.convert_hartree2kcal()):
-                    energy *= self.hartree2kcalmol
-                
-                if (self.subtract_self_energies()):
-                    
-                    self_interaction = self.self_energy[charges.long()].sum(axis=0)
-                        
-                    energy = energy - self_interaction
-                
-                all_energies[j] = energy
+            for e in self.elements:
                 
-            if (F is not None):
-                forces = torch.from_numpy(F[j]).double()
+                element_rows = molecules.element_atoms(e)
                 
-                if (self.convert_hartree2kcal()):
-                    forces *= self.hartree2kcalmol
-                    
-                all_forces[j,:natoms,:] = forces
-                
-            if (cells is not None):
-                print (cells)
-                cell = torch.from_numpy(cells[j]).float()
-                inv_cell = torch.from_numpy(inv_cells[j]).float()
-                all_cells[j] = cell
-                all_inv_cells[j] = inv_cell
-  
-        all_coordinates = all_coordinates.cuda()
-        all_charges = all_charges.cuda()
-        natom_counts = natom_counts.cuda()
-        atomIDs = atomIDs.int().cuda()
-        molIDs = molIDs.int().cuda()
-        
-        data_dict['coordinates'] = all_coordinates
-        data_dict['charges'] = all_charges
-        data_dict['natom_counts'] = natom_counts
-        data_dict['atomIDs'] = atomIDs
-        data_dict['molIDs'] = molIDs
+                if (element_rows.shape[0] > 0):
+                    data_dict['element_rows'][int(e)] = to_device(torch.from_numpy(element_rows))
         
         data_dict['energies'] = None
         data_dict['forces'] = None
-        data_dict['cells'] = torch.empty((0, 3, 3), device='cuda')
-        data_dict['inv_cells'] = torch.empty((0, 3, 3), device='cuda')
+        data_dict['cells'] = torch.empty((0, 3, 3), device=self.device)
+        data_dict['inv_cells'] = torch.empty((0, 3, 3), device=self.device)
              
-        if (E is not None):
-            all_energies = all_energies.cuda()
-            data_dict['energies'] = all_energies
+        if (molecules.energies is not None):
             
-        if (F is not None):
-            all_forces = all_forces.cuda()
-            data_dict['forces'] = all_forces
-            
-        if (cells is not None):
-            all_cells = all_cells.cuda()
-            all_inv_cells = all_inv_cells.cuda()
-            data_dict['cells'] = all_cells
-            data_dict['inv_cells'] = all_inv_cells
+            # copied, the packed arrays may be views of the caller's dataset
+            all_energies = torch.tensor(np.asarray(molecules.energies).reshape(zbatch), dtype=torch.float64)
+            
+            if (self.convert_hartree2kcal()):
+                all_energies *= self.hartree2kcalmol
+            
+            if (subtract_self_energies):
+                
+                if (topology is not None):
+                    all_energies -= self.self_energy.cpu().double()[torch.from_numpy(topology)].sum()
+                else:
+                    atomic_energies = self.self_energy.cpu().double()[flat_charges.long()]
+                    
+                    all_energies.index_add_(0, molIDs, -atomic_energies)
+            
+            data_dict['energies'] = to_device(all_energies)
+            
+        if (molecules.forces is not None):
+            
+            flat_forces = torch.from_numpy(np.asarray(molecules.forces).astype(np.float64, copy=False))
+            
+            if (self.convert_hartree2kcal()):
+                flat_forces = flat_forces * self.hartree2kcalmol
+                
+            if (topology is not None):
+                all_forces = flat_forces.reshape(zbatch, max_atoms, 3)
+            else:
+                all_forces = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float64)
+                all_forces[molIDs, atomIDs] = flat_forces
+            
+            data_dict['forces'] = to_device(all_forces)
+            
+        if (molecules.cells is not None):
+            
+            cells = np.asarray(molecules.cells, dtype=np.float64).reshape(zbatch, 3, 3)
+            inv_cells = molecules.inv_cells
+            
+            if (inv_cells is None):
+                inv_cells = np.linalg.inv(cells)
+                
+            data_dict['cells'] = to_device(torch.from_numpy(cells.astype(np.float32)))
+            data_dict['inv_cells'] = to_device(torch.from_numpy(np.asarray(inv_cells, dtype=np.float32).reshape(zbatch, 3, 3)))
             
         return data_dict
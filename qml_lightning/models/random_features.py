@@ -7,9 +7,10 @@ import torch
 import numpy as np
 from tqdm import tqdm
 
-from qml_lightning.cuda.rff_gpu import get_rff, get_rff_derivatives
+from qml_lightning.backend import get_kernel, Timer
 
 from qml_lightning.models.kernel import BaseKernel
+from qml_lightning.utils.dataset import as_dataset
 
 from qml_lightning.representations.dimensionality_reduction import project_representation, project_derivative
 
@@ -17,12 +18,9 @@ from qml_lightning.representations.dimensionality_reduction import project_repre
 class RandomFourrierFeaturesModel(BaseKernel):
     
     def __init__(self, rep=None, elements=np.array([1, 6, 7, 8]), sigma=2.0, llambda=1e-10,
-                 nstacks=8192, npcas=128, nbatch_train=64, nbatch_test=64):
+                 nstacks=8192, npcas=128, nbatch_train=64, nbatch_test=64, device=None):
         
-        super(RandomFourrierFeaturesModel, self).__init__(rep, elements, sigma, llambda)
-        
-        cuda = torch.cuda.is_available()
-        self.device = torch.device('cuda' if cuda else 'cpu')
+        super(RandomFourrierFeaturesModel, self).__init__(rep, elements, sigma, llambda, device)
         
         self.npcas = npcas
         self.nbatch_train = nbatch_train
@@ -30,7 +28,7 @@ class RandomFourrierFeaturesModel(BaseKernel):
         
         self._nfeatures = nstacks * self.npcas
 
-        self.species = torch.from_numpy(elements).float().cuda()
+        self.species = torch.from_numpy(elements).float().to(self.device)
         
         self.sample_elemental_basis()
         
@@ -48,8 +46,8 @@ class RandomFourrierFeaturesModel(BaseKernel):
         
         for e in self.elements:
             
-            W[e] = torch.from_numpy(np.random.normal(0.0, 1.0, [d, D]) / (2 * self.sigma ** 2)).cuda()
-            b[e] = torch.from_numpy(np.random.uniform(0.0, 1.0, [D]) * 2.0 * np.pi).cuda()
+            W[e] = torch.from_numpy(np.random.normal(0.0, 1.0, [d, D]) / (2 * self.sigma ** 2)).to(self.device)
+            b[e] = torch.from_numpy(np.random.uniform(0.0, 1.0, [D]) * 2.0 * np.pi).to(self.device)
             
         self.W = W
         self.b = b
@@ -57,11 +55,15 @@ class RandomFourrierFeaturesModel(BaseKernel):
     def nfeatures(self):
         return self._nfeatures
     
-    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None):
-        get_rff(rep, self.W[element], self.b[element], indexes, feature_matrix)
+    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None, atom_offsets=None):
+        get_kernel('rff', rep)(rep, self.W[element], self.b[element], indexes, feature_matrix)
         
         if (derivative_matrix is not None and grad is not None):
-            get_rff_derivatives(rep, grad, self.W[element], self.b[element], indexes, derivative_matrix)
+            
+            if (atom_offsets is None):
+                atom_offsets = torch.empty(0, dtype=torch.int, device=rep.device)
+                
+            get_kernel('rff_derivatives', rep)(rep, grad, self.W[element], self.b[element], indexes, atom_offsets, derivative_matrix)
             
     def get_finite_difference_features(self, rep, X, Z, elements, atomIDs, molIDs, natom_counts, dx=0.001):
         device = X.device
@@ -119,14 +121,15 @@ class RandomFourrierFeaturesModel(BaseKernel):
         return feature_derivative
     
     def predict_opt(self, coordinates, charges, atomIDs, molIDs, natom_counts, zcells,
-                    forces=True, print_info=True, profiler=False):
+                    forces=True, print_info=True, profiler=False, element_rows=None):
+        
+        '''element_rows: optional per-element ragged atom rows of the batch, data['element_rows'] of format_packed'''
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start = torch.cuda.Event(enable_timing=True)
-            end = torch.cuda.Event(enable_timing=True)
+            timer = Timer(self.device)
         
-            start.record()
+            timer.start()
 
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
@@ -137,15 +140,20 @@ class RandomFourrierFeaturesModel(BaseKernel):
    
             torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, zcells)
     
-            Ztest = torch.zeros(coordinates.shape[0], self.nfeatures(), device=torch.device('cuda'), dtype=torch.float32)
+            Ztest = torch.zeros(coordinates.shape[0], self.nfeatures(), device=self.device, dtype=torch.float32)
             
             for e in self.elements:
+                
+                if (element_rows is None):
+                    molIDs_e, atomIDs_e = torch.where(charges.int() == e)
+                elif (e in element_rows):
+                    molIDs_e, atomIDs_e = molIDs.long()[element_rows[e]], atomIDs.long()[element_rows[e]]
+                else:
+                    continue
                  
-                indexes = charges.int() == e
-                 
-                batch_indexes = torch.where(indexes)[0].type(torch.int)
+                batch_indexes = molIDs_e.type(torch.int)
                  
-                sub = torch_rep[indexes]
+                sub = torch_rep[molIDs_e, atomIDs_e]
                 
                 if (sub.shape[0] == 0): continue
                     
@@ -158,11 +166,10 @@ class RandomFourrierFeaturesModel(BaseKernel):
             if (forces):
                 forces_torch, = torch.autograd.grad(-total_energies.sum(), coordinates)
             
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
 
         if (print_info):
-            print("prediction for", coordinates.shape[0], "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", coordinates.shape[0], "molecules time: ", timer.elapsed_time(), "ms")
         
         if (forces):
             result = (total_energies, forces_torch)
@@ -175,37 +182,39 @@ class RandomFourrierFeaturesModel(BaseKernel):
             
         return result
     
-    def predict(self, X, Z, max_natoms, cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+    def predict(self, X, Z=None, max_natoms=None, cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+
+        '''X, Z: lists of per-molecule coordinates and charges, or X: PackedMolecules (Z is then ignored)'''
 
         if (not use_backward):
-            return self.predict_cuda(X, Z, max_natoms, cells, forces, print_info)
+            return self.predict_cuda(X, Z, max_natoms, cells, forces=forces, print_info=print_info)
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        timer = Timer(self.device)
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start.record()
+            timer.start()
 
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
                 exit()
             
-            predict_energies = torch.zeros(len(X), device=self.device, dtype=torch.float64)
-            predict_forces = torch.zeros(len(X), max_natoms, 3, device=self.device, dtype=torch.float64)
+            molecules = as_dataset(X, Z, cells=cells).geometries()
             
-            for i in tqdm(range(0, len(X), self.nbatch_test)) if print_info else range(0, len(X), self.nbatch_test):
+            if (max_natoms is None):
+                max_natoms = molecules.max_natoms
                 
-                coordinates = X[i:i + self.nbatch_test]
-                charges = Z[i:i + self.nbatch_test]
-                
-                zbatch = len(coordinates)
+            predict_energies = torch.zeros(len(molecules), device=self.device, dtype=torch.float64)
+            predict_forces = torch.zeros(len(molecules), max_natoms, 3, device=self.device, dtype=torch.float64)
+            
+            schedule = self.schedule_batches(molecules, self.nbatch_test)
+            
+            batches = self.prefetch_batches(molecules, schedule)
+            
+            for b, data in tqdm(batches, total=len(schedule)) if print_info else batches:
                 
-                if (cells is not None):
-                    zcells = cells[i:i + self.nbatch_test]
-                else: zcells = None
-                    
-                data = self.format_data(coordinates, charges, cells=zcells)
+                # positions of the batch molecules in the input
+                batch_order = torch.from_numpy(schedule.indexes(b)).to(self.device)
                 
                 coordinates = data['coordinates']
                 charges = data['charges']
@@ -214,27 +223,29 @@ class RandomFourrierFeaturesModel(BaseKernel):
                 natom_counts = data['natom_counts']
                 zcells = data['cells']
                 
-                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, forces=forces, print_info=False, profiler=False)
+                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, forces=forces, print_info=False, profiler=False,
+                                          element_rows=data['element_rows'])
                 
                 if (forces):
-                    predict_energies[i:i + self.nbatch_test] = result[0]
+                    predict_energies[batch_order] = result[0]
                     
                     forces_cuda = result[1]
-    
-                    for j in range(forces_cuda.shape[0]):
-                        predict_forces[i + j,:natom_counts[j]] = forces_cuda[j,:natom_counts[j]]
+                    
+                    rows = (molIDs.long(), atomIDs.long())
+                    
+                    predict_forces[batch_order[rows[0]], rows[1]] = forces_cuda[rows]
                 else:
-                    predict_energies[i:i + self.nbatch_test] = result
+                    predict_energies[batch_order] = result
       
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
         
         if (profiler):
             print(prof.key_averages(group_by_stack_n=30).table(sort_by='self_cuda_time_total', row_limit=30))
             # print(prof.key_averages().table(sort_by="self_cuda_time_total"))
             
         if (print_info):
-            print("prediction for", len(X), "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", len(molecules), "molecules time: ", timer.elapsed_time(), "ms")
+            print("batch pipeline:", batches.report())
         
         if (forces):
             return (predict_energies, predict_forces)
@@ -251,12 +262,9 @@ class RandomFourrierFeaturesModel(BaseKernel):
 class OrthogonalFeaturesModel(BaseKernel):
     
     def __init__(self, rep=None, elements=np.array([1, 6, 7, 8]), sigma=2.0, llambda=1e-10,
-                 nstacks=128, npcas=128, nbatch_train=64, nbatch_test=64):
+                 nstacks=128, npcas=128, nbatch_train=64, nbatch_test=64, device=None):
         
-        super(OrthogonalFeaturesModel, self).__init__(rep, elements, sigma, llambda)
-        
-        cuda = torch.cuda.is_available()
-        self.device = torch.device('cuda' if cuda else 'cpu')
+        super(OrthogonalFeaturesModel, self).__init__(rep, elements, sigma, llambda, device)
         
         self.npcas = npcas
         self.nbatch_train = nbatch_train
@@ -265,7 +273,7 @@ class OrthogonalFeaturesModel(BaseKernel):
         self.nstacks = nstacks
         self._nfeatures = nstacks * npcas
 
-        self.species = torch.from_numpy(elements).float().cuda()
+        self.species = torch.from_numpy(elements).float().to(self.device)
         
         self.sample_elemental_basis()
         
@@ -283,10 +291,10 @@ class OrthogonalFeaturesModel(BaseKernel):
         
         for e in self.elements:
             
-            Wq = torch.zeros(D, d).double().cuda()
+            Wq = torch.zeros(D, d).double().to(self.device)
             
             for i in range(self.nstacks):
-                Wn = torch.from_numpy(np.random.normal(0.0, 1.0, [d, d]) / (2 * self.sigma ** 2)).cuda()
+                Wn = torch.from_numpy(np.random.normal(0.0, 1.0, [d, d]) / (2 * self.sigma ** 2)).to(self.device)
                 
                 Q, R = torch.linalg.qr(Wn)
                 
@@ -296,7 +304,7 @@ class OrthogonalFeaturesModel(BaseKernel):
             
         for e in self.elements:
             # b[e] = torch.from_numpy(np.random.uniform(0.0, 1.0, [D]) * 2.0 * np.pi).cuda()
-            b[e] = torch.zeros(D).cuda()
+            b[e] = torch.zeros(D).to(self.device)
             
         self.W = W
         self.b = b
@@ -320,11 +328,15 @@ class OrthogonalFeaturesModel(BaseKernel):
     def nfeatures(self):
         return self._nfeatures
     
-    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None):
-        get_rff(rep, self.W[element], self.b[element], indexes, feature_matrix)
+    def calculate_features(self, rep, element, indexes, feature_matrix, grad=None, derivative_matrix=None, atom_offsets=None):
+        get_kernel('rff', rep)(rep, self.W[element], self.b[element], indexes, feature_matrix)
         
         if (derivative_matrix is not None and grad is not None):
-            get_rff_derivatives(rep, grad, self.W[element], self.b[element], indexes, derivative_matrix)
+            
+            if (atom_offsets is None):
+                atom_offsets = torch.empty(0, dtype=torch.int, device=rep.device)
+                
+            get_kernel('rff_derivatives', rep)(rep, grad, self.W[element], self.b[element], indexes, atom_offsets, derivative_matrix)
             
     def get_finite_difference_features(self, rep, X, Z, elements, atomIDs, molIDs, natom_counts, dx=0.001):
         device = X.device
@@ -382,14 +394,15 @@ class OrthogonalFeaturesModel(BaseKernel):
         return feature_derivative
     
     def predict_opt(self, coordinates, charges, atomIDs, molIDs, natom_counts, zcells,
-                    forces=True, print_info=True, profiler=False):
+                    forces=True, print_info=True, profiler=False, element_rows=None):
+        
+        '''element_rows: optional per-element ragged atom rows of the batch, data['element_rows'] of format_packed'''
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start = torch.cuda.Event(enable_timing=True)
-            end = torch.cuda.Event(enable_timing=True)
+            timer = Timer(self.device)
         
-            start.record()
+            timer.start()
 
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
@@ -400,15 +413,20 @@ class OrthogonalFeaturesModel(BaseKernel):
    
             torch_rep = self.rep.forward(coordinates, charges, atomIDs, molIDs, natom_counts, zcells)
     
-            Ztest = torch.zeros(coordinates.shape[0], self.nfeatures(), device=torch.device('cuda'), dtype=torch.float32)
+            Ztest = torch.zeros(coordinates.shape[0], self.nfeatures(), device=self.device, dtype=torch.float32)
             
             for e in self.elements:
+                
+                if (element_rows is None):
+                    molIDs_e, atomIDs_e = torch.where(charges.int() == e)
+                elif (e in element_rows):
+                    molIDs_e, atomIDs_e = molIDs.long()[element_rows[e]], atomIDs.long()[element_rows[e]]
+                else:
+                    continue
                  
-                indexes = charges.int() == e
-                 
-                batch_indexes = torch.where(indexes)[0].type(torch.int)
+                batch_indexes = molIDs_e.type(torch.int)
                  
-                sub = torch_rep[indexes]
+                sub = torch_rep[molIDs_e, atomIDs_e]
                 
                 if (sub.shape[0] == 0): continue
                     
@@ -421,11 +439,10 @@ class OrthogonalFeaturesModel(BaseKernel):
             if (forces):
                 forces_torch, = torch.autograd.grad(-total_energies.sum(), coordinates)
             
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
 
         if (print_info):
-            print("prediction for", coordinates.shape[0], "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", coordinates.shape[0], "molecules time: ", timer.elapsed_time(), "ms")
         
         if (forces):
             result = (total_energies, forces_torch)
@@ -438,37 +455,39 @@ class OrthogonalFeaturesModel(BaseKernel):
             
         return result
     
-    def predict(self, X, Z, max_natoms, cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+    def predict(self, X, Z=None, max_natoms=None, cells=None, forces=True, print_info=True, use_backward=True, profiler=False):
+
+        '''X, Z: lists of per-molecule coordinates and charges, or X: PackedMolecules (Z is then ignored)'''
 
         if (not use_backward):
-            return self.predict_cuda(X, Z, max_natoms, cells, forces, print_info)
+            return self.predict_cuda(X, Z, max_natoms, cells, forces=forces, print_info=print_info)
         
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
+        timer = Timer(self.device)
         
-        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=True, with_stack=True) as prof:
+        with torch.autograd.profiler.profile(enabled=profiler, use_cuda=self.device.type == 'cuda', with_stack=True) as prof:
             
-            start.record()
+            timer.start()
 
             if (self.is_trained is False):
                 print ("Error: must train the model first by calling train()!")
                 exit()
             
-            predict_energies = torch.zeros(len(X), device=self.device, dtype=torch.float64)
-            predict_forces = torch.zeros(len(X), max_natoms, 3, device=self.device, dtype=torch.float64)
+            molecules = as_dataset(X, Z, cells=cells).geometries()
             
-            for i in tqdm(range(0, len(X), self.nbatch_test)) if print_info else range(0, len(X), self.nbatch_test):
+            if (max_natoms is None):
+                max_natoms = molecules.max_natoms
                 
-                coordinates = X[i:i + self.nbatch_test]
-                charges = Z[i:i + self.nbatch_test]
-                
-                zbatch = len(coordinates)
+            predict_energies = torch.zeros(len(molecules), device=self.device, dtype=torch.float64)
+            predict_forces = torch.zeros(len(molecules), max_natoms, 3, device=self.device, dtype=torch.float64)
+            
+            schedule = self.schedule_batches(molecules, self.nbatch_test)
+            
+            batches = self.prefetch_batches(molecules, schedule)
+            
+            for b, data in tqdm(batches, total=len(schedule)) if print_info else batches:
                 
-                if (cells is not None):
-                    zcells = cells[i:i + self.nbatch_test]
-                else: zcells = None
-                    
-                data = self.format_data(coordinates, charges, cells=zcells)
+                # positions of the batch molecules in the input
+                batch_order = torch.from_numpy(schedule.indexes(b)).to(self.device)
                 
                 coordinates = data['coordinates']
                 charges = data['charges']
@@ -477,27 +496,29 @@ class OrthogonalFeaturesModel(BaseKernel):
                 natom_counts = data['natom_counts']
                 zcells = data['cells']
                 
-                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, forces=forces, print_info=False, profiler=False)
+                result = self.predict_opt(coordinates, charges, atomIDs, molIDs, natom_counts, zcells, forces=forces, print_info=False, profiler=False,
+                                          element_rows=data['element_rows'])
                 
                 if (forces):
-                    predict_energies[i:i + self.nbatch_test] = result[0]
+                    predict_energies[batch_order] = result[0]
                     
                     forces_cuda = result[1]
-    
-                    for j in range(forces_cuda.shape[0]):
-                        predict_forces[i + j,:natom_counts[j]] = forces_cuda[j,:natom_counts[j]]
+                    
+                    rows = (molIDs.long(), atomIDs.long())
+                    
+                    predict_forces[batch_order[rows[0]], rows[1]] = forces_cuda[rows]
                 else:
-                    predict_energies[i:i + self.nbatch_test] = result
+                    predict_energies[batch_order] = result
       
-            end.record()
-            torch.cuda.synchronize()
+            timer.stop()
         
         if (profiler):
             print(prof.key_averages(group_by_stack_n=30).table(sort_by='self_cuda_time_total', row_limit=30))
             # print(prof.key_averages().table(sort_by="self_cuda_time_total"))
             
         if (print_info):
-            print("prediction for", len(X), "molecules time: ", start.elapsed_time(end), "ms")
+            print("prediction for", len(molecules), "molecules time: ", timer.elapsed_time(), "ms")
+            print("batch pipeline:", batches.report())
         
         if (forces):
             return (predict_energies, predict_forces)
@@ -8,20 +8,23 @@ Created on 1 Apr 2021
 
 '''
 import torch
-from qml_lightning.cuda import pairlist_gpu
-from qml_lightning.cuda import egto_gpu
+from qml_lightning.backend import get_kernel, resolve_device, load_extension
 import numpy as np
 from qml_lightning.representations.Representation import Representation
+from qml_lightning.representations.FCHL import empty_cell
+from qml_lightning.representations.neighbours import get_neighbours_and_element_types, build_neighbour_list, wrap_coordinates
 
 
 class EGTOCuda(Representation):
 
     def __init__(self, species=np.array([1, 6, 7, 8]), low_cutoff=0.0, high_cutoff=6.0, ngaussians=24, eta=1.2, lmax=3,
-                 lchannel_weights=1.0, inv_factors=1.0, rswitch=4.5, cutoff_function="cosine", distribution="gaussian"):
+                 lchannel_weights=1.0, inv_factors=1.0, rswitch=4.5, cutoff_function="cosine", distribution="gaussian", device=None):
         
         super(EGTOCuda, self).__init__()
         
-        self.species = torch.from_numpy(species).float().cuda()
+        self.device = resolve_device(device)
+        
+        self.species = torch.from_numpy(species).float().to(self.device)
         self.nspecies = len(species)
         
         self.low_cutoff = low_cutoff
@@ -31,10 +34,10 @@ class EGTOCuda(Representation):
         self.lmax = lmax
         
         if isinstance(lchannel_weights, list) or isinstance(lchannel_weights, np.ndarray):
-            self.lchannel_weights = torch.Tensor(lchannel_weights).cuda()
+            self.lchannel_weights = torch.Tensor(lchannel_weights).to(self.device)
         else:
             # assume scalar
-            self.lchannel_weights = torch.zeros(lmax + 1).cuda()
+            self.lchannel_weights = torch.zeros(lmax + 1).to(self.device)
             self.lchannel_weights[:] = lchannel_weights
             
         self.init_inv_factors(inv_factors)
@@ -44,9 +47,9 @@ class EGTOCuda(Representation):
         # eta = (0.5 / ((1.0 - np.exp(-cutoff)) / K)) ** 2 
         
         if (distribution == "expexp"):
-            self.offset = torch.linspace(np.exp(-0.4), np.exp(-self.high_cutoff), ngaussians).cuda()
+            self.offset = torch.linspace(np.exp(-0.4), np.exp(-self.high_cutoff), ngaussians).to(self.device)
         else:
-            self.offset = torch.linspace(0.0, self.high_cutoff, ngaussians + 1)[1:].cuda()
+            self.offset = torch.linspace(0.0, self.high_cutoff, ngaussians + 1)[1:].to(self.device)
 
         mbody_list = torch.zeros(species.shape[0], species.shape[0], dtype=torch.int32)
         
@@ -62,9 +65,9 @@ class EGTOCuda(Representation):
                 mbody_list[j][i] = count
                 count += 1
             
-        self.mbody_list = mbody_list.cuda()
+        self.mbody_list = mbody_list.to(self.device)
         
-        element_to_id = torch.zeros(max(self.species.int()) + 1, dtype=torch.long, device=torch.device('cuda'))
+        element_to_id = torch.zeros(max(self.species.int()) + 1, dtype=torch.long, device=self.device)
         
         for i, el in enumerate(self.species.int()):
             element_to_id[el] = i
@@ -77,15 +80,13 @@ class EGTOCuda(Representation):
             for j in range(i + 1, self.nspecies):
                 element_combinations.append([int(self.species[i]), int(self.species[j])])
         
-        self.element_combinations = torch.cuda.LongTensor(element_combinations)
+        self.element_combinations = torch.LongTensor(element_combinations).to(self.device)
         
         self.nmbody = self.element_combinations.shape[0] + self.nspecies
         
         self.fp_size = ngaussians * (lmax + 1) * self.nmbody
         
-        self.pi = torch.acos(torch.zeros(1)).cuda() * 2
-        
-        self.device = torch.device('cuda')
+        self.pi = torch.acos(torch.zeros(1)).to(self.device) * 2
         
         self.rswitch = rswitch
         
@@ -106,10 +107,10 @@ class EGTOCuda(Representation):
     def init_inv_factors(self, factors):
         
         if isinstance(factors, list) or isinstance(factors, np.ndarray):
-            self.inv_factors = torch.Tensor(factors).cuda()
+            self.inv_factors = torch.Tensor(factors).to(self.device)
         else:
             # assume scalar
-            self.inv_factors = torch.zeros(self.lmax + 1).cuda()
+            self.inv_factors = torch.zeros(self.lmax + 1).to(self.device)
             self.inv_factors[:] = factors
             
         inv_factors = []
@@ -118,7 +119,7 @@ class EGTOCuda(Representation):
                 for m in range(i - k + 1):
                     inv_factors.append(self.inv_factors[i])
                     
-        self.inv_factors_torch = torch.Tensor(inv_factors).cuda()
+        self.inv_factors_torch = torch.Tensor(inv_factors).to(self.device)
         
     def generate_angular_numbers(self):
         angular_components = []
@@ -137,55 +138,44 @@ class EGTOCuda(Representation):
         angular_weights = torch.FloatTensor(angular_weights)
         angular_indexes = torch.IntTensor(angular_indexes)
         
-        self.orbital_components = angular_components.cuda()
-        self.orbital_weights = angular_weights.cuda()
-        self.orbital_indexes = angular_indexes.cuda()
+        self.orbital_components = angular_components.to(self.device)
+        self.orbital_weights = angular_weights.to(self.device)
+        self.orbital_indexes = angular_indexes.to(self.device)
     
-    def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                           cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_egto(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
+                 cell=None, gradients=False):
         
-        inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
+        if (cell is None):
+            cell = empty_cell(X)
+        
+        inv_cell = empty_cell(X)
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
             
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
-                                                         cell , inv_cell)
-      
-        max_neighbours = nneighbours.max().item()
-     
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
-                                                            cell, inv_cell)
-         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
-
-        output = egto_gpu.get_egto(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
-                               self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factors, self.eta, self.lmax, self.high_cutoff, self.rswitch,
-                               cell, inv_cell, self.cut_func, self.dist_func, False)
+        X = wrap_coordinates(X, cell, inv_cell)
         
-        return output[0]
-    
-    def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                                                                     cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+        species = self.species.to(X.device)
         
-        inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
+        neighbours, element_types = get_neighbours_and_element_types(X, Z, species, atom_counts, self.high_cutoff, cell, inv_cell)
         
-        if (cell.shape[0] > 0):
-            inv_cell = torch.inverse(cell)
-
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
-                                                          cell, inv_cell)
+        return get_kernel('egto', X)(X, Z, species, element_types, atomIDs, molIDs, neighbours.row_offsets(), neighbours.indices, neighbours.shifts,
+                               neighbours.nneighbours, self.mbody_list.to(X.device), self.orbital_components.to(X.device),
+                               self.orbital_weights.to(X.device), self.orbital_indexes.to(X.device), self.offset.to(X.device),
+                               self.lchannel_weights.to(X.device), self.inv_factors.to(X.device), self.eta, self.lmax, self.high_cutoff,
+                               self.rswitch, cell, inv_cell, self.cut_func, self.dist_func, gradients)
+    
+    def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
+                           cell=None):
         
-        max_neighbours = nneighbours.max().item()
-     
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
-                                                            cell, inv_cell)
+        output = self.get_egto(X, Z, atomIDs, molIDs, atom_counts, cell, False)
         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        return output[0]
+    
+    def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
+                                          cell=None):
         
-        output = egto_gpu.get_egto(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
-        self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factors, self.eta, self.lmax, self.high_cutoff, self.rswitch,
-        cell, inv_cell, self.cut_func, self.dist_func, True)
+        output = self.get_egto(X, Z, atomIDs, molIDs, atom_counts, cell, True)
         
         return output[0], output[1]
     
@@ -211,16 +201,16 @@ class EGTOCuda(Representation):
                 
         return rep_derivative_fd
     
-    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
         return self.forward(X, Z, atom_counts, cell)
     
-    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
         
         X.requires_grad = True
         
         gto = self.forward(X, Z, atom_counts, cell)
 
-        derivative = torch.zeros(X.shape[0], X.shape[1], X.shape[1], 3, gto.shape[2], device=torch.device('cuda'))
+        derivative = torch.zeros(X.shape[0], X.shape[1], X.shape[1], 3, gto.shape[2], device=X.device)
         
         for i in range (gto.shape[0]):
             for j in range(gto.shape[1]):
@@ -231,78 +221,75 @@ class EGTOCuda(Representation):
     
         return derivative
         
-    def forward(self, coordinates, nuclear_charges, natom_counts, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def forward(self, coordinates, nuclear_charges, natom_counts, cell=None):
 
         n_batch, max_natoms, _ = coordinates.shape
         
-        inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
-            
-        num_neighbours = pairlist_gpu.get_num_neighbours_gpu(coordinates, natom_counts, self.high_cutoff,
-                                                          cell, inv_cell)
+        device = coordinates.device
         
-        max_neighbours = num_neighbours.max().item()
+        if (cell is None):
+            cell = empty_cell(coordinates)
         
-        neighbours = pairlist_gpu.get_neighbour_list_gpu(coordinates, natom_counts, max_neighbours, self.high_cutoff,
-                                                            cell, inv_cell)
-
-        pairlist_mask = (neighbours != -1)
-
-        # hack to get rid of the -1's - picks a valid index for a given atom and fills -1 values with that. pairlist_mask stores
-        # the "real" atom indexes
-        pairlist_gpu.safe_fill_gpu(neighbours)
+        inv_cell = empty_cell(coordinates)
         
-        idx_m = torch.arange(coordinates.shape[0], dtype=torch.long)[:, None, None]
+        if (cell.shape[0] > 0):
+            inv_cell = torch.inverse(cell)
+            
+        coordinates = wrap_coordinates(coordinates, cell, inv_cell)
         
-        local_atoms = coordinates[idx_m, neighbours.long()]
+        # CSR neighbour list, so every tensor below is [npairs, ...] rather than padded to the largest neighbour count in the batch
+        neighbours = build_neighbour_list(coordinates, natom_counts, self.high_cutoff, cell, inv_cell)
+        
+        molIDs, atomIDs, neighbourIDs = neighbours.pairs()
+        
+        rows = molIDs * max_natoms + atomIDs
 
-        nbh_coords = (coordinates[:,:, None,:] - local_atoms)
+        nbh_coords = coordinates[molIDs, atomIDs] - coordinates[molIDs, neighbourIDs]
         
-        # TODO apply PBC here if cell is defined
         if (cell.shape[0] > 0):
-            inv_cell = torch.inverse(cell)
+            # the neighbouring image sits at r_j + h n, which also covers cells narrower than 2 * high_cutoff
+            nbh_coords = nbh_coords - torch.einsum('pmk,pk->pm', cell[molIDs], neighbours.shifts.to(cell.dtype))
             
-        distances = torch.linalg.norm(nbh_coords, dim=3)
+        distances = torch.linalg.norm(nbh_coords, dim=1)
         
-        # mask for the "dummy" atoms introduced when padding the neighbourlist to n_max_neighbours
-        parlist_maskval = torch.ones_like(neighbours)
-        pairlist_coeffs = parlist_maskval * pairlist_mask
-     
         centered_distances = torch.pow(distances[..., None] - self.offset, 2)
 
-        neighbor_numbers = nuclear_charges[idx_m, neighbours[:,:,:].long()]
+        neighbor_numbers = nuclear_charges[molIDs, neighbourIDs]
   
         cutoffs = 0.5 * (torch.cos(distances * self.pi / self.high_cutoff) + 1.0)
        
-        radial_basis = torch.sqrt(self.eta / self.pi) * torch.exp(-self.eta * centered_distances) * cutoffs[..., None] * pairlist_coeffs[..., None]
+        radial_basis = torch.sqrt(self.eta / self.pi) * torch.exp(-self.eta * centered_distances) * cutoffs[..., None]
    
-        inv_scaling = torch.pow(1.0 / distances[..., None], self.inv_factors_torch + self.orbital_indexes) * pairlist_coeffs[..., None]
+        inv_scaling = torch.pow(1.0 / distances[..., None], self.inv_factors_torch + self.orbital_indexes)
       
         angular_terms = inv_scaling * torch.pow(nbh_coords[..., None, 0] , self.orbital_components[:, 0 ]) * \
                 torch.pow(nbh_coords[..., None, 1] , self.orbital_components[:, 1 ]) * \
                 torch.pow(nbh_coords[..., None, 2] , self.orbital_components[:, 2 ])
         
-        fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.nmbody, self.ngaussians, dtype=radial_basis.dtype, device=self.device)
+        norbs = self.orbital_components.shape[0]
+        
+        fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.nmbody, self.ngaussians, dtype=radial_basis.dtype, device=device)
+        
+        # per-species sums over the neighbours of each atom, [nbatch, max_natoms, norbs, ngaussians]. The two-species terms below use the
+        # sum of two of these, since the sum over neighbours of either species is the sum of the per-species sums.
+        species_expansions = []
         
-        # first construct the single-species three-body terms, e.g X-HH, X-CC...
         for i in range(self.nspecies):
-
-            elemental_fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.ngaussians, dtype=radial_basis.dtype, device=self.device)
-    
-            mask = (neighbor_numbers[..., None] == self.species[i]).any(-1)
             
-            maskval = torch.ones_like(neighbor_numbers[..., None])
+            mask = neighbor_numbers == self.species[i]
             
-            mask_ = mask.unsqueeze(-1).expand(neighbours[..., None].size())
+            expansion = torch.zeros(n_batch * max_natoms, norbs, self.ngaussians, dtype=radial_basis.dtype, device=device)
             
-            coeffs = torch.squeeze(maskval * mask_, dim=-1)
-
-            filtered_radial = coeffs[..., None] * radial_basis 
-
-            test = angular_terms[... , None] * filtered_radial[..., None,:] 
+            expansion.index_add_(0, rows[mask], angular_terms[mask][..., None] * radial_basis[mask][:, None,:])
+            
+            species_expansions.append(expansion.view(n_batch, max_natoms, norbs, self.ngaussians))
         
-            test = torch.sum(test, dim=2)
+        # first construct the single-species three-body terms, e.g X-HH, X-CC...
+        for i in range(self.nspecies):
 
-            orbitals = self.orbital_weights[None, None,:, None] * torch.pow(test, 2)
+            elemental_fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.ngaussians, dtype=radial_basis.dtype, device=device)
+
+            orbitals = self.orbital_weights[None, None,:, None] * torch.pow(species_expansions[i], 2)
           
             elemental_fingerprint.index_add_(2, self.orbital_indexes, orbitals)
             
@@ -311,35 +298,21 @@ class EGTOCuda(Representation):
         # now construct the two-species three-body terms, e.g X-CH, X-CN, while negating out the single-species term
         for i in range(self.element_combinations.shape[0]):
     
-            elemental_fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.ngaussians, dtype=radial_basis.dtype, device=self.device)
+            elemental_fingerprint = torch.zeros(n_batch, max_natoms, self.lmax + 1, self.ngaussians, dtype=radial_basis.dtype, device=device)
             
             mbody = self.element_combinations[i]
             
-            mask = (neighbor_numbers[..., None] == mbody).any(-1)
-            
-            maskval = torch.ones_like(neighbor_numbers[..., None])
-            
-            mask_ = mask.unsqueeze(-1).expand(neighbours[..., None].size())
-            
-            coeffs = torch.squeeze(maskval * mask_, dim=-1)
-            
-            masked_radial = coeffs[..., None] * radial_basis
-        
-            test = angular_terms[... , None] * masked_radial[..., None,:]
+            single_species_id = self.element_to_id[mbody]
             
-            test = torch.sum(test, dim=2)
+            expansion = species_expansions[single_species_id[0]] + species_expansions[single_species_id[1]]
         
-            orbitals = self.orbital_weights[None, None,:, None] * torch.pow(test, 2)
-            
-            single_species_id = self.element_to_id[mbody]
+            orbitals = self.orbital_weights[None, None,:, None] * torch.pow(expansion, 2)
             
             elemental_fingerprint.index_add_(2, self.orbital_indexes, orbitals)
             
             fingerprint[:,:,:, self.nspecies + i,:] = (self.lchannel_weights[None, None,:, None] * elemental_fingerprint) - (fingerprint[:,:,:, single_species_id[0],:] + \
                                                                                 fingerprint[:,:,:, single_species_id[1],:])
-        # zero out any invalid atom_ids
-        for i in range(n_batch):
-            fingerprint[i, natom_counts[i]:,:,:,:] = 0.0
+        # padding atoms have no neighbours in the CSR list, so their rows are already zero
             
         return fingerprint.reshape(n_batch, max_natoms, self.fp_size)
     
@@ -347,12 +320,18 @@ class EGTOCuda(Representation):
 class EGTOCuda_ver2(Representation):
 
     def __init__(self, species=np.array([1, 6, 7, 8]), low_cutoff=0.0, high_cutoff=6.0, ngaussians=24,
-                 eta=torch.linspace(3.0, 1.0, 24, device=torch.device('cuda')), lmax=3,
-                 lchannel_weights=1.0, inv_factors=torch.linspace(3.0, 1.0, 24, device=torch.device('cuda')),
+                 eta=None, lmax=3,
+                 lchannel_weights=1.0, inv_factors=None,
                  rswitch=4.5, cutoff_function="cosine", distribution="gaussian"):
         
         super(EGTOCuda_ver2, self).__init__()
         
+        if (eta is None):
+            eta = torch.linspace(3.0, 1.0, 24, device=torch.device('cuda'))
+            
+        if (inv_factors is None):
+            inv_factors = torch.linspace(3.0, 1.0, 24, device=torch.device('cuda'))
+        
         self.species = torch.from_numpy(species).float().cuda()
         self.nspecies = len(species)
         
@@ -458,48 +437,54 @@ class EGTOCuda_ver2(Representation):
         self.orbital_indexes = angular_indexes.cuda()
     
     def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                           cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                           cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
             
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                          cell , inv_cell)
       
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
          
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
 
-        output = egto_gpu.get_egto_ver2(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver2(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
                                self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factors, self.eta, self.lmax, self.high_cutoff, self.rswitch,
                                cell, inv_cell, self.cut_func, self.dist_func, False)
         
         return output[0]
     
     def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                                                                     cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                                                                     cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
 
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
         
-        output = egto_gpu.get_egto_ver2(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver2(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
         self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factors, self.eta, self.lmax, self.high_cutoff, self.rswitch,
         cell, inv_cell, self.cut_func, self.dist_func, True)
         
@@ -527,10 +512,17 @@ class EGTOCuda_ver2(Representation):
                 
         return rep_derivative_fd
     
-    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
+            
         return self.forward(X, Z, atom_counts, cell)
     
-    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         X.requires_grad = True
         
@@ -547,25 +539,28 @@ class EGTOCuda_ver2(Representation):
     
         return derivative
         
-    def forward(self, coordinates, nuclear_charges, natom_counts, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def forward(self, coordinates, nuclear_charges, natom_counts, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
 
         n_batch, max_natoms, _ = coordinates.shape
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
             
-        num_neighbours = pairlist_gpu.get_num_neighbours_gpu(coordinates, natom_counts, self.high_cutoff,
+        num_neighbours = get_kernel('num_neighbours', coordinates)(coordinates, natom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = num_neighbours.max().item()
         
-        neighbours = pairlist_gpu.get_neighbour_list_gpu(coordinates, natom_counts, max_neighbours, self.high_cutoff,
+        neighbours = get_kernel('neighbour_list', coordinates)(coordinates, natom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
 
         pairlist_mask = (neighbours != -1)
 
         # hack to get rid of the -1's - picks a valid index for a given atom and fills -1 values with that. pairlist_mask stores
         # the "real" atom indexes
-        pairlist_gpu.safe_fill_gpu(neighbours)
+        get_kernel('safe_fill', neighbours)(neighbours)
         
         idx_m = torch.arange(coordinates.shape[0], dtype=torch.long)[:, None, None]
         
@@ -773,48 +768,54 @@ class EGTOCuda_ver3(Representation):
         self.orbital_indexes = angular_indexes.cuda()
     
     def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                           cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                           cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
             
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                          cell , inv_cell)
       
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
          
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
 
-        output = egto_gpu.get_egto_ver3(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver3(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
                                self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factor, self.eta, self.lmax, self.high_cutoff, self.rswitch,
                                cell, inv_cell, self.cut_func, self.dist_func, False)
         
         return output[0]
     
     def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                                                                     cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                                                                     cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
 
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
         
-        output = egto_gpu.get_egto_ver3(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver3(X, Z, self.species, element_types, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
         self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factor, self.eta, self.lmax, self.high_cutoff, self.rswitch,
         cell, inv_cell, self.cut_func, self.dist_func, True)
         
@@ -842,10 +843,17 @@ class EGTOCuda_ver3(Representation):
                 
         return rep_derivative_fd
     
-    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
+            
         return self.forward(X, Z, atom_counts, cell)
     
-    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         X.requires_grad = True
         
@@ -862,25 +870,28 @@ class EGTOCuda_ver3(Representation):
     
         return derivative
         
-    def forward(self, coordinates, nuclear_charges, natom_counts, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def forward(self, coordinates, nuclear_charges, natom_counts, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
 
         n_batch, max_natoms, _ = coordinates.shape
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
             
-        num_neighbours = pairlist_gpu.get_num_neighbours_gpu(coordinates, natom_counts, self.high_cutoff,
+        num_neighbours = get_kernel('num_neighbours', coordinates)(coordinates, natom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = num_neighbours.max().item()
         
-        neighbours = pairlist_gpu.get_neighbour_list_gpu(coordinates, natom_counts, max_neighbours, self.high_cutoff,
+        neighbours = get_kernel('neighbour_list', coordinates)(coordinates, natom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
 
         pairlist_mask = (neighbours != -1)
 
         # hack to get rid of the -1's - picks a valid index for a given atom and fills -1 values with that. pairlist_mask stores
         # the "real" atom indexes
-        pairlist_gpu.safe_fill_gpu(neighbours)
+        get_kernel('safe_fill', neighbours)(neighbours)
         
         idx_m = torch.arange(coordinates.shape[0], dtype=torch.long)[:, None, None]
         
@@ -1090,48 +1101,54 @@ class EGTOCuda_ver4(Representation):
         self.orbital_indexes = angular_indexes.cuda()
     
     def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                           cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                           cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
             
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                          cell , inv_cell)
       
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
          
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
 
-        output = egto_gpu.get_egto_ver4(X, Z, self.species, element_types, self.element_vectors, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver4(X, Z, self.species, element_types, self.element_vectors, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
                                self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factor, self.eta, self.lmax, self.high_cutoff, self.rswitch,
                                cell, inv_cell, self.cut_func, self.dist_func, False)
         
         return output[0]
     
     def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                                                                     cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+                                                                     cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         if (cell.shape[0] > 0):
             inv_cell = torch.inverse(cell)
 
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
+        nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = nneighbours.max().item()
      
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
+        neighbourlist = get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        element_types = get_kernel('element_types', X)(X, Z, atom_counts, self.species) 
         
-        output = egto_gpu.get_egto_ver4(X, Z, self.species, element_types, self.element_vectors, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
+        output = load_extension('egto_gpu').get_egto_ver4(X, Z, self.species, element_types, self.element_vectors, atomIDs, molIDs, neighbourlist, nneighbours, self.mbody_list,
         self.orbital_components, self.orbital_weights, self.orbital_indexes, self.offset, self.lchannel_weights, self.inv_factor, self.eta, self.lmax, self.high_cutoff, self.rswitch,
         cell, inv_cell, self.cut_func, self.dist_func, True)
         
@@ -1159,10 +1176,17 @@ class EGTOCuda_ver4(Representation):
                 
         return rep_derivative_fd
     
-    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
+            
         return self.forward(X, Z, atom_counts, cell)
     
-    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def get_representation_derivative_torch(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
         
         X.requires_grad = True
         
@@ -1179,25 +1203,28 @@ class EGTOCuda_ver4(Representation):
     
         return derivative
         
-    def forward(self, coordinates, nuclear_charges, natom_counts, cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
+    def forward(self, coordinates, nuclear_charges, natom_counts, cell=None):
+        
+        if (cell is None):
+            cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
 
         n_batch, max_natoms, _ = coordinates.shape
         
         inv_cell = torch.empty(0, 3, 3, device=torch.device('cuda'))
             
-        num_neighbours = pairlist_gpu.get_num_neighbours_gpu(coordinates, natom_counts, self.high_cutoff,
+        num_neighbours = get_kernel('num_neighbours', coordinates)(coordinates, natom_counts, self.high_cutoff,
                                                           cell, inv_cell)
         
         max_neighbours = num_neighbours.max().item()
         
-        neighbours = pairlist_gpu.get_neighbour_list_gpu(coordinates, natom_counts, max_neighbours, self.high_cutoff,
+        neighbours = get_kernel('neighbour_list', coordinates)(coordinates, natom_counts, max_neighbours, self.high_cutoff,
                                                             cell, inv_cell)
 
         pairlist_mask = (neighbours != -1)
 
         # hack to get rid of the -1's - picks a valid index for a given atom and fills -1 values with that. pairlist_mask stores
         # the "real" atom indexes
-        pairlist_gpu.safe_fill_gpu(neighbours)
+        get_kernel('safe_fill', neighbours)(neighbours)
         
         idx_m = torch.arange(coordinates.shape[0], dtype=torch.long)[:, None, None]
         
@@ -8,54 +8,31 @@ Created on 1 Apr 2021
 
 '''
 import torch
-from qml_lightning.cuda import pairlist_gpu
-from qml_lightning.cuda import fchl_gpu, egto_gpu
+from qml_lightning.backend import get_kernel, resolve_device
+from qml_lightning.representations.neighbours import get_neighbours, wrap_coordinates
 import numpy as np
 
 
+def empty_cell(X: torch.Tensor):
+    return torch.empty(0, 3, 3, device=X.device)
+
+
+def empty_offsets(X: torch.Tensor):
+    return torch.empty(0, dtype=torch.int, device=X.device)
+
+
 class FCHLFunction(torch.autograd.Function):
 
     @staticmethod
     def forward(ctx, X, non_grad_parameters):
-        start_total = torch.cuda.Event(enable_timing=True)
-        end_total = torch.cuda.Event(enable_timing=True)
-        
-        start_total.record()
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
         
         Z, species, atomIDs, molIDs, atom_counts, cell, inv_cell, \
-                Rs2, Rs3, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut = non_grad_parameters
-        
-        start.record()
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, rcut,
-                                                      cell , inv_cell)
-        end.record()
-        torch.cuda.synchronize()
-        
-        # print ("pairlist n_neighbours time: ", start.elapsed_time(end))
-        
-        max_neighbours = nneighbours.max().item()
-        
-        # print ("max_neighbours", max_neighbours)
-        # print ("avg_neighbours", nneighbours.float().mean().int())
+                Rs2, Rs3, eta2, eta3, two_body_decay, three_body_weight, three_body_decay, rcut, neighbour_list = non_grad_parameters
         
-        start.record()
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, rcut,
-                                                            cell, inv_cell)
-        end.record()
-        torch.cuda.synchronize()
+        neighbours, element_types = get_neighbours(X, Z.float(), species, atom_counts, rcut, cell, inv_cell, neighbour_list)
         
-        # print ("pairlist neighbours time: ", start.elapsed_time(end))
-        
-        start.record()
-        element_types = egto_gpu.get_element_types_gpu(X, Z.float(), atom_counts, species) 
-        end.record()
-        torch.cuda.synchronize()
-        
-        # print ("element_types time: ", start.elapsed_time(end))
-        
-        ctx.save_for_backward(X, Z.float(), species, atomIDs, molIDs, element_types, cell, inv_cell, neighbourlist, nneighbours)
+        ctx.save_for_backward(X, Z.float(), species, atomIDs, molIDs, element_types, cell, inv_cell, neighbours.row_offsets(), neighbours.indices,
+                              neighbours.shifts, neighbours.nneighbours)
         
         ctx.Rs2 = Rs2
         ctx.Rs3 = Rs3
@@ -66,34 +43,21 @@ class FCHLFunction(torch.autograd.Function):
         ctx.three_body_decay = three_body_decay 
         ctx.rcut = rcut
         
-        start.record()
-        output = fchl_gpu.get_fchl_representation(X, Z, species.float(), element_types, cell, inv_cell, atomIDs, molIDs, neighbourlist, nneighbours,
-                               Rs2, Rs3, eta2, eta3, two_body_decay, three_body_weight, three_body_decay,
-                               rcut)
-        end.record()
-        torch.cuda.synchronize()
-        # print ("fchl time: ", start.elapsed_time(end))
-        
-        end_total.record()
-        torch.cuda.synchronize()
-        # print ("forward total time: ", start_total.elapsed_time(end_total))
+        output = get_kernel('fchl_representation', X)(X, Z, species.float(), element_types, cell, inv_cell, atomIDs, molIDs, neighbours.row_offsets(),
+                               neighbours.indices, neighbours.shifts, neighbours.nneighbours, Rs2, Rs3, eta2, eta3, two_body_decay, three_body_weight,
+                               three_body_decay, rcut)
+
         return output
 
     @staticmethod
     def backward(ctx, gradX):
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
-        
-        start.record()
-        X, Z, species, atomIDs, molIDs, element_types, cell, inv_cell, neighbourlist, nneighbours = ctx.saved_tensors
-        
-        grad_out = fchl_gpu.fchl_backwards(X, Z, species, element_types, cell, inv_cell, atomIDs, molIDs, neighbourlist, nneighbours,
-                               ctx.Rs2, ctx.Rs3, ctx.eta2, ctx.eta3, ctx.two_body_decay, ctx.three_body_weight, ctx.three_body_decay,
-                               ctx.rcut, gradX)
+
+        X, Z, species, atomIDs, molIDs, element_types, cell, inv_cell, neighbour_offsets, neighbour_indices, neighbour_shifts, \
+                nneighbours = ctx.saved_tensors
         
-        end.record()
-        torch.cuda.synchronize()
-        # print ("fchl grad time: ", start.elapsed_time(end))
+        grad_out = get_kernel('fchl_backwards', X)(X, Z, species, element_types, cell, inv_cell, atomIDs, molIDs, neighbour_offsets, neighbour_indices,
+                               neighbour_shifts, nneighbours, ctx.Rs2, ctx.Rs3, ctx.eta2, ctx.eta3, ctx.two_body_decay, ctx.three_body_weight, ctx.three_body_decay,
+                               ctx.rcut, gradX.contiguous())
         
         # grad = fchl_gpu.get_fchl_derivative(X, Z, species, element_types, atomIDs, molIDs, neighbourlist, nneighbours,
         #                       ctx.Rs2, ctx.Rs3, ctx.eta2, ctx.eta3, ctx.two_body_decay, ctx.three_body_weight, ctx.three_body_decay,
@@ -104,19 +68,22 @@ class FCHLFunction(torch.autograd.Function):
         # gradX :  nbatch, natoms,      1, 1, repsize
         # grad_out = torch.einsum('abcde,abe->acd', grad, gradX)
         
-        # print ("backwards time: ", start.elapsed_time(end))
-        
         return grad_out, None
     
 
 class FCHLCuda(torch.nn.Module):
+    
+    # get_representation_and_derivative accepts atom_offsets and writes the derivative without padded atoms
+    ragged_derivative = True
 
     def __init__(self, species=np.array([1, 6, 7, 8]), low_cutoff=0.0, high_cutoff=8.0, nRs2=24, nRs3=20,
-                 eta2=0.32, eta3=2.7, two_body_decay=1.8, three_body_weight=13.4, three_body_decay=0.57):
+                 eta2=0.32, eta3=2.7, two_body_decay=1.8, three_body_weight=13.4, three_body_decay=0.57, device=None):
         
         super(FCHLCuda, self).__init__()
         
-        self.species = torch.from_numpy(species).float().cuda()
+        self.device = resolve_device(device)
+        
+        self.species = torch.from_numpy(species).float().to(self.device)
         self.nspecies = len(species)
         
         self.low_cutoff = low_cutoff
@@ -133,87 +100,68 @@ class FCHLCuda(torch.nn.Module):
         
         self.three_body_decay = three_body_decay
         
-        self.Rs2 = torch.linspace(0.0, self.high_cutoff, nRs2 + 1)[1:].cuda()
-        self.Rs3 = torch.linspace(0.0, self.high_cutoff, nRs3 + 1)[1:].cuda()
+        self.Rs2 = torch.linspace(0.0, self.high_cutoff, nRs2 + 1)[1:].to(self.device)
+        self.Rs3 = torch.linspace(0.0, self.high_cutoff, nRs3 + 1)[1:].to(self.device)
 
         self.fp_size = self.nspecies * nRs2 + (self.nspecies * (self.nspecies + 1)) * nRs3
         
-        self.pi = torch.acos(torch.zeros(1)).cuda() * 2
-        
-        self.device = torch.device('cuda')
+        self.pi = torch.acos(torch.zeros(1)).to(self.device) * 2
     
     def get_representation(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                           cell=torch.empty(0, 3, 3, device=torch.device('cuda')), inv_cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
-        
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
-        
-        start.record()
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
-                                                         cell , inv_cell)
-        end.record()
-        torch.cuda.synchronize()
-        
-        # print (nneighbours)
-        # print ("pairlist n_neighbours time: ", start.elapsed_time(end))
-        
-        max_neighbours = nneighbours.max().item()
-        
-        # print (max_neighbours)
-        
-        start.record()
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
-                                                            cell, inv_cell)
-        end.record()
-        torch.cuda.synchronize()
+                           cell=None, inv_cell=None, neighbour_list=None):
         
-        # print ("pairlist neighbours time: ", start.elapsed_time(end))
+        if (cell is None):
+            cell = empty_cell(X)
+            inv_cell = empty_cell(X)
+            
+        X = wrap_coordinates(X, cell, inv_cell)
         
-        start.record()
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
-        end.record()
-        torch.cuda.synchronize()
+        species = self.species.to(X.device)
         
-        # print ("element_types time: ", start.elapsed_time(end))
+        neighbours, element_types = get_neighbours(X, Z, species, atom_counts, self.high_cutoff, cell, inv_cell, neighbour_list)
         
         '''torch::Tensor get_fchl_representation(torch::Tensor coordinates, torch::Tensor charges, torch::Tensor species, torch::Tensor element_types, torch::Tensor cell,
-        torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbourlist, torch::Tensor nneighbours,
-        torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay, float three_body_weight,
-        float three_body_decay, float rcut)'''
+        torch::Tensor inv_cell, torch::Tensor blockAtomIDs, torch::Tensor blockMolIDs, torch::Tensor neighbour_offsets, torch::Tensor neighbour_indices,
+        torch::Tensor neighbour_shifts, torch::Tensor nneighbours, torch::Tensor two_body_gridpoints, torch::Tensor three_body_gridpoints, float eta2, float eta3, float two_body_decay,
+        float three_body_weight, float three_body_decay, float rcut)'''
         
-        start.record()
-        output = fchl_gpu.get_fchl_representation(X, Z, self.species, element_types, cell, inv_cell, atomIDs, molIDs, neighbourlist, nneighbours,
-                            self.Rs2, self.Rs3, self.eta2, self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay,
-                            self.high_cutoff)
-        
-        end.record()
-        torch.cuda.synchronize()
+        output = get_kernel('fchl_representation', X)(X, Z, species, element_types, cell, inv_cell, atomIDs, molIDs, neighbours.row_offsets(),
+                            neighbours.indices, neighbours.shifts, neighbours.nneighbours, self.Rs2.to(X.device), self.Rs3.to(X.device), self.eta2,
+                            self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay, self.high_cutoff)
         
         return output
     
     def get_representation_and_derivative(self, X:torch.Tensor, Z: torch.Tensor, atomIDs: torch.Tensor, molIDs: torch.Tensor, atom_counts: torch.Tensor,
-                                                                     cell=torch.empty(0, 3, 3, device=torch.device('cuda')),
-                                                                     inv_cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
-
-        nneighbours = pairlist_gpu.get_num_neighbours_gpu(X, atom_counts, self.high_cutoff,
-                                                          cell, inv_cell)
+                                          cell=None, inv_cell=None, neighbour_list=None, atom_offsets=None):
+        
+        '''
+        returns the representation [nbatch, max_natoms, repsize] and its derivative [nbatch, max_natoms, max_natoms, 3, repsize].
+        
+        atom_offsets: [nbatch + 1] exclusive prefix sum of atom_counts. When given, the derivative is packed without the padded atoms
+        as [natoms_total, max_natoms, 3, repsize], one row per entry of (molIDs, atomIDs) in that order, i.e row atom_offsets[molID] + iatom
+        for the ragged order, or one contiguous block of rows per element if (molIDs, atomIDs) are sorted by element
+        '''
         
-        max_neighbours = nneighbours.max().item()
-     
-        neighbourlist = pairlist_gpu.get_neighbour_list_gpu(X, atom_counts, max_neighbours, self.high_cutoff,
-                                                            cell, inv_cell)
+        if (atom_offsets is None):
+            atom_offsets = empty_offsets(X)
+            
+        if (cell is None):
+            cell = empty_cell(X)
+            inv_cell = empty_cell(X)
+            
+        X = wrap_coordinates(X, cell, inv_cell)
         
-        element_types = egto_gpu.get_element_types_gpu(X, Z, atom_counts, self.species) 
+        species = self.species.to(X.device)
         
-        output = fchl_gpu.get_fchl_and_derivative(X, Z, self.species, element_types, cell, inv_cell, atomIDs, molIDs, neighbourlist, nneighbours,
-                               self.Rs2, self.Rs3, self.eta2, self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay,
-                               self.high_cutoff, True)
+        neighbours, element_types = get_neighbours(X, Z, species, atom_counts, self.high_cutoff, cell, inv_cell, neighbour_list)
+        
+        output = get_kernel('fchl_and_derivative', X)(X, Z, species, element_types, cell, inv_cell, atomIDs, molIDs, neighbours.row_offsets(),
+                               neighbours.indices, neighbours.shifts, neighbours.nneighbours, self.Rs2.to(X.device), self.Rs3.to(X.device), self.eta2,
+                               self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay, self.high_cutoff, atom_offsets, True)
          
         return output[0], output[1]
     
-    def rep_deriv_fd(self, X, Z, atomIDs, molIDs, natom_counts,
-                     cells=torch.empty(0, 3, 3, device=torch.device('cuda')),
-                     inv_cells=torch.empty(0, 3, 3, device=torch.device('cuda')), dx=0.005):
+    def rep_deriv_fd(self, X, Z, atomIDs, molIDs, natom_counts, cells=None, inv_cells=None, dx=0.005):
     
         rep_derivative_fd = torch.zeros(X.shape[0], X.shape[1], X.shape[1], 3, self.fp_size, dtype=torch.float64, device=X.device)
         
@@ -235,8 +183,14 @@ class FCHLCuda(torch.nn.Module):
                 
         return rep_derivative_fd
     
-    def forward(self, X, Z, atomIDs, molIDs, atom_counts,
-                cell=torch.empty(0, 3, 3, device=torch.device('cuda')), inv_cell=torch.empty(0, 3, 3, device=torch.device('cuda'))):
-        return FCHLFunction.apply(X, (Z, self.species, atomIDs, molIDs, atom_counts, cell, inv_cell,
-                self.Rs2, self.Rs3, self.eta2, self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay, self.high_cutoff))
-    
+    def forward(self, X, Z, atomIDs, molIDs, atom_counts, cell=None, inv_cell=None, neighbour_list=None):
+        
+        if (cell is None):
+            cell = empty_cell(X)
+            inv_cell = empty_cell(X)
+            
+        X = wrap_coordinates(X, cell, inv_cell)
+        
+        return FCHLFunction.apply(X, (Z, self.species.to(X.device), atomIDs, molIDs, atom_counts, cell, inv_cell,
+                self.Rs2.to(X.device), self.Rs3.to(X.device), self.eta2, self.eta3, self.two_body_decay, self.three_body_weight, self.three_body_decay,
+                self.high_cutoff, neighbour_list))
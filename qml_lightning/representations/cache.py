@@ -0,0 +1,118 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Persistent, content-addressed cache of representations.
+
+A representation only depends on the geometry (coordinates, charges, atom counts and cell) and on the representation
+hyperparameters, so a batch's representation is stored under the hash of its geometry block combined with a digest of the
+representation configuration. Any other run that formats the same molecules into the same batch, with the same representation, loads
+the stored arrays instead of recomputing them: repeated get_reductors / train / predict calls, hyperparameter scans and repeated
+experiments across processes. Changing a hyperparameter (nRs2, eta2, rcut, ...) changes the digest, so stale entries are never read.
+
+Entries are .npy files, loaded memory-mapped and copied to the device. Writes go to a temporary file that is renamed into place, so
+several processes can share a cache directory.
+
+'''
+import os
+import hashlib
+
+import numpy as np
+import torch
+
+
+def representation_digest(rep):
+
+    '''
+    digest of the representation class and of every public scalar, array and tensor attribute (species, cutoffs, radial grids,
+    decays, ...), the device excluded
+    '''
+
+    h = hashlib.sha1(type(rep).__name__.encode())
+
+    for name, value in sorted(vars(rep).items()):
+
+        if (name.startswith('_') or name == 'device'):
+            continue
+
+        if (isinstance(value, torch.Tensor)):
+            value = value.detach().cpu().numpy()
+
+        if (isinstance(value, np.ndarray)):
+            h.update(name.encode() + str(value.dtype).encode() + str(value.shape).encode() + np.ascontiguousarray(value).tobytes())
+        elif (isinstance(value, (bool, int, float, str, np.number))):
+            h.update(name.encode() + repr(value).encode())
+
+    return h.hexdigest()
+
+
+class RepresentationCache(object):
+
+    '''
+        path: cache directory, created if missing
+        rep: the representation, its hyperparameters enter every key
+    '''
+
+    def __init__(self, path, rep):
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.digest = representation_digest(rep)
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, *tags):
+
+        '''
+        hash of the geometry block of a batch formatted by format_packed, the representation digest and tags, e.g 'derivative' or a
+        digest of the projection matrices for projected entries
+        '''
+
+        h = hashlib.sha1(self.digest.encode())
+
+        for name in ('coordinates', 'charges', 'natom_counts', 'cells'):
+            tensor = data[name].detach().cpu().contiguous()
+            h.update(name.encode() + str(tuple(tensor.shape)).encode() + tensor.numpy().tobytes())
+
+        for tag in tags:
+            h.update(str(tag).encode())
+
+        return h.hexdigest()
+
+    def _file(self, key, name):
+        return os.path.join(self.path, key[:2], f"{key}.{name}.npy")
+
+    def load(self, key, names, device):
+
+        '''the tensors names of entry key on device, or None if any of them is missing'''
+
+        files = [self._file(key, name) for name in names]
+
+        if (not all(os.path.isfile(f) for f in files)):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        # copy-on-write maps so torch.from_numpy does not have to copy or warn about read-only memory
+        return [torch.from_numpy(np.load(f, mmap_mode='c')).to(device) for f in files]
+
+    def save(self, key, names, tensors):
+
+        os.makedirs(os.path.join(self.path, key[:2]), exist_ok=True)
+
+        for name, tensor in zip(names, tensors):
+
+            file = self._file(key, name)
+            tmp = f"{file}.{os.getpid()}.tmp"
+
+            with open(tmp, 'wb') as f:
+                np.save(f, tensor.detach().cpu().numpy())
+
+            os.replace(tmp, file)
+
+    def report(self):
+        return f"representation cache {self.path}: {self.hits} hits, {self.misses} misses"
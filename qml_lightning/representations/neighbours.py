@@ -0,0 +1,214 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Neighbour lists used by the representations.
+
+NeighbourList stores the pairs in compressed sparse row (CSR) format, so memory and work scale with the number of pairs within the
+cutoff rather than with nbatch * max_natoms * max_neighbours. For periodic systems every lattice image within the cutoff is listed
+with its integer shift, so cells narrower than twice the cutoff can be used directly rather than replicated into supercells.
+
+Periodic coordinates are wrapped into the cell once per call with wrap_coordinates, before the list is built. The pair search then
+detects orthorhombic cells and switches to a per-axis minimum image, triclinic cells use the general h^{-1} / h path.
+
+VerletList is a persistent neighbour list for MD. It is built once with rcut + skin and reused until any atom has moved more than
+skin / 2 since the last build, the pairs outside rcut being dropped inside the representation kernels.
+
+'''
+import torch
+from qml_lightning.backend import get_kernel
+
+
+class NeighbourList(object):
+
+    '''
+    CSR neighbour list over the rows (molID, iatom), row = molID * max_natoms + iatom:
+
+        nneighbours: [nbatch, max_natoms] number of neighbours of each atom
+        offsets: [nbatch * max_natoms + 1] the neighbours of row are indices[offsets[row]:offsets[row + 1]]
+        indices: [npairs] neighbour atom index within its molecule
+        shifts: [npairs, 3] integer lattice translation n of each neighbour for periodic systems, i.e the neighbouring image sits at
+                r_j + h n, where h is the cell matrix. In cells narrower than 2 * rcut the same atom j (or i itself) can appear once per
+                image. [0, 3] for open boundaries.
+    '''
+
+    def __init__(self, nneighbours, offsets, indices, shifts):
+        self.nneighbours = nneighbours
+        self.offsets = offsets
+        self.indices = indices
+        self.shifts = shifts
+
+    @property
+    def npairs(self):
+        return self.indices.shape[0]
+
+    @property
+    def max_natoms(self):
+        return self.nneighbours.shape[1]
+
+    def row_offsets(self):
+
+        '''[nbatch, max_natoms] start of each row in indices, as consumed by the representation kernels'''
+
+        return self.offsets[:-1].view(self.nneighbours.shape)
+
+    def pairs(self):
+
+        '''molecule, central atom and neighbour index of every pair, as long tensors of shape [npairs]'''
+
+        rows = torch.repeat_interleave(torch.arange(self.nneighbours.numel(), device=self.indices.device), self.nneighbours.flatten().long())
+
+        return rows // self.max_natoms, rows % self.max_natoms, self.indices.long()
+
+
+def wrap_coordinates(X: torch.Tensor, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+    '''
+    wraps every atom into its cell, r <-- r - h floor(h^{-1} r), so the fractional coordinates lie in [0, 1). Atoms that drifted many
+    cells away during MD keep their float precision and the minimum image shift of every pair is -1, 0 or 1. The translation is
+    piecewise constant, so the derivatives with respect to X are unchanged. X is returned as-is for open boundaries.
+    '''
+
+    if (cell.shape[0] == 0):
+        return X
+
+    s = torch.einsum('bij,baj->bai', inv_cell, X.detach())
+
+    return X - torch.einsum('bij,baj->bai', cell, torch.floor(s))
+
+
+def build_neighbour_list(X: torch.Tensor, atom_counts: torch.Tensor, rcut: float, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+    '''
+    builds the CSR neighbour list for the device X resides on: the neighbours are counted, the row offsets obtained by a prefix sum
+    and the indices written directly into the [npairs] array, so there is no padding to the largest neighbour count in the batch.
+    The image shifts are stored whenever cell is non-empty.
+    '''
+
+    nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, rcut, cell, inv_cell)
+
+    offsets = torch.zeros(nneighbours.numel() + 1, dtype=torch.int32, device=X.device)
+
+    offsets[1:] = torch.cumsum(nneighbours.flatten(), dim=0)
+
+    npairs = offsets[-1].item()
+
+    indices, shifts = get_kernel('neighbour_list_csr', X)(X, atom_counts, rcut, cell, inv_cell, offsets[:-1].view(nneighbours.shape), npairs,
+                                                          cell.shape[0] > 0)
+
+    return NeighbourList(nneighbours, offsets, indices, shifts)
+
+
+def get_neighbours_and_element_types(X: torch.Tensor, Z: torch.Tensor, species: torch.Tensor, atom_counts: torch.Tensor, rcut: float,
+                                     cell: torch.Tensor, inv_cell: torch.Tensor):
+
+    '''builds the CSR neighbour list and element types for the device X resides on'''
+
+    neighbours = build_neighbour_list(X, atom_counts, rcut, cell, inv_cell)
+
+    element_types = get_kernel('element_types', X)(X, Z, atom_counts, species)
+
+    return neighbours, element_types
+
+
+def get_neighbours(X: torch.Tensor, Z: torch.Tensor, species: torch.Tensor, atom_counts: torch.Tensor, rcut: float,
+                   cell: torch.Tensor, inv_cell: torch.Tensor, neighbour_list=None):
+
+    '''neighbour_list: optional VerletList, reused across calls until it needs rebuilding, otherwise a new list is built for rcut'''
+
+    if (neighbour_list is None):
+        return get_neighbours_and_element_types(X, Z, species, atom_counts, rcut, cell, inv_cell)
+
+    if (neighbour_list.rcut < rcut):
+        print("ERROR: the Verlet list cutoff", neighbour_list.rcut, "is smaller than the representation cutoff", rcut)
+        exit()
+
+    return neighbour_list.get(X, Z, species, atom_counts, cell, inv_cell)
+
+
+class VerletList(object):
+
+    '''
+    usage:
+
+        neighbour_list = VerletList(rep.high_cutoff, skin=1.0)
+
+        for step in range(nsteps):
+            energies, forces = model.predict_opt(X, Z, atomIDs, molIDs, natom_counts, neighbour_list=neighbour_list)
+            ...
+    '''
+
+    def __init__(self, rcut, skin=1.0):
+
+        if (skin < 0.0):
+            print("ERROR: the Verlet list skin must be non-negative, got:", skin)
+            exit()
+
+        self.rcut = rcut
+        self.skin = skin
+
+        self.nbuilds = 0
+        self.ncalls = 0
+
+        self.reset()
+
+    def reset(self):
+
+        '''forces a rebuild on the next call'''
+
+        self.reference_coordinates = None
+        self.charges = None
+        self.atom_counts = None
+        self.cell = None
+
+        self.neighbours = None
+        self.element_types = None
+
+    def displacements(self, X: torch.Tensor, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+        '''
+        squared displacement of every atom since the last build. The image shifts stored in the list refer to the coordinates at build
+        time, so no minimum image is applied: an atom wrapped back into the cell shows up as a large displacement and triggers a rebuild.
+        '''
+
+        dX = X - self.reference_coordinates
+
+        return (dX ** 2).sum(dim=-1)
+
+    def needs_rebuild(self, X: torch.Tensor, Z: torch.Tensor, atom_counts: torch.Tensor, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+        if (self.reference_coordinates is None or self.reference_coordinates.shape != X.shape or
+                self.reference_coordinates.device != X.device or self.cell.shape != cell.shape):
+            return True
+
+        # fold every check into a single device -> host transfer
+        changed = (Z != self.charges).any() | (atom_counts != self.atom_counts).any() | (cell != self.cell).any()
+
+        changed = changed | (self.displacements(X, cell, inv_cell).max() > (0.5 * self.skin) ** 2)
+
+        return changed.item()
+
+    def build(self, X: torch.Tensor, Z: torch.Tensor, species: torch.Tensor, atom_counts: torch.Tensor, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+        X = X.detach()
+
+        self.neighbours, self.element_types = get_neighbours_and_element_types(X, Z, species, atom_counts, self.rcut + self.skin, cell, inv_cell)
+
+        self.reference_coordinates = X.clone()
+        self.charges = Z.clone()
+        self.atom_counts = atom_counts.clone()
+        self.cell = cell.clone()
+
+        self.nbuilds += 1
+
+    def get(self, X: torch.Tensor, Z: torch.Tensor, species: torch.Tensor, atom_counts: torch.Tensor, cell: torch.Tensor, inv_cell: torch.Tensor):
+
+        '''returns the NeighbourList and element types for X, rebuilding the list only when it is no longer valid'''
+
+        self.ncalls += 1
+
+        if (self.needs_rebuild(X.detach(), Z, atom_counts, cell, inv_cell)):
+            self.build(X, Z, species, atom_counts, cell, inv_cell)
+
+        return self.neighbours, self.element_types
@@ -1,6 +1,8 @@
 import h5py
 import numpy as np
 
+from qml_lightning.utils.packed import PackedMolecules
+
 
 def iter_data_buckets(h5filename, keys=['wb97x_tz.energy', 'wb97x_tz.forces']):
     
@@ -17,7 +19,7 @@ def iter_data_buckets(h5filename, keys=['wb97x_tz.energy', 'wb97x_tz.forces']):
     with h5py.File(h5filename, 'r') as f:
         for grp in f.values():
             Nc = grp['coordinates'].shape[0]
-            mask = np.ones(Nc, dtype=np.bool)
+            mask = np.ones(Nc, dtype=bool)
             data = dict((k, grp[k][()]) for k in keys)
             for k in keys:
                 v = data[k].reshape(Nc, -1)
@@ -27,4 +29,17 @@ def iter_data_buckets(h5filename, keys=['wb97x_tz.energy', 'wb97x_tz.forces']):
             d = dict((k, data[k][mask]) for k in keys)
             d['atomic_numbers'] = grp['atomic_numbers'][()]
             d['coordinates'] = grp['coordinates'][()][mask]
-            yield d 
+            yield d
+
+
+def iter_packed_buckets(h5filename, energy_key='wb97x_dz.energy', forces_key='wb97x_dz.forces'):
+    
+    """ Iterate over the buckets of an ANI HDF5 file as PackedMolecules, one molecule (all of its conformers) at a time, 
+    e.g for model.train_streaming. forces_key may be None to only read energies.
+    """
+    
+    keys = [k for k in (energy_key, forces_key) if k is not None]
+    
+    for d in iter_data_buckets(h5filename, keys=keys):
+        yield PackedMolecules.from_frames(d['coordinates'], d['atomic_numbers'], E=d[energy_key],
+                                          F=d[forces_key] if forces_key is not None else None)
@@ -0,0 +1,95 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Batch scheduling over PackedMolecules.
+
+By default a dataset is cut into consecutive batches of nbatch molecules. With an atom budget, molecules are instead grouped into
+size buckets (molecules with the same number of atoms) in ascending size, and each batch is filled until its padded cost reaches the
+budget. The padded cost of a batch of nmol molecules padded to max_natoms atoms is nmol * max_natoms, or nmol * max_natoms^2 when
+budgeting atom pairs, which is what the padded representation derivatives scale with. Batches then hold few large molecules or many
+small ones, and hardly any padding since neighbouring molecules in the schedule have (nearly) the same size.
+
+'''
+import numpy as np
+
+
+class BatchSchedule(object):
+
+    '''
+        order: [nmol] molecule indexes in the order they are batched
+        bounds: [nbatches + 1] batch b holds the molecules order[bounds[b]:bounds[b + 1]]
+        contiguous: True if order is the identity, batches are then zero-copy slices
+    '''
+
+    def __init__(self, order, bounds, contiguous):
+        self.order = order
+        self.bounds = bounds
+        self.contiguous = contiguous
+
+    def __len__(self):
+        return self.bounds.shape[0] - 1
+
+    def indexes(self, b):
+
+        '''indexes of the molecules of batch b in the original dataset, used to put outputs back in the input order'''
+
+        return self.order[self.bounds[b]:self.bounds[b + 1]]
+
+    def batch(self, molecules, b):
+
+        '''PackedMolecules of batch b'''
+
+        if (self.contiguous):
+            return molecules.slice(self.bounds[b], self.bounds[b + 1])
+
+        return molecules.subset(self.indexes(b))
+
+
+def schedule_batches(natom_counts, nbatch, atom_budget=None, pairs=False):
+
+    '''
+    natom_counts: [nmol] number of atoms per molecule
+    nbatch: molecules per batch when atom_budget is None
+    atom_budget: maximum padded atoms (pairs=False) or atom pairs (pairs=True) per batch, a molecule larger than the budget is batched
+    on its own
+    '''
+
+    natom_counts = np.asarray(natom_counts, dtype=np.int64)
+
+    nmol = natom_counts.shape[0]
+
+    if (atom_budget is None):
+        return BatchSchedule(np.arange(nmol), np.append(np.arange(0, nmol, nbatch), nmol), True)
+
+    order = np.argsort(natom_counts, kind='stable')
+
+    sizes, counts = np.unique(natom_counts[order], return_counts=True)
+
+    bounds = [0]
+
+    position = 0
+    nopen = 0
+
+    for size, count in zip(sizes, counts):
+
+        # molecules are visited in ascending size, so the current bucket sets the padded size of the open batch
+        capacity = max(1, atom_budget // max(1, size * size if pairs else size))
+
+        while (count > 0):
+
+            if (nopen >= capacity):
+                bounds.append(position)
+                nopen = 0
+
+            take = min(count, capacity - nopen)
+
+            nopen += take
+            position += take
+            count -= take
+
+    if (nopen > 0):
+        bounds.append(position)
+
+    return BatchSchedule(order, np.array(bounds, dtype=np.int64), False)
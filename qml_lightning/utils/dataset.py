@@ -0,0 +1,260 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Datasets with precomputed element and size indexes.
+
+Dataset is a PackedMolecules that also holds the bookkeeping the models otherwise rebuild from the charges for every batch: the atom
+counts, the molecule and position of every atom, and per element the atoms of that element and the molecules containing it. The
+indexes are built once. Slices of contiguous molecules (the batches of build_Z_components and predict) cut them with one searchsorted
+per element, subsets (budgeted batches, subsamples) gather them, and format_packed hands the per-element atom rows of each batch to the
+models, so the batch loops index with them instead of evaluating charges == e and torch.where per element.
+
+A Dataset of frames of a single molecule (same atom count and charges in every molecule, e.g an MD17 or 3BPA trajectory built with
+from_frames) is detected when it is built and keeps that charge vector as its topology. The indexes of any n frames are then the
+first rows of the dataset's own, so its batches take prefix views instead of cutting or gathering indexes, and format_packed reshapes
+them into padded tensors and reuses per-topology device indexes, see BaseKernel.frame_indexes.
+
+'''
+import numpy as np
+
+from qml_lightning.utils.packed import PackedMolecules, as_packed
+
+
+def _group(element_index, nelements):
+
+    '''atom rows grouped by element index, ascending within each element, and the bounds of each group'''
+
+    order = np.argsort(element_index, kind='stable')
+
+    bounds = np.zeros(nelements + 2, dtype=np.int64)
+    np.cumsum(np.bincount(element_index, minlength=nelements + 1), out=bounds[1:])
+
+    return order, bounds[:nelements + 1]
+
+
+def _molecules(molIDs, order, bounds):
+
+    '''per element, the sorted molecules containing it'''
+
+    result = []
+
+    for i in range(bounds.shape[0] - 1):
+
+        mols = molIDs[order[bounds[i]:bounds[i + 1]]]
+
+        # the atoms of a group are ascending, so are their molecules
+        result.append(mols[np.concatenate(([True], mols[1:] != mols[:-1]))] if mols.shape[0] > 0 else mols)
+
+    return result
+
+
+class Dataset(PackedMolecules):
+
+    '''
+        coordinates, charges, offsets, energies, forces, cells, inv_cells: see PackedMolecules
+        elements: nuclear charges to index, defaults to the ones present in charges. Atoms of other elements are in no group.
+
+    Indexes, built once:
+
+        molIDs: [natoms_total] molecule of every atom
+        atomIDs: [natoms_total] position of every atom within its molecule
+        element_index: [natoms_total] position of the element of every atom in elements, len(elements) if not indexed
+        element_order: [natoms_total] atom rows grouped by element, in the order of elements, ascending within each element
+        element_bounds: [len(elements) + 1] the atoms of elements[i] are element_order[element_bounds[i]:element_bounds[i + 1]]
+        topology: [natoms] charges shared by every molecule of a single topology dataset, None otherwise
+    '''
+
+    def __init__(self, coordinates, charges, offsets, energies=None, forces=None, cells=None, inv_cells=None, elements=None):
+
+        super(Dataset, self).__init__(coordinates, charges, offsets, energies=energies, forces=forces, cells=cells, inv_cells=inv_cells)
+
+        charges = np.asarray(self.charges).astype(np.int64)
+
+        if (elements is None):
+            elements = np.unique(charges)
+
+        elements = np.asarray(elements, dtype=np.int64)
+
+        counts = np.diff(self.offsets).astype(np.int64)
+
+        molIDs = np.repeat(np.arange(counts.shape[0], dtype=np.int64), counts)
+
+        # position of each nuclear charge in elements
+        lookup = np.full(max(int(charges.max()) if charges.shape[0] > 0 else 0, int(elements.max()) if elements.shape[0] > 0 else 0) + 1,
+                         elements.shape[0], dtype=np.int64)
+        lookup[elements] = np.arange(elements.shape[0])
+
+        element_index = lookup[charges]
+
+        order, bounds = _group(element_index, elements.shape[0])
+
+        topology = None
+
+        if (counts.shape[0] > 0 and counts[0] > 0 and (counts == counts[0]).all()):
+            frames = charges.reshape(counts.shape[0], counts[0])
+            if ((frames == frames[0]).all()):
+                topology = frames[0].copy()
+
+        self._set_indexes(elements, counts, molIDs, np.arange(molIDs.shape[0], dtype=np.int64) - np.repeat(self.offsets[:-1], counts),
+                          element_index, order, bounds, _molecules(molIDs, order, bounds), topology)
+
+    def _set_indexes(self, elements, counts, molIDs, atomIDs, element_index, element_order, element_bounds, element_molecules, topology=None):
+
+        self.elements = elements
+        self._natom_counts = counts
+        self.molIDs = molIDs
+        self.atomIDs = atomIDs
+        self.element_index = element_index
+        self.element_order = element_order
+        self.element_bounds = element_bounds
+        self._element_molecules = element_molecules
+        self.topology = topology
+
+    @classmethod
+    def _from_indexes(cls, molecules, *indexes):
+
+        '''Dataset of the PackedMolecules molecules with indexes already derived from those of a parent'''
+
+        dataset = cls.__new__(cls)
+
+        PackedMolecules.__init__(dataset, molecules.coordinates, molecules.charges, molecules.offsets, energies=molecules.energies,
+                                 forces=molecules.forces, cells=molecules.cells, inv_cells=molecules.inv_cells)
+
+        dataset._set_indexes(*indexes)
+
+        return dataset
+
+    @classmethod
+    def from_packed(cls, molecules, elements=None):
+
+        '''indexes PackedMolecules molecules, the arrays are shared, not copied'''
+
+        return cls(molecules.coordinates, molecules.charges, molecules.offsets, energies=molecules.energies, forces=molecules.forces,
+                   cells=molecules.cells, inv_cells=molecules.inv_cells, elements=elements)
+
+    @property
+    def natom_counts(self):
+        return self._natom_counts
+
+    def _position(self, element):
+
+        matches = np.nonzero(self.elements == int(element))[0]
+
+        return matches[0] if matches.shape[0] > 0 else None
+
+    def element_atoms(self, element):
+
+        '''ascending rows of the atoms of element, empty if the dataset holds none'''
+
+        i = self._position(element)
+
+        if (i is None):
+            return self.element_order[:0]
+
+        return self.element_order[self.element_bounds[i]:self.element_bounds[i + 1]]
+
+    def molecules_containing(self, element):
+
+        '''indices of the molecules that contain at least one atom of element'''
+
+        i = self._position(element)
+
+        if (i is None):
+            return np.zeros(0, dtype=np.int64)
+
+        return self._element_molecules[i]
+
+    def _frame_indexes(self, nframes):
+
+        '''indexes of any nframes <= len(self) frames of a single topology dataset, prefixes of the indexes of this one'''
+
+        natoms = self.topology.shape[0]
+        nelements = self.elements.shape[0]
+
+        # atoms per frame of every element group, the unindexed group last
+        per_frame = np.bincount(self.element_index[:natoms], minlength=nelements + 1)
+
+        # the rows of a group are ascending, i.e ordered by frame, so those of the first nframes frames are its first rows
+        order = np.concatenate([self.element_order[s:s + c * nframes] for s, c in zip(self.element_bounds, per_frame)])
+
+        bounds = np.zeros(nelements + 1, dtype=np.int64)
+        np.cumsum(per_frame[:nelements] * nframes, out=bounds[1:])
+
+        mols = np.arange(nframes, dtype=np.int64)
+
+        return (self.elements, self._natom_counts[:nframes], self.molIDs[:nframes * natoms], self.atomIDs[:nframes * natoms],
+                self.element_index[:nframes * natoms], order, bounds, [mols if c > 0 else mols[:0] for c in per_frame[:nelements]],
+                self.topology)
+
+    def slice(self, start, stop):
+
+        '''molecules start:stop, the packed arrays as views and the indexes cut per element'''
+
+        stop = min(stop, len(self))
+
+        if (self.topology is not None):
+            return Dataset._from_indexes(PackedMolecules.slice(self, start, stop), *self._frame_indexes(stop - start))
+
+        a0, a1 = self.offsets[start], self.offsets[stop]
+
+        # one group per element, followed by the atoms of elements not indexed
+        groups = [self.element_order[self.element_bounds[i]:self.element_bounds[i + 1]] for i in range(self.elements.shape[0])]
+        groups.append(self.element_order[self.element_bounds[-1]:])
+
+        ranges = [g.searchsorted([a0, a1]) for g in groups]
+
+        order = np.concatenate([g[lo:hi] for g, (lo, hi) in zip(groups, ranges)]) - a0
+
+        bounds = np.zeros(self.elements.shape[0] + 2, dtype=np.int64)
+        np.cumsum([hi - lo for lo, hi in ranges], out=bounds[1:])
+
+        element_molecules = []
+
+        for mols in self._element_molecules:
+            lo, hi = mols.searchsorted([start, stop])
+            element_molecules.append(mols[lo:hi] - start)
+
+        return Dataset._from_indexes(PackedMolecules.slice(self, start, stop), self.elements, self._natom_counts[start:stop],
+                                     self.molIDs[a0:a1] - start, self.atomIDs[a0:a1], self.element_index[a0:a1], order,
+                                     bounds[:self.elements.shape[0] + 1], element_molecules)
+
+    def subset(self, indices):
+
+        '''copy of the molecules in indices, in that order, with the indexes gathered from this dataset'''
+
+        indices = np.asarray(indices, dtype=np.int64)
+
+        offsets, rows = self._subset_rows(indices)
+
+        if (self.topology is not None and indices.shape[0] <= len(self)):
+            return Dataset._from_indexes(self._gather(indices, offsets, rows), *self._frame_indexes(indices.shape[0]))
+
+        counts = self._natom_counts[indices]
+
+        molIDs = np.repeat(np.arange(indices.shape[0], dtype=np.int64), counts)
+
+        element_index = self.element_index[rows]
+
+        order, bounds = _group(element_index, self.elements.shape[0])
+
+        return Dataset._from_indexes(self._gather(indices, offsets, rows), self.elements, counts, molIDs, self.atomIDs[rows],
+                                     element_index, order, bounds, _molecules(molIDs, order, bounds))
+
+    def geometries(self):
+
+        '''the same molecules and indexes without energies and forces, e.g for prediction'''
+
+        return Dataset._from_indexes(PackedMolecules.geometries(self), self.elements, self._natom_counts, self.molIDs, self.atomIDs,
+                                     self.element_index, self.element_order, self.element_bounds, self._element_molecules, self.topology)
+
+
+def as_dataset(X, Q=None, E=None, F=None, cells=None, inv_cells=None):
+
+    '''X, Q, ... as a Dataset: X is returned as-is if it already is one, PackedMolecules and lists of per-molecule arrays are indexed once'''
+
+    if (isinstance(X, Dataset)):
+        return X
+
+    return Dataset.from_packed(as_packed(X, Q, E=E, F=F, cells=cells, inv_cells=inv_cells))
@@ -0,0 +1,235 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Vectorised extended XYZ reader.
+
+Frames are returned as PackedMolecules. The per-atom columns are taken from the Properties key of each comment line (species or Z,
+pos, and the forces column), the energy from the energy key and the cell from the Lattice key, whose three vectors are stored as the
+columns of the cell matrix (r = h s) as expected by the representations.
+
+Only the frame headers are visited in Python. The atom lines of all frames are gathered with a NumPy index, joined and tokenised once,
+and the numeric columns are converted by NumPy, so the cost per atom line is a few C-level operations rather than a float() per token.
+read_extxyz can keep the parsed arrays in an .npz sidecar next to the file, which is reused while the file is unchanged.
+
+'''
+import os
+import re
+import itertools
+
+import numpy as np
+
+from qml_lightning.utils.packed import PackedMolecules
+
+ELEMENTS = ('X H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh '
+            'Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra '
+            'Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og').split()
+
+SYMBOL2CHARGE = {s: z for z, s in enumerate(ELEMENTS)}
+
+DEFAULT_PROPERTIES = 'species:S:1:pos:R:3'
+
+_KEY_VALUE = re.compile(r'(\S+?)=("[^"]*"|\S+)')
+
+# bump when the sidecar layout changes
+_CACHE_VERSION = 1
+
+
+def parse_comment(line):
+
+    '''key=value pairs of an extended XYZ comment line, keys lower-cased and quotes stripped'''
+
+    return {k.lower(): v.strip('"') for k, v in _KEY_VALUE.findall(line)}
+
+
+def parse_properties(properties):
+
+    '''
+    column ranges of the per-atom properties, e.g species:S:1:pos:R:3:forces:R:3 -> {'species': (0, 1), 'pos': (1, 4), 'forces': (4, 7)}
+    '''
+
+    fields = properties.split(':')
+
+    columns = {}
+    start = 0
+
+    for i in range(0, len(fields), 3):
+
+        ncols = int(fields[i + 2])
+
+        columns[fields[i].lower()] = (start, start + ncols)
+
+        start += ncols
+
+    return columns
+
+
+def parse_frames(lines, energy_key='energy', forces_key='forces', source='extxyz'):
+
+    '''
+    PackedMolecules of the complete frames in lines (a list of str). energy_key and forces_key may be None to skip energies and
+    forces, Lattice is read if every frame has one.
+    '''
+
+    energy_key = energy_key.lower() if energy_key is not None else None
+    forces_key = forces_key.lower() if forces_key is not None else None
+
+    # frame headers: the only per-frame Python loop
+    starts = []
+    counts = []
+
+    p = 0
+
+    while p < len(lines):
+
+        if (not lines[p].strip()):
+            p += 1
+            continue
+
+        starts.append(p)
+        counts.append(int(lines[p]))
+
+        p += counts[-1] + 2
+
+    if (p > len(lines)):
+        print("ERROR: the last frame of", source, "is truncated.")
+        exit()
+
+    starts = np.array(starts, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+
+    nframes = starts.shape[0]
+
+    offsets = np.zeros(nframes + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    infos = [parse_comment(lines[s + 1]) for s in starts]
+
+    # line index of every atom, in frame order
+    atom_lines = np.repeat(starts + 2 - offsets[:-1], counts) + np.arange(offsets[-1], dtype=np.int64)
+
+    lines = np.array(lines, dtype=object)
+
+    coordinates = np.zeros((offsets[-1], 3), dtype=np.float64)
+    charges = np.zeros(offsets[-1], dtype=np.float64)
+    forces = np.zeros((offsets[-1], 3), dtype=np.float64) if forces_key is not None else None
+
+    properties = np.array([info.get('properties', DEFAULT_PROPERTIES) for info in infos], dtype=object)
+
+    # frames normally share one Properties layout, tokenise each layout in one go
+    for layout in np.unique(properties):
+
+        columns = parse_properties(layout)
+
+        ncols = max(b for a, b in columns.values())
+
+        rows = np.repeat(properties == layout, counts)
+
+        table = np.array(' '.join(lines[atom_lines[rows]]).split()).reshape(-1, ncols)
+
+        if ('species' in columns):
+            symbols, inverse = np.unique(table[:, columns['species'][0]], return_inverse=True)
+            charges[rows] = np.array([SYMBOL2CHARGE[s] for s in symbols], dtype=np.float64)[inverse]
+        else:
+            charges[rows] = table[:, columns['z'][0]].astype(np.float64)
+
+        a, b = columns['pos']
+        coordinates[rows] = table[:, a:b].astype(np.float64)
+
+        if (forces_key is not None):
+
+            if (forces_key not in columns):
+                print("ERROR: no", forces_key, "column in the Properties of", source, "- set forces_key=None to skip forces.")
+                exit()
+
+            a, b = columns[forces_key]
+            forces[rows] = table[:, a:b].astype(np.float64)
+
+    energies = None
+
+    if (energy_key is not None):
+
+        if (any(energy_key not in info for info in infos)):
+            print("ERROR: no", energy_key, "key in the comment lines of", source, "- set energy_key=None to skip energies.")
+            exit()
+
+        energies = np.array([info[energy_key] for info in infos], dtype=np.float64)
+
+    cells = None
+
+    if (nframes > 0 and all('lattice' in info for info in infos)):
+        cells = np.array([info['lattice'].split() for info in infos], dtype=np.float64).reshape(nframes, 3, 3).transpose(0, 2, 1)
+
+    return PackedMolecules(coordinates, charges, offsets, energies=energies, forces=forces, cells=cells)
+
+
+def read_extxyz(path, energy_key='energy', forces_key='forces', cache=False):
+
+    '''
+    reads every frame of the extended XYZ file at path as PackedMolecules.
+
+    cache: True to store the parsed arrays in path + '.npz' and reuse them on later calls, the sidecar is rebuilt whenever the size or
+    modification time of the file, or the keys requested, change
+    '''
+
+    stat = os.stat(path)
+
+    signature = np.array([_CACHE_VERSION, stat.st_size, stat.st_mtime_ns])
+    keys = np.array([energy_key or '', forces_key or ''])
+
+    sidecar = path + '.npz'
+
+    if (cache and os.path.isfile(sidecar)):
+
+        with np.load(sidecar) as data:
+
+            if (np.array_equal(data['signature'], signature) and np.array_equal(data['keys'], keys)):
+                return PackedMolecules(data['coordinates'], data['charges'], data['offsets'],
+                                       energies=data['energies'] if 'energies' in data else None,
+                                       forces=data['forces'] if 'forces' in data else None,
+                                       cells=data['cells'] if 'cells' in data else None)
+
+    with open(path, 'r') as f:
+        molecules = parse_frames(f.read().splitlines(), energy_key=energy_key, forces_key=forces_key, source=path)
+
+    if (cache):
+
+        columns = {'coordinates': molecules.coordinates, 'charges': molecules.charges, 'offsets': molecules.offsets,
+                   'energies': molecules.energies, 'forces': molecules.forces, 'cells': molecules.cells}
+
+        np.savez(sidecar, signature=signature, keys=keys, **{k: v for k, v in columns.items() if v is not None})
+
+    return molecules
+
+
+def iter_extxyz_chunks(path, chunk_size=4096, energy_key='energy', forces_key='forces'):
+
+    '''
+    generator over the frames of the extended XYZ file at path as PackedMolecules of at most chunk_size frames, for files too large
+    to be read at once. Each chunk is parsed with parse_frames.
+    '''
+
+    with open(path, 'r') as f:
+
+        while True:
+
+            lines = []
+
+            for _ in range(chunk_size):
+
+                header = f.readline()
+
+                while (header and not header.strip()):
+                    header = f.readline()
+
+                if (not header):
+                    break
+
+                lines.append(header)
+                lines.extend(itertools.islice(f, int(header) + 1))
+
+            if (len(lines) == 0):
+                break
+
+            yield parse_frames([l.rstrip('\n') for l in lines], energy_key=energy_key, forces_key=forces_key, source=path)
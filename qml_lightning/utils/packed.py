@@ -0,0 +1,183 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Packed (flat) molecular datasets.
+
+PackedMolecules stores a dataset as a handful of contiguous arrays rather than as lists of per-molecule arrays: the atoms of all
+molecules are concatenated along the first axis and delimited by an offsets array. Batches are obtained by slicing, which returns
+views of the underlying arrays (NumPy or memory-mapped), so no per-molecule Python objects are created while training or predicting.
+
+'''
+import numpy as np
+
+
+class PackedMolecules(object):
+
+    '''
+        coordinates: [natoms_total, 3]
+        charges: [natoms_total]
+        offsets: [nmol + 1] exclusive prefix sum of the atom counts, the atoms of molecule i are offsets[i]:offsets[i + 1]
+        energies: [nmol], or None
+        forces: [natoms_total, 3], or None
+        cells: [nmol, 3, 3] lattice vectors as columns (r = h s), or None for open boundaries
+        inv_cells: [nmol, 3, 3], or None to compute them from cells when a batch is formatted
+    '''
+
+    def __init__(self, coordinates, charges, offsets, energies=None, forces=None, cells=None, inv_cells=None):
+
+        offsets = np.asarray(offsets)
+
+        if (offsets.ndim != 1 or offsets.shape[0] < 1 or offsets[0] != 0):
+            print("ERROR: offsets must be a 1D exclusive prefix sum of the atom counts starting at 0, got shape", offsets.shape)
+            exit()
+
+        if (coordinates.shape[0] != offsets[-1] or charges.shape[0] != offsets[-1]):
+            print("ERROR: offsets describe", offsets[-1], "atoms but coordinates and charges hold", coordinates.shape[0], "and", charges.shape[0])
+            exit()
+
+        self.coordinates = coordinates
+        self.charges = charges
+        self.offsets = offsets
+        self.energies = energies
+        self.forces = forces
+        self.cells = cells
+        self.inv_cells = inv_cells
+
+    @classmethod
+    def from_lists(cls, X, Q, E=None, F=None, cells=None, inv_cells=None):
+
+        '''packs lists of per-molecule arrays, X: [natom_i, 3], Q: [natom_i], E: scalars, F: [natom_i, 3], cells: [3, 3]'''
+
+        counts = np.fromiter((len(x) for x in X), dtype=np.int64, count=len(X))
+
+        offsets = np.zeros(len(X) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(np.concatenate(X), np.concatenate(Q), offsets,
+                   energies=np.asarray(E, dtype=np.float64).reshape(len(X)) if E is not None else None,
+                   forces=np.concatenate(F) if F is not None else None,
+                   cells=np.asarray(cells).reshape(len(X), 3, 3) if cells is not None else None,
+                   inv_cells=np.asarray(inv_cells).reshape(len(X), 3, 3) if (cells is not None and inv_cells is not None) else None)
+
+    @classmethod
+    def from_frames(cls, R, z, E=None, F=None, cells=None, inv_cells=None):
+
+        '''
+        packs nframes conformers of one molecule, e.g MD17: R [nframes, natoms, 3], z [natoms], E [nframes], F [nframes, natoms, 3].
+        R and F are reshaped without copying whenever they are contiguous.
+        '''
+
+        nframes, natoms = R.shape[0], R.shape[1]
+
+        offsets = np.arange(nframes + 1, dtype=np.int64) * natoms
+
+        return cls(R.reshape(nframes * natoms, 3), np.tile(np.asarray(z), nframes), offsets,
+                   energies=np.asarray(E).reshape(nframes) if E is not None else None,
+                   forces=F.reshape(nframes * natoms, 3) if F is not None else None,
+                   cells=cells, inv_cells=inv_cells)
+
+    @classmethod
+    def concatenate(cls, chunks):
+
+        '''one PackedMolecules holding the molecules of every PackedMolecules in chunks, in order'''
+
+        counts = np.concatenate([c.natom_counts for c in chunks])
+
+        offsets = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        def column(name):
+            values = [getattr(c, name) for c in chunks]
+            return np.concatenate(values) if all(v is not None for v in values) else None
+
+        return cls(np.concatenate([c.coordinates for c in chunks]), np.concatenate([c.charges for c in chunks]), offsets,
+                   energies=column('energies'), forces=column('forces'), cells=column('cells'), inv_cells=column('inv_cells'))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    @property
+    def natom_counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def max_natoms(self):
+        return int(self.natom_counts.max()) if len(self) > 0 else 0
+
+    def slice(self, start, stop):
+
+        '''molecules start:stop as views of the packed arrays'''
+
+        stop = min(stop, len(self))
+
+        a0, a1 = self.offsets[start], self.offsets[stop]
+
+        return PackedMolecules(self.coordinates[a0:a1], self.charges[a0:a1], self.offsets[start:stop + 1] - a0,
+                               energies=self.energies[start:stop] if self.energies is not None else None,
+                               forces=self.forces[a0:a1] if self.forces is not None else None,
+                               cells=self.cells[start:stop] if self.cells is not None else None,
+                               inv_cells=self.inv_cells[start:stop] if self.inv_cells is not None else None)
+
+    def subset(self, indices):
+
+        '''copy of the molecules in indices, in that order'''
+
+        indices = np.asarray(indices, dtype=np.int64)
+
+        offsets, rows = self._subset_rows(indices)
+
+        return self._gather(indices, offsets, rows)
+
+    def _gather(self, indices, offsets, rows):
+
+        '''PackedMolecules of the molecules in indices, given their offsets and atom rows from _subset_rows'''
+
+        return PackedMolecules(self.coordinates[rows], self.charges[rows], offsets,
+                               energies=self.energies[indices] if self.energies is not None else None,
+                               forces=self.forces[rows] if self.forces is not None else None,
+                               cells=self.cells[indices] if self.cells is not None else None,
+                               inv_cells=self.inv_cells[indices] if self.inv_cells is not None else None)
+
+    def _subset_rows(self, indices):
+
+        '''offsets of the molecules in indices once packed, and the rows of their atoms'''
+
+        counts = self.natom_counts[indices]
+
+        offsets = np.zeros(indices.shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # atom rows of the selected molecules, without a per-molecule loop
+        rows = np.repeat(self.offsets[indices] - offsets[:-1], counts) + np.arange(offsets[-1], dtype=np.int64)
+
+        return offsets, rows
+
+    def geometries(self):
+
+        '''the same molecules without energies and forces, e.g for prediction'''
+
+        return PackedMolecules(self.coordinates, self.charges, self.offsets, cells=self.cells, inv_cells=self.inv_cells)
+
+    def molecules_containing(self, element):
+
+        '''indices of the molecules that contain at least one atom of element'''
+
+        molIDs = np.repeat(np.arange(len(self), dtype=np.int64), self.natom_counts)
+
+        return np.unique(molIDs[self.charges == element])
+
+
+def as_packed(X, Q=None, E=None, F=None, cells=None, inv_cells=None):
+
+    '''X, Q, ... as PackedMolecules: X is returned as-is if it already is one, lists of per-molecule arrays are packed once'''
+
+    if (isinstance(X, PackedMolecules)):
+        return X
+
+    if (Q is None):
+        print("ERROR: charges Q must be given along with the list of coordinates X.")
+        exit()
+
+    return PackedMolecules.from_lists(X, Q, E=E, F=F, cells=cells, inv_cells=inv_cells)
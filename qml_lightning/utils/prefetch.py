@@ -0,0 +1,188 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+Bounded producer/consumer pipeline overlapping batch preparation with compute.
+
+Prefetcher runs prepare(item) for every item of an iterable in a background thread, keeping at most depth prepared batches queued,
+while the caller consumes earlier batches. prepare is typically model.format_packed, i.e packing, self-energy subtraction, unit
+conversion and the host to device copy. The item iterable is also advanced in the background thread, so reading a streamed dataset
+(e.g HDF5 groups) overlaps with compute too.
+
+On CUDA devices the producer issues its copies on a side stream, from pinned host buffers if prepare uses them, and the consumer's
+stream waits on an event recorded after each batch, so copies overlap with kernels of the previous batch without synchronizing.
+
+Every stage is timed, so report() shows where the pipeline stalls:
+
+    prepare: time spent in prepare(item) (and advancing items)
+    producer stall: time the producer waited on a full queue, i.e compute is the bottleneck
+    consumer stall: time the consumer waited on an empty queue, i.e preparation is the bottleneck
+    compute: time the consumer spent between receiving a batch and asking for the next one
+
+'''
+import time
+import queue
+import threading
+import contextlib
+
+import torch
+
+from qml_lightning.backend import device_type_of
+
+_DONE = object()
+
+
+def _record_stream(data, stream):
+
+    '''marks every CUDA tensor in data as used by stream, so the caching allocator does not reuse it while stream may still read it'''
+
+    if (isinstance(data, torch.Tensor)):
+        if (data.is_cuda):
+            data.record_stream(stream)
+    elif (isinstance(data, dict)):
+        for v in data.values():
+            _record_stream(v, stream)
+    elif (isinstance(data, (list, tuple))):
+        for v in data:
+            _record_stream(v, stream)
+
+
+class Prefetcher(object):
+
+    '''
+        items: iterable of inputs of prepare, consumed once
+        prepare: function item -> batch
+        depth: maximum number of prepared batches waiting to be consumed, 0 prepares each batch when it is requested (no thread)
+        device: device the batches are placed on by prepare
+    '''
+
+    def __init__(self, items, prepare, depth=2, device=None):
+
+        self.items = items
+        self.prepare = prepare
+        self.depth = depth
+        self.device = device
+
+        self.nbatches = 0
+
+        self.prepare_ms = 0.0
+        self.producer_stall_ms = 0.0
+        self.consumer_stall_ms = 0.0
+        self.compute_ms = 0.0
+
+    def __iter__(self):
+
+        if (self.depth <= 0):
+            return self._serial()
+
+        return self._pipelined()
+
+    def _serial(self):
+
+        for item in self.items:
+
+            t0 = time.perf_counter()
+            batch = self.prepare(item)
+            t1 = time.perf_counter()
+
+            self.prepare_ms += (t1 - t0) * 1000.0
+            self.nbatches += 1
+
+            yield batch
+
+            self.compute_ms += (time.perf_counter() - t1) * 1000.0
+
+    def _pipelined(self):
+
+        cuda = device_type_of(self.device) == 'cuda'
+
+        stream = torch.cuda.Stream(self.device) if cuda else None
+
+        batches = queue.Queue(maxsize=self.depth)
+
+        stop = threading.Event()
+
+        def put(entry):
+
+            t0 = time.perf_counter()
+
+            # wake up regularly to check whether the consumer has stopped early
+            while not stop.is_set():
+                try:
+                    batches.put(entry, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            self.producer_stall_ms += (time.perf_counter() - t0) * 1000.0
+
+        def produce():
+
+            try:
+                with torch.cuda.stream(stream) if cuda else contextlib.nullcontext():
+
+                    iterator = iter(self.items)
+
+                    while not stop.is_set():
+
+                        t0 = time.perf_counter()
+
+                        item = next(iterator, _DONE)
+
+                        if (item is _DONE):
+                            break
+
+                        batch = self.prepare(item)
+
+                        event = None
+
+                        if (cuda):
+                            event = torch.cuda.Event()
+                            event.record(stream)
+
+                        self.prepare_ms += (time.perf_counter() - t0) * 1000.0
+
+                        put((batch, event, None))
+
+            except BaseException as e:
+                # errors (including the exit() of an input check) are raised again in the consumer
+                put((None, None, e))
+
+            put((_DONE, None, None))
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        try:
+            while True:
+
+                t0 = time.perf_counter()
+                batch, event, error = batches.get()
+                t1 = time.perf_counter()
+
+                self.consumer_stall_ms += (t1 - t0) * 1000.0
+
+                if (error is not None):
+                    raise error
+
+                if (batch is _DONE):
+                    break
+
+                if (event is not None):
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    _record_stream(batch, current)
+
+                self.nbatches += 1
+
+                yield batch
+
+                self.compute_ms += (time.perf_counter() - t1) * 1000.0
+        finally:
+            stop.set()
+            producer.join()
+
+    def report(self):
+        return (f"{self.nbatches} batches, queue depth {self.depth}: prepare {self.prepare_ms:.2f} ms, producer stall {self.producer_stall_ms:.2f} ms, "
+                f"consumer stall {self.consumer_stall_ms:.2f} ms, compute {self.compute_ms:.2f} ms")
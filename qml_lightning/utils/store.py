@@ -0,0 +1,238 @@
+'''
+Created on 18 Oct 2026
+
+@author: Nicholas J. Browning
+
+On-disk columnar store for datasets that do not fit in memory.
+
+A store is a directory holding one flat binary file per column of PackedMolecules (coordinates, charges, offsets and optionally
+energies, forces and cells) and a store.json describing their dtypes and shapes. open_store memory-maps the columns, so batches sliced
+from the returned PackedMolecules are read from disk on demand and training memory only depends on the batch size.
+
+Stores are written incrementally with StoreWriter, so the converters (npz, ANI-style HDF5, extxyz) never hold more than one chunk of
+the source dataset in memory, except for npz files of object arrays which numpy can only load whole.
+
+'''
+import os
+import json
+
+import numpy as np
+
+from qml_lightning.utils.packed import PackedMolecules
+
+# coordinates are stored in single precision as the representation kernels take float32 inputs
+COLUMN_DTYPES = {'coordinates': np.float32, 'charges': np.uint8, 'offsets': np.int64, 'energies': np.float64, 'forces': np.float64,
+                 'cells': np.float64}
+
+# trailing shape of each column, the leading dimension is natoms_total, nmol or nmol + 1
+COLUMN_SHAPES = {'coordinates': (3,), 'charges': (), 'offsets': (), 'energies': (), 'forces': (3,), 'cells': (3, 3)}
+
+
+class StoreWriter(object):
+
+    '''
+    appends PackedMolecules chunks to the store at path, usage:
+
+        with StoreWriter(path) as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+
+    the columns written are fixed by the first chunk, every later chunk must carry the same columns
+    '''
+
+    def __init__(self, path):
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.columns = None
+        self.files = {}
+
+        self.nmol = 0
+        self.natoms = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, molecules):
+
+        chunk = {'coordinates': molecules.coordinates, 'charges': molecules.charges, 'energies': molecules.energies,
+                 'forces': molecules.forces, 'cells': molecules.cells}
+
+        columns = ['offsets'] + [k for k, v in chunk.items() if v is not None]
+
+        if (self.columns is None):
+
+            self.columns = columns
+
+            for column in columns:
+                self.files[column] = open(os.path.join(self.path, column + '.bin'), 'wb')
+
+            self.files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+
+        elif (columns != self.columns):
+            print("ERROR: every chunk appended to a store must have the same columns, expected", self.columns, "got", columns)
+            exit()
+
+        chunk['offsets'] = molecules.offsets[1:] + self.natoms
+
+        for column in columns:
+            self.files[column].write(np.ascontiguousarray(chunk[column], dtype=COLUMN_DTYPES[column]).tobytes())
+
+        self.nmol += len(molecules)
+        self.natoms += int(molecules.offsets[-1])
+
+    def close(self):
+
+        if (self.columns is None):
+            print("ERROR: no molecules were written to the store at", self.path)
+            exit()
+
+        for f in self.files.values():
+            f.close()
+
+        self.files = {}
+
+        lengths = {'coordinates': self.natoms, 'charges': self.natoms, 'forces': self.natoms, 'offsets': self.nmol + 1,
+                   'energies': self.nmol, 'cells': self.nmol}
+
+        meta = {'nmol': self.nmol, 'natoms': self.natoms,
+                'columns': {c: {'dtype': np.dtype(COLUMN_DTYPES[c]).str, 'shape': [lengths[c]] + list(COLUMN_SHAPES[c])} for c in self.columns}}
+
+        with open(os.path.join(self.path, 'store.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+
+def write_store(path, molecules, chunk_size=65536):
+
+    '''writes PackedMolecules to a new store at path'''
+
+    with StoreWriter(path) as writer:
+        for i in range(0, len(molecules), chunk_size):
+            writer.append(molecules.slice(i, i + chunk_size))
+
+
+def open_store(path):
+
+    '''
+    memory-maps the store at path as PackedMolecules. The maps are copy-on-write, so the columns can be wrapped by torch.from_numpy
+    without copying while the files on disk are never modified.
+    '''
+
+    meta_file = os.path.join(path, 'store.json')
+
+    if (not os.path.isfile(meta_file)):
+        print("ERROR: no store found at", path, "- convert a dataset with convert_npz, convert_hdf5 or convert_extxyz first.")
+        exit()
+
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+
+    columns = {}
+
+    for column, info in meta['columns'].items():
+
+        if (np.prod(info['shape']) == 0):
+            columns[column] = np.zeros(info['shape'], dtype=np.dtype(info['dtype']))
+            continue
+
+        columns[column] = np.memmap(os.path.join(path, column + '.bin'), dtype=np.dtype(info['dtype']), mode='c', shape=tuple(info['shape']))
+
+    return PackedMolecules(columns['coordinates'], columns['charges'], columns['offsets'], energies=columns.get('energies'),
+                          forces=columns.get('forces'), cells=columns.get('cells'))
+
+
+def convert_npz(npz_path, path, coordinates='R', charges='z', energies='E', forces='F', cells=None, chunk_size=65536):
+
+    '''
+    converts an npz file to a store. Two layouts are understood, selected by the key names given:
+
+        single topology (e.g MD17): coordinates [nframes, natoms, 3] with charges [natoms]
+        molecule lists (e.g QM9): object arrays of per-molecule coordinates [natom_i, 3] and charges [natom_i]
+
+    energies, forces and cells may be None, or missing from the file, to skip them
+    '''
+
+    data = np.load(npz_path, allow_pickle=True)
+
+    def column(key):
+        return data[key] if (key is not None and key in data) else None
+
+    R, z, E, F, H = column(coordinates), column(charges), column(energies), column(forces), column(cells)
+
+    with StoreWriter(path) as writer:
+
+        for i in range(0, len(R), chunk_size):
+
+            sub = slice(i, i + chunk_size)
+
+            if (R.dtype != object and R.ndim == 3 and z.ndim == 1):
+                chunk = PackedMolecules.from_frames(R[sub], z, E=E[sub] if E is not None else None, F=F[sub] if F is not None else None,
+                                                    cells=H[sub] if H is not None else None)
+            else:
+                chunk = PackedMolecules.from_lists(list(R[sub]), list(z[sub]), E=E[sub] if E is not None else None,
+                                                   F=list(F[sub]) if F is not None else None, cells=H[sub] if H is not None else None)
+
+            writer.append(chunk)
+
+
+def convert_hdf5(h5_path, path, energy_key='wb97x_dz.energy', forces_key='wb97x_dz.forces'):
+
+    '''
+    converts an ANI-style HDF5 file (one group per molecule holding atomic_numbers [natoms] and coordinates [nconformers, natoms, 3],
+    e.g ANI-1x) to a store, one group at a time. forces_key may be None to skip forces. Conformers with NaN properties are dropped.
+    '''
+
+    from qml_lightning.utils.ani1x_dataloader import iter_packed_buckets
+
+    with StoreWriter(path) as writer:
+        for group in iter_packed_buckets(h5_path, energy_key=energy_key, forces_key=forces_key):
+            writer.append(group)
+
+
+def convert_extxyz(xyz_path, path, energy_key='energy', forces_key='forces', chunk_size=4096):
+
+    '''converts an extended XYZ file to a store, chunk_size frames at a time. See qml_lightning.utils.extxyz for the keys.'''
+
+    from qml_lightning.utils.extxyz import iter_extxyz_chunks
+
+    with StoreWriter(path) as writer:
+        for chunk in iter_extxyz_chunks(xyz_path, chunk_size, energy_key=energy_key, forces_key=forces_key):
+            writer.append(chunk)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="python3 -m qml_lightning.utils.store input.{npz,h5,xyz,extxyz} output_store_dir")
+
+    parser.add_argument("input", type=str)
+    parser.add_argument("output", type=str)
+    parser.add_argument("-energy_key", type=str, default=None, help="defaults to E (npz), wb97x_dz.energy (HDF5), energy (extxyz)")
+    parser.add_argument("-forces_key", type=str, default=None, help="defaults to F (npz), wb97x_dz.forces (HDF5), forces (extxyz)")
+    parser.add_argument("-coordinates_key", type=str, default='R', help="npz only")
+    parser.add_argument("-charges_key", type=str, default='z', help="npz only")
+    parser.add_argument("-cells_key", type=str, default=None, help="npz only")
+
+    args = parser.parse_args()
+
+    extension = os.path.splitext(args.input)[1].lower()
+
+    if (extension == '.npz'):
+        convert_npz(args.input, args.output, coordinates=args.coordinates_key, charges=args.charges_key, energies=args.energy_key or 'E',
+                    forces=args.forces_key or 'F', cells=args.cells_key)
+    elif (extension in ('.h5', '.hdf5')):
+        convert_hdf5(args.input, args.output, energy_key=args.energy_key or 'wb97x_dz.energy', forces_key=args.forces_key or 'wb97x_dz.forces')
+    elif (extension in ('.xyz', '.extxyz')):
+        convert_extxyz(args.input, args.output, energy_key=args.energy_key or 'energy', forces_key=args.forces_key or 'forces')
+    else:
+        print("ERROR: unknown dataset format", extension, "- expected .npz, .h5/.hdf5 or .xyz/.extxyz")
+        exit()
+
+    molecules = open_store(args.output)
+
+    print ("wrote", len(molecules), "molecules,", molecules.offsets[-1], "atoms to", args.output)
@@ -4,7 +4,7 @@ Created on 11 Dec 2021
 @author: Nicholas J. Browning
 '''
 import torch
-from qml_lightning.cuda import utils_gpu
+from qml_lightning.backend import get_kernel, load_extension
 
 
 class MulInPlaceByConst(torch.autograd.Function):
@@ -12,7 +12,7 @@ class MulInPlaceByConst(torch.autograd.Function):
     @staticmethod
     def forward(ctx, X, f):
         
-        utils_gpu.MulInPlaceByConstCUDA(X, f)
+        get_kernel('mul_in_place_by_const', X)(X, f)
         
         ctx.f = f
         
@@ -21,7 +21,7 @@ class MulInPlaceByConst(torch.autograd.Function):
     @staticmethod
     def backward(ctx, gradX):
         
-        utils_gpu.MulInPlaceByConstCUDA(gradX, ctx.f)
+        get_kernel('mul_in_place_by_const', gradX)(gradX, ctx.f)
         
         return gradX, None
     
@@ -34,7 +34,7 @@ class CosFeatures(torch.autograd.Function):
         ctx.normalisation = normalisation
         ctx.save_for_backward(X, indexes, bias)
         
-        return utils_gpu.CosFeaturesCUDA(X, indexes, bias, normalisation)
+        return load_extension('utils_gpu').CosFeaturesCUDA(X, indexes, bias, normalisation)
 
     @staticmethod
     def backward(ctx, gradX):
@@ -42,5 +42,5 @@ class CosFeatures(torch.autograd.Function):
         print ("gradX shape: ", gradX.shape)
         X, indexes, bias = ctx.saved_tensors
         
-        return utils_gpu.DerivativeCosFeaturesCUDA(X, indexes, bias, ctx.normalisation, gradX), None, None, None
+        return load_extension('utils_gpu').DerivativeCosFeaturesCUDA(X, indexes, bias, ctx.normalisation, gradX), None, None, None
 
@@ -21,6 +21,8 @@ __url__ = "TODO"
 optimisation_level_host = ['-O2']
 optimisation_level_device = ['-O2']
 
+openmp_flags = ['-fopenmp']
+
 
 def readme():
     with open('README.md') as f:
@@ -32,6 +34,49 @@ def requirements():
         return [line.rstrip() for line in f]
 
 
+# CPU (OpenMP) backend - always built so the library can be installed on machines without a CUDA toolkit.
+
+fchl_cpu_extension = CppExtension(
+    '.cuda.fchl_cpu', [
+        'qml_lightning/cuda/fchl_cpu.cpp'
+    ],
+    extra_compile_args=optimisation_level_host + openmp_flags,
+    extra_link_args=openmp_flags)
+
+gto_cpu_extension = CppExtension(
+    '.cuda.egto_cpu', [
+        'qml_lightning/cuda/gto_cpu.cpp'
+    ],
+    extra_compile_args=optimisation_level_host + openmp_flags,
+    extra_link_args=openmp_flags)
+
+pairlist_cpu_extension = CppExtension(
+    '.cuda.pairlist_cpu', [
+        'qml_lightning/cuda/pairlist_cpu.cpp'
+    ],
+    extra_compile_args=optimisation_level_host + openmp_flags,
+    extra_link_args=openmp_flags)
+
+sorf_cpu_extension = CppExtension(
+    '.cuda.sorf_cpu', [
+        'qml_lightning/cuda/hadamard_cpu.cpp'
+    ],
+    extra_compile_args=optimisation_level_host + openmp_flags,
+    extra_link_args=openmp_flags)
+
+rff_cpu_extension = CppExtension(
+    '.cuda.rff_cpu', [
+        'qml_lightning/cuda/random_features_cpu.cpp'
+    ],
+    extra_compile_args=optimisation_level_host + openmp_flags,
+    extra_link_args=openmp_flags)
+
+ext_modules.append(fchl_cpu_extension)
+ext_modules.append(gto_cpu_extension)
+ext_modules.append(pairlist_cpu_extension)
+ext_modules.append(sorf_cpu_extension)
+ext_modules.append(rff_cpu_extension)
+
 if torch.cuda.is_available() and CUDA_HOME is not None:
     
     gto_extension = CUDAExtension(
@@ -90,9 +135,8 @@ if torch.cuda.is_available() and CUDA_HOME is not None:
     ext_modules.append(utils_extension)
     
 else:
-    print("ERROR: cuda not available, or CUDA_HOME not set.")
-    exit()
-    
+    print("WARNING: cuda not available, or CUDA_HOME not set. Only the CPU backend will be built.")
+
 setup(
     name='qmlightning',
     packages=['qml_lightning',
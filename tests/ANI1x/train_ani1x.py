@@ -0,0 +1,100 @@
+import torch
+import numpy as np
+
+import argparse
+
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.utils.ani1x_dataloader import iter_packed_buckets
+from qml_lightning.utils.packed import PackedMolecules
+
+'''
+Streaming training on the full ANI-1x HDF5 file (https://github.com/aiqm/ANI1x_datasets). The file is read one molecule group at a
+time, Z^T Z and the self-energy statistics are accumulated in a single pass, and every test_every-th group is held out for testing.
+'''
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nbatch_train", type=int, default=64)
+    parser.add_argument("-nbatch_test", type=int, default=256)
+    parser.add_argument("-atom_budget", type=int, default=None)
+    parser.add_argument("-prefetch", type=int, default=2, help="batches read and formatted ahead of the current batch")
+
+    '''model parameters'''
+    parser.add_argument("-sigma", type=float, default=2.0)
+    parser.add_argument("-llambda", type=float, default=1e-5)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-ntransforms", type=int, default=2)
+    parser.add_argument("-nstacks", type=int, default=64)
+
+    parser.add_argument('-rcut', type=float, default=6.0)
+
+    parser.add_argument("-forces", type=int, default=1)
+    parser.add_argument("-energy_key", type=str, default="wb97x_dz.energy")
+    parser.add_argument("-forces_key", type=str, default="wb97x_dz.forces")
+    parser.add_argument("-reductor_groups", type=int, default=256, help="number of held-in groups used to compute the projections")
+    parser.add_argument("-test_every", type=int, default=50)
+    parser.add_argument("-path", type=str, default="../data/ani1x-release.h5")
+
+    args = parser.parse_args()
+
+    print ("---Argument Summary---")
+    print (args)
+
+    forces_key = args.forces_key if args.forces else None
+
+    unique_z = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=unique_z, high_cutoff=args.rcut)
+
+    model = HadamardFeaturesModel(rep, elements=unique_z, sigma=args.sigma, llambda=args.llambda,
+                                nstacks=args.nstacks, ntransforms=args.ntransforms, npcas=args.npcas,
+                                nbatch_train=args.nbatch_train, nbatch_test=args.nbatch_test)
+
+    model.set_atom_budget(args.atom_budget)
+    model.set_prefetch(args.prefetch)
+
+    # energies and forces are in Hartree, Hartree / A
+    model.set_convert_hartree2kcal(True)
+    model.set_subtract_self_energies(True)
+
+    def groups(test):
+        for i, group in enumerate(iter_packed_buckets(args.path, energy_key=args.energy_key, forces_key=forces_key)):
+            if ((i % args.test_every == 0) == test):
+                yield group
+
+    print ("Calculating projection matrices...")
+
+    reductor_groups = []
+
+    for group in groups(test=False):
+        reductor_groups.append(group.subset(np.random.choice(len(group), size=min(len(group), 16), replace=False)))
+
+        if (len(reductor_groups) == args.reductor_groups):
+            break
+
+    model.get_reductors(PackedMolecules.concatenate(reductor_groups).geometries(), npcas=args.npcas)
+
+    del reductor_groups
+
+    print ("Streaming training set...")
+    model.train_streaming(groups(test=False))
+
+    test_molecules = PackedMolecules.concatenate(list(groups(test=True)))
+
+    data = model.format_packed(test_molecules)
+
+    test_energies = data['energies']
+
+    if (args.forces):
+        energy_predictions, force_predictions = model.predict(test_molecules, forces=True, use_backward=True)
+
+        print("Energy MAE /w backwards:", torch.mean(torch.abs(energy_predictions - test_energies)))
+        print("Force MAE /w backwards:", torch.mean(torch.abs(force_predictions - data['forces'])))
+    else:
+        energy_predictions = model.predict(test_molecules, forces=False, use_backward=True)
+
+        print("Energy MAE /w backwards:", torch.mean(torch.abs(energy_predictions - test_energies)))
@@ -5,6 +5,7 @@ import argparse
 
 from qml_lightning.representations.FCHL import FCHLCuda
 from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.utils.dataset import Dataset
 
 if __name__ == "__main__":
     
@@ -72,27 +73,19 @@ if __name__ == "__main__":
     nuclear_charges = data['z']
     energies = data['E'].flatten()
     forces = data['F']
-
-    nuclear_charges = np.repeat(nuclear_charges[np.newaxis,:], coords.shape[0], axis=0)
+    
+    # all frames share one topology, so the trajectory is packed without per-frame arrays and indexed once
+    molecules = Dataset.from_frames(coords, nuclear_charges, energies, forces)
     
     train_IDs = np.fromfile(args.train_ids, dtype=int)
     test_indexes = np.fromfile(args.test_ids, dtype=int)
     
-    unique_z = np.unique(np.concatenate(nuclear_charges)).astype(int)
-
-    ALL_IDX = np.arange(len(coords))
+    unique_z = np.unique(nuclear_charges).astype(int)
     
     train_indexes = train_IDs[:ntrain]
     
-    train_coordinates = [coords[i] for i in train_indexes]
-    train_charges = [nuclear_charges[i] for i in train_indexes]
-    train_energies = [energies[i] for i in train_indexes]
-    train_forces = [forces[i] for i in train_indexes]
-    
-    test_coordinates = [coords[i] for i in test_indexes]
-    test_charges = [nuclear_charges[i] for i in test_indexes]
-    test_energies = [energies[i] for i in test_indexes]
-    test_forces = [forces[i] for i in test_indexes]
+    train_molecules = molecules.subset(train_indexes)
+    test_molecules = molecules.subset(test_indexes)
     
     rep = FCHLCuda(species=unique_z, high_cutoff=rcut, nRs2=nRs2, nRs3=nRs3, eta2=eta2, eta3=eta3,
                    two_body_decay=two_body_decay, three_body_decay=three_body_decay, three_body_weight=three_body_weight)
@@ -102,21 +95,21 @@ if __name__ == "__main__":
                                 nbatch_train=nbatch_train, nbatch_test=nbatch_test)
     
     print ("Calculating projection matrices...")
-    model.get_reductors(coords, nuclear_charges, npcas=npcas)
+    model.get_reductors(molecules, npcas=npcas)
     
     print ("Subtracting linear atomic property contributions ...")
     model.set_subtract_self_energies(True)
-    model.calculate_self_energy(train_charges, train_energies)
+    model.calculate_self_energy(train_molecules)
    
-    model.train(train_coordinates, train_charges, train_energies, train_forces)
+    model.train(train_molecules)
     
-    data = model.format_data(test_coordinates, test_charges, test_energies, test_forces)
+    data = model.format_packed(test_molecules)
 
     test_energies = data['energies']
     test_forces = data['forces']
     max_natoms = data['natom_counts'].max().item()
 
-    energy_predictions, force_predictions = model.predict(test_coordinates, test_charges, max_natoms, forces=True, use_backward=True)
+    energy_predictions, force_predictions = model.predict(test_molecules, max_natoms=max_natoms, forces=True, use_backward=True)
 
     print("Energy MAE /w backwards:", torch.mean(torch.abs(energy_predictions - test_energies)))
     print("Force MAE /w backwards:", torch.mean(torch.abs(force_predictions - test_forces)))
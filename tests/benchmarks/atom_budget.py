@@ -0,0 +1,106 @@
+'''
+Fixed molecule-count batches versus atom-budget batches with size buckets on a heterogeneous dataset.
+
+Random molecules of 3 to 120 atoms are generated and a model with random weights predicts their energies and forces, once with
+nbatch_test molecules per batch and once with an atom budget chosen to match the padded size of an average fixed batch. The two
+predictions are checked to agree (so the input order is restored), and for each schedule the number of batches, the padding waste,
+the largest padded representation derivative and the prediction time are reported.
+
+python3 atom_budget.py -nmols 2048 -nbatch 64 -min_atoms 3 -max_atoms 120 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.packed import PackedMolecules
+
+
+def random_molecule(natoms, elements, density=0.05):
+
+    length = (natoms / density) ** (1.0 / 3.0)
+
+    return np.random.uniform(0.0, length, (natoms, 3)), np.random.choice(elements, size=natoms).astype(np.float64)
+
+
+def schedule_summary(model, molecules, rep_size):
+
+    '''number of batches, fraction of padded atoms and the largest padded derivative [nmol, max_natoms, max_natoms, 3, rep_size] in MB'''
+
+    schedule = model.schedule_batches(molecules, model.nbatch_test)
+
+    counts = molecules.natom_counts
+
+    padded = 0
+    peak = 0
+
+    for b in range(len(schedule)):
+
+        batch_counts = counts[schedule.indexes(b)]
+
+        padded += batch_counts.shape[0] * batch_counts.max()
+        peak = max(peak, batch_counts.shape[0] * batch_counts.max() ** 2 * 3 * rep_size * 4)
+
+    return len(schedule), 1.0 - counts.sum() / padded, peak / 1024 ** 2
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=2048)
+    parser.add_argument("-nbatch", type=int, default=64)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=120)
+    parser.add_argument("-atom_budget", type=int, default=None, help="defaults to nbatch * the mean molecule size")
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_test=args.nbatch,
+                                  device=rep.device)
+
+    molecules = PackedMolecules.from_lists(*zip(*[random_molecule(n, elements) for n in
+                                                  np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)]))
+
+    atom_budget = args.atom_budget if args.atom_budget is not None else int(args.nbatch * molecules.natom_counts.mean())
+
+    model.get_reductors(molecules, npcas=args.npcas, print_info=False)
+
+    model.alpha = torch.randn(model.nfeatures(), device=model.device, dtype=torch.float64)
+    model.is_trained = True
+
+    timer = Timer(model.device)
+
+    results = {}
+
+    for name, budget in (('fixed', None), ('budget', atom_budget)):
+
+        model.set_atom_budget(budget)
+
+        nbatches, waste, peak_mb = schedule_summary(model, molecules, model.rep.fp_size)
+
+        timer.start()
+        energies, forces = model.predict(molecules, forces=True, print_info=False)
+        timer.stop()
+
+        results[name] = (energies, forces, nbatches, waste, peak_mb, timer.elapsed_time())
+
+    if (not torch.allclose(results['fixed'][0], results['budget'][0], rtol=1e-5, atol=1e-4) or
+            not torch.allclose(results['fixed'][1], results['budget'][1], rtol=1e-4, atol=1e-3)):
+        print ("ERROR: fixed and atom-budget predictions disagree, max energy deviation:", (results['fixed'][0] - results['budget'][0]).abs().max().item())
+        exit()
+
+    print (f"nmols = {args.nmols}, natoms = {args.min_atoms}-{args.max_atoms}, nbatch = {args.nbatch}, atom_budget = {atom_budget}, device = {model.device}")
+
+    for name, (energies, forces, nbatches, waste, peak_mb, elapsed) in results.items():
+        print (f"{name:6s}: {nbatches:6d} batches, padding {waste * 100:6.2f} %, largest derivative {peak_mb:10.2f} MB, {elapsed:10.2f} ms")
@@ -0,0 +1,83 @@
+'''
+Per-batch index bookkeeping versus the precomputed indexes of Dataset.
+
+Random QM9-like molecules are split into batches of -nbatch molecules. For every batch the atom counts, (molIDs, atomIDs), the atoms of
+each element and the molecules containing each element are derived from the charges as the batch loops used to, and then taken from a
+Dataset built once and sliced per batch. The two are checked to agree, and the time of each, including building the Dataset, is reported.
+
+python3 dataset_indexes.py -nmols 100000 -nbatch 128
+'''
+import argparse
+import time
+
+import numpy as np
+
+from qml_lightning.utils.packed import PackedMolecules
+from qml_lightning.utils.dataset import Dataset
+
+
+def batch_indexes(batch, elements):
+
+    '''the bookkeeping of a PackedMolecules batch, recomputed from its charges'''
+
+    counts = np.diff(batch.offsets)
+
+    molIDs = np.repeat(np.arange(counts.shape[0]), counts)
+    atomIDs = np.arange(molIDs.shape[0]) - np.repeat(batch.offsets[:-1], counts)
+
+    atoms = {e: np.nonzero(batch.charges == e)[0] for e in elements}
+    mols = {e: np.unique(molIDs[atoms[e]]) for e in elements}
+
+    return counts, molIDs, atomIDs, atoms, mols
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=100000)
+    parser.add_argument("-nbatch", type=int, default=128)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    counts = np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)
+
+    offsets = np.zeros(args.nmols + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    coordinates = np.random.uniform(0.0, 10.0, (offsets[-1], 3))
+    charges = np.random.choice(elements, size=offsets[-1]).astype(np.float64)
+
+    molecules = PackedMolecules(coordinates, charges, offsets)
+
+    t0 = time.perf_counter()
+
+    recomputed = [batch_indexes(molecules.slice(i, i + args.nbatch), elements) for i in range(0, args.nmols, args.nbatch)]
+
+    t1 = time.perf_counter()
+
+    dataset = Dataset.from_packed(molecules, elements)
+
+    t2 = time.perf_counter()
+
+    batches = [dataset.slice(i, i + args.nbatch) for i in range(0, args.nmols, args.nbatch)]
+
+    indexed = [(b.natom_counts, b.molIDs, b.atomIDs, {e: b.element_atoms(e) for e in elements},
+                {e: b.molecules_containing(e) for e in elements}) for b in batches]
+
+    t3 = time.perf_counter()
+
+    for r, d in zip(recomputed, indexed):
+        if (not all(np.array_equal(a, b) for a, b in zip(r[:3], d[:3])) or
+                not all(np.array_equal(r[3][e], d[3][e]) and np.array_equal(r[4][e], d[4][e]) for e in elements)):
+            print ("ERROR: the recomputed and precomputed indexes disagree")
+            exit()
+
+    print (f"nmols = {args.nmols}, nbatch = {args.nbatch}, natoms = {offsets[-1]}")
+    print (f"recomputed per batch: {(t1 - t0) * 1000.0:10.2f} ms")
+    print (f"Dataset build:        {(t2 - t1) * 1000.0:10.2f} ms")
+    print (f"Dataset slices:       {(t3 - t2) * 1000.0:10.2f} ms")
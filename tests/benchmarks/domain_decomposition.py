@@ -0,0 +1,85 @@
+'''
+Domain-decomposed prediction for a single large periodic structure.
+
+A model with random weights is set up for a random periodic box. Its energy and forces are computed in one block with predict_opt and
+with predict_domains, the two are checked to agree, and the time of each is reported. The box can then be grown past the size a single
+padded block fits into memory (e.g -natoms 200000 -skip_reference) to time the decomposed path alone.
+
+python3 domain_decomposition.py -natoms 20000 -domain_length 15.0 -nworkers 4 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-natoms", type=int, default=20000)
+    parser.add_argument("-density", type=float, default=0.1, help="atoms / A^3")
+    parser.add_argument("-rcut", type=float, default=6.0)
+    parser.add_argument("-domain_length", type=float, default=15.0)
+    parser.add_argument("-nworkers", type=int, default=0)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-skip_reference", action='store_true')
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=args.rcut, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, device=rep.device)
+
+    length = (args.natoms / args.density) ** (1.0 / 3.0)
+
+    X = np.random.uniform(0.0, length, (args.natoms, 3))
+    Q = np.random.choice(elements, size=args.natoms).astype(np.float64)
+    cell = np.eye(3) * length
+
+    # projections from small open clusters and random weights, the decomposition is exact for any weights
+    clusters = [np.random.uniform(0.0, 8.0, (64, 3)) for i in range(32)]
+    cluster_charges = [np.random.choice(elements, size=64).astype(np.float64) for i in range(32)]
+
+    model.get_reductors(clusters, cluster_charges, npcas=args.npcas, print_info=False)
+
+    model.alpha = torch.randn(model.nfeatures(), device=model.device, dtype=torch.float64)
+    model.is_trained = True
+
+    timer = Timer(model.device)
+
+    timer.start()
+    energy, forces = model.predict_domains(X, Q, cell=cell, domain_length=args.domain_length, nworkers=args.nworkers, print_info=False)
+    timer.stop()
+
+    domain_ms = timer.elapsed_time()
+
+    print (f"natoms = {args.natoms}, box = {length:.2f} A, rcut = {args.rcut}, domain_length = {args.domain_length}, nworkers = {args.nworkers}")
+
+    if (not args.skip_reference):
+
+        data = model.format_data([X], [Q], cells=[cell])
+
+        timer.start()
+        reference_energy, reference_forces = model.predict_opt(data['coordinates'], data['charges'], data['atomIDs'], data['molIDs'],
+                                                               data['natom_counts'], data['cells'], data['inv_cells'], print_info=False)
+        timer.stop()
+
+        reference_energy = reference_energy.double().cpu()[0]
+        reference_forces = reference_forces.double().cpu()[0]
+
+        if (not torch.allclose(energy, reference_energy, rtol=1e-4, atol=1e-2) or not torch.allclose(forces, reference_forces, rtol=1e-3, atol=1e-2)):
+            print ("ERROR: domain-decomposed and single-block predictions disagree, energy:", energy.item(), reference_energy.item(),
+                   "max force deviation:", (forces - reference_forces).abs().max().item())
+            exit()
+
+        print (f"single block: {timer.elapsed_time():10.2f} ms")
+
+    print (f"domains:      {domain_ms:10.2f} ms")
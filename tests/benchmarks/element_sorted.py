@@ -0,0 +1,84 @@
+'''
+Ragged versus element-sorted atom layout in build_Z_components with forces.
+
+Z^T Z is accumulated over random QM9-like molecules with energies and forces, first with the representation derivative in the ragged
+layout, whose rows of each element are gathered (copied) before projection, and then with set_element_sorted(True), where the
+derivative is computed with the atoms grouped by element and each element is projected from a view. The two are checked to agree,
+and the time and, on CUDA devices, the peak memory of each are reported.
+
+python3 element_sorted.py -nmols 2048 -nbatch 64 -device cuda
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.dataset import Dataset
+
+
+def random_molecule(natoms, elements, density=0.05):
+
+    length = (natoms / density) ** (1.0 / 3.0)
+
+    return np.random.uniform(0.0, length, (natoms, 3)), np.random.choice(elements, size=natoms).astype(np.float64)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=2048)
+    parser.add_argument("-nbatch", type=int, default=64)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_train=args.nbatch,
+                                  device=rep.device)
+
+    X, Q = zip(*[random_molecule(n, elements) for n in np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)])
+
+    molecules = Dataset.from_lists(X, Q, E=np.random.normal(size=args.nmols), F=[np.random.normal(size=(len(x), 3)) for x in X])
+
+    model.get_reductors(molecules.geometries(), npcas=args.npcas, print_info=False)
+
+    timer = Timer(model.device)
+
+    cuda = model.device.type == 'cuda'
+
+    results = {}
+
+    for element_sorted in (False, True):
+
+        model.set_element_sorted(element_sorted)
+
+        if (cuda):
+            torch.cuda.reset_peak_memory_stats(model.device)
+
+        timer.start()
+        ZTZ, ZY = model.build_Z_components(molecules, print_info=False)
+        timer.stop()
+
+        peak = torch.cuda.max_memory_allocated(model.device) / 1024 ** 2 if cuda else float('nan')
+
+        results[element_sorted] = (ZTZ, ZY, timer.elapsed_time(), peak)
+
+    if (not torch.allclose(results[False][0], results[True][0]) or not torch.allclose(results[False][1], results[True][1])):
+        print ("ERROR: ragged and element-sorted Z^T Z disagree, max deviation:", (results[False][0] - results[True][0]).abs().max().item())
+        exit()
+
+    print (f"nmols = {args.nmols}, nbatch = {args.nbatch}, device = {model.device}")
+
+    for element_sorted, (ZTZ, ZY, elapsed, peak) in results.items():
+        print (f"{'element-sorted' if element_sorted else 'ragged':15s}: {elapsed:10.2f} ms, peak memory {peak:10.2f} MB")
@@ -0,0 +1,102 @@
+'''
+Line-by-line versus vectorised extended XYZ parsing.
+
+A 3BPA-style extxyz file of random frames (species, positions, forces, energy and optionally a Lattice) is written to a temporary
+directory and read three ways: with the per-token Python loop that train_3BPA.py used, with read_extxyz, and with read_extxyz from its
+.npz sidecar. The results are checked to agree and the time of each is reported.
+
+python3 extxyz_reader.py -nframes 20000 -natoms 27
+'''
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+
+from qml_lightning.utils.extxyz import read_extxyz, ELEMENTS
+
+
+def write_frames(path, nframes, natoms, periodic):
+
+    symbols = np.array(['H', 'C', 'N', 'O'])
+
+    with open(path, 'w') as f:
+
+        for i in range(nframes):
+
+            species = np.random.choice(symbols, size=natoms)
+            positions = np.random.uniform(0.0, 10.0, (natoms, 3))
+            forces = np.random.normal(size=(natoms, 3))
+
+            lattice = 'Lattice="10.0 0.0 0.0 0.0 10.0 0.0 0.0 0.0 10.0" ' if periodic else ''
+
+            f.write(f"{natoms}\n{lattice}Properties=species:S:1:pos:R:3:forces:R:3 energy={np.random.normal():.10f} pbc=\"F F F\"\n")
+
+            for s, p, g in zip(species, positions, forces):
+                f.write(f"{s} {p[0]:.8f} {p[1]:.8f} {p[2]:.8f} {g[0]:.8f} {g[1]:.8f} {g[2]:.8f}\n")
+
+
+def read_line_by_line(path):
+
+    '''the previous reader of train_3BPA.py, one float() per token'''
+
+    lines = open(path, 'r').readlines()
+
+    curr = 0
+
+    charges, coordinates, energies, forces = [], [], [], []
+
+    while (curr < len(lines)):
+
+        natoms = int(lines[curr])
+
+        energies.append(float(lines[curr + 1].split("energy=")[1].split(" ")[0]))
+
+        rows = [lines[i].split() for i in range(curr + 2, curr + 2 + natoms)]
+
+        charges.append(np.array([float(ELEMENTS.index(r[0])) for r in rows]))
+        coordinates.append(np.array([[float(v) for v in r[1:4]] for r in rows]))
+        forces.append(np.array([[float(v) for v in r[4:]] for r in rows]))
+
+        curr += 2 + natoms
+
+    return charges, coordinates, np.array(energies), forces
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nframes", type=int, default=20000)
+    parser.add_argument("-natoms", type=int, default=27)
+    parser.add_argument("-periodic", action='store_true')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        path = os.path.join(directory, 'frames.xyz')
+
+        write_frames(path, args.nframes, args.natoms, args.periodic)
+
+        t0 = time.perf_counter()
+        charges, coordinates, energies, forces = read_line_by_line(path)
+        t1 = time.perf_counter()
+        molecules = read_extxyz(path, cache=True)
+        t2 = time.perf_counter()
+        cached = read_extxyz(path, cache=True)
+        t3 = time.perf_counter()
+
+        size_mb = os.path.getsize(path) / 1024 ** 2
+
+    for m in (molecules, cached):
+        if (not np.allclose(m.coordinates, np.concatenate(coordinates)) or not np.allclose(m.forces, np.concatenate(forces)) or
+                not np.array_equal(m.charges, np.concatenate(charges)) or not np.allclose(m.energies, energies)):
+            print ("ERROR: the line-by-line and vectorised readers disagree")
+            exit()
+
+    print (f"nframes = {args.nframes}, natoms = {args.natoms}, file = {size_mb:.2f} MB")
+    print (f"line by line: {(t1 - t0) * 1000.0:10.2f} ms")
+    print (f"read_extxyz:  {(t2 - t1) * 1000.0:10.2f} ms (including writing the sidecar)")
+    print (f"sidecar:      {(t3 - t2) * 1000.0:10.2f} ms")
@@ -0,0 +1,119 @@
+'''
+Per-batch overhead of BaseKernel.format_data.
+
+Packs nbatch random molecules (energies with self-energy subtraction, forces and cells) with the vectorised format_data and with
+the previous per-molecule torch.cat implementation, checks both give identical tensors and reports the time per batch.
+
+python3 format_data.py -nbatch 1024 -device cpu
+'''
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from qml_lightning.models.kernel import BaseKernel
+
+
+def format_data_loop(model, X, Q, E=None, F=None, cells=None, inv_cells=None):
+
+    '''reference: the per-molecule packing loop format_data used previously'''
+
+    zbatch = len(X)
+
+    natom_counts = torch.zeros(zbatch, dtype=torch.int32)
+
+    for j in range(zbatch):
+        natom_counts[j] = X[j].shape[0]
+
+    max_atoms = natom_counts.max().item()
+
+    all_coordinates = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float32)
+    all_charges = torch.zeros(zbatch, max_atoms, dtype=torch.float32)
+    all_energies = torch.DoubleTensor(E)
+    all_forces = torch.zeros(zbatch, max_atoms, 3, dtype=torch.float64)
+    all_cells = torch.zeros(zbatch, 3, 3, dtype=torch.float32)
+    all_inv_cells = torch.zeros(zbatch, 3, 3, dtype=torch.float32)
+
+    molIDs = torch.Tensor([])
+    atomIDs = torch.Tensor([])
+
+    for j in range(zbatch):
+
+        charges = torch.from_numpy(Q[j]).float()
+        coordinates = torch.from_numpy(X[j]).float()
+
+        natoms = natom_counts[j]
+
+        all_charges[j,:natoms] = charges
+        all_coordinates[j,:natoms,:] = coordinates
+
+        molIDs = torch.cat((molIDs, torch.empty(natoms, dtype=torch.int32).fill_(j)), dim=0)
+        atomIDs = torch.cat((atomIDs, torch.arange(0, natoms)), dim=0)
+
+        all_energies[j] = all_energies[j] - model.self_energy[charges.long()].sum(axis=0)
+
+        all_forces[j,:natoms,:] = torch.from_numpy(F[j]).double()
+
+        all_cells[j] = torch.from_numpy(cells[j]).float()
+        all_inv_cells[j] = torch.from_numpy(inv_cells[j]).float()
+
+    return {'coordinates': all_coordinates.to(model.device), 'charges': all_charges.to(model.device), 'natom_counts': natom_counts.to(model.device),
+            'atomIDs': atomIDs.int().to(model.device), 'molIDs': molIDs.int().to(model.device), 'energies': all_energies.to(model.device),
+            'forces': all_forces.to(model.device), 'cells': all_cells.to(model.device), 'inv_cells': all_inv_cells.to(model.device)}
+
+
+def time_batches(fn, nrepeats):
+
+    timings = []
+
+    for i in range(nrepeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+
+    return np.median(timings)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nbatch", type=int, default=1024)
+    parser.add_argument("-min_atoms", type=int, default=5)
+    parser.add_argument("-max_atoms", type=int, default=30)
+    parser.add_argument("-nrepeats", type=int, default=10)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    model = BaseKernel(None, elements, 1.0, 1e-8, device=args.device)
+
+    model.set_subtract_self_energies(True)
+    model.self_energy = torch.Tensor([0., -0.500273, 0., 0., 0., 0., -37.845355, -54.583861, -75.064579]).double()
+
+    natoms = np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nbatch)
+
+    X = [np.random.uniform(-5.0, 5.0, (n, 3)) for n in natoms]
+    Q = [np.random.choice(elements, size=n).astype(np.float64) for n in natoms]
+    E = list(np.random.uniform(-500.0, -100.0, args.nbatch))
+    F = [np.random.normal(0.0, 1.0, (n, 3)) for n in natoms]
+    cells = [np.eye(3) * 20.0 for n in natoms]
+    inv_cells = [np.eye(3) / 20.0 for n in natoms]
+
+    reference = format_data_loop(model, X, Q, E, F, cells, inv_cells)
+    data = model.format_data(X, Q, E, F, cells, inv_cells)
+
+    for key in reference.keys():
+        if (not torch.allclose(reference[key].double(), data[key].double())):
+            print ("ERROR: format_data and the reference packing disagree for", key)
+            exit()
+
+    loop_ms = time_batches(lambda: format_data_loop(model, X, Q, E, F, cells, inv_cells), args.nrepeats)
+    vectorised_ms = time_batches(lambda: model.format_data(X, Q, E, F, cells, inv_cells), args.nrepeats)
+
+    print (f"nbatch = {args.nbatch}, device = {model.device}, {natoms.sum()} atoms")
+    print (f"per-molecule loop: {loop_ms:8.2f} ms / batch")
+    print (f"vectorised:        {vectorised_ms:8.2f} ms / batch ({loop_ms / vectorised_ms:.1f}x)")
@@ -0,0 +1,63 @@
+'''
+Cold-start import benchmark.
+
+Each module is imported in a fresh interpreter, after torch and numpy (which every worker pays for regardless), and the time
+spent importing qml_lightning is reported. Importing must not load any compiled extension nor initialise a CUDA context.
+
+python3 import_time.py -nrepeats 10 -max_ms 50
+'''
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+_probe = '''
+import json, sys, time
+import torch, numpy
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000.0
+extensions = sorted(m for m in sys.modules if m.startswith('qml_lightning.cuda.'))
+print(json.dumps({{'ms': elapsed, 'extensions': extensions, 'cuda_initialized': torch.cuda.is_initialized()}}))
+'''
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nrepeats", type=int, default=10)
+    parser.add_argument("-max_ms", type=float, default=50.0)
+    parser.add_argument("-modules", type=str, nargs='+', default=['qml_lightning.models.hadamard_features',
+                                                                  'qml_lightning.models.random_features',
+                                                                  'qml_lightning.representations.FCHL',
+                                                                  'qml_lightning.representations.EGTO'])
+
+    args = parser.parse_args()
+
+    failed = False
+
+    for module in args.modules:
+
+        timings = []
+
+        for i in range(args.nrepeats):
+
+            output = subprocess.run([sys.executable, '-c', _probe.format(module=module)], capture_output=True, text=True, check=True)
+
+            result = json.loads(output.stdout.strip().split('\n')[-1])
+
+            timings.append(result['ms'])
+
+        median = np.median(timings)
+
+        print (f"{module}: median {median:.1f} ms, min {np.min(timings):.1f} ms, max {np.max(timings):.1f} ms")
+        print (f"    extensions loaded: {result['extensions']}, CUDA initialised: {result['cuda_initialized']}")
+
+        if (median > args.max_ms or len(result['extensions']) > 0 or result['cuda_initialized']):
+            failed = True
+
+    if (failed):
+        print ("ERROR: import exceeded the time budget, loaded a compiled extension or initialised CUDA.")
+        sys.exit(1)
@@ -0,0 +1,101 @@
+'''
+Training from an in-memory dataset versus a memory-mapped store.
+
+A random dataset of QM9-like molecules with energies and forces is written to a store in a temporary directory. Z^T Z is accumulated
+by build_Z_components from the in-memory PackedMolecules and from the store opened with open_store, the two are checked to agree, and
+the size of the store, the memory the in-memory dataset occupies, the peak resident memory added by the store pass and the time of each
+pass are reported. The store pass runs first, so its peak is not hidden by the in-memory pass.
+
+python3 memmap_store.py -nmols 100000 -nbatch 128 -device cpu
+'''
+import argparse
+import resource
+import tempfile
+import os
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.packed import PackedMolecules
+from qml_lightning.utils.store import write_store, open_store
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def random_dataset(nmols, min_atoms, max_atoms, elements, density=0.05):
+
+    counts = np.random.randint(min_atoms, max_atoms + 1, size=nmols)
+
+    offsets = np.zeros(nmols + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    lengths = np.repeat((counts / density) ** (1.0 / 3.0), counts)
+
+    return PackedMolecules(np.random.uniform(0.0, 1.0, (offsets[-1], 3)) * lengths[:, None], np.random.choice(elements, size=offsets[-1]).astype(np.float64),
+                           offsets, energies=np.random.normal(size=nmols), forces=np.random.normal(size=(offsets[-1], 3)))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=100000)
+    parser.add_argument("-nbatch", type=int, default=128)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_train=args.nbatch,
+                                  device=rep.device)
+
+    with tempfile.TemporaryDirectory() as path:
+
+        molecules = random_dataset(args.nmols, args.min_atoms, args.max_atoms, elements)
+
+        write_store(path, molecules)
+
+        store_mb = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) / 1024 ** 2
+
+        stored = open_store(path)
+
+        model.get_reductors(stored, npcas=args.npcas, print_info=False)
+
+        timer = Timer(model.device)
+
+        # the store holds single-precision coordinates, train both passes from the same values
+        molecules.coordinates = np.asarray(stored.coordinates, dtype=np.float64)
+
+        rss = peak_rss_mb()
+
+        timer.start()
+        ZTZ_stored, ZY_stored = model.build_Z_components(stored, print_info=False)
+        timer.stop()
+
+        stored_rss, stored_ms = peak_rss_mb() - rss, timer.elapsed_time()
+
+        timer.start()
+        ZTZ_memory, ZY_memory = model.build_Z_components(molecules, print_info=False)
+        timer.stop()
+
+        memory_mb, memory_ms = sum(a.nbytes for a in (molecules.coordinates, molecules.charges, molecules.forces)) / 1024 ** 2, timer.elapsed_time()
+
+    if (not torch.allclose(ZTZ_memory, ZTZ_stored) or not torch.allclose(ZY_memory, ZY_stored)):
+        print ("ERROR: Z^T Z from memory and from the store disagree, max deviation:", (ZTZ_memory - ZTZ_stored).abs().max().item())
+        exit()
+
+    print (f"nmols = {args.nmols}, natoms = {molecules.offsets[-1]}, store = {store_mb:.2f} MB, nbatch = {args.nbatch}, device = {model.device}")
+    print (f"store:  peak RSS +{stored_rss:10.2f} MB, {stored_ms:10.2f} ms")
+    print (f"memory: dataset   {memory_mb:10.2f} MB, {memory_ms:10.2f} ms")
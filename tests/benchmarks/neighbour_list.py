@@ -0,0 +1,89 @@
+'''
+Dense versus CSR neighbour lists for a batch with heterogeneous densities.
+
+The batch holds a dense slab next to several small gas-phase molecules, so most of the dense [nbatch, max_natoms, max_neighbours] list is
+padding. Both lists are built, checked to contain the same pairs, and their size and build time are reported.
+
+python3 neighbour_list.py -slab_atoms 2048 -nmolecules 63 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import get_kernel, Timer
+from qml_lightning.models.kernel import BaseKernel
+from qml_lightning.representations.neighbours import build_neighbour_list
+
+
+def build_dense(X, atom_counts, rcut, cell, inv_cell):
+
+    nneighbours = get_kernel('num_neighbours', X)(X, atom_counts, rcut, cell, inv_cell)
+
+    max_neighbours = nneighbours.max().item()
+
+    return nneighbours, get_kernel('neighbour_list', X)(X, atom_counts, max_neighbours, rcut, cell, inv_cell)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-slab_atoms", type=int, default=2048)
+    parser.add_argument("-molecule_atoms", type=int, default=12)
+    parser.add_argument("-nmolecules", type=int, default=63)
+    parser.add_argument("-rcut", type=float, default=6.0)
+    parser.add_argument("-nrepeats", type=int, default=10)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    packer = BaseKernel(None, elements, 1.0, 1e-8, device=args.device)
+
+    # slab at roughly condensed-phase density (0.1 atoms / A^3) with a 2:1 aspect ratio, gas molecules spread over a 4 A box
+    length = (args.slab_atoms / (0.1 * 0.5)) ** (1.0 / 3.0)
+
+    X = [np.random.uniform(0.0, 1.0, (args.slab_atoms, 3)) * np.array([length, length, 0.5 * length])]
+    X += [np.random.uniform(0.0, 4.0, (args.molecule_atoms, 3)) for i in range(args.nmolecules)]
+
+    Q = [np.random.choice(elements, size=x.shape[0]).astype(np.float64) for x in X]
+
+    data = packer.format_data(X, Q)
+
+    coordinates = data['coordinates']
+    natom_counts = data['natom_counts']
+
+    cell = torch.empty(0, 3, 3, device=coordinates.device)
+    inv_cell = torch.empty(0, 3, 3, device=coordinates.device)
+
+    nneighbours, dense = build_dense(coordinates, natom_counts, args.rcut, cell, inv_cell)
+
+    neighbours = build_neighbour_list(coordinates, natom_counts, args.rcut, cell, inv_cell)
+
+    if (not torch.equal(nneighbours, neighbours.nneighbours) or not torch.equal(dense[dense != -1], neighbours.indices)):
+        print ("ERROR: the dense and CSR neighbour lists differ")
+        exit()
+
+    timer = Timer(coordinates.device)
+
+    timings = {'dense': [], 'csr': []}
+
+    for i in range(args.nrepeats):
+
+        timer.start()
+        build_dense(coordinates, natom_counts, args.rcut, cell, inv_cell)
+        timer.stop()
+
+        timings['dense'].append(timer.elapsed_time())
+
+        timer.start()
+        build_neighbour_list(coordinates, natom_counts, args.rcut, cell, inv_cell)
+        timer.stop()
+
+        timings['csr'].append(timer.elapsed_time())
+
+    print (f"nbatch = {coordinates.shape[0]}, max_natoms = {coordinates.shape[1]}, npairs = {neighbours.npairs}, device = {coordinates.device}")
+    print (f"dense: {dense.numel():12d} entries ({100.0 * neighbours.npairs / dense.numel():5.1f}% used), {np.median(timings['dense']):8.2f} ms")
+    print (f"CSR:   {neighbours.npairs + neighbours.offsets.numel():12d} entries, {np.median(timings['csr']):8.2f} ms")
@@ -0,0 +1,124 @@
+'''
+Neighbour list and FCHL19 cost for a periodic water box, orthorhombic fast path versus the general triclinic path.
+
+A cubic box of randomly oriented water molecules at 1 g/cm^3 (~10k atoms by default) is built, and a copy of it is rigidly rotated
+together with its cell, so the cell matrix is no longer diagonal and the pair search has to take the general h^{-1} / h path. Both
+boxes describe the same system, so the neighbour counts and representations are checked to agree before the build and representation
+times are reported.
+
+python3 periodic_water_box.py -nwaters 3334 -rcut 6.0 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.kernel import BaseKernel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.representations.neighbours import build_neighbour_list, wrap_coordinates
+
+
+def water_box(nwaters, density=0.0334):
+
+    '''nwaters randomly oriented rigid waters on a jittered cubic lattice, density in molecules / A^3'''
+
+    length = (nwaters / density) ** (1.0 / 3.0)
+
+    nside = int(np.ceil(nwaters ** (1.0 / 3.0)))
+    spacing = length / nside
+
+    sites = np.array([[i, j, k] for i in range(nside) for j in range(nside) for k in range(nside)], dtype=np.float64)[:nwaters]
+    centres = (sites + 0.5) * spacing + np.random.uniform(-0.1, 0.1, (nwaters, 3)) * spacing
+
+    angle = np.deg2rad(104.52) / 2.0
+    water = np.array([[0.0, 0.0, 0.0], [0.9572 * np.sin(angle), 0.9572 * np.cos(angle), 0.0], [-0.9572 * np.sin(angle), 0.9572 * np.cos(angle), 0.0]])
+
+    X = np.concatenate([c + water @ random_rotation().T for c in centres])
+    Q = np.tile(np.array([8.0, 1.0, 1.0]), nwaters)
+
+    return X, Q, np.eye(3) * length
+
+
+def random_rotation():
+
+    q, r = np.linalg.qr(np.random.normal(size=(3, 3)))
+
+    return q * np.sign(np.diag(r))
+
+
+def time_calls(fn, device, nrepeats):
+
+    timer = Timer(device)
+
+    timings = []
+
+    for i in range(nrepeats):
+
+        timer.start()
+        fn()
+        timer.stop()
+
+        timings.append(timer.elapsed_time())
+
+    return np.median(timings)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nwaters", type=int, default=3334)
+    parser.add_argument("-rcut", type=float, default=6.0)
+    parser.add_argument("-nrepeats", type=int, default=5)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=args.rcut, device=args.device)
+
+    packer = BaseKernel(None, elements, 1.0, 1e-8, device=rep.device)
+
+    X, Q, cell = water_box(args.nwaters)
+
+    R = random_rotation()
+
+    # the kernels use column lattice vectors, r = h s, rotating both r and h leaves the fractional coordinates unchanged
+    boxes = {'orthorhombic': packer.format_data([X], [Q], cells=[cell]), 'triclinic': packer.format_data([X @ R.T], [Q], cells=[R @ cell])}
+
+    neighbours = {}
+    representations = {}
+
+    for name, data in boxes.items():
+
+        data['coordinates'] = wrap_coordinates(data['coordinates'], data['cells'], data['inv_cells'])
+
+        neighbours[name] = build_neighbour_list(data['coordinates'], data['natom_counts'], args.rcut, data['cells'], data['inv_cells'])
+
+        representations[name] = rep.get_representation(data['coordinates'], data['charges'], data['atomIDs'], data['molIDs'], data['natom_counts'],
+                                                       data['cells'], data['inv_cells'])
+
+    # pairs sitting within float rounding of rcut may be found in one frame but not the other
+    ndiff = (neighbours['orthorhombic'].nneighbours != neighbours['triclinic'].nneighbours).sum().item()
+
+    if (ndiff > 1e-3 * X.shape[0]):
+        print ("ERROR: the orthorhombic and triclinic neighbour counts differ for", ndiff, "atoms")
+        exit()
+
+    if (ndiff == 0 and not torch.allclose(representations['orthorhombic'], representations['triclinic'], atol=1e-3)):
+        print ("ERROR: the orthorhombic and triclinic representations disagree")
+        exit()
+
+    print (f"natoms = {X.shape[0]}, box = {cell[0, 0]:.2f} A, rcut = {args.rcut}, npairs = {neighbours['orthorhombic'].npairs}, device = {rep.device}")
+
+    for name, data in boxes.items():
+
+        build_ms = time_calls(lambda: build_neighbour_list(data['coordinates'], data['natom_counts'], args.rcut, data['cells'], data['inv_cells']),
+                              rep.device, args.nrepeats)
+
+        rep_ms = time_calls(lambda: rep.get_representation(data['coordinates'], data['charges'], data['atomIDs'], data['molIDs'],
+                                                           data['natom_counts'], data['cells'], data['inv_cells']), rep.device, args.nrepeats)
+
+        print (f"{name:12s}: neighbour list {build_ms:8.2f} ms, FCHL19 {rep_ms:8.2f} ms")
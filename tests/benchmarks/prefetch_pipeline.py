@@ -0,0 +1,79 @@
+'''
+Serial versus prefetched batch preparation in build_Z_components.
+
+Z^T Z is accumulated over random QM9-like molecules with energies and forces, first formatting every batch when it is needed
+(set_prefetch(0)) and then with a background thread formatting up to -depth batches ahead. The two are checked to agree, and the total
+time and the per-stage report of the batch pipeline (prepare, producer stall, consumer stall, compute) are printed for both.
+
+python3 prefetch_pipeline.py -nmols 4096 -nbatch 128 -depth 2 -device cuda
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.packed import PackedMolecules
+
+
+def random_molecule(natoms, elements, density=0.05):
+
+    length = (natoms / density) ** (1.0 / 3.0)
+
+    return np.random.uniform(0.0, length, (natoms, 3)), np.random.choice(elements, size=natoms).astype(np.float64)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=4096)
+    parser.add_argument("-nbatch", type=int, default=128)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+    parser.add_argument("-depth", type=int, default=2)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_train=args.nbatch,
+                                  device=rep.device)
+
+    X, Q = zip(*[random_molecule(n, elements) for n in np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)])
+
+    molecules = PackedMolecules.from_lists(X, Q, E=np.random.normal(size=args.nmols), F=[np.random.normal(size=(len(x), 3)) for x in X])
+
+    model.get_reductors(molecules.geometries(), npcas=args.npcas, print_info=False)
+
+    timer = Timer(model.device)
+
+    results = {}
+
+    for depth in (0, args.depth):
+
+        model.set_prefetch(depth)
+
+        print (f"--- queue depth {depth} ---")
+
+        timer.start()
+        ZTZ, ZY = model.build_Z_components(molecules, print_info=True)
+        timer.stop()
+
+        results[depth] = (ZTZ, timer.elapsed_time())
+
+    if (not torch.allclose(results[0][0], results[args.depth][0])):
+        print ("ERROR: serial and prefetched Z^T Z disagree, max deviation:", (results[0][0] - results[args.depth][0]).abs().max().item())
+        exit()
+
+    print (f"nmols = {args.nmols}, nbatch = {args.nbatch}, device = {model.device}")
+
+    for depth, (ZTZ, elapsed) in results.items():
+        print (f"depth {depth}: {elapsed:10.2f} ms")
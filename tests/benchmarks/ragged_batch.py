@@ -0,0 +1,130 @@
+'''
+Padded versus ragged force rows in the Z^T Z accumulation for batches that mix small and large molecules.
+
+Random QM9-like molecules of 3 to 29 atoms are generated. Z^T Z is accumulated with build_Z_components, which uses the ragged
+(padding-free) layout, and with a reference that pads every molecule to the largest one in the batch, as build_Z_components did
+before. The two are checked to agree, and the number of force rows, the size of the derivative feature buffer and the time of each
+are reported.
+
+python3 ragged_batch.py -nmols 1024 -nbatch 128 -min_atoms 3 -max_atoms 29 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.representations.dimensionality_reduction import project_representation, project_derivative
+
+
+def random_molecule(natoms, elements, density=0.05):
+
+    length = (natoms / density) ** (1.0 / 3.0)
+
+    return np.random.uniform(0.0, length, (natoms, 3)), np.random.choice(elements, size=natoms).astype(np.float64)
+
+
+def padded_ZTZ(model, X, Q, F):
+
+    '''Z^T Z of the force rows with every molecule padded to max_natoms, returns Z^T Z and the peak derivative feature buffer in bytes'''
+
+    ZTZ = torch.zeros(model.nfeatures(), model.nfeatures(), device=model.device, dtype=torch.float64)
+
+    peak_bytes = 0
+
+    for i in range(0, len(X), model.nbatch_train):
+
+        data = model.format_data(X[i:i + model.nbatch_train], Q[i:i + model.nbatch_train], F=F[i:i + model.nbatch_train])
+
+        charges = data['charges']
+
+        zbatch, max_natoms = charges.shape
+
+        gto, gto_derivative = model.rep.get_representation_and_derivative(data['coordinates'], charges, data['atomIDs'], data['molIDs'],
+                                                                          data['natom_counts'])
+
+        Ztrain = torch.zeros(zbatch, model.nfeatures(), device=model.device, dtype=torch.float64)
+        Gtrain_derivative = torch.zeros(zbatch, max_natoms, 3, model.nfeatures(), device=model.device, dtype=torch.float64)
+
+        peak_bytes = max(peak_bytes, Gtrain_derivative.numel() * Gtrain_derivative.element_size())
+
+        for e in model.elements:
+
+            indexes = charges.int() == e
+
+            if (indexes.sum() == 0):
+                continue
+
+            batch_indexes = torch.where(indexes)[0].type(torch.int)
+
+            sub = project_representation(gto[indexes], model.reductors[e])
+            sub_grad = project_derivative(gto_derivative[indexes], model.reductors[e])
+
+            model.calculate_features(sub, e, batch_indexes, Ztrain, sub_grad, Gtrain_derivative)
+
+        Gtrain_derivative = Gtrain_derivative.reshape(zbatch * max_natoms * 3, model.nfeatures())
+
+        ZTZ += torch.matmul(Gtrain_derivative.T, Gtrain_derivative)
+
+    return ZTZ, peak_bytes
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=1024)
+    parser.add_argument("-nbatch", type=int, default=128)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_train=args.nbatch,
+                                  device=rep.device)
+
+    molecules = [random_molecule(n, elements) for n in np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)]
+
+    X = [m[0] for m in molecules]
+    Q = [m[1] for m in molecules]
+    F = [np.random.normal(size=(len(x), 3)) for x in X]
+
+    model.get_reductors(X, Q, npcas=args.npcas, print_info=False)
+
+    timer = Timer(model.device)
+
+    timer.start()
+    ZTZ_padded, padded_bytes = padded_ZTZ(model, X, Q, F)
+    timer.stop()
+
+    padded_ms = timer.elapsed_time()
+
+    timer.start()
+    ZTZ_ragged, ZY = model.build_Z_components(X, Q, F=F, print_info=False)
+    timer.stop()
+
+    ragged_ms = timer.elapsed_time()
+
+    if (not torch.allclose(ZTZ_ragged, ZTZ_padded, rtol=1e-5, atol=1e-6)):
+        print ("ERROR: the padded and ragged Z^T Z disagree, max deviation:", (ZTZ_ragged - ZTZ_padded).abs().max().item())
+        exit()
+
+    counts = np.array([len(x) for x in X])
+
+    padded_rows = sum(min(args.nbatch, args.nmols - i) * counts[i:i + args.nbatch].max() for i in range(0, args.nmols, args.nbatch)) * 3
+    ragged_rows = counts.sum() * 3
+
+    ragged_bytes = max(counts[i:i + args.nbatch].sum() for i in range(0, args.nmols, args.nbatch)) * 3 * model.nfeatures() * 8
+
+    print (f"nmols = {args.nmols}, natoms = {args.min_atoms}-{args.max_atoms}, nbatch = {args.nbatch}, nfeatures = {model.nfeatures()}, device = {model.device}")
+    print (f"padded: {padded_rows:10d} force rows, derivative features {padded_bytes / 1024 ** 2:10.2f} MB, {padded_ms:10.2f} ms")
+    print (f"ragged: {ragged_rows:10d} force rows, derivative features {ragged_bytes / 1024 ** 2:10.2f} MB, {ragged_ms:10.2f} ms")
@@ -0,0 +1,88 @@
+'''
+Recomputed versus cached representations in repeated training runs.
+
+Z^T Z is accumulated three times over the same random QM9-like molecules with energies and forces: without a cache, with an empty
+representation cache in a temporary directory (which fills it) and with the filled cache. With -projected the projected
+representations are cached too. The results are checked to agree, and the time of each run and the size of the cache are reported.
+
+python3 representation_cache.py -nmols 2048 -nbatch 128 -projected -device cpu
+'''
+import argparse
+import tempfile
+import os
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.packed import PackedMolecules
+
+
+def random_molecule(natoms, elements, density=0.05):
+
+    length = (natoms / density) ** (1.0 / 3.0)
+
+    return np.random.uniform(0.0, length, (natoms, 3)), np.random.choice(elements, size=natoms).astype(np.float64)
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files) / 1024 ** 2
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nmols", type=int, default=2048)
+    parser.add_argument("-nbatch", type=int, default=128)
+    parser.add_argument("-min_atoms", type=int, default=3)
+    parser.add_argument("-max_atoms", type=int, default=29)
+    parser.add_argument("-npcas", type=int, default=128)
+    parser.add_argument("-nstacks", type=int, default=8)
+    parser.add_argument("-projected", action='store_true')
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=args.npcas, nstacks=args.nstacks, nbatch_train=args.nbatch,
+                                  device=rep.device)
+
+    X, Q = zip(*[random_molecule(n, elements) for n in np.random.randint(args.min_atoms, args.max_atoms + 1, size=args.nmols)])
+
+    molecules = PackedMolecules.from_lists(X, Q, E=np.random.normal(size=args.nmols), F=[np.random.normal(size=(len(x), 3)) for x in X])
+
+    model.get_reductors(molecules.geometries(), npcas=args.npcas, print_info=False)
+
+    timer = Timer(model.device)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as path:
+
+        for name, cache in (('uncached', None), ('filling', path), ('cached', path)):
+
+            model.set_representation_cache(cache, projected=args.projected)
+
+            timer.start()
+            ZTZ, ZY = model.build_Z_components(molecules, print_info=False)
+            timer.stop()
+
+            results[name] = (ZTZ, timer.elapsed_time())
+
+        cache_mb = directory_mb(path)
+
+    for name in ('filling', 'cached'):
+        if (not torch.allclose(results['uncached'][0], results[name][0])):
+            print ("ERROR: the", name, "Z^T Z disagrees with the uncached one, max deviation:", (results['uncached'][0] - results[name][0]).abs().max().item())
+            exit()
+
+    print (f"nmols = {args.nmols}, nbatch = {args.nbatch}, projected = {args.projected}, cache = {cache_mb:.2f} MB, device = {model.device}")
+
+    for name, (ZTZ, elapsed) in results.items():
+        print (f"{name:8s}: {elapsed:10.2f} ms")
@@ -0,0 +1,83 @@
+'''
+Generic versus single topology batch formatting of a trajectory.
+
+A random trajectory of one molecule (MD17-like, -natoms atoms) with energies and forces is packed with Dataset.from_frames, which
+detects the shared topology, and split into batches of -nbatch frames. Every batch is formatted twice: by the single topology path
+(reshapes and cached device indexes) and by the generic path (scatter into padded buffers and per-batch index copies), obtained by
+clearing the topology of a copy of the dataset. The formatted batches are checked to agree and the formatting time of each path is
+reported.
+
+python3 single_topology.py -nframes 50000 -natoms 21 -nbatch 256 -device cuda
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.utils.dataset import Dataset
+
+KEYS = ('coordinates', 'charges', 'natom_counts', 'atomIDs', 'molIDs', 'atom_offsets', 'energies', 'forces')
+
+
+def format_all(model, molecules, nbatch):
+
+    timer = Timer(model.device)
+
+    timer.start()
+
+    batches = [model.format_packed(molecules.slice(i, i + nbatch)) for i in range(0, len(molecules), nbatch)]
+
+    timer.stop()
+
+    return batches, timer.elapsed_time()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nframes", type=int, default=50000)
+    parser.add_argument("-natoms", type=int, default=21)
+    parser.add_argument("-nbatch", type=int, default=256)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=6.0, device=args.device)
+
+    model = HadamardFeaturesModel(rep, elements=elements, sigma=3.0, npcas=128, nstacks=8, nbatch_train=args.nbatch, device=rep.device)
+
+    z = np.random.choice(elements, size=args.natoms).astype(np.float64)
+
+    R = np.random.uniform(0.0, 6.0, (args.nframes, args.natoms, 3))
+
+    trajectory = Dataset.from_frames(R, z, np.random.normal(size=args.nframes), np.random.normal(size=(args.nframes, args.natoms, 3)))
+
+    if (trajectory.topology is None):
+        print ("ERROR: the trajectory was not detected as a single topology")
+        exit()
+
+    generic = Dataset.from_packed(trajectory, elements)
+    generic.topology = None
+
+    # build the cached device indexes outside of the timing
+    model.format_packed(trajectory.slice(0, args.nbatch))
+
+    fast, fast_ms = format_all(model, trajectory, args.nbatch)
+    slow, slow_ms = format_all(model, generic, args.nbatch)
+
+    for a, b in zip(fast, slow):
+
+        if (any(not torch.equal(a[k], b[k]) for k in KEYS) or a['element_rows'].keys() != b['element_rows'].keys() or
+                any(not torch.equal(a['element_rows'][e], b['element_rows'][e]) for e in a['element_rows'])):
+            print ("ERROR: the single topology and generic batches disagree")
+            exit()
+
+    print (f"nframes = {args.nframes}, natoms = {args.natoms}, nbatch = {args.nbatch}, device = {model.device}")
+    print (f"generic:         {slow_ms:10.2f} ms")
+    print (f"single topology: {fast_ms:10.2f} ms")
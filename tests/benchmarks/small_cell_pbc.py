@@ -0,0 +1,88 @@
+'''
+FCHL19 for a periodic cell narrower than twice the cutoff versus the equivalent replicated supercell.
+
+A random triclinic cell is filled with atoms and replicated nrep times along each cell vector. Both are computed with the same cutoff,
+the per-atom representations of the small cell are checked against those of its first copy in the supercell, and the time of each is
+reported.
+
+python3 small_cell_pbc.py -natoms 16 -length 4.0 -rcut 6.0 -nrep 4 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.kernel import BaseKernel
+from qml_lightning.representations.FCHL import FCHLCuda
+
+
+def time_representation(rep, data, nrepeats):
+
+    timer = Timer(rep.device)
+
+    timings = []
+
+    for i in range(nrepeats):
+
+        timer.start()
+        rep.get_representation(data['coordinates'], data['charges'], data['atomIDs'], data['molIDs'], data['natom_counts'],
+                               data['cells'], data['inv_cells'])
+        timer.stop()
+
+        timings.append(timer.elapsed_time())
+
+    return np.median(timings)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-natoms", type=int, default=16)
+    parser.add_argument("-length", type=float, default=4.0)
+    parser.add_argument("-rcut", type=float, default=6.0)
+    parser.add_argument("-nrep", type=int, default=4, help="supercell replications along each cell vector, should satisfy nrep * length > 2 * rcut")
+    parser.add_argument("-nrepeats", type=int, default=10)
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=args.rcut, device=args.device)
+
+    packer = BaseKernel(None, elements, 1.0, 1e-8, device=rep.device)
+
+    # rows of cell are the lattice vectors, r = s @ cell
+    cell = args.length * (np.eye(3) + np.random.uniform(-0.1, 0.1, (3, 3)))
+
+    X = np.random.uniform(0.0, 1.0, (args.natoms, 3)) @ cell
+    Q = np.random.choice(elements, size=args.natoms).astype(np.float64)
+
+    translations = np.array([[i, j, k] for i in range(args.nrep) for j in range(args.nrep) for k in range(args.nrep)]) @ cell
+
+    Xsuper = (X[None,:,:] + translations[:, None,:]).reshape(-1, 3)
+    Qsuper = np.tile(Q, translations.shape[0])
+
+    # the kernels use column lattice vectors, r = h s
+    small = packer.format_data([X], [Q], cells=[cell.T])
+    supercell = packer.format_data([Xsuper], [Qsuper], cells=[args.nrep * cell.T])
+
+    rep_small = rep.get_representation(small['coordinates'], small['charges'], small['atomIDs'], small['molIDs'], small['natom_counts'],
+                                       small['cells'], small['inv_cells'])
+
+    rep_super = rep.get_representation(supercell['coordinates'], supercell['charges'], supercell['atomIDs'], supercell['molIDs'],
+                                       supercell['natom_counts'], supercell['cells'], supercell['inv_cells'])
+
+    if (not torch.allclose(rep_small[0], rep_super[0,:args.natoms], atol=1e-4)):
+        print ("ERROR: the small cell and supercell representations disagree, max deviation:",
+               (rep_small[0] - rep_super[0,:args.natoms]).abs().max().item())
+        exit()
+
+    small_ms = time_representation(rep, small, args.nrepeats)
+    super_ms = time_representation(rep, supercell, args.nrepeats)
+
+    print (f"natoms = {args.natoms}, cell length = {args.length}, rcut = {args.rcut}, supercell = {args.nrep}^3, device = {rep.device}")
+    print (f"small cell: {small_ms:8.2f} ms")
+    print (f"supercell:  {super_ms:8.2f} ms ({super_ms / small_ms:.1f}x)")
@@ -0,0 +1,86 @@
+'''
+Per-step FCHL19 cost with and without a persistent Verlet neighbour list.
+
+A random cluster is propagated with small random displacements; at every step the representation and its derivative are computed
+with a freshly built neighbour list and with a VerletList (rcut + skin), the two are checked to agree and the time per step is
+reported, along with the number of times the Verlet list was rebuilt.
+
+python3 verlet_list.py -natoms 256 -nsteps 100 -skin 1.0 -device cpu
+'''
+import argparse
+
+import numpy as np
+import torch
+
+from qml_lightning.backend import Timer
+from qml_lightning.models.kernel import BaseKernel
+from qml_lightning.representations.FCHL import FCHLCuda
+from qml_lightning.representations.neighbours import VerletList
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-natoms", type=int, default=256)
+    parser.add_argument("-nsteps", type=int, default=100)
+    parser.add_argument("-rcut", type=float, default=6.0)
+    parser.add_argument("-skin", type=float, default=1.0)
+    parser.add_argument("-step_size", type=float, default=0.02)
+    parser.add_argument("-density", type=float, default=0.1, help="atoms / A^3")
+    parser.add_argument("-device", type=str, default=None)
+
+    args = parser.parse_args()
+
+    elements = np.array([1, 6, 7, 8])
+
+    rep = FCHLCuda(species=elements, high_cutoff=args.rcut, device=args.device)
+
+    packer = BaseKernel(None, elements, 1.0, 1e-8, device=rep.device)
+
+    box = (args.natoms / args.density) ** (1.0 / 3.0)
+
+    X = [np.random.uniform(0.0, box, (args.natoms, 3))]
+    Q = [np.random.choice(elements, size=args.natoms).astype(np.float64)]
+
+    data = packer.format_data(X, Q)
+
+    coordinates = data['coordinates']
+    charges = data['charges']
+    atomIDs = data['atomIDs']
+    molIDs = data['molIDs']
+    natom_counts = data['natom_counts']
+
+    neighbour_list = VerletList(args.rcut, skin=args.skin)
+
+    fresh_timer = Timer(rep.device)
+    verlet_timer = Timer(rep.device)
+
+    fresh_ms = 0.0
+    verlet_ms = 0.0
+
+    for step in range(args.nsteps):
+
+        coordinates = coordinates + args.step_size * torch.randn_like(coordinates)
+
+        fresh_timer.start()
+        rep_fresh, deriv_fresh = rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs, natom_counts)
+        fresh_timer.stop()
+
+        verlet_timer.start()
+        rep_verlet, deriv_verlet = rep.get_representation_and_derivative(coordinates, charges, atomIDs, molIDs, natom_counts,
+                                                                         neighbour_list=neighbour_list)
+        verlet_timer.stop()
+
+        if (step > 0):
+            fresh_ms += fresh_timer.elapsed_time()
+            verlet_ms += verlet_timer.elapsed_time()
+
+        if (not torch.allclose(rep_fresh, rep_verlet, atol=1e-5) or not torch.allclose(deriv_fresh, deriv_verlet, atol=1e-4)):
+            print ("ERROR: Verlet list and freshly built neighbour list representations disagree at step", step)
+            exit()
+
+    nsteps = max(args.nsteps - 1, 1)
+
+    print (f"natoms = {args.natoms}, rcut = {args.rcut}, skin = {args.skin}, device = {rep.device}")
+    print (f"fresh neighbour list: {fresh_ms / nsteps:8.3f} ms / step")
+    print (f"Verlet list:          {verlet_ms / nsteps:8.3f} ms / step, {neighbour_list.nbuilds} builds in {neighbour_list.ncalls} steps")
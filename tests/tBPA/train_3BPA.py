@@ -5,53 +5,9 @@ import argparse
 import json
 from qml_lightning.representations.FCHL import FCHLCuda
 from qml_lightning.models.hadamard_features import HadamardFeaturesModel
+from qml_lightning.utils.extxyz import read_extxyz
 
 
-def read_datafile(fname):
-    f = open(fname, 'r')
-    
-    lines = f.readlines()
-    
-    curr = 0
-    element2charge = {'H': 1.0, 'C': 6.0, 'N': 7.0, 'O': 8.0}
-    
-    all_charges = []
-    all_coordinates = []
-    all_energies = []
-    all_forces = []
-    
-    while (curr < len(lines)):
-        natoms = int(lines[curr])
-        
-        energy = float(lines[curr + 1].split("=")[3].split(" ")[0])
-        
-        elements = []
-        coordinates = np.zeros((natoms, 3))
-        forces = np.zeros((natoms, 3))
-        
-        for i in range(curr + 2, curr + 2 + natoms):
-      
-            data = lines[i].split()
-            
-            element = data[0]
-            c = np.array([float(v) for v in data[1:4]])
-            f = np.array([float(v) for v in data[4:]])
-            
-            elements.append(element)
-            coordinates[i - (curr + 2)] = c
-            forces[i - (curr + 2)] = f
-        
-        charges = np.array([element2charge[v] for v in elements])
-       
-        all_charges.append(charges)
-        all_coordinates.append(coordinates)
-        all_energies.append(energy)
-        all_forces.append(forces)
-        
-        curr += 2 + natoms
-    return np.array(all_charges), np.array(all_coordinates), np.array(all_energies), np.array(all_forces)
-
-    
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
@@ -109,10 +65,11 @@ if __name__ == "__main__":
     n_gpus = 1 if cuda else None
     device = torch.device('cuda' if cuda else 'cpu')
    
-    train_charges, train_coordinates, train_energies, train_forces = read_datafile(args.train_data)
-    test_charges, test_coordinates, test_energies, test_forces = read_datafile(args.test_data)
+    # the parsed files are cached next to them (.xyz.npz) for instant reloads
+    train_molecules = read_extxyz(args.train_data, cache=True)
+    test_molecules = read_extxyz(args.test_data, cache=True)
     
-    unique_z = np.unique(np.concatenate(train_charges)).astype(int)
+    unique_z = np.unique(train_molecules.charges).astype(int)
         
     rep = FCHLCuda(species=unique_z, high_cutoff=rcut, nRs2=nRs2, nRs3=nRs3, eta2=eta2, eta3=eta3,
                    two_body_decay=two_body_decay, three_body_decay=three_body_decay, three_body_weight=three_body_weight)
@@ -124,21 +81,21 @@ if __name__ == "__main__":
     print ("Note: results are in eV")
     
     print ("Calculating projection matrices...")
-    model.get_reductors(train_coordinates, train_charges, npcas=npcas)
+    model.get_reductors(train_molecules, npcas=npcas)
     
     print ("Subtracting linear atomic property contributions ...")
     model.set_subtract_self_energies(True)
     model.self_energy = torch.Tensor([0., -13.587222780835477, 0., 0., 0., 0., -1029.4889999855063, -1484.9814568572233, -2041.9816003861047]).double()
   
-    model.train(train_coordinates, train_charges, train_energies, train_forces)
+    model.train(train_molecules)
     
-    data = model.format_data(test_coordinates, test_charges, test_energies, test_forces)
+    data = model.format_packed(test_molecules)
 
     test_energies = data['energies']
     test_forces = data['forces']
     max_natoms = data['natom_counts'].max().item()
 
-    energy_predictions, force_predictions = model.predict(test_coordinates, test_charges, max_natoms, forces=True, use_backward=True)
+    energy_predictions, force_predictions = model.predict(test_molecules, max_natoms=max_natoms, forces=True, use_backward=True)
 
     print("Energy MAE /w backwards:", torch.mean(torch.abs(energy_predictions - test_energies)))
     print("Force MAE /w backwards:", torch.mean(torch.abs(force_predictions - test_forces)))